@@ -0,0 +1,113 @@
+"""
+Recall, latency and documents scored by cluster-routed PLAID search.
+
+Builds the same synthetic index as plaid_search.py, with documents grouped
+into subjects that share topic centroids, clusters documents on
+their mean-pooled token embeddings with KMeansClusterer, as the indexing
+service does, and searches each query against only its nprobe nearest
+clusters. nprobe 0 is the unrouted baseline. Recall is measured against exact
+MaxSim over the uncompressed embeddings.
+
+    python benchmarks/cluster_routing.py --documents 200000 --clusters 1000
+    python benchmarks/cluster_routing.py --nprobe 0 5 10 20 50 --json results.json
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "indexing-service", "src", "services"))
+from plaid_search import build_corpus, build_queries, exact_top_k, normalize
+from plaid_engine import PlaidIndex, default_search_params
+from cluster_router import ClusterRouter
+from kmeans_clusterer import KMeansClusterer
+from report import write_report
+
+def pooled_embeddings(doclens, embeddings):
+    starts = np.r_[0, np.cumsum(doclens)[:-1]]
+    sums = np.add.reduceat(embeddings, starts, axis=0)
+    return normalize(sums / doclens[:, None].astype(np.float32))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=50000)
+    parser.add_argument("--centroids", type=int, default=4096)
+    parser.add_argument("--clusters", type=int, default=256, help="Document clusters fitted by KMeansClusterer")
+    parser.add_argument("--doclen", type=int, default=64, help="Mean tokens per document")
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--nbits", type=int, default=2)
+    parser.add_argument("--topics", type=int, default=8, help="Centroids each document draws its tokens from")
+    parser.add_argument("--subjects", type=int, default=32, help="Groups of documents sharing topic centroids")
+    parser.add_argument("--spread", type=float, default=0.6, help="Token noise around its centroid")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--query-length", type=int, default=32)
+    parser.add_argument("--query-noise", type=float, default=0.3)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[0, 1, 4, 16, 64])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+    
+    start = time.perf_counter()
+    centroids, doclens, embeddings = build_corpus(args, rng)
+    index = PlaidIndex.from_embeddings(embeddings, doclens, centroids, args.nbits)
+    pooled = pooled_embeddings(doclens, embeddings)
+    clusterer = KMeansClusterer(n_clusters=args.clusters).fit(pooled)
+    router = ClusterRouter(clusterer.centroids, clusterer.predict_batch(pooled))
+    print(
+        f"Built index: {args.documents} documents, {len(embeddings)} tokens, "
+        f"{router.n_clusters} clusters in {time.perf_counter() - start:.1f}s"
+    )
+    
+    queries = build_queries(args, rng, doclens, embeddings)
+    truth = exact_top_k(queries, doclens, embeddings, args.k)
+    ncells = default_search_params(args.k)["ncells"]
+    
+    rows = []
+    print(f"{'nprobe':>6} {'recall@k':>9} {'candidates':>10} {'reduction':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    baseline = None
+    for nprobe in args.nprobe:
+        latencies, recalls, candidates = [], [], []
+        for query, expected in zip(queries, truth):
+            route = {"nprobe": nprobe} if nprobe else None
+            start = time.perf_counter()
+            allowed = router.allowed(query, route)
+            pids, _ = index.search(query, args.k, allowed=allowed)
+            latencies.append((time.perf_counter() - start) * 1000)
+            recalls.append(len(set(pids.tolist()) & set(expected.tolist())) / args.k)
+            
+            # Documents that reach the scoring stages, outside the timed region
+            found = index.candidates(index.centroids @ query.T, ncells)
+            if allowed is not None:
+                found = np.intersect1d(found, allowed, assume_unique=True)
+                if len(found) < args.k:
+                    found = allowed
+            candidates.append(len(found))
+            
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        mean_candidates = float(np.mean(candidates))
+        if baseline is None and not nprobe:
+            baseline = mean_candidates
+        row = {
+            "nprobe": nprobe,
+            "recall": float(np.mean(recalls)),
+            "candidates": mean_candidates,
+            "reduction": baseline / mean_candidates if baseline and mean_candidates else None,
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99)
+        }
+        rows.append(row)
+        reduction = f"{row['reduction']:.1f}x" if row["reduction"] else "-"
+        print(
+            f"{nprobe:>6} {row['recall']:>9.3f} {mean_candidates:>10.0f} {reduction:>9} "
+            f"{p50:>8.2f} {p95:>8.2f} {p99:>8.2f}"
+        )
+        
+    if args.json:
+        write_report(args.json, "cluster_routing", vars(args), rows)
+
+if __name__ == "__main__":
+    main()
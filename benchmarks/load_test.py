@@ -0,0 +1,162 @@
+"""
+Open-loop load test of the api-gateway's /search and /documents/index.
+
+Requests arrive as a Poisson process at --rate per second for --duration
+seconds, whether or not earlier ones have finished, so a slow service shows
+up as queueing latency instead of a lower request rate. Latency is measured
+from when a request was due to be sent, not from when it went out. A share
+of --index-fraction of the requests index a small batch of new documents;
+the rest search an index seeded with --seed-documents synthetic documents.
+
+Against a running deployment:
+
+    python benchmarks/load_test.py --url http://localhost:8080 --rate 50 --duration 60
+
+Or against the services started locally by local_stack.py:
+
+    python benchmarks/load_test.py --local --offline --rate 10 --json results.json
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import httpx
+import numpy as np
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from local_stack import add_stack_arguments, stack_from_args
+from report import latency_summary, write_report
+
+VOCABULARY_SIZE = 5000
+
+class Corpus:
+    """Synthetic documents of random words, and queries drawn from them"""
+    
+    def __init__(self, rng: np.random.Generator, doclen: int):
+        self.rng = rng
+        self.doclen = doclen
+        self.words = np.array([f"w{number}" for number in range(VOCABULARY_SIZE)])
+        self.texts: List[str] = []
+        
+    def documents(self, count: int) -> List[Dict[str, Any]]:
+        documents = []
+        for _ in range(count):
+            text = " ".join(self.rng.choice(self.words, self.doclen))
+            self.texts.append(text)
+            documents.append({"content": text, "metadata": {"source": "load-test"}})
+        return documents
+        
+    def query(self, length: int = 6) -> str:
+        words = self.texts[self.rng.integers(len(self.texts))].split()
+        return " ".join(self.rng.choice(words, min(length, len(words)), replace=False))
+
+async def seed_index(client: httpx.AsyncClient, corpus: Corpus, count: int) -> str:
+    response = await client.post("/documents/index", json=corpus.documents(count), timeout=None)
+    response.raise_for_status()
+    return response.json()["index_id"]
+
+async def send(client: httpx.AsyncClient, kind: str, payload: Any, due: float) -> Tuple[str, bool, float]:
+    path = "/search" if kind == "search" else "/documents/index"
+    try:
+        response = await client.post(path, json=payload)
+        ok = response.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    return kind, ok, (time.perf_counter() - due) * 1000
+
+async def run_load(args, client: httpx.AsyncClient, corpus: Corpus, index_id: str) -> Tuple[List[Tuple[str, bool, float]], float]:
+    rng = corpus.rng
+    start = time.perf_counter()
+    due = start
+    tasks = []
+    while True:
+        due += rng.exponential(1 / args.rate)
+        if due - start >= args.duration:
+            break
+        if rng.random() < args.index_fraction:
+            kind, payload = "index", corpus.documents(args.index_batch)
+        else:
+            kind, payload = "search", {"query": corpus.query(), "index_id": index_id, "limit": args.k}
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(send(client, kind, payload, due)))
+    outcomes = await asyncio.gather(*tasks)
+    return outcomes, time.perf_counter() - start
+
+def summarize(outcomes: List[Tuple[str, bool, float]], elapsed: float) -> List[Dict[str, Any]]:
+    rows = []
+    for kind in ("search", "index", "all"):
+        selected = [outcome for outcome in outcomes if kind == "all" or outcome[0] == kind]
+        if not selected:
+            continue
+        succeeded = [latency for _, ok, latency in selected if ok]
+        rows.append({
+            "endpoint": kind,
+            "requests": len(selected),
+            "ok": len(succeeded),
+            "errors": len(selected) - len(succeeded),
+            "throughput_per_s": len(succeeded) / elapsed,
+            **latency_summary(succeeded)
+        })
+    return rows
+
+async def load_test(args) -> List[Dict[str, Any]]:
+    corpus = Corpus(np.random.default_rng(args.seed), args.doclen)
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(
+        base_url=args.url, headers={"X-API-Key": args.api_key}, timeout=args.timeout, limits=limits
+    ) as client:
+        if args.index_id:
+            index_id = args.index_id
+            # Queries are still drawn from synthetic text, so only the vocabulary matters
+            corpus.documents(args.seed_documents)
+        else:
+            start = time.perf_counter()
+            index_id = await seed_index(client, corpus, args.seed_documents)
+            print(f"Seeded index {index_id} with {args.seed_documents} documents in {time.perf_counter() - start:.1f}s")
+            
+        outcomes, elapsed = await run_load(args, client, corpus, index_id)
+    return summarize(outcomes, elapsed)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="api-gateway to load; ignored with --local")
+    parser.add_argument("--api-key", default="test-api-key")
+    parser.add_argument("--rate", type=float, default=20, help="Requests per second")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load")
+    parser.add_argument("--index-fraction", type=float, default=0.05, help="Share of requests that index documents")
+    parser.add_argument("--index-batch", type=int, default=8, help="Documents per indexing request")
+    parser.add_argument("--index-id", help="Search this existing index instead of seeding one")
+    parser.add_argument("--seed-documents", type=int, default=500)
+    parser.add_argument("--doclen", type=int, default=80, help="Words per synthetic document")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--max-connections", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--local", action="store_true", help="Start the services locally first, see local_stack.py")
+    add_stack_arguments(parser)
+    args = parser.parse_args()
+    
+    if args.local:
+        with stack_from_args(args) as stack:
+            args.url = stack.gateway_url
+            rows = asyncio.run(load_test(args))
+    else:
+        rows = asyncio.run(load_test(args))
+        
+    print(f"{'endpoint':>8} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for row in rows:
+        print(
+            f"{row['endpoint']:>8} {row['requests']:>8} {row['errors']:>6} {row['throughput_per_s']:>8.1f} "
+            f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f}"
+        )
+        
+    if args.json:
+        write_report(args.json, "load_test", vars(args), rows)
+
+if __name__ == "__main__":
+    main()
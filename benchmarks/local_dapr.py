@@ -0,0 +1,200 @@
+"""
+In-memory stand-in for a Dapr sidecar's state store and pub/sub.
+
+Serves the Dapr gRPC API that the services' DaprStateStore speaks, so they run
+unchanged with DAPR_GRPC_PORT pointing here. State lives in one dict shared
+by every store name, honouring ttlInSeconds. Published events are delivered
+over HTTP to every app that subscribes to the topic, as found through the
+app's /dapr/subscribe route, wrapped in a CloudEvent envelope. One sidecar
+can serve all services at once.
+
+    python benchmarks/local_dapr.py --port 50001 --app http://localhost:8001
+"""
+import argparse
+import json
+import logging
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent import futures
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import grpc
+from dapr.proto import api_service_v1, api_v1
+from google.protobuf import empty_pb2
+
+logger = logging.getLogger(__name__)
+
+class MemorySidecar(api_service_v1.DaprServicer):
+    def __init__(self, apps: Sequence[str] = (), delivery_workers: int = 4):
+        self.apps = [app.rstrip("/") for app in apps]
+        self._state: Dict[Tuple[str, str], Tuple[bytes, Optional[float], int]] = {}
+        self._lock = threading.Lock()
+        self._subscriptions: Dict[str, List[dict]] = {}
+        self._delivery = futures.ThreadPoolExecutor(max_workers=delivery_workers, thread_name_prefix="dapr-delivery")
+        self.server: Optional[grpc.Server] = None
+        self.port = 0
+        
+        self.reads = 0
+        self.writes = 0
+        self.published = 0
+        self.delivered = 0
+        self.delivery_failures = 0
+        
+    def _read(self, store: str, key: str) -> Optional[Tuple[bytes, int]]:
+        with self._lock:
+            self.reads += 1
+            entry = self._state.get((store, key))
+            if entry is None:
+                return None
+            value, expires_at, etag = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._state[(store, key)]
+                return None
+            return value, etag
+            
+    def GetState(self, request, context):
+        entry = self._read(request.store_name, request.key)
+        if entry is None:
+            return api_v1.GetStateResponse()
+        return api_v1.GetStateResponse(data=entry[0], etag=str(entry[1]))
+        
+    def GetBulkState(self, request, context):
+        items = []
+        for key in request.keys:
+            entry = self._read(request.store_name, key)
+            if entry is None:
+                items.append(api_v1.BulkStateItem(key=key))
+            else:
+                items.append(api_v1.BulkStateItem(key=key, data=entry[0], etag=str(entry[1])))
+        return api_v1.GetBulkStateResponse(items=items)
+        
+    def _write(self, store: str, item):
+        # Called with the lock held
+        self.writes += 1
+        ttl = item.metadata.get("ttlInSeconds")
+        expires_at = time.time() + float(ttl) if ttl else None
+        previous = self._state.get((store, item.key))
+        etag = previous[2] + 1 if previous else 1
+        self._state[(store, item.key)] = (item.value, expires_at, etag)
+        
+    def SaveState(self, request, context):
+        with self._lock:
+            for item in request.states:
+                self._write(request.store_name, item)
+        return empty_pb2.Empty()
+        
+    def ExecuteStateTransaction(self, request, context):
+        # Applied under one lock acquisition, so readers see all of it or none
+        with self._lock:
+            for operation in request.operations:
+                if operation.operationType == "delete":
+                    self.writes += 1
+                    self._state.pop((request.storeName, operation.request.key), None)
+                else:
+                    self._write(request.storeName, operation.request)
+        return empty_pb2.Empty()
+        
+    def DeleteState(self, request, context):
+        with self._lock:
+            self.writes += 1
+            self._state.pop((request.store_name, request.key), None)
+        return empty_pb2.Empty()
+        
+    def DeleteBulkState(self, request, context):
+        with self._lock:
+            for item in request.states:
+                self.writes += 1
+                self._state.pop((request.store_name, item.key), None)
+        return empty_pb2.Empty()
+        
+    def _subscribed(self, app: str) -> List[dict]:
+        """An app's subscriptions, fetched until the app first answers"""
+        if app not in self._subscriptions:
+            try:
+                with urllib.request.urlopen(f"{app}/dapr/subscribe", timeout=5) as response:
+                    self._subscriptions[app] = json.loads(response.read())
+            except OSError as e:
+                logger.warning(f"Could not read subscriptions of {app}: {str(e)}")
+                return []
+        return self._subscriptions[app]
+        
+    def _deliver(self, pubsub: str, topic: str, data: bytes, content_type: str):
+        try:
+            payload = json.loads(data) if "json" in content_type else data.decode("utf-8")
+        except ValueError:
+            payload = data.decode("utf-8", errors="replace")
+        event = json.dumps({
+            "id": uuid.uuid4().hex,
+            "source": "local-dapr",
+            "specversion": "1.0",
+            "type": "com.dapr.event.sent",
+            "datacontenttype": content_type or "application/json",
+            "pubsubname": pubsub,
+            "topic": topic,
+            "data": payload
+        }).encode("utf-8")
+        
+        for app in self.apps:
+            for subscription in self._subscribed(app):
+                if subscription.get("pubsubname") != pubsub or subscription.get("topic") != topic:
+                    continue
+                route = subscription.get("route", f"/{topic}")
+                request = urllib.request.Request(
+                    f"{app}/{route.lstrip('/')}", data=event, method="POST",
+                    headers={"Content-Type": "application/cloudevents+json"}
+                )
+                try:
+                    urllib.request.urlopen(request, timeout=30).close()
+                    self.delivered += 1
+                except OSError as e:
+                    self.delivery_failures += 1
+                    logger.warning(f"Could not deliver {topic} event to {app}: {str(e)}")
+                    
+    def PublishEvent(self, request, context):
+        self.published += 1
+        self._delivery.submit(self._deliver, request.pubsub_name, request.topic, request.data, request.data_content_type)
+        return empty_pb2.Empty()
+        
+    def GetMetadata(self, request, context):
+        return api_v1.GetMetadataResponse(id="local-dapr")
+        
+    def start(self, port: int = 0, host: str = "127.0.0.1") -> "MemorySidecar":
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=16, thread_name_prefix="dapr"))
+        api_service_v1.add_DaprServicer_to_server(self, self.server)
+        self.port = self.server.add_insecure_port(f"{host}:{port}")
+        self.server.start()
+        return self
+        
+    def stop(self):
+        if self.server is not None:
+            self.server.stop(grace=1)
+        self._delivery.shutdown(wait=False)
+        
+    def stats(self) -> Dict[str, int]:
+        return {
+            "keys": len(self._state),
+            "reads": self.reads,
+            "writes": self.writes,
+            "published": self.published,
+            "delivered": self.delivered,
+            "delivery_failures": self.delivery_failures
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=50001)
+    parser.add_argument("--app", action="append", default=[], help="Base URL of an app to deliver events to")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    
+    sidecar = MemorySidecar(args.app).start(args.port)
+    print(f"Serving in-memory Dapr state and pub/sub on port {sidecar.port}")
+    try:
+        sidecar.server.wait_for_termination()
+    except KeyboardInterrupt:
+        sidecar.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""
+In-memory stand-in for the S3 API of Cloudflare R2.
+
+Implements what R2Storage uses: single and multipart uploads, ranged and
+plain reads, HEAD, ListObjectsV2 with delimiters and continuation tokens,
+batch deletes and server-side copies. Requests are not authenticated and
+objects live in memory, so it suits benchmarks, not durable data. Point the
+storage service at it with CLOUDFLARE_R2_ENDPOINT.
+
+    python benchmarks/local_s3.py --port 9000
+"""
+import argparse
+import hashlib
+import threading
+import time
+import uuid
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, quote, unquote, urlparse
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+S3_NAMESPACE = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+class StoredObject:
+    def __init__(self, data: bytes, metadata: Dict[str, str], etag: Optional[str] = None):
+        self.data = data
+        self.metadata = metadata
+        self.etag = etag or hashlib.md5(data).hexdigest()
+        self.last_modified = time.time()
+
+def _decode_aws_chunked(body: bytes) -> bytes:
+    """Strip the chunk framing (and any trailing checksum) of an aws-chunked body"""
+    data = bytearray()
+    position = 0
+    while True:
+        line_end = body.index(b"\r\n", position)
+        size = int(body[position:line_end].split(b";")[0], 16)
+        position = line_end + 2
+        if size == 0:
+            return bytes(data)
+        data.extend(body[position:position + size])
+        position += size + 2
+
+def _iso(timestamp: float) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(timestamp))
+
+class LocalS3:
+    """Buckets of in-memory objects served over HTTP from a background thread"""
+    
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.buckets: Dict[str, Dict[str, StoredObject]] = {}
+        self.uploads: Dict[str, Tuple[str, str, Dict[str, str], Dict[int, bytes]]] = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        
+        store = self
+        
+        class Handler(S3RequestHandler):
+            s3 = store
+            
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+        
+    @property
+    def endpoint(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+        
+    def bucket(self, name: str) -> Dict[str, StoredObject]:
+        with self.lock:
+            return self.buckets.setdefault(name, {})
+            
+    def start(self) -> "LocalS3":
+        self.thread = threading.Thread(target=self.server.serve_forever, name="local-s3", daemon=True)
+        self.thread.start()
+        return self
+        
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class S3RequestHandler(BaseHTTPRequestHandler):
+    s3: LocalS3
+    protocol_version = "HTTP/1.1"
+    
+    def log_message(self, format, *args):
+        pass
+        
+    def _target(self) -> Tuple[str, str, Dict[str, List[str]]]:
+        url = urlparse(self.path)
+        query = parse_qs(url.query, keep_blank_values=True)
+        path = unquote(url.path).lstrip("/")
+        # Virtual-host style requests carry the bucket in the Host header
+        host = self.headers.get("Host", "").split(":")[0]
+        address = self.server.server_address[0]
+        if host not in ("localhost", address) and host.count(".") and not host.replace(".", "").isdigit():
+            return host.split(".")[0], path, query
+        bucket, _, key = path.partition("/")
+        return bucket, key, query
+        
+    def _body(self) -> bytes:
+        body = self.rfile.read(int(self.headers.get("Content-Length", "0")))
+        if "aws-chunked" in self.headers.get("Content-Encoding", ""):
+            body = _decode_aws_chunked(body)
+        return body
+        
+    def _metadata(self) -> Dict[str, str]:
+        return {
+            name[len("x-amz-meta-"):].lower(): value
+            for name, value in self.headers.items() if name.lower().startswith("x-amz-meta-")
+        }
+        
+    def _send(self, status: int, body: bytes = b"", headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+            
+    def _xml(self, status: int, body: str):
+        self._send(status, f'<?xml version="1.0" encoding="UTF-8"?>{body}'.encode("utf-8"), {"Content-Type": "application/xml"})
+        
+    def _error(self, status: int, code: str, message: str = ""):
+        self._xml(status, f"<Error><Code>{code}</Code><Message>{escape(message)}</Message></Error>")
+        
+    def _object_headers(self, obj: StoredObject) -> Dict[str, str]:
+        headers = {
+            "ETag": f'"{obj.etag}"',
+            "Last-Modified": formatdate(obj.last_modified, usegmt=True),
+            "Accept-Ranges": "bytes"
+        }
+        headers.update({f"x-amz-meta-{name}": value for name, value in obj.metadata.items()})
+        return headers
+        
+    def _source(self) -> Optional[StoredObject]:
+        source = unquote(self.headers["x-amz-copy-source"]).lstrip("/")
+        bucket, _, key = source.partition("/")
+        return self.s3.bucket(bucket).get(key.split("?")[0])
+        
+    def do_HEAD(self):
+        self.s3.requests += 1
+        bucket, key, _ = self._target()
+        obj = self.s3.bucket(bucket).get(key)
+        if obj is None:
+            return self._send(404)
+        headers = self._object_headers(obj)
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(obj.data)))
+        self.end_headers()
+        
+    def do_GET(self):
+        self.s3.requests += 1
+        bucket, key, query = self._target()
+        if not key:
+            return self._list(bucket, query)
+            
+        obj = self.s3.bucket(bucket).get(key)
+        if obj is None:
+            return self._error(404, "NoSuchKey", key)
+        byte_range = self.headers.get("Range")
+        if byte_range is None:
+            return self._send(200, obj.data, self._object_headers(obj))
+            
+        start, _, end = byte_range.replace("bytes=", "").partition("-")
+        start = int(start)
+        end = min(int(end) if end else len(obj.data) - 1, len(obj.data) - 1)
+        headers = self._object_headers(obj)
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(obj.data)}"
+        self._send(206, obj.data[start:end + 1], headers)
+        
+    def _list(self, bucket: str, query: Dict[str, List[str]]):
+        prefix = query.get("prefix", [""])[0]
+        delimiter = query.get("delimiter", [""])[0]
+        max_keys = int(query.get("max-keys", ["1000"])[0])
+        after = query.get("continuation-token", query.get("start-after", [""]))[0]
+        
+        entries: List[Tuple[str, Optional[StoredObject]]] = []
+        seen_prefixes = set()
+        for key in sorted(self.s3.bucket(bucket)):
+            if not key.startswith(prefix):
+                continue
+            if delimiter and delimiter in key[len(prefix):]:
+                common = key[:len(prefix) + key[len(prefix):].index(delimiter) + len(delimiter)]
+                if common not in seen_prefixes:
+                    seen_prefixes.add(common)
+                    entries.append((common, None))
+                continue
+            entries.append((key, self.s3.bucket(bucket)[key]))
+            
+        entries = [entry for entry in entries if entry[0] > after]
+        page, truncated = entries[:max_keys], len(entries) > max_keys
+        contents = "".join(
+            f"<Contents><Key>{escape(key)}</Key><LastModified>{_iso(obj.last_modified)}</LastModified>"
+            f"<ETag>&quot;{obj.etag}&quot;</ETag><Size>{len(obj.data)}</Size></Contents>"
+            for key, obj in page if obj is not None
+        )
+        prefixes = "".join(
+            f"<CommonPrefixes><Prefix>{escape(key)}</Prefix></CommonPrefixes>" for key, obj in page if obj is None
+        )
+        token = f"<NextContinuationToken>{escape(page[-1][0])}</NextContinuationToken>" if truncated else ""
+        self._xml(200, (
+            f'<ListBucketResult xmlns="{S3_NAMESPACE}"><Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix>'
+            f"<KeyCount>{len(page)}</KeyCount><MaxKeys>{max_keys}</MaxKeys>"
+            f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>{token}{contents}{prefixes}</ListBucketResult>"
+        ))
+        
+    def do_PUT(self):
+        self.s3.requests += 1
+        bucket, key, query = self._target()
+        if not key:
+            self.s3.bucket(bucket)
+            return self._send(200)
+            
+        if "x-amz-copy-source" in self.headers:
+            self._body()
+            source = self._source()
+            if source is None:
+                return self._error(404, "NoSuchKey", self.headers["x-amz-copy-source"])
+            data = source.data
+            copy_range = self.headers.get("x-amz-copy-source-range")
+            if copy_range:
+                start, _, end = copy_range.replace("bytes=", "").partition("-")
+                data = data[int(start):int(end) + 1]
+            if "uploadId" in query:
+                return self._put_part(query, data, copy=True)
+            obj = StoredObject(data, self._metadata() or dict(source.metadata))
+            self.s3.bucket(bucket)[key] = obj
+            return self._xml(200, (
+                f"<CopyObjectResult><LastModified>{_iso(obj.last_modified)}</LastModified>"
+                f"<ETag>&quot;{obj.etag}&quot;</ETag></CopyObjectResult>"
+            ))
+            
+        if "uploadId" in query:
+            return self._put_part(query, self._body())
+            
+        obj = StoredObject(self._body(), self._metadata())
+        self.s3.bucket(bucket)[key] = obj
+        self._send(200, headers={"ETag": f'"{obj.etag}"'})
+        
+    def _put_part(self, query: Dict[str, List[str]], data: bytes, copy: bool = False):
+        upload = self.s3.uploads.get(query["uploadId"][0])
+        if upload is None:
+            return self._error(404, "NoSuchUpload")
+        upload[3][int(query["partNumber"][0])] = data
+        etag = hashlib.md5(data).hexdigest()
+        if copy:
+            return self._xml(200, f"<CopyPartResult><ETag>&quot;{etag}&quot;</ETag></CopyPartResult>")
+        self._send(200, headers={"ETag": f'"{etag}"'})
+        
+    def do_POST(self):
+        self.s3.requests += 1
+        bucket, key, query = self._target()
+        body = self._body()
+        
+        if "delete" in query:
+            root = ElementTree.fromstring(body)
+            keys = [element.text for element in root.iter() if element.tag.split("}")[-1] == "Key"]
+            objects = self.s3.bucket(bucket)
+            for deleted in keys:
+                objects.pop(deleted, None)
+            return self._xml(200, f'<DeleteResult xmlns="{S3_NAMESPACE}"></DeleteResult>')
+            
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            self.s3.uploads[upload_id] = (bucket, key, self._metadata(), {})
+            return self._xml(200, (
+                f"<InitiateMultipartUploadResult><Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>"
+                f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+            ))
+            
+        if "uploadId" in query:
+            upload = self.s3.uploads.pop(query["uploadId"][0], None)
+            if upload is None:
+                return self._error(404, "NoSuchUpload")
+            _, _, metadata, parts = upload
+            data = b"".join(parts[number] for number in sorted(parts))
+            etag = f"{hashlib.md5(data).hexdigest()}-{len(parts)}"
+            self.s3.bucket(bucket)[key] = StoredObject(data, metadata, etag)
+            return self._xml(200, (
+                f"<CompleteMultipartUploadResult><Location>/{quote(bucket)}/{quote(key)}</Location>"
+                f"<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key><ETag>&quot;{etag}&quot;</ETag>"
+                f"</CompleteMultipartUploadResult>"
+            ))
+            
+        self._error(400, "InvalidRequest", "Unsupported POST")
+        
+    def do_DELETE(self):
+        self.s3.requests += 1
+        bucket, key, query = self._target()
+        if "uploadId" in query:
+            self.s3.uploads.pop(query["uploadId"][0], None)
+        else:
+            self.s3.bucket(bucket).pop(key, None)
+        self._send(204)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    args = parser.parse_args()
+    
+    s3 = LocalS3(args.host, args.port)
+    print(f"Serving in-memory S3 at {s3.endpoint}")
+    try:
+        s3.server.serve_forever()
+    except KeyboardInterrupt:
+        s3.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Run the four services locally, without Dapr, R2 or a GPU.
+
+Starts the in-memory S3 (local_s3.py) and Dapr (local_dapr.py) stand-ins,
+then the storage, indexing, query and api-gateway services as uvicorn
+processes wired to them and to each other. ColBERT runs on the CPU; with
+--offline the model must already be in the Hugging Face cache. Extra
+service settings can be passed with --env, e.g. --env SEARCH_WORKERS=2.
+
+    python benchmarks/local_stack.py
+    python benchmarks/local_stack.py --offline --env INDEX_WORKERS=1
+
+The gateway listens on http://127.0.0.1:8080 by default and accepts the
+X-API-Key test-api-key; stop everything with Ctrl-C.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Dict, List, Optional, Sequence
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from local_s3 import LocalS3
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+BUCKET = "quickcolbert"
+# In start order: the gateway needs the others, the indexing and query services need storage
+SERVICES = ("storage-service", "indexing-service", "query-service", "api-gateway")
+# Services with a /ready endpoint, which fails until they have warmed up
+WARMED_SERVICES = ("indexing-service", "query-service")
+
+class LocalStack:
+    """The services and their stand-ins, started together and stopped together"""
+    
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        base_port: int = 8000,
+        gateway_port: int = 8080,
+        dapr_port: int = 50001,
+        work_dir: Optional[str] = None,
+        offline: bool = False,
+        env: Optional[Dict[str, str]] = None,
+        services: Sequence[str] = SERVICES,
+        startup_timeout: float = 300.0
+    ):
+        self.host = host
+        self.ports = {
+            "indexing-service": base_port,
+            "query-service": base_port + 1,
+            "storage-service": base_port + 2,
+            "api-gateway": gateway_port
+        }
+        self.dapr_port = dapr_port
+        self.work_dir = work_dir
+        self.offline = offline
+        self.env = env or {}
+        self.services = [service for service in SERVICES if service in services]
+        self.startup_timeout = startup_timeout
+        
+        self._own_work_dir = work_dir is None
+        self.s3: Optional[LocalS3] = None
+        self.dapr: Optional[subprocess.Popen] = None
+        self.processes: Dict[str, subprocess.Popen] = {}
+        
+    def url(self, service: str) -> str:
+        return f"http://{self.host}:{self.ports[service]}"
+        
+    @property
+    def gateway_url(self) -> str:
+        return self.url("api-gateway")
+        
+    def _service_env(self, service: str) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update({
+            "PYTHONPATH": os.pathsep.join(filter(None, [os.path.join(REPO, "libs", "common"), env.get("PYTHONPATH")])),
+            "DAPR_GRPC_PORT": str(self.dapr_port),
+            "STORAGE_SERVICE_URL": self.url("storage-service"),
+            "INDEXING_SERVICE_URL": self.url("indexing-service"),
+            "QUERY_SERVICE_URL": self.url("query-service"),
+            "CLOUDFLARE_R2_BUCKET": BUCKET,
+            "CLOUDFLARE_R2_ACCESS_KEY": "local",
+            "CLOUDFLARE_R2_SECRET_KEY": "local",
+            "CLOUDFLARE_R2_ENDPOINT": self.s3.endpoint,
+            "INDEX_DISK_CACHE_DIR": os.path.join(self.work_dir, "indexes"),
+            "CLUSTER_CACHE_DIR": os.path.join(self.work_dir, "clusters"),
+            "TMPDIR": os.path.join(self.work_dir, "tmp")
+        })
+        if self.offline:
+            env.update({"HF_HUB_OFFLINE": "1", "TRANSFORMERS_OFFLINE": "1"})
+        env.update(self.env)
+        return env
+        
+    def _wait_until_healthy(self, service: str, deadline: float):
+        # Runs start once the services are warm
+        url = f"{self.url(service)}/{'ready' if service in WARMED_SERVICES else 'health'}"
+        while time.time() < deadline:
+            process = self.processes[service]
+            if process.poll() is not None:
+                raise RuntimeError(f"{service} exited with status {process.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=2) as response:
+                    if response.status == 200:
+                        return
+            except OSError:
+                time.sleep(0.5)
+        raise TimeoutError(f"{service} did not become ready within {self.startup_timeout} seconds")
+        
+    def start(self) -> "LocalStack":
+        if self.work_dir is None:
+            self.work_dir = tempfile.mkdtemp(prefix="quickcolbert-stack-")
+        os.makedirs(os.path.join(self.work_dir, "tmp"), exist_ok=True)
+        
+        self.s3 = LocalS3(self.host).start()
+        # The sidecar runs in its own process, serving every service
+        self.dapr = subprocess.Popen([
+            sys.executable, os.path.join(REPO, "benchmarks", "local_dapr.py"),
+            "--port", str(self.dapr_port), "--app", self.url("query-service")
+        ])
+        
+        deadline = time.time() + self.startup_timeout
+        try:
+            for service in self.services:
+                self.processes[service] = subprocess.Popen(
+                    [
+                        sys.executable, "-m", "uvicorn", "src.app:app",
+                        "--host", self.host, "--port", str(self.ports[service]), "--log-level", "warning"
+                    ],
+                    cwd=os.path.join(REPO, "services", service),
+                    env=self._service_env(service)
+                )
+            for service in self.processes:
+                self._wait_until_healthy(service, deadline)
+        except BaseException:
+            self.stop()
+            raise
+        return self
+        
+    def stop(self):
+        children: List[subprocess.Popen] = list(self.processes.values()) + ([self.dapr] if self.dapr else [])
+        for process in children:
+            if process.poll() is None:
+                process.terminate()
+        for process in children:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.processes.clear()
+        self.dapr = None
+        
+        if self.s3 is not None:
+            self.s3.stop()
+            self.s3 = None
+        if self._own_work_dir and self.work_dir is not None:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+            self.work_dir = None
+            
+    def __enter__(self) -> "LocalStack":
+        return self.start()
+        
+    def __exit__(self, *exc_info):
+        self.stop()
+
+def parse_env(pairs: Sequence[str]) -> Dict[str, str]:
+    env = {}
+    for pair in pairs:
+        name, separator, value = pair.partition("=")
+        if not separator:
+            raise argparse.ArgumentTypeError(f"Expected NAME=VALUE, got {pair}")
+        env[name] = value
+    return env
+
+def add_stack_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--base-port", type=int, default=8000, help="Indexing service port; query and storage follow it")
+    parser.add_argument("--gateway-port", type=int, default=8080)
+    parser.add_argument("--dapr-port", type=int, default=50001)
+    parser.add_argument("--work-dir", help="Keep caches and scratch files here instead of a temp dir")
+    parser.add_argument("--offline", action="store_true", help="Only use models already in the Hugging Face cache")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="Extra service setting")
+    parser.add_argument("--services", nargs="+", choices=SERVICES, default=list(SERVICES), help="Only start these services")
+
+def stack_from_args(args) -> LocalStack:
+    return LocalStack(
+        host=args.host,
+        base_port=args.base_port,
+        gateway_port=args.gateway_port,
+        dapr_port=args.dapr_port,
+        work_dir=args.work_dir,
+        offline=args.offline,
+        env=parse_env(args.env),
+        services=args.services
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_stack_arguments(parser)
+    args = parser.parse_args()
+    
+    with stack_from_args(args) as stack:
+        print(f"Services are up; the api-gateway is at {stack.gateway_url}")
+        try:
+            while all(process.poll() is None for process in stack.processes.values()):
+                time.sleep(1)
+            print("A service exited, stopping the stack")
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == "__main__":
+    main()
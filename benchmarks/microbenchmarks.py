@@ -0,0 +1,243 @@
+"""
+Microbenchmarks of the hot paths of each service, on the CPU and offline.
+
+    kmeans   KMeansClusterer.fit and predict_batch on synthetic embeddings
+    search   ColbertSearcher.search and search_batch on a synthetic PLAID
+             token store, with a stub encoder standing in for ColBERT
+    storage  R2Storage uploads and downloads against the in-memory S3 of
+             local_s3.py
+
+The stub encoder returns precomputed query embeddings, so search timings
+cover everything but the model: the executor hop, candidate generation,
+centroid interaction and exact MaxSim.
+
+    python benchmarks/microbenchmarks.py
+    python benchmarks/microbenchmarks.py --sections search --documents 200000 --json results.json
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, "..", "libs", "common"))
+sys.path.insert(0, os.path.join(BENCHMARKS, "..", "services", "query-service", "src", "services"))
+from index_format import write_array
+from local_s3 import LocalS3
+from plaid_engine import PlaidIndex
+from plaid_search import build_corpus, build_queries
+from report import latency_summary, write_report
+
+SECTIONS = ("kmeans", "search", "storage")
+
+def import_from_service(service: str, module: str, name: str):
+    """Import from a service's src package, as its app does when run from the service directory"""
+    # Every service names its package src, so forget the last service's before importing
+    for cached in [cached for cached in sys.modules if cached == "src" or cached.startswith("src.")]:
+        del sys.modules[cached]
+    sys.path.insert(0, os.path.join(BENCHMARKS, "..", "services", service))
+    try:
+        return getattr(importlib.import_module(f"src.services.{module}"), name)
+    finally:
+        del sys.path[0]
+
+def bench_kmeans(args, rng):
+    KMeansClusterer = import_from_service("indexing-service", "kmeans_clusterer", "KMeansClusterer")
+    points = rng.standard_normal((args.points, args.dim)).astype(np.float32)
+    points /= np.linalg.norm(points, axis=1, keepdims=True)
+    
+    rows = []
+    for clusters in args.clusters:
+        start = time.perf_counter()
+        clusterer = KMeansClusterer(n_clusters=clusters).fit(points)
+        fit_seconds = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        clusterer.predict_batch(points)
+        predict_seconds = time.perf_counter() - start
+        
+        row = {
+            "section": "kmeans",
+            "points": args.points,
+            "clusters": clusters,
+            "fit_s": fit_seconds,
+            "predict_points_per_s": args.points / predict_seconds
+        }
+        rows.append(row)
+        print(f"kmeans   clusters={clusters:<6} fit {fit_seconds:.2f}s, predict {row['predict_points_per_s']:,.0f} points/s")
+    return rows
+
+def write_index(index_dir: str, index: PlaidIndex, num_tokens: int):
+    """Lay out a PLAID index as a RAGatouille index directory with a token store"""
+    store_dir = os.path.join(index_dir, "token_store")
+    os.makedirs(store_dir)
+    arrays = {
+        "centroids": index.centroids,
+        "buckets": index.bucket_weights,
+        "codes": index.codes,
+        "residuals": index.residuals,
+        "doc_offsets": index.doc_offsets,
+        "ivf_pids": index.ivf_pids,
+        "ivf_lengths": np.diff(index.ivf_offsets)
+    }
+    for name, array in arrays.items():
+        write_array(os.path.join(store_dir, f"{name}.qcar"), np.ascontiguousarray(array))
+    with open(os.path.join(store_dir, "store.json"), "w") as f:
+        json.dump({
+            "version": 1,
+            "nbits": index.nbits,
+            "dim": index.dim,
+            "num_documents": index.document_count,
+            "num_tokens": num_tokens,
+            "num_centroids": len(index.centroids)
+        }, f)
+    with open(os.path.join(index_dir, "collection.json"), "w") as f:
+        json.dump([f"document {pid}" for pid in range(index.document_count)], f)
+    with open(os.path.join(index_dir, "pid_docid_map.json"), "w") as f:
+        json.dump({str(pid): f"doc-{pid}" for pid in range(index.document_count)}, f)
+
+async def bench_search(args, rng):
+    # Time the search itself, not query embedding cache hits
+    os.environ["QUERY_EMBEDDING_CACHE_MAX_BYTES"] = "0"
+    ColbertSearcher = import_from_service("query-service", "colbert_searcher", "ColbertSearcher")
+    
+    centroids, doclens, embeddings = build_corpus(args, rng)
+    index = PlaidIndex.from_embeddings(embeddings, doclens, centroids, args.nbits)
+    query_embeddings = build_queries(args, rng, doclens, embeddings)
+    
+    def encode(queries):
+        # Queries are named after their precomputed embeddings: "query 17"
+        return np.stack([query_embeddings[int(query.split()[-1])] for query in queries])
+        
+    index_dir = tempfile.mkdtemp(prefix="quickcolbert-bench-")
+    searcher = ColbertSearcher()
+    try:
+        write_index(index_dir, index, len(embeddings))
+        searcher.model = object()
+        searcher._encode = encode
+        await searcher.load_index(index_dir, "bench")
+        queries = [f"query {number}" for number in range(args.queries)]
+        
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            await searcher.search(query, limit=args.k, index_id="bench")
+            latencies.append((time.perf_counter() - start) * 1000)
+        rows = [{"section": "search", "mode": "single", "documents": args.documents, **latency_summary(latencies)}]
+        
+        batch_latencies = []
+        for start_query in range(0, len(queries), args.batch_size):
+            batch = queries[start_query:start_query + args.batch_size]
+            start = time.perf_counter()
+            await searcher.search_batch(batch, limit=args.k, index_id="bench")
+            batch_latencies.append((time.perf_counter() - start) * 1000)
+        rows.append({
+            "section": "search",
+            "mode": "batch",
+            "documents": args.documents,
+            "batch_size": args.batch_size,
+            "queries_per_s": len(queries) / (sum(batch_latencies) / 1000),
+            **latency_summary(batch_latencies)
+        })
+    finally:
+        searcher.executor.shutdown(wait=False)
+        shutil.rmtree(index_dir, ignore_errors=True)
+        
+    for row in rows:
+        print(f"search   {row['mode']:<6} p50 {row['p50_ms']:.2f}ms, p95 {row['p95_ms']:.2f}ms, p99 {row['p99_ms']:.2f}ms")
+    return rows
+
+async def bench_storage(args, rng):
+    s3 = LocalS3().start()
+    os.environ.update({
+        "CLOUDFLARE_R2_ENDPOINT": s3.endpoint,
+        "CLOUDFLARE_R2_BUCKET": "bench",
+        "CLOUDFLARE_R2_ACCESS_KEY": "local",
+        "CLOUDFLARE_R2_SECRET_KEY": "local",
+        "R2_PART_SIZE": str(args.part_mb * 1024 ** 2)
+    })
+    R2Storage = import_from_service("storage-service", "r2_storage", "R2Storage")
+    storage = R2Storage()
+    data = rng.integers(0, 256, args.object_mb * 1024 ** 2, dtype=np.uint8).tobytes()
+    
+    async def chunks():
+        for start in range(0, len(data), 1024 ** 2):
+            yield data[start:start + 1024 ** 2]
+            
+    async def drain():
+        async for _ in storage.iter_object("bench/streamed"):
+            pass
+            
+    operations = [
+        ("store_object", lambda: storage.store_object("bench/object", data)),
+        ("get_object", lambda: storage.get_object("bench/object")),
+        ("store_stream", lambda: storage.store_stream("bench/streamed", chunks())),
+        ("iter_object", drain)
+    ]
+    rows = []
+    try:
+        for name, operation in operations:
+            seconds = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                await operation()
+                seconds.append(time.perf_counter() - start)
+            row = {
+                "section": "storage",
+                "operation": name,
+                "object_mb": args.object_mb,
+                "part_mb": args.part_mb,
+                "mb_per_s": args.object_mb / float(np.median(seconds))
+            }
+            rows.append(row)
+            print(f"storage  {name:<12} {row['mb_per_s']:.1f} MB/s")
+    finally:
+        storage.close()
+        s3.stop()
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sections", nargs="+", choices=SECTIONS, default=list(SECTIONS))
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--points", type=int, default=100000, help="Embeddings clustered by the kmeans section")
+    parser.add_argument("--clusters", type=int, nargs="+", default=[256, 1024])
+    parser.add_argument("--documents", type=int, default=20000)
+    parser.add_argument("--centroids", type=int, default=2048)
+    parser.add_argument("--doclen", type=int, default=64, help="Mean tokens per document")
+    parser.add_argument("--nbits", type=int, default=2)
+    parser.add_argument("--topics", type=int, default=8, help="Centroids each document draws its tokens from")
+    parser.add_argument("--subjects", type=int, default=0)
+    parser.add_argument("--spread", type=float, default=0.6, help="Token noise around its centroid")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--query-length", type=int, default=32)
+    parser.add_argument("--query-noise", type=float, default=0.3)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--object-mb", type=int, default=64, help="Size of the objects moved by the storage section")
+    parser.add_argument("--part-mb", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+    
+    rows = []
+    if "kmeans" in args.sections:
+        rows.extend(bench_kmeans(args, rng))
+    if "search" in args.sections:
+        rows.extend(asyncio.run(bench_search(args, rng)))
+    if "storage" in args.sections:
+        rows.extend(asyncio.run(bench_storage(args, rng)))
+        
+    if args.json:
+        write_report(args.json, "microbenchmarks", vars(args), rows)
+
+if __name__ == "__main__":
+    main()
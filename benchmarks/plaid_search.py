@@ -0,0 +1,131 @@
+"""
+Recall and latency of the PLAID engine on a synthetic ColBERT-style index.
+
+Documents are bags of token embeddings drawn around a few random centroids
+each (their topics), optionally chosen from a shared pool per subject, and
+compressed with nbits residuals, as ColBERT indexing does. Each query is a
+noisy subset of one document's tokens. Results are compared against exact
+MaxSim over the uncompressed embeddings, for a grid of engine knobs.
+
+    python benchmarks/plaid_search.py --documents 200000 --centroids 16384
+    python benchmarks/plaid_search.py --ncells 1 2 4 --ndocs 256 1024 --json results.json
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "libs", "common"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "query-service", "src", "services"))
+from plaid_engine import PlaidIndex
+from report import write_report
+
+def normalize(x: np.ndarray) -> np.ndarray:
+    return x / np.linalg.norm(x, axis=-1, keepdims=True)
+
+def build_corpus(args, rng):
+    centroids = normalize(rng.standard_normal((args.centroids, args.dim)).astype(np.float32))
+    doclens = rng.integers(args.doclen // 2, args.doclen * 3 // 2, args.documents)
+    if args.subjects:
+        # Each subject owns a contiguous range of centroids its documents draw topics from
+        per_subject = max(1, args.centroids // args.subjects)
+        subjects = rng.integers(0, args.subjects, args.documents)
+        topics = subjects[:, None] * per_subject + rng.integers(0, per_subject, (args.documents, args.topics))
+        topics %= args.centroids
+    else:
+        topics = rng.integers(0, args.centroids, (args.documents, args.topics))
+    owners = np.repeat(np.arange(args.documents), doclens)
+    tokens = len(owners)
+    embeddings = np.empty((tokens, args.dim), dtype=np.float32)
+    for start in range(0, tokens, 1 << 20):
+        end = min(start + (1 << 20), tokens)
+        codes = topics[owners[start:end], rng.integers(0, args.topics, end - start)]
+        noise = rng.standard_normal((end - start, args.dim)).astype(np.float32) * args.spread / np.sqrt(args.dim)
+        embeddings[start:end] = normalize(centroids[codes] + noise)
+    return centroids, doclens, embeddings
+
+def build_queries(args, rng, doclens, embeddings):
+    offsets = np.r_[0, np.cumsum(doclens)]
+    targets = rng.integers(0, len(doclens), args.queries)
+    queries = []
+    for target in targets:
+        tokens = embeddings[offsets[target] + rng.integers(0, doclens[target], args.query_length)]
+        noise = rng.standard_normal(tokens.shape).astype(np.float32) * args.query_noise / np.sqrt(args.dim)
+        queries.append(normalize(tokens + noise))
+    return np.stack(queries)
+
+def exact_top_k(queries, doclens, embeddings, k):
+    """Brute-force MaxSim over the uncompressed embeddings"""
+    starts = np.r_[0, np.cumsum(doclens)[:-1]]
+    results = []
+    for query in queries:
+        scores = np.empty(len(doclens), dtype=np.float32)
+        for start in range(0, len(doclens), 4096):
+            end = min(start + 4096, len(doclens))
+            span = slice(starts[start], starts[end] if end < len(doclens) else len(embeddings))
+            similarities = embeddings[span] @ query.T
+            maxima = np.maximum.reduceat(similarities, starts[start:end] - starts[start], axis=0)
+            scores[start:end] = maxima.sum(axis=1)
+        results.append(np.argsort(-scores)[:k])
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=50000)
+    parser.add_argument("--centroids", type=int, default=4096)
+    parser.add_argument("--doclen", type=int, default=64, help="Mean tokens per document")
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--nbits", type=int, default=2)
+    parser.add_argument("--topics", type=int, default=8, help="Centroids each document draws its tokens from")
+    parser.add_argument("--subjects", type=int, default=0, help="Groups of documents sharing topic centroids; 0 for none")
+    parser.add_argument("--spread", type=float, default=0.6, help="Token noise around its centroid")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--query-length", type=int, default=32)
+    parser.add_argument("--query-noise", type=float, default=0.3)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--ncells", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threshold", type=float, nargs="+", default=[0.5, 0.4])
+    parser.add_argument("--ndocs", type=int, nargs="+", default=[256, 1024])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+    
+    start = time.perf_counter()
+    centroids, doclens, embeddings = build_corpus(args, rng)
+    index = PlaidIndex.from_embeddings(embeddings, doclens, centroids, args.nbits)
+    print(f"Built index: {args.documents} documents, {len(embeddings)} tokens in {time.perf_counter() - start:.1f}s")
+    
+    queries = build_queries(args, rng, doclens, embeddings)
+    truth = exact_top_k(queries, doclens, embeddings, args.k)
+    
+    rows = []
+    print(f"{'ncells':>6} {'threshold':>9} {'ndocs':>6} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for ncells, threshold, ndocs in itertools.product(args.ncells, args.threshold, args.ndocs):
+        latencies, recalls = [], []
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            pids, _ = index.search(query, args.k, ncells=ncells, centroid_score_threshold=threshold, ndocs=ndocs)
+            latencies.append((time.perf_counter() - start) * 1000)
+            recalls.append(len(set(pids.tolist()) & set(expected.tolist())) / args.k)
+            
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        row = {
+            "ncells": ncells,
+            "centroid_score_threshold": threshold,
+            "ndocs": ndocs,
+            "recall": float(np.mean(recalls)),
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99)
+        }
+        rows.append(row)
+        print(f"{ncells:>6} {threshold:>9} {ndocs:>6} {row['recall']:>9.3f} {p50:>8.2f} {p95:>8.2f} {p99:>8.2f}")
+        
+    if args.json:
+        write_report(args.json, "plaid_search", vars(args), rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Machine-readable benchmark reports.
+
+Every benchmark can write its results with write_report, as one JSON document
+holding the benchmark name, when and where it ran (git commit, host, Python
+and NumPy versions), its configuration and its result rows, so runs can be
+collected and compared over time to spot regressions.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+from typing import Any, Dict, List, Sequence
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def environment() -> Dict[str, Any]:
+    return {
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__
+    }
+
+def latency_summary(latencies_ms: Sequence[float]) -> Dict[str, float]:
+    """Mean, percentiles and maximum of latencies in milliseconds"""
+    if len(latencies_ms) == 0:
+        return {"mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {
+        "mean_ms": float(np.mean(latencies_ms)),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(np.max(latencies_ms))
+    }
+
+def write_report(path: str, benchmark: str, config: Dict[str, Any], results: List[Dict[str, Any]]):
+    report = {
+        "benchmark": benchmark,
+        "timestamp": time.time(),
+        "git_commit": git_commit(),
+        "environment": environment(),
+        "config": config,
+        "results": results
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
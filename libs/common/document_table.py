@@ -0,0 +1,153 @@
+import json
+import os
+import shutil
+import numpy as np
+from array import array
+from typing import Any, Dict, List, Optional
+from index_format import create_array, open_array, seal_array
+
+# Document table: the contents, ids and metadata of an index's documents as
+# flat byte columns in <index>/document_table, so query workers map them
+# instead of each parsing collection.json and the id maps into Python objects.
+#
+#   table.json                 version and document count
+#   <column>.qcar              (bytes,) uint8 UTF-8 values laid end to end
+#   <column>_offsets.qcar      (documents + 1,) int64 start of each value
+#
+# Columns are contents, ids and metadata (JSON text, empty without metadata).
+TABLE_DIR = "document_table"
+TABLE_INFO = "table.json"
+TABLE_VERSION = 1
+COLUMNS = ("contents", "ids", "metadata")
+
+def table_path(index_path: str) -> str:
+    return os.path.join(index_path, TABLE_DIR)
+
+def has_document_table(index_path: str) -> bool:
+    return os.path.exists(os.path.join(table_path(index_path), TABLE_INFO))
+
+def _seal(out: np.ndarray, path: str):
+    if isinstance(out, np.memmap):
+        out.flush()
+    del out
+    seal_array(path)
+
+class DocumentTableWriter:
+    """
+    Writes a document table as documents arrive.
+    
+    Values are appended to plain files in a .partial directory and copied
+    into array containers by close, which swaps the table into place.
+    """
+    
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        self._partial = table_path(index_path) + ".partial"
+        shutil.rmtree(self._partial, ignore_errors=True)
+        os.makedirs(self._partial)
+        self._files = {column: open(os.path.join(self._partial, f"{column}.bin"), "wb") for column in COLUMNS}
+        self._offsets = {column: array("q", [0]) for column in COLUMNS}
+        self.count = 0
+        
+    def _put(self, column: str, value: str):
+        data = value.encode("utf-8")
+        self._files[column].write(data)
+        offsets = self._offsets[column]
+        offsets.append(offsets[-1] + len(data))
+        
+    def add(self, content: str, document_id: str, metadata: Optional[Dict[str, Any]] = None):
+        self._put("contents", content)
+        self._put("ids", document_id)
+        self._put("metadata", json.dumps(metadata) if metadata else "")
+        self.count += 1
+        
+    def close(self, chunk_size: int = 8 * 1024 * 1024):
+        for column in COLUMNS:
+            self._files[column].close()
+            raw = os.path.join(self._partial, f"{column}.bin")
+            path = os.path.join(self._partial, f"{column}.qcar")
+            out = create_array(path, np.uint8, (self._offsets[column][-1],))
+            position = 0
+            with open(raw, "rb") as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    out[position:position + len(chunk)] = np.frombuffer(chunk, dtype=np.uint8)
+                    position += len(chunk)
+            _seal(out, path)
+            os.remove(raw)
+            
+            offsets_path = os.path.join(self._partial, f"{column}_offsets.qcar")
+            offsets = create_array(offsets_path, np.int64, (len(self._offsets[column]),))
+            offsets[...] = np.frombuffer(self._offsets[column], dtype=np.int64)
+            _seal(offsets, offsets_path)
+            
+        with open(os.path.join(self._partial, TABLE_INFO), "w") as f:
+            json.dump({"version": TABLE_VERSION, "num_documents": self.count}, f)
+            
+        shutil.rmtree(table_path(self.index_path), ignore_errors=True)
+        os.rename(self._partial, table_path(self.index_path))
+
+class DocumentTable:
+    """Contents, ids and metadata of an index's documents by position"""
+    
+    def __init__(self, contents: List[str], ids: List[str], metadata: List[Optional[Dict[str, Any]]]):
+        self._columns = {"contents": contents, "ids": ids, "metadata": metadata}
+        self._count = len(ids)
+        
+    @classmethod
+    def from_lists(cls, contents: List[str], ids: List[str], metadata: Dict[str, Any]) -> "DocumentTable":
+        """A table over an index's collection.json, pid map and metadata map, for indexes built without one"""
+        return cls(contents, ids, [metadata.get(document_id) for document_id in ids])
+        
+    def __len__(self) -> int:
+        return self._count
+        
+    def _value(self, column: str, pid: int):
+        values = self._columns[column]
+        return values[pid] if pid < len(values) else None
+        
+    def content(self, pid: int) -> str:
+        return self._value("contents", pid) or ""
+        
+    def document_id(self, pid: int) -> str:
+        document_id = self._value("ids", pid)
+        return str(pid) if document_id is None else document_id
+        
+    def metadata(self, pid: int) -> Dict[str, Any]:
+        return self._value("metadata", pid) or {}
+
+class _MappedColumn:
+    """Values of one column decoded from the mapped bytes on access"""
+    
+    def __init__(self, data: np.ndarray, offsets: np.ndarray, decode):
+        self.data = data
+        self.offsets = offsets
+        self.decode = decode
+        
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+        
+    def __getitem__(self, pid: int):
+        start, end = int(self.offsets[pid]), int(self.offsets[pid + 1])
+        return self.decode(self.data[start:end].tobytes().decode("utf-8"))
+
+def open_document_table(index_path: str) -> DocumentTable:
+    """Open a document table with every column memory-mapped read-only"""
+    directory = table_path(index_path)
+    with open(os.path.join(directory, TABLE_INFO)) as f:
+        info = json.load(f)
+    if info["version"] > TABLE_VERSION:
+        raise ValueError(f"Unsupported document table version {info['version']}")
+        
+    decoders = {"contents": str, "ids": str, "metadata": lambda text: json.loads(text) if text else None}
+    columns = {
+        column: _MappedColumn(
+            open_array(os.path.join(directory, f"{column}.qcar")),
+            open_array(os.path.join(directory, f"{column}_offsets.qcar")),
+            decoders[column]
+        )
+        for column in COLUMNS
+    }
+    return DocumentTable(columns["contents"], columns["ids"], columns["metadata"])
@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Any, Dict, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# An index artifact is the index directory stored file by file under a key
+# prefix, plus a manifest listing every file with its size, SHA-256 and object
+# key. The manifest is written last, so its presence marks a complete upload.
+# Files unchanged since a previous version keep pointing at that version's
+# object, so an incremental update only uploads what changed.
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+class ArtifactError(ValueError):
+    """Raised when an index artifact is incomplete or fails verification"""
+
+def file_checksum(path: str, chunk_size: int = 8 * 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def build_manifest(index_dir: str, index_name: str) -> Dict[str, Any]:
+    """List every file under index_dir with its size and checksum"""
+    files = []
+    for root, _, names in os.walk(index_dir):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            files.append({
+                "path": os.path.relpath(path, index_dir).replace(os.sep, "/"),
+                "size": os.path.getsize(path),
+                "sha256": file_checksum(path)
+            })
+            
+    files.sort(key=lambda entry: entry["path"])
+    return {
+        "version": MANIFEST_VERSION,
+        "index_name": index_name,
+        "created_at": time.time(),
+        "total_bytes": sum(entry["size"] for entry in files),
+        "files": files
+    }
+
+def read_manifest(index_dir: str) -> Dict[str, Any]:
+    with open(os.path.join(index_dir, MANIFEST_NAME)) as f:
+        return json.load(f)
+
+def file_key(prefix: str, entry: Dict[str, Any]) -> str:
+    return entry.get("key", f"{prefix}/{entry['path']}")
+
+async def fetch_manifest(storage_client, prefix: str) -> Dict[str, Any]:
+    try:
+        return json.loads(await storage_client.get_object(f"{prefix}/{MANIFEST_NAME}"))
+    except Exception as e:
+        raise ArtifactError(f"No complete index artifact under {prefix}: {str(e)}")
+
+async def upload_index(
+    storage_client,
+    index_dir: str,
+    prefix: str,
+    index_name: str,
+    concurrency: int = 8,
+    previous: Optional[Dict[str, Any]] = None,
+    previous_prefix: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Upload an index directory with up to concurrency files in flight and return its manifest
+    
+    Files whose checksum matches the same path in the previous manifest are
+    not uploaded again.
+    """
+    loop = asyncio.get_event_loop()
+    start_time = time.time()
+    manifest = await loop.run_in_executor(None, build_manifest, index_dir, index_name)
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    unchanged: Dict[str, str] = {}
+    if previous is not None:
+        checksums = {entry["path"]: entry["sha256"] for entry in manifest["files"]}
+        unchanged = {
+            entry["path"]: file_key(previous_prefix, entry) for entry in previous["files"]
+            if checksums.get(entry["path"]) == entry["sha256"]
+        }
+        
+    async def upload(entry: Dict[str, Any]):
+        if entry["path"] in unchanged:
+            entry["key"] = unchanged[entry["path"]]
+            return
+        entry["key"] = f"{prefix}/{entry['path']}"
+        async with semaphore:
+            await storage_client.put_file(
+                entry["key"],
+                os.path.join(index_dir, entry["path"]),
+                {"sha256": entry["sha256"]}
+            )
+            
+    await asyncio.gather(*[upload(entry) for entry in manifest["files"]])
+    await storage_client.put_object(f"{prefix}/{MANIFEST_NAME}", json.dumps(manifest).encode("utf-8"))
+    
+    uploaded = [entry for entry in manifest["files"] if entry["path"] not in unchanged]
+    logger.info(
+        f"Uploaded index {index_name} ({len(uploaded)} of {len(manifest['files'])} files, "
+        f"{sum(entry['size'] for entry in uploaded)} of {manifest['total_bytes']} bytes) "
+        f"to {prefix} in {time.time() - start_time:.2f} seconds"
+    )
+    return manifest
+
+def _reuse_file(source: str, target: str):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+async def download_index(
+    storage_client,
+    prefix: str,
+    index_dir: str,
+    concurrency: int = 8,
+    reuse_dir: Optional[str] = None,
+    paths: Optional[Sequence[str]] = None
+) -> Dict[str, Any]:
+    """
+    Download and verify an uploaded index into index_dir, writing the manifest last
+    
+    Files that an earlier complete download in reuse_dir already holds with
+    the same checksum are linked from there instead of downloaded. With
+    paths, only the files at those paths that the index has are downloaded
+    and no manifest is written, as the directory is not a complete index.
+    """
+    loop = asyncio.get_event_loop()
+    manifest = await fetch_manifest(storage_client, prefix)
+    
+    local = {}
+    if reuse_dir is not None and os.path.exists(os.path.join(reuse_dir, MANIFEST_NAME)):
+        local = {entry["path"]: entry["sha256"] for entry in read_manifest(reuse_dir)["files"]}
+        
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def download(entry: Dict[str, Any]):
+        path = os.path.join(index_dir, *entry["path"].split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if local.get(entry["path"]) == entry["sha256"]:
+            _reuse_file(os.path.join(reuse_dir, *entry["path"].split("/")), path)
+            return
+        async with semaphore:
+            await storage_client.download(file_key(prefix, entry), path)
+        checksum = await loop.run_in_executor(None, file_checksum, path)
+        if checksum != entry["sha256"]:
+            raise ArtifactError(f"Checksum mismatch for {entry['path']} in {prefix}")
+            
+    entries = manifest["files"] if paths is None else [entry for entry in manifest["files"] if entry["path"] in paths]
+    await asyncio.gather(*[download(entry) for entry in entries])
+    if paths is not None:
+        return manifest
+        
+    with open(os.path.join(index_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f)
+    return manifest
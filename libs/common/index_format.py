@@ -0,0 +1,162 @@
+import struct
+import zlib
+import numpy as np
+from typing import Any, Dict
+
+# QuickColbert array container (.qcar): a fixed 64-byte header followed by one
+# little-endian array. Uncompressed payloads start at HEADER_SIZE so readers
+# can memory-map them directly.
+#
+#   magic      4s   b"QCAR"
+#   version    H
+#   flags      H    FLAG_ZLIB when the payload is zlib-compressed
+#   dtype      8s   NumPy dtype string, e.g. b"<u2", b"<i4", b"<f4"
+#   ndim       I
+#   shape      4Q   unused dimensions are zero
+#   length     Q    payload size in bytes as stored
+#   crc32      I    CRC-32 of the stored payload
+MAGIC = b"QCAR"
+FORMAT_VERSION = 1
+FLAG_ZLIB = 1
+MAX_DIMS = 4
+HEADER = struct.Struct("<4sHH8sI4QQI")
+HEADER_SIZE = 64
+
+assert HEADER.size == HEADER_SIZE
+
+class FormatError(ValueError):
+    """Raised when a buffer or file is not a valid array container"""
+
+def label_dtype(n_clusters: int) -> np.dtype:
+    """Smallest little-endian dtype that can hold cluster ids below n_clusters"""
+    return np.dtype("<u2") if n_clusters <= np.iinfo(np.uint16).max else np.dtype("<i4")
+
+def _little_endian(array: np.ndarray) -> np.ndarray:
+    dtype = array.dtype.newbyteorder("<") if array.dtype.byteorder == ">" else array.dtype
+    return np.ascontiguousarray(array, dtype=dtype)
+
+def encode_header(array: np.ndarray, payload: bytes, compressed: bool) -> bytes:
+    if array.ndim > MAX_DIMS:
+        raise FormatError(f"Arrays with more than {MAX_DIMS} dimensions are not supported")
+        
+    shape = list(array.shape) + [0] * (MAX_DIMS - array.ndim)
+    return HEADER.pack(
+        MAGIC,
+        FORMAT_VERSION,
+        FLAG_ZLIB if compressed else 0,
+        array.dtype.str.encode("ascii"),
+        array.ndim,
+        *shape,
+        len(payload),
+        zlib.crc32(payload)
+    )
+
+def decode_header(header: bytes) -> Dict[str, Any]:
+    if len(header) < HEADER_SIZE:
+        raise FormatError("Buffer is shorter than the array header")
+        
+    magic, version, flags, dtype, ndim, *rest = HEADER.unpack(header[:HEADER_SIZE])
+    if magic != MAGIC:
+        raise FormatError("Not a QuickColbert array container")
+    if version > FORMAT_VERSION:
+        raise FormatError(f"Unsupported array container version {version}")
+        
+    shape, length, crc = rest[:MAX_DIMS], rest[MAX_DIMS], rest[MAX_DIMS + 1]
+    return {
+        "version": version,
+        "compressed": bool(flags & FLAG_ZLIB),
+        "dtype": np.dtype(dtype.rstrip(b"\0").decode("ascii")),
+        "shape": tuple(shape[:ndim]),
+        "length": length,
+        "crc32": crc
+    }
+
+def encode_array(array: np.ndarray, compress: bool = False, level: int = 6) -> bytes:
+    """Serialize an array into the container format"""
+    array = _little_endian(array)
+    payload = array.tobytes()
+    if compress:
+        payload = zlib.compress(payload, level)
+    return encode_header(array, payload, compress) + payload
+
+def decode_array(data: bytes, verify: bool = True) -> np.ndarray:
+    """Deserialize a container; uncompressed payloads are returned without copying"""
+    header = decode_header(data)
+    payload = memoryview(data)[HEADER_SIZE:HEADER_SIZE + header["length"]]
+    if len(payload) != header["length"]:
+        raise FormatError("Array payload is truncated")
+    if verify and zlib.crc32(payload) != header["crc32"]:
+        raise FormatError("Array payload checksum mismatch")
+        
+    if header["compressed"]:
+        payload = zlib.decompress(payload)
+    return np.frombuffer(payload, dtype=header["dtype"]).reshape(header["shape"])
+
+def write_array(path: str, array: np.ndarray, compress: bool = False) -> int:
+    """Write an array container to path and return the number of bytes written"""
+    data = encode_array(array, compress)
+    with open(path, "wb") as f:
+        f.write(data)
+    return len(data)
+
+def open_array(path: str) -> np.ndarray:
+    """
+    Open an array container from disk.
+    
+    Uncompressed containers are memory-mapped read-only, so pages are only
+    read when touched; compressed ones are read and inflated into memory.
+    """
+    with open(path, "rb") as f:
+        header = decode_header(f.read(HEADER_SIZE))
+        if header["compressed"]:
+            f.seek(0)
+            return decode_array(f.read())
+            
+    if header["length"] == 0:
+        return np.empty(header["shape"], dtype=header["dtype"])
+    return np.memmap(path, dtype=header["dtype"], mode="r", offset=HEADER_SIZE, shape=header["shape"])
+
+def create_array(path: str, dtype, shape) -> np.memmap:
+    """
+    Create an uncompressed container at path and return its payload mapped for writing.
+    
+    The header checksum is left empty until seal_array is called once the
+    payload has been filled in.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.byteorder == ">":
+        dtype = dtype.newbyteorder("<")
+    shape = tuple(int(n) for n in shape)
+    if len(shape) > MAX_DIMS:
+        raise FormatError(f"Arrays with more than {MAX_DIMS} dimensions are not supported")
+    length = int(np.prod(shape)) * dtype.itemsize
+    
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(
+            MAGIC,
+            FORMAT_VERSION,
+            0,
+            dtype.str.encode("ascii"),
+            len(shape),
+            *(list(shape) + [0] * (MAX_DIMS - len(shape))),
+            length,
+            0
+        ))
+        f.truncate(HEADER_SIZE + length)
+        
+    if length == 0:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r+", offset=HEADER_SIZE, shape=shape)
+
+def seal_array(path: str, chunk_size: int = 8 * 1024 * 1024):
+    """Record the checksum of a container created with create_array"""
+    with open(path, "r+b") as f:
+        header = HEADER.unpack(f.read(HEADER_SIZE))
+        crc = 0
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+        f.seek(0)
+        f.write(HEADER.pack(*header[:-1], crc))
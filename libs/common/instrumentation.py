@@ -0,0 +1,256 @@
+import collections
+import contextvars
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Histogram, generate_latest, multiprocess
+from starlette.responses import Response
+
+logger = logging.getLogger(__name__)
+
+# Stage timings, request metrics, trace context and on-demand profiling shared
+# by the services. Each service calls instrument(app, name) once; code on the
+# hot path times its stages with `with stage("encode"):` or observe_stage, and
+# everything is exported as Prometheus histograms on /metrics. Trace context
+# follows the W3C traceparent header: it is read from incoming requests (or
+# started by the first service a request reaches) and forwarded by the httpx
+# clients that install propagate_trace as a request hook.
+#
+# With PROMETHEUS_MULTIPROC_DIR set, metrics are kept in files there and
+# /metrics aggregates every process, e.g. the pre-fork query workers.
+
+# Seconds; stages range from sub-millisecond lookups to minutes-long index builds
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0
+)
+
+STAGE_SECONDS = Histogram(
+    "quickcolbert_stage_seconds", "Time spent in one stage of handling a request",
+    ["service", "stage"], buckets=LATENCY_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "quickcolbert_request_seconds", "Time to handle an HTTP request, until its response is sent",
+    ["service", "handler", "method", "status"], buckets=LATENCY_BUCKETS
+)
+
+_service = os.environ.get("SERVICE_NAME", "unknown")
+# Labelled histogram children, looked up once per stage instead of per observation
+_stages: Dict[str, Any] = {}
+
+def set_service(name: str):
+    global _service
+    _service = name
+    _stages.clear()
+
+def observe_stage(name: str, seconds: float):
+    """Record the duration of a stage measured elsewhere"""
+    child = _stages.get(name)
+    if child is None:
+        child = _stages[name] = STAGE_SECONDS.labels(_service, name)
+    child.observe(seconds)
+
+class stage:
+    """Time a block as a stage: `with stage("score"):`"""
+    
+    __slots__ = ("name", "started_at", "seconds")
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        
+    def __enter__(self) -> "stage":
+        self.started_at = time.perf_counter()
+        return self
+        
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.started_at
+        observe_stage(self.name, self.seconds)
+
+def _random_id(bits: int) -> str:
+    # Ids only need to be unique, not unpredictable
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+class TraceContext:
+    """The W3C trace context of the request being handled"""
+    
+    __slots__ = ("trace_id", "span_id", "flags")
+    
+    def __init__(self, trace_id: str, span_id: str, flags: str = "01"):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.flags = flags
+        
+    @classmethod
+    def start(cls) -> "TraceContext":
+        return cls(_random_id(128), _random_id(64))
+        
+    @classmethod
+    def parse(cls, header: Optional[str]) -> Optional["TraceContext"]:
+        """Read a traceparent header, or None when it is missing or malformed"""
+        parts = header.strip().split("-") if header else []
+        if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or parts[1] == "0" * 32:
+            return None
+        return cls(parts[1], parts[2], parts[3][:2])
+        
+    def child(self) -> "TraceContext":
+        """The context of a span started by this one, e.g. a request to another service"""
+        return TraceContext(self.trace_id, _random_id(64), self.flags)
+        
+    def header(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{self.flags}"
+
+_trace: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+
+def current_trace() -> Optional[TraceContext]:
+    return _trace.get()
+
+@contextmanager
+def use_trace(trace: Optional[TraceContext]):
+    """Make trace the current context, e.g. in a background job started by a request"""
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+async def propagate_trace(request):
+    """httpx request hook forwarding the current trace context to the service called"""
+    trace = _trace.get()
+    if trace is not None and "traceparent" not in request.headers:
+        request.headers["traceparent"] = trace.child().header()
+
+class SamplingProfiler:
+    """
+    Statistical profiler: samples the stack of every thread each interval
+    seconds from a background thread and counts identical stacks.
+    
+    Samples cover the whole process, so concurrent requests show up too.
+    folded() renders the counts in the collapsed-stack format read by
+    flamegraph.pl and speedscope.
+    """
+    
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Dict[str, int] = collections.Counter()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+                
+    def start(self) -> "SamplingProfiler":
+        self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+        
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.items())
+
+class InstrumentationMiddleware:
+    """
+    ASGI middleware timing every HTTP request and setting its trace context.
+    
+    Requests sent with an X-Profile header are profiled with a
+    SamplingProfiler when PROFILE_REQUESTS is enabled, one at a time; the
+    folded stacks are written to PROFILE_DIR, named after the trace id, and
+    the response's X-Profile header says where.
+    """
+    
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+        self.profiling = os.environ.get("PROFILE_REQUESTS", "false").lower() == "true"
+        self.profile_dir = os.environ.get("PROFILE_DIR", "/tmp/quickcolbert/profiles")
+        self.profile_interval = float(os.environ.get("PROFILE_INTERVAL_MS", "5")) / 1000
+        self._profiling_lock = threading.Lock()
+        self._requests: Dict[tuple, Any] = {}
+        
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+            
+        traceparent, profile = None, False
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1")
+            elif name == b"x-profile":
+                profile = True
+        trace = TraceContext.parse(traceparent) or TraceContext.start()
+        profiler = None
+        if profile and self.profiling and self._profiling_lock.acquire(blocking=False):
+            profiler = SamplingProfiler(self.profile_interval).start()
+        profile_path = os.path.join(self.profile_dir, f"{self.service}-{trace.trace_id}.folded") if profiler else None
+        status = 500
+        
+        async def send_with_trace(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", trace.trace_id.encode("ascii"))]
+                if profile_path is not None:
+                    message["headers"].append((b"x-profile", profile_path.encode("utf-8")))
+            await send(message)
+            
+        token = _trace.set(trace)
+        start_time = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            _trace.reset(token)
+            self._observe(scope, status, time.perf_counter() - start_time)
+            if profiler is not None:
+                self._write_profile(profiler, profile_path)
+                
+    def _observe(self, scope, status: int, seconds: float):
+        # Routing leaves the matched endpoint in the scope
+        labels = (getattr(scope.get("endpoint"), "__name__", "unmatched"), scope["method"], status)
+        child = self._requests.get(labels)
+        if child is None:
+            child = self._requests[labels] = REQUEST_SECONDS.labels(self.service, labels[0], labels[1], str(status))
+        child.observe(seconds)
+        
+    def _write_profile(self, profiler: SamplingProfiler, path: str):
+        try:
+            profiler.stop()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            with open(path, "w") as f:
+                f.write(profiler.folded())
+            logger.info(f"Wrote request profile to {path}")
+        except OSError as e:
+            logger.warning(f"Could not write request profile to {path}: {str(e)}")
+        finally:
+            self._profiling_lock.release()
+
+def metrics_response() -> Response:
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+def instrument(app, service: str):
+    """Time a FastAPI app's requests and stages as service, and serve /metrics"""
+    set_service(service)
+    app.add_middleware(InstrumentationMiddleware, service=service)
+    app.add_api_route("/metrics", metrics_response, methods=["GET"], include_in_schema=False)
@@ -0,0 +1,74 @@
+import hashlib
+import logging
+import os
+import time
+from importlib import metadata
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# A model snapshot is the fully constructed RAGPretrainedModel pickled with
+# torch.save, so a restart skips building it from the Hugging Face checkpoint
+# (config parsing, tokenizer set-up, module construction and weight copies).
+# Pickles are only valid for the library versions that wrote them, so those
+# are part of the file name, and any snapshot that fails to load is rebuilt.
+# Unpickling runs arbitrary code: the directory must only be writable by the
+# service itself.
+
+def _versions() -> str:
+    versions = []
+    for package in ("torch", "transformers", "ragatouille", "colbert-ai"):
+        try:
+            versions.append(f"{package}={metadata.version(package)}")
+        except metadata.PackageNotFoundError:
+            versions.append(f"{package}=none")
+    return ",".join(versions)
+
+def snapshot_path(snapshot_dir: str, model_name: str) -> str:
+    digest = hashlib.sha256(_versions().encode("utf-8")).hexdigest()[:16]
+    return os.path.join(snapshot_dir, f"{model_name.replace('/', '--')}-{digest}.pt")
+
+def load_pretrained(model_name: str, snapshot_dir: Optional[str] = None, prepare: Optional[Callable[[Any], Any]] = None):
+    """
+    RAGPretrainedModel.from_pretrained(model_name), from a snapshot when there is one
+    
+    prepare runs on freshly built models before they are snapshotted, so
+    whatever it sets up (e.g. the inference checkpoint) is saved with them.
+    """
+    from ragatouille import RAGPretrainedModel
+    
+    path = snapshot_path(snapshot_dir, model_name) if snapshot_dir else None
+    if path is not None and os.path.exists(path):
+        start_time = time.time()
+        try:
+            import torch
+            model = torch.load(path, map_location="cpu", weights_only=False)
+            logger.info(f"Loaded {model_name} from snapshot {path} in {time.time() - start_time:.2f} seconds")
+            return model
+        except Exception as e:
+            logger.warning(f"Could not load model snapshot {path}, rebuilding it: {str(e)}")
+            
+    start_time = time.time()
+    model = RAGPretrainedModel.from_pretrained(model_name)
+    if prepare is not None:
+        prepare(model)
+    logger.info(f"Loaded {model_name} in {time.time() - start_time:.2f} seconds")
+    
+    if path is not None:
+        save_snapshot(model, path)
+    return model
+
+def save_snapshot(model, path: str):
+    """Write a snapshot atomically, so concurrent writers and readers never see a partial file"""
+    import torch
+    
+    tmp_path = f"{path}.{os.getpid()}.part"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        torch.save(model, tmp_path)
+        os.replace(tmp_path, path)
+        logger.info(f"Saved model snapshot to {path}")
+    except Exception as e:
+        logger.warning(f"Could not save model snapshot to {path}: {str(e)}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
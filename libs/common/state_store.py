@@ -0,0 +1,257 @@
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from instrumentation import observe_stage
+
+logger = logging.getLogger(__name__)
+
+# Async access to the services' shared state (a Dapr state store) and events
+# (Dapr pub/sub). Reads of several keys cost one round trip with get_many,
+# related writes go in one atomic transaction, and nothing blocks the event
+# loop. Values are bytes, str, or anything JSON-serializable. Services build
+# their store with state_store_from_env(); STATE_STORE_BACKEND=memory keeps
+# the state in process instead, e.g. for tests.
+
+def _encode(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return json.dumps(value).encode("utf-8")
+
+def decode_json(data: Optional[bytes]) -> Optional[Any]:
+    return json.loads(data.decode("utf-8")) if data else None
+
+class StateStoreError(Exception):
+    """The state store could not complete a read or write"""
+
+class StateStore:
+    """Async state store and publisher; subclasses implement the _methods, one round trip each"""
+    
+    def __init__(self, store_name: str = "statestore"):
+        self.store_name = store_name
+        self.round_trips = 0
+        self.keys_read = 0
+        self.keys_written = 0
+        self.published = 0
+        
+    async def get(self, key: str) -> Optional[bytes]:
+        """The value stored under key, or None"""
+        return (await self.get_many([key]))[key]
+        
+    async def get_json(self, key: str) -> Optional[Any]:
+        return decode_json(await self.get(key))
+        
+    async def get_many(self, keys: Sequence[str]) -> Dict[str, Optional[bytes]]:
+        """Values of several keys, None for missing ones, in one round trip"""
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        values = await self._timed("state_get", self._get_many(keys))
+        self.keys_read += len(keys)
+        return {key: values.get(key) or None for key in keys}
+        
+    async def save(self, key: str, value: Any, ttl: Optional[int] = None):
+        await self.save_many({key: value}, ttl)
+        
+    async def save_many(self, items: Dict[str, Any], ttl: Optional[int] = None):
+        """Write several keys in one round trip, each expiring after ttl seconds if given; not atomic"""
+        if not items:
+            return
+        await self._timed("state_save", self._save_many({key: _encode(value) for key, value in items.items()}, ttl))
+        self.keys_written += len(items)
+        
+    async def transaction(self, upserts: Dict[str, Any], deletes: Sequence[str] = ()):
+        """Write and delete keys atomically, in one round trip"""
+        if not upserts and not deletes:
+            return
+        await self._timed("state_transaction", self._transaction({key: _encode(value) for key, value in upserts.items()}, list(deletes)))
+        self.keys_written += len(upserts) + len(deletes)
+        
+    async def delete(self, key: str):
+        await self.transaction({}, [key])
+        
+    async def publish(self, pubsub_name: str, topic: str, data: Any):
+        """Publish a JSON event to a pub/sub topic"""
+        await self._timed("publish", self._publish(pubsub_name, topic, _encode(data)))
+        self.published += 1
+        
+    async def _timed(self, name: str, call):
+        self.round_trips += 1
+        start_time = time.perf_counter()
+        try:
+            return await call
+        finally:
+            observe_stage(name, time.perf_counter() - start_time)
+            
+    async def _get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        raise NotImplementedError
+        
+    async def _save_many(self, items: Dict[str, bytes], ttl: Optional[int]):
+        raise NotImplementedError
+        
+    async def _transaction(self, upserts: Dict[str, bytes], deletes: List[str]):
+        raise NotImplementedError
+        
+    async def _publish(self, pubsub_name: str, topic: str, data: bytes):
+        raise NotImplementedError
+        
+    async def close(self):
+        pass
+        
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self).__name__,
+            "round_trips": self.round_trips,
+            "keys_read": self.keys_read,
+            "keys_written": self.keys_written,
+            "published": self.published
+        }
+
+class DaprStateStore(StateStore):
+    """
+    A Dapr state store and pub/sub, over the sidecar's gRPC API.
+    
+    The dapr-client SDK is synchronous, so this uses the generated stubs on
+    a grpc.aio channel instead: calls are awaited on the event loop rather
+    than blocking it or holding a thread each.
+    """
+    
+    def __init__(
+        self,
+        store_name: str = "statestore",
+        address: Optional[str] = None,
+        api_token: Optional[str] = None,
+        timeout: float = 10.0
+    ):
+        super().__init__(store_name)
+        self.address = address or (
+            f"{os.environ.get('DAPR_RUNTIME_HOST', '127.0.0.1')}:{os.environ.get('DAPR_GRPC_PORT', '50001')}"
+        )
+        api_token = api_token or os.environ.get("DAPR_API_TOKEN")
+        self.metadata: Tuple[Tuple[str, str], ...] = (("dapr-api-token", api_token),) if api_token else ()
+        self.timeout = timeout
+        self._channel = None
+        self._dapr = None
+        
+    def _stub(self):
+        # Created lazily so the channel binds to the event loop that uses it
+        if self._dapr is None:
+            import grpc
+            from dapr.proto import api_service_v1
+            self._channel = grpc.aio.insecure_channel(self.address)
+            self._dapr = api_service_v1.DaprStub(self._channel)
+        return self._dapr
+        
+    async def _call(self, method: str, request):
+        import grpc
+        try:
+            return await getattr(self._stub(), method)(request, metadata=self.metadata, timeout=self.timeout)
+        except grpc.aio.AioRpcError as e:
+            raise StateStoreError(f"Dapr {method} failed: {e.code().name} {e.details()}") from e
+            
+    async def _get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        from dapr.proto import api_v1
+        if len(keys) == 1:
+            response = await self._call("GetState", api_v1.GetStateRequest(store_name=self.store_name, key=keys[0]))
+            return {keys[0]: response.data}
+        response = await self._call(
+            "GetBulkState", api_v1.GetBulkStateRequest(store_name=self.store_name, keys=keys, parallelism=len(keys))
+        )
+        for item in response.items:
+            if item.error:
+                raise StateStoreError(f"Could not read {item.key}: {item.error}")
+        return {item.key: item.data for item in response.items}
+        
+    def _state_item(self, key: str, value: bytes, ttl: Optional[int] = None):
+        from dapr.proto import common_v1
+        return common_v1.StateItem(key=key, value=value, metadata={"ttlInSeconds": str(ttl)} if ttl else {})
+        
+    async def _save_many(self, items: Dict[str, bytes], ttl: Optional[int]):
+        from dapr.proto import api_v1
+        await self._call("SaveState", api_v1.SaveStateRequest(
+            store_name=self.store_name, states=[self._state_item(key, value, ttl) for key, value in items.items()]
+        ))
+        
+    async def _transaction(self, upserts: Dict[str, bytes], deletes: List[str]):
+        from dapr.proto import api_v1, common_v1
+        operations = [
+            api_v1.TransactionalStateOperation(operationType="upsert", request=self._state_item(key, value))
+            for key, value in upserts.items()
+        ] + [
+            api_v1.TransactionalStateOperation(operationType="delete", request=common_v1.StateItem(key=key))
+            for key in deletes
+        ]
+        await self._call(
+            "ExecuteStateTransaction",
+            api_v1.ExecuteStateTransactionRequest(storeName=self.store_name, operations=operations)
+        )
+        
+    async def _publish(self, pubsub_name: str, topic: str, data: bytes):
+        from dapr.proto import api_v1
+        await self._call("PublishEvent", api_v1.PublishEventRequest(
+            pubsub_name=pubsub_name, topic=topic, data=data, data_content_type="application/json"
+        ))
+        
+    async def close(self):
+        if self._channel is not None:
+            await self._channel.close()
+            self._channel = None
+            self._dapr = None
+            
+    def stats(self) -> Dict[str, Any]:
+        return dict(super().stats(), address=self.address)
+
+class MemoryStateStore(StateStore):
+    """
+    In-process state store and pub/sub with the same behaviour, for tests and
+    single-process runs. Published events are kept in events and passed to
+    the callbacks subscribed to their topic.
+    """
+    
+    def __init__(self, store_name: str = "statestore"):
+        super().__init__(store_name)
+        self._state: Dict[str, Tuple[bytes, Optional[float]]] = {}
+        self.events: List[Tuple[str, str, Any]] = []
+        self._subscribers: Dict[str, List[Callable[[Any], Any]]] = {}
+        
+    def subscribe(self, topic: str, callback: Callable[[Any], Any]):
+        """Call callback, a function or coroutine function, with the data of each event published to topic"""
+        self._subscribers.setdefault(topic, []).append(callback)
+        
+    async def _get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        now = time.time()
+        values = {}
+        for key in keys:
+            entry = self._state.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > now):
+                values[key] = entry[0]
+        return values
+        
+    async def _save_many(self, items: Dict[str, bytes], ttl: Optional[int]):
+        expires_at = time.time() + ttl if ttl else None
+        for key, value in items.items():
+            self._state[key] = (value, expires_at)
+            
+    async def _transaction(self, upserts: Dict[str, bytes], deletes: List[str]):
+        for key, value in upserts.items():
+            self._state[key] = (value, None)
+        for key in deletes:
+            self._state.pop(key, None)
+            
+    async def _publish(self, pubsub_name: str, topic: str, data: bytes):
+        event = json.loads(data.decode("utf-8"))
+        self.events.append((pubsub_name, topic, event))
+        for callback in self._subscribers.get(topic, []):
+            result = callback(event)
+            if hasattr(result, "__await__"):
+                await result
+
+def state_store_from_env() -> StateStore:
+    """The state store named by STATE_STORE_NAME, through Dapr unless STATE_STORE_BACKEND is memory"""
+    store_name = os.environ.get("STATE_STORE_NAME", "statestore")
+    if os.environ.get("STATE_STORE_BACKEND", "dapr").lower() == "memory":
+        return MemoryStateStore(store_name)
+    return DaprStateStore(store_name, timeout=float(os.environ.get("STATE_STORE_TIMEOUT", "10")))
@@ -0,0 +1,126 @@
+import asyncio
+import httpx
+import json
+import logging
+import os
+from typing import Any, AsyncIterator, Dict, List, Optional
+from instrumentation import propagate_trace
+
+logger = logging.getLogger(__name__)
+
+class StorageClient:
+    """Async client for the storage-service object API"""
+    
+    def __init__(self, base_url: Optional[str] = None, timeout: float = 300.0):
+        self.base_url = base_url or os.environ.get("STORAGE_SERVICE_URL", "http://localhost:8002")
+        self.timeout = timeout
+        self.client: Optional[httpx.AsyncClient] = None
+        
+    def _client(self) -> httpx.AsyncClient:
+        # Created lazily so the client binds to the event loop that uses it
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                base_url=self.base_url, timeout=self.timeout, event_hooks={"request": [propagate_trace]}
+            )
+        return self.client
+        
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+            
+    async def put_object(self, key: str, data: bytes, metadata: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """Store an object under key"""
+        response = await self._client().post(
+            f"/objects/{key}",
+            files={"file": (os.path.basename(key), data, "application/octet-stream")},
+            data={"metadata": json.dumps(metadata or {})}
+        )
+        response.raise_for_status()
+        return response.json()
+        
+    async def put_file(self, key: str, path: str, metadata: Optional[Dict[str, str]] = None, chunk_size: int = 1024 * 1024) -> Dict[str, Any]:
+        """Store a local file under key, streaming it from disk as the request body"""
+        async def chunks():
+            loop = asyncio.get_event_loop()
+            with open(path, "rb") as f:
+                while True:
+                    # Disk reads run on the default executor, so they do not stall the event loop
+                    chunk = await loop.run_in_executor(None, f.read, chunk_size)
+                    if not chunk:
+                        return
+                    yield chunk
+                    
+        response = await self._client().put(
+            f"/objects/{key}",
+            content=chunks(),
+            headers={
+                "Content-Type": "application/octet-stream",
+                "X-Object-Metadata": json.dumps(metadata or {})
+            }
+        )
+        response.raise_for_status()
+        return response.json()
+        
+    async def get_object(self, key: str) -> bytes:
+        """Fetch an object's contents"""
+        response = await self._client().get(f"/objects/{key}")
+        response.raise_for_status()
+        return response.content
+        
+    async def iter_object(self, key: str) -> AsyncIterator[bytes]:
+        """Stream an object's contents chunk by chunk, without holding the whole object"""
+        async with self._client().stream("GET", f"/objects/{key}") as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                yield chunk
+                
+    async def download(self, key: str, path: str) -> int:
+        """Stream an object to path, replacing it atomically; returns the number of bytes written"""
+        loop = asyncio.get_event_loop()
+        tmp_path = f"{path}.{os.getpid()}.part"
+        size = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                async for chunk in self.iter_object(key):
+                    # Disk writes run on the default executor, as put_file's reads do
+                    await loop.run_in_executor(None, f.write, chunk)
+                    size += len(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+            
+        logger.info(f"Downloaded {key} ({size} bytes) to {path}")
+        return size
+        
+    async def list_objects(self, prefix: str = "", page_size: int = 1000) -> AsyncIterator[Dict[str, Any]]:
+        """Every object under prefix with its size, etag and last-modified time, page by page"""
+        token = None
+        while True:
+            params = {"prefix": prefix, "max_keys": page_size}
+            if token:
+                params["continuation_token"] = token
+            response = await self._client().get("/objects", params=params)
+            response.raise_for_status()
+            page = response.json()
+            for obj in page["objects"]:
+                yield obj
+            token = page.get("next_continuation_token")
+            if not token:
+                return
+                
+    async def delete_objects(self, keys: Optional[List[str]] = None, prefix: Optional[str] = None) -> Dict[str, Any]:
+        """Delete keys and/or everything under prefix"""
+        response = await self._client().post("/batch/delete", json={"keys": keys or [], "prefix": prefix})
+        response.raise_for_status()
+        return response.json()
+        
+    async def copy_prefix(self, source_prefix: str, target_prefix: str) -> Dict[str, Any]:
+        response = await self._client().post(
+            "/batch/copy-prefix",
+            json={"source_prefix": source_prefix, "target_prefix": target_prefix}
+        )
+        response.raise_for_status()
+        return response.json()
@@ -0,0 +1,177 @@
+import json
+import logging
+import os
+import shutil
+import numpy as np
+from typing import Any, Dict, Optional, Tuple
+from index_format import create_array, label_dtype, open_array, seal_array
+
+logger = logging.getLogger(__name__)
+
+# Token store: the compressed token embeddings of a ColBERT index as flat,
+# uncompressed array containers in <index>/token_store, so a query pod can
+# memory-map them and only page in the documents it scores.
+#
+#   store.json         nbits, dim and counts
+#   centroids.qcar     (centroids, dim) float32
+#   buckets.qcar       (2^nbits,) float32 residual value of each bucket
+#   codes.qcar         (tokens,) centroid id of every token
+#   residuals.qcar     (tokens, dim * nbits / 8) uint8 packed residual buckets
+#   doc_offsets.qcar   (documents + 1,) int64 first token of each document
+#   ivf_pids.qcar      documents holding a token of each centroid, grouped by centroid
+#   ivf_lengths.qcar   (centroids,) int64 length of each centroid's group
+STORE_DIR = "token_store"
+STORE_INFO = "store.json"
+STORE_VERSION = 1
+
+def store_path(index_path: str) -> str:
+    return os.path.join(index_path, STORE_DIR)
+
+def has_token_store(index_path: str) -> bool:
+    return os.path.exists(os.path.join(store_path(index_path), STORE_INFO))
+
+def decompression_table(nbits: int) -> np.ndarray:
+    """Bucket indices packed in each possible residual byte, (256, 8 // nbits)"""
+    bits = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).reshape(256, 8 // nbits, nbits)
+    # ColBERT packs each bucket index least significant bit first
+    return (bits.astype(np.uint8) << np.arange(nbits, dtype=np.uint8)).sum(axis=2).astype(np.uint8)
+
+def quantization_buckets(residuals: np.ndarray, nbits: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Cutoffs and values of 2^nbits buckets with equal shares of (a sample of) the residual values"""
+    sample = residuals.ravel()[::max(1, residuals.size >> 22)]
+    cutoffs = np.quantile(sample, np.arange(1, 1 << nbits) / (1 << nbits)).astype(np.float32)
+    weights = np.quantile(sample, (np.arange(1 << nbits) + 0.5) / (1 << nbits)).astype(np.float32)
+    return cutoffs, weights
+
+def pack_residuals(residuals: np.ndarray, cutoffs: np.ndarray, nbits: int) -> np.ndarray:
+    """Quantise (tokens, dim) residuals into nbits buckets packed as ColBERT does"""
+    buckets = np.searchsorted(cutoffs, residuals, side="right").astype(np.uint8)
+    bits = (buckets[..., None] >> np.arange(nbits, dtype=np.uint8)) & 1
+    return np.packbits(bits.reshape(len(residuals), -1), axis=1)
+
+def unpack_residuals(packed: np.ndarray, weights: np.ndarray, nbits: int) -> np.ndarray:
+    """Residual values of packed rows, (tokens, dim) float32"""
+    values = weights.astype(np.float32)[decompression_table(nbits)]
+    return values[packed].reshape(len(packed), -1)
+
+def build_ivf(codes: np.ndarray, doc_offsets: np.ndarray, n_centroids: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Inverted lists: for each centroid, the documents holding at least one of its tokens"""
+    n_documents = len(doc_offsets) - 1
+    token_pids = np.repeat(np.arange(n_documents, dtype=np.int64), np.diff(doc_offsets))
+    pairs = np.unique(np.asarray(codes, dtype=np.int64) * n_documents + token_pids)
+    lengths = np.bincount(pairs // n_documents, minlength=n_centroids)
+    return (pairs % n_documents).astype(np.int32), lengths
+
+def _write(store_dir: str, name: str, array: np.ndarray):
+    out = create_array(os.path.join(store_dir, f"{name}.qcar"), array.dtype, array.shape)
+    out[...] = array
+    _finish(out, store_dir, name)
+
+def _finish(out: np.ndarray, store_dir: str, name: str):
+    if isinstance(out, np.memmap):
+        out.flush()
+    del out
+    seal_array(os.path.join(store_dir, f"{name}.qcar"))
+
+def write_token_store(index_path: str, nbits: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Convert the chunked ColBERT index at index_path into a token store.
+    
+    Chunks are copied one at a time into the mapped output, so the whole index
+    is never held in memory. With nbits different from the index's own, the
+    residuals are decompressed and quantised again with that many bits. The
+    store is written next to the index and swapped in when complete.
+    """
+    import torch
+    
+    def load(name: str):
+        return torch.load(os.path.join(index_path, name), map_location="cpu")
+        
+    with open(os.path.join(index_path, "metadata.json")) as f:
+        metadata = json.load(f)
+    source_nbits = metadata.get("config", {}).get("nbits", 2)
+    nbits = nbits or source_nbits
+    if 8 % nbits != 0:
+        raise ValueError(f"Unsupported residual width: {nbits} bits")
+        
+    doclens = []
+    for chunk in range(metadata["num_chunks"]):
+        with open(os.path.join(index_path, f"doclens.{chunk}.json")) as f:
+            doclens.extend(json.load(f))
+    doc_offsets = np.zeros(len(doclens) + 1, dtype=np.int64)
+    np.cumsum(doclens, out=doc_offsets[1:])
+    
+    centroids = load("centroids.pt").float().numpy()
+    _, source_weights = load("buckets.pt")
+    source_weights = source_weights.float().numpy()
+    dim = centroids.shape[1]
+    
+    # Buckets for requantising are fitted to the first chunk's residuals
+    cutoffs, weights = None, source_weights
+    if nbits != source_nbits:
+        sample = load("0.residuals.pt").numpy()[:1 << 16]
+        cutoffs, weights = quantization_buckets(unpack_residuals(sample, source_weights, source_nbits), nbits)
+        
+    partial = store_path(index_path) + ".partial"
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    
+    tokens = int(doc_offsets[-1])
+    codes = create_array(os.path.join(partial, "codes.qcar"), label_dtype(len(centroids)), (tokens,))
+    residuals = create_array(os.path.join(partial, "residuals.qcar"), np.uint8, (tokens, dim * nbits // 8))
+    
+    position = 0
+    for chunk in range(metadata["num_chunks"]):
+        chunk_codes = load(f"{chunk}.codes.pt").numpy()
+        chunk_residuals = load(f"{chunk}.residuals.pt").numpy()
+        if cutoffs is not None:
+            chunk_residuals = pack_residuals(unpack_residuals(chunk_residuals, source_weights, source_nbits), cutoffs, nbits)
+        codes[position:position + len(chunk_codes)] = chunk_codes
+        residuals[position:position + len(chunk_codes)] = chunk_residuals
+        position += len(chunk_codes)
+    if position != tokens:
+        raise ValueError(f"Document lengths cover {tokens} tokens but {position} are stored")
+        
+    if os.path.exists(os.path.join(index_path, "ivf.pid.pt")):
+        ivf_pids, ivf_lengths = (tensor.numpy() for tensor in load("ivf.pid.pt"))
+    else:
+        ivf_pids, ivf_lengths = build_ivf(codes, doc_offsets, len(centroids))
+        
+    _finish(codes, partial, "codes")
+    _finish(residuals, partial, "residuals")
+    _write(partial, "centroids", centroids.astype(np.float32))
+    _write(partial, "buckets", np.asarray(weights, dtype=np.float32))
+    _write(partial, "doc_offsets", doc_offsets)
+    _write(partial, "ivf_pids", np.asarray(ivf_pids, dtype=np.int32))
+    _write(partial, "ivf_lengths", np.asarray(ivf_lengths, dtype=np.int64))
+    
+    info = {
+        "version": STORE_VERSION,
+        "nbits": nbits,
+        "dim": dim,
+        "num_documents": len(doclens),
+        "num_tokens": tokens,
+        "num_centroids": len(centroids)
+    }
+    with open(os.path.join(partial, STORE_INFO), "w") as f:
+        json.dump(info, f)
+        
+    shutil.rmtree(store_path(index_path), ignore_errors=True)
+    os.rename(partial, store_path(index_path))
+    
+    logger.info(f"Wrote token store for {index_path}: {tokens} tokens at {nbits} bits")
+    return info
+
+def open_token_store(index_path: str) -> Dict[str, Any]:
+    """Open a token store with every array memory-mapped read-only"""
+    directory = store_path(index_path)
+    with open(os.path.join(directory, STORE_INFO)) as f:
+        info = json.load(f)
+    if info["version"] > STORE_VERSION:
+        raise ValueError(f"Unsupported token store version {info['version']}")
+        
+    arrays = {
+        name: open_array(os.path.join(directory, f"{name}.qcar"))
+        for name in ("centroids", "buckets", "codes", "residuals", "doc_offsets", "ivf_pids", "ivf_lengths")
+    }
+    return {**info, **arrays}
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from prometheus_client import Gauge
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+COLD_START_SECONDS = Gauge(
+    "quickcolbert_cold_start_seconds", "Seconds from process start until the service was ready",
+    ["service"], multiprocess_mode="max"
+)
+WARMUP_STEP_SECONDS = Gauge(
+    "quickcolbert_warmup_step_seconds", "Seconds taken by one startup warmup step",
+    ["service", "step"], multiprocess_mode="max"
+)
+
+_imported_at = time.time()
+
+def process_start_time() -> float:
+    """When this process started, from /proc where available, else when this module was imported"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the parenthesised command name; starttime is field 22 of the line
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return _imported_at
+
+class Warmup:
+    """
+    Startup steps run in the background once the server is accepting requests.
+    
+    The service answers /health (liveness) straight away, while /ready
+    (readiness) fails until every step has finished, so Kubernetes only routes
+    traffic to warm pods. Steps run in order; a step that fails is retried
+    after retry_delay seconds, since its dependencies (storage, the Dapr
+    sidecar) may simply not be up yet. Requests that arrive early are still
+    served, paying for whatever is not warm yet themselves.
+    """
+    
+    def __init__(self, service: str, retry_delay: float = 5.0, max_attempts: int = 3):
+        self.service = service
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.steps: List[Tuple[str, Callable[[], Awaitable[Any]]]] = []
+        self.status: Dict[str, Dict[str, Any]] = {}
+        self.started_at = process_start_time()
+        self.ready_at: Optional[float] = None
+        self.failed = False
+        self._task: Optional[asyncio.Task] = None
+        
+    def step(self, name: str, run: Callable[[], Awaitable[Any]]):
+        """Add a step; run is a coroutine function whose result is reported in the status"""
+        self.steps.append((name, run))
+        self.status[name] = {"status": "pending", "duration": None}
+        
+    @property
+    def ready(self) -> bool:
+        return self.ready_at is not None
+        
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+        
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            
+    async def _run(self):
+        for name, run in self.steps:
+            status = self.status[name]
+            status["status"] = "running"
+            for attempt in range(1, self.max_attempts + 1):
+                start_time = time.time()
+                try:
+                    status["result"] = await run()
+                    break
+                except Exception as e:
+                    status["error"] = str(e)
+                    logger.warning(f"Warmup step {name} failed (attempt {attempt} of {self.max_attempts}): {str(e)}")
+                    if attempt < self.max_attempts:
+                        await asyncio.sleep(self.retry_delay)
+            else:
+                # Stay unready, out of rotation, with /ready saying which step failed
+                status["status"] = "failed"
+                self.failed = True
+                logger.error(f"Warmup of {self.service} failed at step {name}")
+                return
+                
+            status["status"] = "completed"
+            status["duration"] = time.time() - start_time
+            status.pop("error", None)
+            WARMUP_STEP_SECONDS.labels(self.service, name).set(status["duration"])
+            logger.info(f"Warmup step {name} completed in {status['duration']:.2f} seconds")
+            
+        self.ready_at = time.time()
+        COLD_START_SECONDS.labels(self.service).set(self.ready_at - self.started_at)
+        logger.info(f"{self.service} ready {self.ready_at - self.started_at:.2f} seconds after starting")
+        
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "failed": self.failed,
+            "cold_start_seconds": self.ready_at - self.started_at if self.ready else None,
+            "steps": self.status
+        }
+        
+    def response(self) -> JSONResponse:
+        """The /ready response: 200 once warm, 503 until then"""
+        return JSONResponse(self.stats(), status_code=200 if self.ready else 503)
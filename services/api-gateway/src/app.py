@@ -1,22 +1,41 @@
-from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Form, Header
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.security import APIKeyHeader
 import logging
-import httpx
-import os
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
-import json
+import asyncio
+import httpx
+from instrumentation import instrument
+from .services.query_router import query_router_from_env, routing_key
+from .services.upstream_clients import upstream_from_env
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="QuickColbert API", description="API Gateway for ColbertV2 Search Service")
+# Request and upstream call latencies on /metrics; each request starts a trace forwarded upstream
+instrument(app, "api-gateway")
+
+# Pooled upstream clients, configured from <SERVICE>_URL and <SERVICE>_TIMEOUT
+indexing_service = upstream_from_env("indexing_service", "INDEXING_SERVICE", "http://localhost:8000", 600.0)
+storage_service = upstream_from_env("storage_service", "STORAGE_SERVICE", "http://localhost:8002", 60.0)
+UPSTREAMS = [indexing_service, storage_service]
+# Searches go to the query service replica(s) each index is placed on: the
+# QUERY_SERVICE_REPLICAS, those QUERY_SERVICE_DNS resolves to, or QUERY_SERVICE_URL
+query_router = query_router_from_env()
 
-# Service URLs from environment
-INDEXING_SERVICE_URL = os.environ.get("INDEXING_SERVICE_URL", "http://localhost:8000")
-QUERY_SERVICE_URL = os.environ.get("QUERY_SERVICE_URL", "http://localhost:8001")
-STORAGE_SERVICE_URL = os.environ.get("STORAGE_SERVICE_URL", "http://localhost:8002")
+@app.on_event("startup")
+async def open_upstream_pools():
+    for upstream in UPSTREAMS:
+        await upstream.start()
+    await query_router.start()
+
+@app.on_event("shutdown")
+async def close_upstream_pools():
+    for upstream in UPSTREAMS:
+        await upstream.close()
+    await query_router.close()
 
 # API key authentication
 API_KEY_HEADER = APIKeyHeader(name="X-API-Key")
@@ -36,13 +55,23 @@ async def get_current_user(api_key: str = Depends(API_KEY_HEADER)):
 
 # Models
 class Document(BaseModel):
+    # Needed to delete the document from its index later
+    id: str
     content: str
     metadata: Dict[str, Any] = {}
 
+class DeleteDocumentsRequest(BaseModel):
+    document_ids: List[str]
+
 class SearchQuery(BaseModel):
     query: str
     index_id: Optional[str] = None
     limit: int = 10
+    nprobe: Optional[int] = None
+    clusters: Optional[List[int]] = None
+
+class BatchSearchRequest(BaseModel):
+    queries: List[SearchQuery]
 
 @app.post("/documents/index")
 async def index_documents(
@@ -52,20 +81,191 @@ async def index_documents(
     """Index a batch of documents"""
     logger.info(f"Received request to index {len(documents)} documents from user {user_id}")
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{INDEXING_SERVICE_URL}/index",
-            json=[doc.dict() for doc in documents],
-            headers={"X-User-ID": user_id}
+    response = await indexing_service.post(
+        "/index",
+        json=[doc.dict(exclude_none=True) for doc in documents],
+        headers={"X-User-ID": user_id}
+    )
+    
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=response.text
         )
         
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=response.status_code,
-                detail=response.text
-            )
-            
-        return response.json()
+    return response.json()
+
+@app.post("/documents/index/stream")
+async def index_document_stream(
+    request: Request,
+    batch_size: Optional[int] = None,
+    user_id: str = Depends(get_current_user)
+):
+    """Index an NDJSON stream of documents without buffering the upload"""
+    logger.info(f"Received streaming index request from user {user_id}")
+    
+    params = {"batch_size": batch_size} if batch_size else {}
+    
+    # Forward the request body chunk by chunk; indexing can outlast the default timeout
+    response = await indexing_service.post(
+        "/index/stream",
+        content=request.stream(),
+        params=params,
+        timeout=None,
+        headers={"X-User-ID": user_id, "Content-Type": "application/x-ndjson"}
+    )
+    
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=response.text
+        )
+        
+    return response.json()
+
+@app.post("/documents/jobs")
+async def submit_index_job(
+    documents: List[Document],
+    priority: int = 0,
+    user_id: str = Depends(get_current_user)
+):
+    """Queue an indexing job and return its job_id immediately"""
+    logger.info(f"Received indexing job for {len(documents)} documents from user {user_id}")
+    
+    response = await indexing_service.post(
+        "/jobs",
+        json=[doc.dict(exclude_none=True) for doc in documents],
+        params={"priority": priority},
+        headers={"X-User-ID": user_id}
+    )
+    
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=response.text
+        )
+        
+    return response.json()
+
+@app.get("/jobs/{job_id}")
+async def get_index_job(job_id: str, user_id: str = Depends(get_current_user)):
+    """Get the progress of an indexing job"""
+    response = await indexing_service.get(
+        f"/jobs/{job_id}",
+        headers={"X-User-ID": user_id}
+    )
+    
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=response.text
+        )
+        
+    return response.json()
+
+@app.delete("/jobs/{job_id}")
+async def cancel_index_job(job_id: str, user_id: str = Depends(get_current_user)):
+    """Cancel an indexing job"""
+    response = await indexing_service.delete(
+        f"/jobs/{job_id}",
+        headers={"X-User-ID": user_id}
+    )
+    
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=response.text
+        )
+        
+    return response.json()
+
+@app.post("/indexes/{index_id}/documents")
+async def append_documents(
+    index_id: str,
+    documents: List[Document],
+    user_id: str = Depends(get_current_user)
+):
+    """Add documents to an existing index without rebuilding it"""
+    logger.info(f"Received request to append {len(documents)} documents to index {index_id} from user {user_id}")
+    
+    response = await indexing_service.post(
+        f"/indexes/{index_id}/documents",
+        json=[doc.dict(exclude_none=True) for doc in documents],
+        headers={"X-User-ID": user_id}
+    )
+    
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=response.text
+        )
+        
+    return response.json()
+
+@app.post("/indexes/{index_id}/documents/stream")
+async def append_document_stream(
+    index_id: str,
+    request: Request,
+    batch_size: Optional[int] = None,
+    user_id: str = Depends(get_current_user)
+):
+    """Add an NDJSON stream of documents to an existing index"""
+    params = {"batch_size": batch_size} if batch_size else {}
+    
+    response = await indexing_service.post(
+        f"/indexes/{index_id}/documents/stream",
+        content=request.stream(),
+        params=params,
+        timeout=None,
+        headers={"X-User-ID": user_id, "Content-Type": "application/x-ndjson"}
+    )
+    
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=response.text
+        )
+        
+    return response.json()
+
+@app.post("/indexes/{index_id}/documents/delete")
+async def delete_documents(
+    index_id: str,
+    request: DeleteDocumentsRequest,
+    user_id: str = Depends(get_current_user)
+):
+    """Delete documents from an index by id"""
+    logger.info(f"Received request to delete {len(request.document_ids)} documents from index {index_id}")
+    
+    response = await indexing_service.post(
+        f"/indexes/{index_id}/documents/delete",
+        json=request.dict(),
+        headers={"X-User-ID": user_id}
+    )
+    
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=response.text
+        )
+        
+    return response.json()
+
+@app.post("/indexes/{index_id}/compact")
+async def compact_index(index_id: str, user_id: str = Depends(get_current_user)):
+    """Queue a compaction that drops deleted documents from an index"""
+    response = await indexing_service.post(
+        f"/indexes/{index_id}/compact",
+        headers={"X-User-ID": user_id}
+    )
+    
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=response.text
+        )
+        
+    return response.json()
 
 @app.post("/search")
 async def search(
@@ -75,44 +275,105 @@ async def search(
     """Search documents"""
     logger.info(f"Received search query from user {user_id}: {query.query}")
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{QUERY_SERVICE_URL}/search",
-            json=query.dict(),
-            headers={"X-User-ID": user_id}
+    response = await query_router.post(
+        routing_key(query.index_id, user_id),
+        "/search",
+        json=query.dict(),
+        headers={"X-User-ID": user_id}
+    )
+    
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=response.text
         )
         
+    return response.json()
+
+@app.post("/search/batch")
+async def search_batch(
+    request: BatchSearchRequest,
+    user_id: str = Depends(get_current_user)
+):
+    """Run a batch of search queries in one request"""
+    logger.info(f"Received batch of {len(request.queries)} search queries from user {user_id}")
+    
+    # Queries for different indexes may be placed on different replicas, so
+    # each replica gets the sub-batch for its indexes and the answers are merged
+    groups: Dict[str, List[int]] = {}
+    for position, query in enumerate(request.queries):
+        groups.setdefault(routing_key(query.index_id, user_id), []).append(position)
+        
+    responses = await asyncio.gather(*[
+        query_router.post(
+            key,
+            "/search/batch",
+            json={"queries": [request.queries[p].dict() for p in positions]},
+            headers={"X-User-ID": user_id}
+        )
+        for key, positions in groups.items()
+    ])
+    
+    for response in responses:
         if response.status_code != 200:
             raise HTTPException(
                 status_code=response.status_code,
                 detail=response.text
             )
             
-        return response.json()
+    if len(responses) == 1:
+        return responses[0].json()
+        
+    results: List[Any] = [None] * len(request.queries)
+    timings: Dict[str, float] = {}
+    processing_time = 0.0
+    for positions, response in zip(groups.values(), responses):
+        body = response.json()
+        for position, result in zip(positions, body["results"]):
+            results[position] = result
+        for name, seconds in body["timings"].items():
+            timings[name] = timings.get(name, 0.0) + seconds
+        # Sub-batches run in parallel
+        processing_time = max(processing_time, body["processing_time"])
+    return {"results": results, "timings": timings, "processing_time": processing_time}
 
 @app.get("/health")
 async def health_check():
     """Check the health of all services"""
-    async with httpx.AsyncClient() as client:
-        try:
-            indexing_health = await client.get(f"{INDEXING_SERVICE_URL}/health")
-            query_health = await client.get(f"{QUERY_SERVICE_URL}/health")
-            storage_health = await client.get(f"{STORAGE_SERVICE_URL}/health")
-            
-            return {
-                "status": "healthy",
-                "services": {
-                    "api_gateway": "healthy",
-                    "indexing_service": "healthy" if indexing_health.status_code == 200 else "unhealthy",
-                    "query_service": "healthy" if query_health.status_code == 200 else "unhealthy",
-                    "storage_service": "healthy" if storage_health.status_code == 200 else "unhealthy"
-                }
-            }
-        except Exception as e:
-            return {
-                "status": "degraded",
-                "error": str(e)
+    try:
+        indexing_health, query_health, storage_health = await asyncio.gather(
+            indexing_service.get("/health"),
+            query_router.get_all("/health"),
+            storage_service.get("/health")
+        )
+        healthy_replicas = [
+            url for url, response in query_health.items()
+            if isinstance(response, httpx.Response) and response.status_code == 200
+        ]
+        
+        return {
+            "status": "healthy",
+            "services": {
+                "api_gateway": "healthy",
+                "indexing_service": "healthy" if indexing_health.status_code == 200 else "unhealthy",
+                "query_service": "healthy" if healthy_replicas else "unhealthy",
+                "query_service_replicas": f"{len(healthy_replicas)}/{len(query_health)} healthy",
+                "storage_service": "healthy" if storage_health.status_code == 200 else "unhealthy"
             }
+        }
+    except Exception as e:
+        return {
+            "status": "degraded",
+            "error": str(e)
+        }
+
+@app.get("/stats")
+async def stats():
+    """Connection pool usage per upstream service, and search routing across query service replicas"""
+    return {
+        "upstreams": {upstream.name: upstream.stats() for upstream in UPSTREAMS},
+        "query_router": query_router.stats()
+    }
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,225 @@
+import asyncio
+import hashlib
+import httpx
+import logging
+import math
+import os
+import socket
+import time
+from typing import Any, Dict, List, Optional, Sequence
+from .upstream_clients import UpstreamClient, upstream_from_env
+
+logger = logging.getLogger(__name__)
+
+# Searches are read-only, so these are retried on the next replica: statuses of
+# a replica that is overloaded, warming up or restarting, and errors reaching it.
+# Timeouts are not; a retry would double the load on an already slow pool.
+RETRY_STATUSES = {502, 503, 504}
+FAILOVER_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+def routing_key(index_id: Optional[str], user_id: str) -> str:
+    """Searches without an index_id go to the user's latest index, so they are routed by user"""
+    return f"index:{index_id}" if index_id else f"user:{user_id}"
+
+class QueryRouter:
+    """
+    Routes searches to a pool of query service replicas by index.
+    
+    Replicas are ranked for each routing key by rendezvous hashing, as the
+    query service ranks shard owners, so an index is searched on the same
+    few replicas and stays warm in their caches; adding or removing a
+    replica only moves the keys it gains or loses. With bounded loads, a
+    replica already serving more than load_factor times the mean number of
+    in-flight requests is passed over for the next in the ranking, so a hot
+    index spills onto a second replica instead of queueing behind one.
+    Below min_load in-flight requests a replica is never passed over: a
+    spill costs a cold index load, while concurrent searches of one index
+    on one replica are batched together.
+    Requests that fail to connect or are answered with a retryable status
+    are retried on the next replica, and a replica that could not be reached
+    is skipped for eject_seconds.
+    
+    Replicas are the given URLs or, with dns_name ("host:port", e.g. a
+    headless Kubernetes service), every address it resolves to, looked up
+    again every refresh_interval seconds. Only ready pods are published in
+    a headless service, so new replicas receive traffic once warm.
+    """
+    
+    def __init__(
+        self,
+        make_client,
+        urls: Sequence[str] = (),
+        dns_name: Optional[str] = None,
+        refresh_interval: float = 10.0,
+        load_factor: float = 1.25,
+        min_load: int = 8,
+        attempts: int = 2,
+        eject_seconds: float = 5.0
+    ):
+        self.make_client = make_client
+        self.urls = [url.rstrip("/") for url in urls]
+        self.dns_name = dns_name
+        self.refresh_interval = refresh_interval
+        self.load_factor = max(1.0, load_factor)
+        self.min_load = max(1, min_load)
+        self.attempts = max(1, attempts)
+        self.eject_seconds = eject_seconds
+        
+        self.replicas: Dict[str, UpstreamClient] = {}
+        self._retired: List[UpstreamClient] = []
+        self._ejected_until: Dict[str, float] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+        
+        self.routed = 0
+        self.spilled = 0
+        self.failovers = 0
+        self.refreshes = 0
+        
+    async def start(self):
+        if self.urls:
+            await self._set_replicas(self.urls)
+            return
+        try:
+            await self._set_replicas(await self._resolve())
+        except (OSError, ValueError) as e:
+            # No replica may be ready yet; the refresh loop keeps looking
+            logger.warning(f"Could not resolve query service replicas from {self.dns_name}: {str(e)}")
+        self._refresh_task = asyncio.ensure_future(self._refresh_loop())
+        
+    async def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+        for client in list(self.replicas.values()) + self._retired:
+            await client.close()
+        self.replicas.clear()
+        self._retired.clear()
+        
+    async def _resolve(self) -> List[str]:
+        host, _, port = self.dns_name.rpartition(":")
+        infos = await asyncio.get_event_loop().getaddrinfo(host, int(port), type=socket.SOCK_STREAM)
+        addresses = sorted({info[4][0] for info in infos})
+        return [f"http://[{address}]:{port}" if ":" in address else f"http://{address}:{port}" for address in addresses]
+        
+    async def _set_replicas(self, urls: List[str]):
+        for url in urls:
+            if url not in self.replicas:
+                client = self.make_client(url)
+                await client.start()
+                self.replicas[url] = client
+                logger.info(f"Added query service replica {url}")
+        for url in [url for url in self.replicas if url not in urls]:
+            # Closed once its in-flight requests have finished
+            self._retired.append(self.replicas.pop(url))
+            self._ejected_until.pop(url, None)
+            logger.info(f"Removed query service replica {url}")
+            
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                urls = await self._resolve()
+                # An empty or failed lookup keeps the last known replicas
+                if urls:
+                    await self._set_replicas(urls)
+                self.refreshes += 1
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not resolve query service replicas from {self.dns_name}: {str(e)}")
+            for client in [client for client in self._retired if client.in_flight == 0]:
+                self._retired.remove(client)
+                await client.close()
+                
+    def ranked(self, key: str) -> List[str]:
+        """Replicas for a routing key, preferred first"""
+        return sorted(
+            self.replicas,
+            key=lambda url: hashlib.sha1(f"{key}@{url}".encode("utf-8")).digest(),
+            reverse=True
+        )
+        
+    def _order(self, key: str) -> List[str]:
+        """The ranking, with the first replica under the load bound moved to the front and ejected replicas last"""
+        now = time.time()
+        ranked = self.ranked(key)
+        healthy = [url for url in ranked if self._ejected_until.get(url, 0.0) <= now]
+        ejected = [url for url in ranked if self._ejected_until.get(url, 0.0) > now]
+        if len(healthy) > 1:
+            in_flight = sum(self.replicas[url].in_flight for url in healthy)
+            bound = max(self.min_load, math.ceil(self.load_factor * (in_flight + 1) / len(healthy)))
+            for position, url in enumerate(healthy):
+                if self.replicas[url].in_flight + 1 <= bound:
+                    if position > 0:
+                        self.spilled += 1
+                        healthy.insert(0, healthy.pop(position))
+                    break
+        return healthy + ejected
+        
+    async def request(self, key: str, method: str, path: str, **kwargs) -> httpx.Response:
+        """Send a request to the replicas for key, failing over to the next on errors"""
+        if not self.replicas:
+            raise httpx.ConnectError("No query service replicas available")
+        self.routed += 1
+        order = self._order(key)[:self.attempts]
+        for attempt, url in enumerate(order):
+            last = attempt == len(order) - 1
+            try:
+                response = await self.replicas[url].request(method, path, **kwargs)
+            except FAILOVER_ERRORS as e:
+                self._ejected_until[url] = time.time() + self.eject_seconds
+                if last:
+                    raise
+                logger.warning(f"Query service replica {url} failed, trying the next one: {str(e)}")
+                self.failovers += 1
+                continue
+            if response.status_code in RETRY_STATUSES and not last:
+                self.failovers += 1
+                continue
+            self._ejected_until.pop(url, None)
+            return response
+            
+    async def post(self, key: str, path: str, **kwargs) -> httpx.Response:
+        return await self.request(key, "POST", path, **kwargs)
+        
+    async def get_all(self, path: str, **kwargs) -> Dict[str, Any]:
+        """GET path from every replica, e.g. /health; failures are returned as the exception"""
+        urls = list(self.replicas)
+        responses = await asyncio.gather(
+            *[self.replicas[url].get(path, **kwargs) for url in urls], return_exceptions=True
+        )
+        return dict(zip(urls, responses))
+        
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "discovery": f"dns:{self.dns_name}" if self.dns_name else "static",
+            "load_factor": self.load_factor,
+            "min_load": self.min_load,
+            "routed": self.routed,
+            "spilled": self.spilled,
+            "failovers": self.failovers,
+            "refreshes": self.refreshes,
+            "replicas": {
+                url: dict(client.stats(), ejected=self._ejected_until.get(url, 0.0) > now)
+                for url, client in self.replicas.items()
+            }
+        }
+
+def query_router_from_env() -> QueryRouter:
+    """
+    A QueryRouter over QUERY_SERVICE_REPLICAS (comma-separated URLs), the
+    replicas QUERY_SERVICE_DNS ("host:port") resolves to, or QUERY_SERVICE_URL alone
+    """
+    urls = [url.strip() for url in os.environ.get("QUERY_SERVICE_REPLICAS", "").split(",") if url.strip()]
+    dns_name = os.environ.get("QUERY_SERVICE_DNS") or None
+    if not urls and not dns_name:
+        urls = [os.environ.get("QUERY_SERVICE_URL", "http://localhost:8001")]
+        
+    return QueryRouter(
+        lambda url: upstream_from_env("query_service", "QUERY_SERVICE", url, 30.0, base_url=url),
+        urls=urls,
+        dns_name=dns_name if not urls else None,
+        refresh_interval=float(os.environ.get("QUERY_SERVICE_DNS_INTERVAL", "10")),
+        load_factor=float(os.environ.get("QUERY_ROUTING_LOAD_FACTOR", "1.25")),
+        min_load=int(os.environ.get("QUERY_ROUTING_MIN_LOAD", "8")),
+        attempts=int(os.environ.get("QUERY_ROUTING_ATTEMPTS", "2")),
+        eject_seconds=float(os.environ.get("QUERY_ROUTING_EJECT_SECONDS", "5"))
+    )
@@ -0,0 +1,119 @@
+import httpx
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+from instrumentation import observe_stage, propagate_trace
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+class UpstreamClient:
+    """A long-lived, pooled httpx client for one upstream service"""
+    
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        timeout: float,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        http2: bool = True
+    ):
+        self.name = name
+        self.base_url = base_url
+        self.timeout = timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections
+        )
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.client: Optional[httpx.AsyncClient] = None
+        
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        
+    async def start(self):
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            limits=self.limits,
+            timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+            http2=self.http2,
+            event_hooks={"request": [propagate_trace]}
+        )
+        logger.info(f"Opened connection pool for {self.name} at {self.base_url} (http2={self.http2})")
+        
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+            
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """Send a request over the shared pool, recording usage metrics"""
+        self.in_flight += 1
+        self.requests += 1
+        start_time = time.time()
+        try:
+            return await self.client.request(method, path, **kwargs)
+        except httpx.HTTPError:
+            self.errors += 1
+            raise
+        finally:
+            latency = time.time() - start_time
+            self.in_flight -= 1
+            self.total_latency += latency
+            observe_stage(f"upstream_{self.name}", latency)
+            
+    async def get(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", path, **kwargs)
+        
+    async def post(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, **kwargs)
+        
+    async def delete(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("DELETE", path, **kwargs)
+        
+    def _open_connections(self) -> Optional[int]:
+        # httpcore does not expose pool state publicly, so this is best effort
+        transport = getattr(self.client, "_transport", None)
+        pool = getattr(transport, "_pool", None)
+        connections = getattr(pool, "connections", None)
+        return len(connections) if connections is not None else None
+        
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "http2": self.http2,
+            "timeout": self.timeout,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "open_connections": self._open_connections() if self.client is not None else 0,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "avg_latency": self.total_latency / self.requests if self.requests else 0.0
+        }
+
+def upstream_from_env(
+    name: str,
+    env_prefix: str,
+    default_url: str,
+    default_timeout: float,
+    base_url: Optional[str] = None
+) -> UpstreamClient:
+    """Build an UpstreamClient from <PREFIX>_URL (unless base_url is given) / <PREFIX>_TIMEOUT and the shared pool settings"""
+    return UpstreamClient(
+        name=name,
+        base_url=base_url or os.environ.get(f"{env_prefix}_URL", default_url),
+        timeout=float(os.environ.get(f"{env_prefix}_TIMEOUT", str(default_timeout))),
+        max_connections=int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.environ.get("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", "20")),
+        http2=os.environ.get("UPSTREAM_HTTP2", "true").lower() == "true"
+    )
@@ -1,23 +1,95 @@
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request
 from pydantic import BaseModel
+import asyncio
+import functools
 import logging
-from typing import List, Dict, Any, Optional
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import List, Dict, Any, Optional, Set
 import time
-import json
-from dapr.clients import DaprClient
-from .services.colbert_indexer import ColbertIndexer
-from .services.kmeans_clusterer import KMeansClusterer
+import uuid
+import numpy as np
+from index_artifacts import fetch_manifest, upload_index
+from index_format import decode_array, decode_header, encode_array
+from instrumentation import instrument, stage
+from state_store import decode_json, state_store_from_env
+from storage_client import StorageClient
+from warmup import Warmup
+from .services.document_stream import DocumentStreamError
+from .services.index_updates import DocumentPositions, artifact_keys, index_artifacts, needs_compaction
+from .services.index_worker import (
+    build_index, cluster_embeddings, collect_live_documents, join_files, split_documents, update_clusters, update_index,
+    warm_worker, worker_status
+)
+from .services.job_queue import Job, JobQueue
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Indexing Service", description="Document indexing with ColbertV2")
+# Job stage durations (queue_wait, indexing, clustering, storing) on /metrics
+instrument(app, "indexing-service")
 
 # Initialize services
-colbert_indexer = ColbertIndexer()
-kmeans_clusterer = KMeansClusterer(n_clusters=100)
-dapr_client = DaprClient()
+state_store = state_store_from_env()
+storage_client = StorageClient()
+
+# Documents per batch for streamed ingestion
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "1024"))
+
+# Indexing and clustering run in a bounded process pool, off the event loop
+INDEX_WORKERS = int(os.environ.get("INDEX_WORKERS", "2"))
+TENANT_JOB_LIMIT = int(os.environ.get("TENANT_JOB_LIMIT", "1"))
+N_CLUSTERS = int(os.environ.get("N_CLUSTERS", "100"))
+# zlib-compress cluster artifacts; uncompressed ones can be memory-mapped by readers
+COMPRESS_CLUSTER_ARTIFACTS = os.environ.get("COMPRESS_CLUSTER_ARTIFACTS", "false").lower() == "true"
+# Files of an index directory uploaded to object storage at once
+UPLOAD_CONCURRENCY = int(os.environ.get("INDEX_UPLOAD_CONCURRENCY", "8"))
+# Residual bits per dimension in the memory-mappable token store (1, 2, 4 or 8);
+# unset keeps the width ColBERT indexed with
+TOKEN_STORE_NBITS = int(os.environ.get("TOKEN_STORE_NBITS", "0")) or None
+# Builds and compactions split an index into this many document ranges, each
+# indexed in parallel and stored as its own index directory. 1 keeps indexes
+# unsharded until documents are appended.
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", "1"))
+# Each append is stored as one more shard, compressed with the centroids of
+# the index, so the stored shards are never rewritten; an index is compacted,
+# merging them, once it has more than SHARD_COUNT + MAX_APPEND_SEGMENTS shards
+MAX_APPEND_SEGMENTS = int(os.environ.get("MAX_APPEND_SEGMENTS", "8"))
+JOB_STAGES = ["indexing", "clustering", "storing"]
+
+# An index is compacted once this fraction of its documents has been deleted;
+# candidates are checked every COMPACTION_INTERVAL seconds
+COMPACTION_THRESHOLD = float(os.environ.get("COMPACTION_THRESHOLD", "0.2"))
+COMPACTION_INTERVAL = float(os.environ.get("COMPACTION_INTERVAL", "300"))
+# Objects only older versions of an index refer to are deleted by the compaction
+# loop once this many seconds have passed since the version that dropped them
+# was published, so replicas still on an older version can finish reading them
+STALE_OBJECT_GRACE = float(os.environ.get("STALE_OBJECT_GRACE", "600"))
+
+process_pool: Optional[ProcessPoolExecutor] = None
+compaction_task: Optional[asyncio.Task] = None
+
+# Every pool worker loads the model as it starts; /ready fails until all have
+warmup = Warmup(
+    "indexing-service",
+    retry_delay=float(os.environ.get("WARMUP_RETRY_DELAY", "5")),
+    max_attempts=int(os.environ.get("WARMUP_MAX_ATTEMPTS", "3"))
+)
+
+# Updates to one index (appends, deletes, compactions) are applied one at a time
+index_locks: Dict[str, asyncio.Lock] = {}
+compaction_candidates: Set[str] = set()
+# Indexes with objects waiting for deletion under retired:<index>
+retiring_indexes: Set[str] = set()
+document_positions = DocumentPositions(storage_client)
+
+class IndexNotFoundError(LookupError):
+    """Raised when an update targets an index that does not exist"""
 
 class Document(BaseModel):
     id: str
@@ -29,78 +101,663 @@ class IndexResponse(BaseModel):
     document_count: int
     processing_time: float
 
-@app.post("/index", response_model=IndexResponse)
-async def index_documents(documents: List[Document], x_user_id: Optional[str] = Header(None)):
+class JobResponse(BaseModel):
+    job_id: str
+    status: str
+
+class DeleteDocumentsRequest(BaseModel):
+    document_ids: List[str]
+
+class DeleteDocumentsResponse(BaseModel):
+    index_id: str
+    deleted: int
+    not_found: List[str]
+    version: int
+
+def index_lock(index_name: str) -> asyncio.Lock:
+    return index_locks.setdefault(index_name, asyncio.Lock())
+
+async def get_index_record(index_name: str) -> Optional[Dict[str, Any]]:
+    with stage("state_lookup"):
+        return await state_store.get_json(f"index:{index_name}")
+
+async def save_index_version(index_name: str, record: Dict[str, Any], stale: Set[str]):
     """
-    Index a batch of documents using ColbertV2
+    Save a new version of an existing index record, retiring the objects only
+    older versions referred to: they are listed under retired:<index> in the
+    same transaction and deleted after STALE_OBJECT_GRACE seconds
     """
-    start_time = time.time()
-    user_id = x_user_id or "anonymous"
-    logger.info(f"Received indexing request for {len(documents)} documents from user {user_id}")
+    upserts = {f"index:{index_name}": record}
+    retired = await state_store.get_json(f"retired:{index_name}") or []
+    if stale:
+        retired.append({"keys": sorted(stale), "after": time.time() + STALE_OBJECT_GRACE})
+        upserts[f"retired:{index_name}"] = retired
+    await state_store.transaction(upserts)
+    if retired:
+        retiring_indexes.add(index_name)
+
+async def publish_index_updated(index_name: str, record: Dict[str, Any]):
+    await state_store.publish(
+        "pubsub",
+        "index-updated",
+        {
+            "index_name": index_name,
+            "version": record["version"],
+            "document_count": record["document_count"],
+            "user_id": record["user_id"]
+        }
+    )
+
+async def delete_retired_objects(index_name: str) -> bool:
+    """Delete the retired objects of an index whose grace period is over; True while others remain"""
+    async with index_lock(index_name):
+        retired = await state_store.get_json(f"retired:{index_name}") or []
+        now = time.time()
+        due = sorted({key for group in retired if group["after"] <= now for key in group["keys"]})
+        if not due:
+            return bool(retired)
+            
+        await storage_client.delete_objects(keys=due)
+        remaining = [group for group in retired if group["after"] > now]
+        if remaining:
+            await state_store.save(f"retired:{index_name}", remaining)
+        else:
+            await state_store.delete(f"retired:{index_name}")
+        logger.info(f"Deleted {len(due)} objects no longer used by index {index_name}")
+        return bool(remaining)
+
+async def store_artifact(key: str, data: bytes) -> Dict[str, Any]:
+    """Upload an encoded array container and return the pointer record kept in the state store"""
+    await storage_client.put_object(key, data, {"format": "qcar"})
+    
+    header = decode_header(data)
+    return {
+        "key": key,
+        "bytes": len(data),
+        "dtype": header["dtype"].str,
+        "shape": list(header["shape"]),
+        "compressed": header["compressed"]
+    }
+
+def index_pointer(prefix: str, version: int, manifest: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "prefix": prefix,
+        "version": version,
+        "files": len(manifest["files"]),
+        "bytes": manifest["total_bytes"],
+        "created_at": manifest["created_at"]
+    }
+
+async def store_index(
+    index_name: str,
+    results: List[Dict[str, Any]],
+    clusters: Dict[str, Any],
+    user_id: str,
+    base: Optional[Dict[str, Any]] = None,
+    append: bool = False
+):
+    """
+    Persist a new version of an index, then announce it
+    
+    results holds one indexed document range per shard, in order; a single
+    result is stored as an unsharded index. base is the current record when an
+    existing index is updated. An append adds its one result as a new segment
+    and shard after base's documents, leaving the stored shards as they are
+    (an unsharded index becomes shard 0); otherwise results replace every
+    segment and shard. Objects the new version no longer refers to are
+    retired rather than deleted.
+    """
+    version = base.get("version", 1) + 1 if base else 1
+    prefix = f"indexes/{index_name}/v{version}"
+    previous = index_artifacts(base) if base else []
+    previous_manifests = dict(zip(
+        [index["prefix"] for index in previous],
+        await asyncio.gather(*(fetch_manifest(storage_client, index["prefix"]) for index in previous))
+    ))
+    sharded = len(results) > 1 or append
+    start = base["document_count"] if append else 0
+    
+    if append:
+        # The new documents were compressed with the centroids of the stored
+        # index into a directory of their own, stored as one more shard
+        shards = [dict(shard) for shard in base["artifacts"].get("shards", [])] or [
+            dict(base["artifacts"]["index"], start=0, count=base["document_count"])
+        ]
+        parts = [f"{prefix}/shards/{len(shards)}"]
+        starts = [start]
+    else:
+        shards = []
+        parts = [f"{prefix}/shards/{i}" if sharded else prefix for i in range(len(results))]
+        starts = list(np.cumsum([0] + [result["document_count"] for result in results[:-1]]))
+    index_prefixes = [f"{part}/index" for part in parts]
+    
+    # The index directories, cluster labels, centroids and the segments' documents
+    # go to object storage; the state store only keeps small pointer records
+    uploads = [
+        upload_index(storage_client, result["path"], index_prefix, index_name, UPLOAD_CONCURRENCY)
+        for result, index_prefix in zip(results, index_prefixes)
+    ]
+    for result, part in zip(results, parts):
+        uploads.append(storage_client.put_file(f"{part}/documents.ndjson", result["documents_path"]))
+        uploads.append(storage_client.put_file(f"{part}/ids.json", result["ids_path"]))
+    labels, centroids, *stored = await asyncio.gather(
+        store_artifact(f"{prefix}/clusters.qcar", clusters["labels"]),
+        store_artifact(f"{prefix}/centroids.qcar", clusters["centroids"]),
+        *uploads
+    )
+    manifests = stored[:len(results)]
+    
+    segments = [
+        {
+            "start": int(segment_start),
+            "count": result["document_count"],
+            "documents": f"{part}/documents.ndjson",
+            "ids": f"{part}/ids.json"
+        }
+        for result, part, segment_start in zip(results, parts, starts)
+    ]
+    artifacts = {
+        "clusters": labels,
+        "centroids": centroids,
+        "segments": (base["artifacts"].get("segments", []) if append else []) + segments
+    }
+    if not sharded:
+        artifacts["index"] = index_pointer(index_prefixes[0], version, manifests[0])
+    else:
+        artifacts["shards"] = shards + [
+            dict(index_pointer(index_prefix, version, manifest), start=int(shard_start), count=result["document_count"])
+            for result, index_prefix, manifest, shard_start in zip(results, index_prefixes, manifests, starts)
+        ]
+    if append and "tombstones" in base["artifacts"]:
+        artifacts["tombstones"] = base["artifacts"]["tombstones"]
+        
+    # Indexes are found through their artifacts; the build directories are removed once stored
+    now = time.time()
+    record = {
+        "document_count": start + sum(result["document_count"] for result in results),
+        "deleted_count": base.get("deleted_count", 0) if append else 0,
+        "created_at": base["created_at"] if base else now,
+        "updated_at": now,
+        "version": version,
+        "user_id": user_id,
+        "n_clusters": clusters["n_clusters"],
+        "artifacts": artifacts
+    }
+    if base is not None:
+        current_manifests = dict(previous_manifests, **dict(zip(index_prefixes, manifests)))
+        stale = artifact_keys(base, previous_manifests) - artifact_keys(record, current_manifests)
+        await save_index_version(index_name, record, stale)
+        await publish_index_updated(index_name, record)
+        if needs_compaction(record, COMPACTION_THRESHOLD, SHARD_COUNT + MAX_APPEND_SEGMENTS):
+            compaction_candidates.add(index_name)
+        return
+        
+    # Store the index and make it the user's default search scope in one
+    # transaction, so searches never see the pointer without the record
+    await state_store.transaction({
+        f"index:{index_name}": record,
+        f"latest_index:{user_id}": index_name
+    })
     
-    # Create a unique index name
-    index_name = f"index_{int(time.time())}_{user_id}"
+    # Publish an event to notify other services
+    await state_store.publish(
+        "pubsub",
+        "index-created",
+        {
+            "index_name": index_name,
+            "document_count": record["document_count"],
+            "user_id": user_id
+        }
+    )
+
+async def plan_shards(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The document ranges a build indexes separately: one unless SHARD_COUNT is above 1"""
+    documents, ndjson_path = payload.get("documents"), payload.get("ndjson_path")
+    if SHARD_COUNT <= 1:
+        return [{"start": 0, "documents": documents, "ndjson_path": ndjson_path}]
+    if ndjson_path is not None:
+        return await asyncio.get_event_loop().run_in_executor(process_pool, split_documents, ndjson_path, SHARD_COUNT)
+        
+    bounds = np.linspace(0, len(documents), max(1, min(SHARD_COUNT, len(documents))) + 1).astype(np.int64)
+    return [
+        {"start": int(start), "documents": documents[start:end], "ndjson_path": None}
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
+
+async def run_index_stages(job: Job, base: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Run the indexing, clustering and storing stages of a build, append or compaction"""
+    loop = asyncio.get_event_loop()
+    payload = job.payload
+    index_name = payload["index_name"]
+    mode = payload.get("mode", "build")
+    batch_size = payload.get("batch_size", INGEST_BATCH_SIZE)
+    shards: List[Dict[str, Any]] = []
+    results: List[Dict[str, Any]] = []
     
     try:
-        # Index documents with ColbertV2
-        index_path = await colbert_indexer.index_documents(
-            [doc.dict() for doc in documents], 
-            index_name
-        )
+        job.start_stage("indexing")
+        if mode == "append":
+            # Only the new documents are encoded, with the centroids of the
+            # stored index (of its last shard), into a segment of their own
+            results = [await loop.run_in_executor(process_pool, functools.partial(
+                update_index,
+                index_name,
+                index_artifacts(base)[-1]["prefix"],
+                base["document_count"],
+                documents=payload.get("documents"),
+                ndjson_path=payload.get("ndjson_path"),
+                batch_size=batch_size,
+                token_store_nbits=TOKEN_STORE_NBITS
+            ))]
+        else:
+            if mode == "compact":
+                # Rebuild from the documents that have not been deleted
+                payload["ndjson_path"] = await loop.run_in_executor(
+                    process_pool, collect_live_documents,
+                    base["artifacts"]["segments"], base["artifacts"].get("tombstones", {}).get("key")
+                )
+            # Shards are indexed in parallel, up to INDEX_WORKERS at a time
+            shards = await plan_shards(payload)
+            outcomes = await asyncio.gather(*(
+                loop.run_in_executor(process_pool, functools.partial(
+                    build_index,
+                    index_name,
+                    documents=shard["documents"],
+                    ndjson_path=shard["ndjson_path"],
+                    batch_size=batch_size,
+                    token_store_nbits=TOKEN_STORE_NBITS,
+                    start=shard["start"]
+                ))
+                for shard in shards
+            ), return_exceptions=True)
+            results = [outcome for outcome in outcomes if isinstance(outcome, dict)]
+            failure = next((outcome for outcome in outcomes if isinstance(outcome, BaseException)), None)
+            if failure is not None:
+                raise failure
+        job.finish_stage("indexing")
         
-        # Get document embeddings (in a real implementation)
-        # For now, we'll simulate them
-        embeddings = [[0.1] * 128 for _ in range(len(documents))]
+        document_count = sum(result["document_count"] for result in results)
+        if document_count == 0:
+            raise DocumentStreamError("No documents in stream")
+            
+        # Clustering sees the pooled embeddings of every shard, in document order
+        embeddings_path = results[0]["embeddings_path"]
+        if len(results) > 1:
+            embeddings_path = await loop.run_in_executor(
+                process_pool, join_files,
+                [result["embeddings_path"] for result in results],
+                os.path.join(results[0]["work_dir"], "pooled.f32")
+            )
+            
+        # Cluster documents using FastKMeans; appends update the stored clustering
+        job.start_stage("clustering")
+        if mode == "append":
+            stored = base["artifacts"]
+            labels_data = await storage_client.get_object(stored["clusters"]["key"])
+            centroids_data = await storage_client.get_object(stored["centroids"]["key"])
+            tombstones_data = await storage_client.get_object(stored["tombstones"]["key"]) if "tombstones" in stored else None
+            clusters = await loop.run_in_executor(
+                process_pool, update_clusters,
+                embeddings_path, document_count, results[0]["dim"],
+                labels_data, centroids_data, tombstones_data, COMPRESS_CLUSTER_ARTIFACTS
+            )
+        else:
+            clusters = await loop.run_in_executor(
+                process_pool, cluster_embeddings,
+                embeddings_path, document_count, results[0]["dim"], N_CLUSTERS, COMPRESS_CLUSTER_ARTIFACTS
+            )
+        job.finish_stage("clustering")
         
-        # Cluster documents using FastKMeans
-        cluster_labels = await kmeans_clusterer.fit_predict(embeddings)
+        job.start_stage("storing")
+        await store_index(index_name, results, clusters, job.user_id, base, append=mode == "append")
+        job.finish_stage("storing")
         
-        # Store index information in the state store
-        await dapr_client.save_state(
-            store_name="statestore",
-            key=f"index:{index_name}",
-            value={
-                "path": index_path,
-                "document_count": len(documents),
-                "created_at": time.time(),
-                "user_id": user_id
-            }
-        )
+        return {"index_id": index_name, "document_count": document_count, "shards": len(results)}
+    finally:
+        ndjson_paths = {payload.get("ndjson_path")} | {shard["ndjson_path"] for shard in shards}
+        for ndjson_path in ndjson_paths:
+            if ndjson_path and os.path.exists(ndjson_path):
+                os.remove(ndjson_path)
+        # The index lives in object storage once stored; the build directories are scratch
+        for result in results:
+            if result.get("work_dir"):
+                shutil.rmtree(result["work_dir"], ignore_errors=True)
+
+async def run_index_job(job: Job) -> Dict[str, Any]:
+    """Run a job; updates to an existing index hold that index's lock throughout"""
+    if job.payload.get("mode", "build") == "build":
+        return await run_index_stages(job, None)
         
-        # Store clusters in the state store
-        await dapr_client.save_state(
-            store_name="statestore",
-            key=f"clusters:{index_name}",
-            value={str(i): cluster_labels[i] for i in range(len(documents))}
-        )
+    index_name = job.payload["index_name"]
+    async with index_lock(index_name):
+        base = await get_index_record(index_name)
+        if base is None:
+            raise IndexNotFoundError(f"Index {index_name} not found")
+        return await run_index_stages(job, base)
+
+async def compaction_loop():
+    """
+    Periodically queue compactions for indexes with enough deleted documents
+    or appended segments, and delete objects retired long enough ago
+    """
+    while True:
+        await asyncio.sleep(COMPACTION_INTERVAL)
+        for index_name in list(retiring_indexes):
+            try:
+                if not await delete_retired_objects(index_name):
+                    retiring_indexes.discard(index_name)
+            except Exception as e:
+                # Kept for the next round
+                logger.warning(f"Could not delete retired objects of {index_name}: {str(e)}")
+                
+        candidates = list(compaction_candidates)
+        compaction_candidates.clear()
+        try:
+            records = await state_store.get_many([f"index:{index_name}" for index_name in candidates])
+        except Exception as e:
+            logger.warning(f"Could not look up compaction candidates: {str(e)}")
+            compaction_candidates.update(candidates)
+            continue
+        for index_name in candidates:
+            try:
+                record = decode_json(records[f"index:{index_name}"])
+                if record is not None and needs_compaction(record, COMPACTION_THRESHOLD, SHARD_COUNT + MAX_APPEND_SEGMENTS):
+                    job = await job_queue.submit(
+                        record["user_id"], {"mode": "compact", "index_name": index_name}, JOB_STAGES, priority=-1
+                    )
+                    logger.info(f"Queued compaction of {index_name} as job {job.job_id}")
+            except Exception as e:
+                logger.warning(f"Could not queue compaction of {index_name}: {str(e)}")
+
+job_queue = JobQueue(run_index_job, max_workers=INDEX_WORKERS, tenant_limit=TENANT_JOB_LIMIT)
+
+async def warm_pool():
+    """Start every pool worker and wait for each to load the model"""
+    loop = asyncio.get_event_loop()
+    workers: Dict[int, bool] = {}
+    # A worker that is already warm may answer twice in a round, so ask until all have
+    for _ in range(4 * INDEX_WORKERS):
+        statuses = await asyncio.gather(*[loop.run_in_executor(process_pool, worker_status) for _ in range(INDEX_WORKERS)])
+        workers.update((status["pid"], status["model_loaded"]) for status in statuses)
+        if len(workers) >= INDEX_WORKERS:
+            break
+    if not all(workers.values()):
+        raise RuntimeError(f"The model did not load in {list(workers.values()).count(False)} indexing workers")
+    return {"workers": len(workers)}
+
+warmup.step("model", warm_pool)
+
+@app.on_event("startup")
+async def startup():
+    global process_pool, compaction_task
+    # Spawned workers avoid inheriting model or CUDA state from the server process
+    process_pool = ProcessPoolExecutor(
+        max_workers=INDEX_WORKERS, mp_context=get_context("spawn"), initializer=warm_worker
+    )
+    job_queue.start()
+    compaction_task = asyncio.ensure_future(compaction_loop())
+    warmup.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await warmup.stop()
+    compaction_task.cancel()
+    await job_queue.stop()
+    process_pool.shutdown(wait=False, cancel_futures=True)
+    await storage_client.close()
+    await state_store.close()
+
+async def spool_request(request: Request) -> str:
+    """
+    Write a streamed request body to a temp file so a worker process can read it
+    
+    The body is stored before the job is queued: indexing starts, and
+    malformed records are reported, once the upload is complete. Writes run
+    off the event loop.
+    """
+    loop = asyncio.get_event_loop()
+    spool = tempfile.NamedTemporaryFile(suffix=".ndjson", delete=False)
+    try:
+        async for chunk in request.stream():
+            await loop.run_in_executor(None, spool.write, chunk)
+    except BaseException:
+        spool.close()
+        os.remove(spool.name)
+        raise
+    spool.close()
+    return spool.name
+
+async def submit_index_job(user_id: str, priority: int, **payload) -> Job:
+    # The suffix keeps names unique when a tenant submits several jobs per second
+    payload["index_name"] = f"index_{int(time.time())}_{user_id}_{uuid.uuid4().hex[:6]}"
+    return await job_queue.submit(user_id, payload, JOB_STAGES, priority)
+
+async def wait_for_index(job: Job, start_time: float) -> IndexResponse:
+    """Wait for a job and translate its outcome into an IndexResponse"""
+    await job.done.wait()
+    
+    if job.status != "completed":
+        logger.error(f"Error indexing documents: {job.error}")
+        if isinstance(job.exception, DocumentStreamError):
+            raise HTTPException(status_code=400, detail=job.error)
+        if isinstance(job.exception, IndexNotFoundError):
+            raise HTTPException(status_code=404, detail=job.error)
+        raise HTTPException(status_code=500, detail=f"Error indexing documents: {job.error or job.status}")
         
-        # Publish an event to notify other services
-        await dapr_client.publish_event(
-            pubsub_name="pubsub",
-            topic_name="index-created",
-            data={
-                "index_name": index_name,
-                "document_count": len(documents),
-                "user_id": user_id
-            }
-        )
+    processing_time = time.time() - start_time
+    logger.info(f"Indexed {job.result['document_count']} documents in {processing_time:.2f} seconds")
+    
+    return IndexResponse(
+        index_id=job.result["index_id"],
+        document_count=job.result["document_count"],
+        processing_time=processing_time
+    )
+
+@app.post("/index", response_model=IndexResponse)
+async def index_documents(
+    documents: List[Document],
+    priority: int = 0,
+    x_user_id: Optional[str] = Header(None)
+):
+    """
+    Index a batch of documents using ColbertV2
+    """
+    start_time = time.time()
+    user_id = x_user_id or "anonymous"
+    logger.info(f"Received indexing request for {len(documents)} documents from user {user_id}")
+    
+    job = await submit_index_job(user_id, priority, documents=[doc.dict() for doc in documents])
+    return await wait_for_index(job, start_time)
+
+@app.post("/index/stream", response_model=IndexResponse)
+async def index_document_stream(
+    request: Request,
+    batch_size: int = Query(INGEST_BATCH_SIZE, gt=0),
+    priority: int = 0,
+    x_user_id: Optional[str] = Header(None)
+):
+    """
+    Index an NDJSON stream of documents (one JSON object per line)
+    
+    Documents are parsed incrementally and indexed in batches of batch_size,
+    so memory use is bounded by the batch size rather than the upload size.
+    """
+    start_time = time.time()
+    user_id = x_user_id or "anonymous"
+    logger.info(f"Received streaming indexing request from user {user_id}")
+    
+    ndjson_path = await spool_request(request)
+    job = await submit_index_job(user_id, priority, ndjson_path=ndjson_path, batch_size=batch_size)
+    return await wait_for_index(job, start_time)
+
+@app.post("/jobs", response_model=JobResponse)
+async def submit_job(
+    documents: List[Document],
+    priority: int = 0,
+    x_user_id: Optional[str] = Header(None)
+):
+    """Queue an indexing job and return its id without waiting for it to finish"""
+    user_id = x_user_id or "anonymous"
+    job = await submit_index_job(user_id, priority, documents=[doc.dict() for doc in documents])
+    return JobResponse(job_id=job.job_id, status=job.status)
+
+@app.post("/jobs/stream", response_model=JobResponse)
+async def submit_stream_job(
+    request: Request,
+    batch_size: int = Query(INGEST_BATCH_SIZE, gt=0),
+    priority: int = 0,
+    x_user_id: Optional[str] = Header(None)
+):
+    """Queue an indexing job for an NDJSON document stream"""
+    user_id = x_user_id or "anonymous"
+    ndjson_path = await spool_request(request)
+    job = await submit_index_job(user_id, priority, ndjson_path=ndjson_path, batch_size=batch_size)
+    return JobResponse(job_id=job.job_id, status=job.status)
+
+def find_job(job_id: str, user_id: Optional[str]) -> Job:
+    job = job_queue.get(job_id)
+    # Jobs of other tenants are reported as missing
+    if job is None or (user_id is not None and job.user_id != user_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, x_user_id: Optional[str] = Header(None)):
+    """Report job status with per-stage progress and timings"""
+    return find_job(job_id, x_user_id).to_dict()
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str, x_user_id: Optional[str] = Header(None)):
+    """Cancel a queued job, or a running job at its next stage boundary"""
+    job = await job_queue.cancel(find_job(job_id, x_user_id).job_id)
+    
+    # A job cancelled before it started never reaches the runner's cleanup
+    ndjson_path = job.payload.get("ndjson_path")
+    if job.status == "cancelled" and job.started_at is None and ndjson_path and os.path.exists(ndjson_path):
+        os.remove(ndjson_path)
         
-        processing_time = time.time() - start_time
-        logger.info(f"Indexed {len(documents)} documents in {processing_time:.2f} seconds")
+    return job.to_dict()
+
+async def find_index(index_id: str, user_id: Optional[str]) -> Dict[str, Any]:
+    record = await get_index_record(index_id)
+    # Indexes of other tenants are reported as missing
+    if record is None or (user_id is not None and record.get("user_id") != user_id):
+        raise HTTPException(status_code=404, detail=f"Index {index_id} not found")
+    return record
+
+async def submit_update_job(index_id: str, user_id: str, priority: int, **payload) -> Job:
+    payload["index_name"] = index_id
+    payload["mode"] = "append"
+    return await job_queue.submit(user_id, payload, JOB_STAGES, priority)
+
+@app.post("/indexes/{index_id}/documents", response_model=IndexResponse)
+async def append_documents(
+    index_id: str,
+    documents: List[Document],
+    priority: int = 0,
+    x_user_id: Optional[str] = Header(None)
+):
+    """
+    Add documents to an existing index
+    
+    Only the new documents are encoded; they are assigned to the index's
+    existing centroids and clusters. document_count in the response is the
+    number of documents added.
+    """
+    start_time = time.time()
+    record = await find_index(index_id, x_user_id)
+    logger.info(f"Received request to append {len(documents)} documents to index {index_id}")
+    
+    job = await submit_update_job(index_id, record["user_id"], priority, documents=[doc.dict() for doc in documents])
+    return await wait_for_index(job, start_time)
+
+@app.post("/indexes/{index_id}/documents/stream", response_model=IndexResponse)
+async def append_document_stream(
+    index_id: str,
+    request: Request,
+    batch_size: int = Query(INGEST_BATCH_SIZE, gt=0),
+    priority: int = 0,
+    x_user_id: Optional[str] = Header(None)
+):
+    """Add an NDJSON stream of documents to an existing index"""
+    start_time = time.time()
+    record = await find_index(index_id, x_user_id)
+    logger.info(f"Received streaming append request for index {index_id}")
+    
+    ndjson_path = await spool_request(request)
+    job = await submit_update_job(index_id, record["user_id"], priority, ndjson_path=ndjson_path, batch_size=batch_size)
+    return await wait_for_index(job, start_time)
+
+@app.post("/indexes/{index_id}/documents/delete", response_model=DeleteDocumentsResponse)
+async def delete_documents(
+    index_id: str,
+    request: DeleteDocumentsRequest,
+    x_user_id: Optional[str] = Header(None)
+):
+    """
+    Delete documents from an index by id
+    
+    Deleted documents are tombstoned and filtered out of search results
+    straight away; their space is reclaimed when the index is next compacted.
+    """
+    await find_index(index_id, x_user_id)
+    
+    async with index_lock(index_id):
+        record = await get_index_record(index_id)
+        if record is None:
+            raise HTTPException(status_code=404, detail=f"Index {index_id} not found")
+            
+        positions, not_found = await document_positions.resolve(index_id, record, request.document_ids)
+        previous = record["artifacts"].get("tombstones")
+        tombstones = np.empty(0, dtype=np.uint32)
+        if previous is not None:
+            tombstones = decode_array(await storage_client.get_object(previous["key"]))
+        merged = np.union1d(tombstones, positions).astype(np.uint32)
+        deleted = len(merged) - len(tombstones)
         
-        return IndexResponse(
-            index_id=index_name,
-            document_count=len(documents),
-            processing_time=processing_time
-        )
-    except Exception as e:
-        logger.error(f"Error indexing documents: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error indexing documents: {str(e)}")
+        if deleted:
+            record["version"] = record.get("version", 1) + 1
+            key = f"indexes/{index_id}/v{record['version']}/tombstones.qcar"
+            record["artifacts"]["tombstones"] = await store_artifact(key, encode_array(merged, COMPRESS_CLUSTER_ARTIFACTS))
+            record["deleted_count"] = len(merged)
+            record["updated_at"] = time.time()
+            await save_index_version(index_id, record, {previous["key"]} if previous is not None else set())
+            await publish_index_updated(index_id, record)
+            if needs_compaction(record, COMPACTION_THRESHOLD, SHARD_COUNT + MAX_APPEND_SEGMENTS):
+                compaction_candidates.add(index_id)
+                
+    logger.info(f"Deleted {deleted} documents from index {index_id} ({len(not_found)} ids not found)")
+    return DeleteDocumentsResponse(
+        index_id=index_id,
+        deleted=deleted,
+        not_found=not_found,
+        version=record.get("version", 1)
+    )
+
+@app.post("/indexes/{index_id}/compact", response_model=JobResponse)
+async def compact_index(
+    index_id: str,
+    priority: int = -1,
+    x_user_id: Optional[str] = Header(None)
+):
+    """Queue a rebuild of an index from its live documents, dropping deleted ones"""
+    record = await find_index(index_id, x_user_id)
+    job = await job_queue.submit(record["user_id"], {"mode": "compact", "index_name": index_id}, JOB_STAGES, priority)
+    return JobResponse(job_id=job.job_id, status=job.status)
+
+@app.get("/stats")
+async def stats():
+    return {"jobs": job_queue.stats(), "warmup": warmup.stats(), "state_store": state_store.stats()}
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness: 200 once every indexing worker has loaded the model, 503 until then"""
+    return warmup.response()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
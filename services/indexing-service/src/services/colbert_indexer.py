@@ -1,8 +1,10 @@
-from ragatouille import RAGPretrainedModel
+import asyncio
 import logging
+import numpy as np
 import os
-import tempfile
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, BinaryIO, Optional, Tuple
+from model_snapshot import load_pretrained
+from .index_writer import ColbertIndexWriter, DocumentWriter, ResidualCodec, default_nbits, pool_embeddings
 
 logger = logging.getLogger(__name__)
 
@@ -13,26 +15,110 @@ class ColbertIndexer:
     async def initialize(self):
         """Initialize the ColbertV2 model"""
         logger.info("Initializing ColbertV2 model")
-        self.model = RAGPretrainedModel.from_pretrained("colbert-ir/colbertv2.0")
+        # With MODEL_SNAPSHOT_DIR set, later starts unpickle the built model instead
+        self.model = load_pretrained("colbert-ir/colbertv2.0", os.environ.get("MODEL_SNAPSHOT_DIR") or None)
         logger.info("ColbertV2 model initialized")
         
-    async def index_documents(self, documents: List[Dict[str, Any]], index_name: str):
-        """Index documents using ColbertV2"""
+    def _checkpoint(self):
+        """Return the ColBERT inference checkpoint wrapped by the RAGatouille model"""
+        colbert = self.model.model
+        checkpoint = getattr(colbert, "inference_ckpt", None)
+        if checkpoint is None:
+            from colbert.modeling.checkpoint import Checkpoint
+            checkpoint = Checkpoint(colbert.checkpoint, colbert_config=colbert.config)
+            colbert.inference_ckpt = checkpoint
+        return checkpoint
+        
+    def _index_config(self, index_path: str) -> Dict[str, Any]:
+        """The ColBERT config recorded in the index metadata, as ColBERT's own indexer records it"""
+        colbert = self.model.model
+        return dict(colbert.config.export(), checkpoint=colbert.checkpoint, index_name=os.path.basename(index_path))
+        
+    def _encode(self, contents: List[str], batch_size: int = 64) -> Tuple[np.ndarray, np.ndarray]:
+        """Token embeddings of documents, flattened to (tokens, dim) float16, and each document's length"""
+        # 'flatten' returns every non-padding token embedding plus per-document lengths
+        embeddings, doclens = self._checkpoint().docFromText(contents, bsize=batch_size, keep_dims="flatten", to_cpu=True)
+        return embeddings.half().numpy(), np.asarray(doclens, dtype=np.int64)
+        
+    def _index_batch(self, batch: List[Dict[str, Any]], writer: ColbertIndexWriter, documents: DocumentWriter) -> np.ndarray:
+        """Encode one batch into the index being written and return its pooled embeddings"""
+        embeddings, doclens = self._encode([doc['content'] for doc in batch])
+        writer.add(embeddings, doclens)
+        documents.add(batch)
+        # Pooled from the same forward pass, for clustering
+        return pool_embeddings(embeddings, doclens)
+        
+    async def index_document_stream(
+        self,
+        batches: AsyncIterator[List[Dict[str, Any]]],
+        index_name: str,
+        embeddings_file: BinaryIO,
+        work_dir: str,
+        prefetch: int = 2,
+        expected_documents: Optional[int] = None,
+        codec: Optional[ResidualCodec] = None
+    ) -> Dict[str, Any]:
+        """
+        Index documents that arrive as an async stream of bounded-size batches.
+        
+        Parsing runs on the event loop while the previous batch is encoded in a
+        worker thread, with at most prefetch parsed batches waiting. Each batch
+        is encoded once: its token embeddings are compressed into the index
+        chunks being written under work_dir (see ColbertIndexWriter) and its
+        pooled embeddings are appended to embeddings_file as raw float32 rows,
+        so neither is kept in memory. expected_documents, when known, sizes the
+        index's centroids. With codec, the centroids and residual buckets of
+        an existing index, the documents are compressed with those instead,
+        e.g. to store documents appended to that index as a segment of it.
+        """
         if self.model is None:
             await self.initialize()
             
-        logger.info(f"Indexing {len(documents)} documents with index name: {index_name}")
+        loop = asyncio.get_event_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=prefetch)
+        
+        async def produce():
+            # Parse errors are handed to the consumer through the queue
+            try:
+                async for batch in batches:
+                    await queue.put(batch)
+                await queue.put(None)
+            except Exception as e:
+                await queue.put(e)
+                
+        producer = asyncio.ensure_future(produce())
+        document_count = 0
+        dim = 0
         
-        # Extract document content
-        contents = [doc['content'] for doc in documents]
+        index_path = os.path.join(work_dir, index_name)
+        writer = ColbertIndexWriter(
+            index_path, self._index_config(index_path), default_nbits(expected_documents),
+            codec=codec, expected_documents=expected_documents
+        )
+        documents = DocumentWriter(index_path)
         
-        # Create index
-        with tempfile.TemporaryDirectory() as tmpdir:
-            index_path = os.path.join(tmpdir, index_name)
-            self.model.index(index_name=index_path, collection=contents)
+        try:
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                    
+                embeddings = await loop.run_in_executor(None, self._index_batch, batch, writer, documents)
+                embeddings_file.write(embeddings.tobytes())
+                document_count += len(batch)
+                dim = embeddings.shape[1]
+                logger.info(f"Indexed {document_count} streamed documents into {index_name}")
+        finally:
+            producer.cancel()
+            documents.close()
             
-            # In a real implementation, we would transfer the index to Cloudflare R2
-            # For now, we'll just return the path
-            logger.info(f"Index created at {index_path}")
+        embeddings_file.flush()
+        if document_count:
+            # The inverted lists are built once, over every chunk
+            await loop.run_in_executor(None, writer.finish)
             
-            return index_path
+        logger.info(f"Index created at {index_path}")
+        
+        return {"path": index_path, "document_count": document_count, "dim": dim}
@@ -0,0 +1,74 @@
+import json
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class DocumentStreamError(ValueError):
+    """Raised when an uploaded document stream contains a malformed record"""
+
+def validate_document(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Check the fields the indexer relies on and normalise the id to a string"""
+    if not isinstance(record.get("content"), str):
+        raise ValueError("field 'content' must be a string")
+    if not isinstance(record.get("metadata", {}), dict):
+        raise ValueError("field 'metadata' must be an object")
+    return {"id": str(record["id"]), "content": record["content"], "metadata": record.get("metadata", {})}
+
+async def iter_document_batches(
+    chunks: AsyncIterator[bytes],
+    batch_size: int,
+    parse: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = validate_document,
+    start: int = 0
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Incrementally parse an NDJSON byte stream into batches of documents.
+    
+    Only the current partial line and one batch are held in memory, so the
+    upload size does not bound memory use. Records without an id are given
+    their position in the stream, offset by start when appending to an index.
+    """
+    buffer = b""
+    batch: List[Dict[str, Any]] = []
+    position = 0
+    
+    def parse_line(line: bytes) -> Optional[Dict[str, Any]]:
+        nonlocal position
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise DocumentStreamError(f"Invalid JSON on record {position}: {str(e)}")
+        if not isinstance(record, dict):
+            raise DocumentStreamError(f"Record {position} is not a JSON object")
+            
+        record.setdefault("id", str(start + position))
+        position += 1
+        if parse is not None:
+            try:
+                record = parse(record)
+            except Exception as e:
+                raise DocumentStreamError(f"Invalid document on record {position - 1}: {str(e)}")
+        return record
+        
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            record = parse_line(line)
+            if record is None:
+                continue
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+                
+    record = parse_line(buffer)
+    if record is not None:
+        batch.append(record)
+    if batch:
+        yield batch
+        
+    logger.info(f"Parsed {position} documents from stream")
@@ -0,0 +1,93 @@
+import json
+import logging
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+from index_artifacts import MANIFEST_NAME, file_key
+
+logger = logging.getLogger(__name__)
+
+def index_artifacts(record: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The index directory pointer of an unsharded record, or one per shard of a sharded one"""
+    artifacts = record.get("artifacts", {})
+    if "shards" in artifacts:
+        return artifacts["shards"]
+    return [artifacts["index"]] if "index" in artifacts else []
+
+def artifact_keys(record: Dict[str, Any], manifests: Dict[str, Dict[str, Any]]) -> Set[str]:
+    """Every object key an index record version refers to, given the manifests of its index directories by prefix"""
+    artifacts = record.get("artifacts", {})
+    keys: Set[str] = set()
+    
+    for index in index_artifacts(record):
+        prefix = index["prefix"]
+        keys.add(f"{prefix}/{MANIFEST_NAME}")
+        keys.update(file_key(prefix, entry) for entry in manifests.get(prefix, {}).get("files", []))
+    for name in ("clusters", "centroids", "tombstones"):
+        if name in artifacts:
+            keys.add(artifacts[name]["key"])
+    for segment in artifacts.get("segments", []):
+        keys.update((segment["documents"], segment["ids"]))
+        
+    return keys
+
+def needs_compaction(record: Dict[str, Any], threshold: float, max_shards: Optional[int] = None) -> bool:
+    """Whether threshold of an index's documents are deleted, or appends left it with more than max_shards shards"""
+    if max_shards is not None and len(index_artifacts(record)) > max_shards:
+        return True
+    document_count = record.get("document_count", 0)
+    return document_count > 0 and record.get("deleted_count", 0) / document_count >= threshold
+
+class DocumentPositions:
+    """
+    Maps document ids to index positions, built from the per-segment id lists.
+    
+    Maps are kept for the max_indexes most recently used indexes. An append
+    only adds a segment, so a cached map is extended with the new segments
+    instead of being rebuilt; a compaction replaces every segment and starts
+    a fresh map.
+    """
+    
+    def __init__(self, storage_client, max_indexes: int = 16):
+        self.storage_client = storage_client
+        self.max_indexes = max_indexes
+        # index_id -> (segment id-list keys loaded, id -> positions)
+        self._maps: "OrderedDict[str, Tuple[List[str], Dict[str, Any]]]" = OrderedDict()
+        
+    async def resolve(self, index_id: str, record: Dict[str, Any], document_ids: List[str]) -> Tuple[np.ndarray, List[str]]:
+        """Positions of the given ids (every copy of an id added more than once) and the ids not found"""
+        segments = record.get("artifacts", {}).get("segments", [])
+        loaded, positions = self._maps.get(index_id, ([], {}))
+        if loaded != [segment["ids"] for segment in segments[:len(loaded)]]:
+            loaded, positions = [], {}
+            
+        for segment in segments[len(loaded):]:
+            ids = json.loads(await self.storage_client.get_object(segment["ids"]))
+            for offset, document_id in enumerate(ids):
+                position = segment["start"] + offset
+                existing = positions.get(document_id)
+                if existing is None:
+                    positions[document_id] = position
+                elif isinstance(existing, list):
+                    existing.append(position)
+                else:
+                    positions[document_id] = [existing, position]
+            loaded = loaded + [segment["ids"]]
+            
+        self._maps[index_id] = (loaded, positions)
+        self._maps.move_to_end(index_id)
+        while len(self._maps) > self.max_indexes:
+            self._maps.popitem(last=False)
+            
+        found: List[int] = []
+        missing: List[str] = []
+        for document_id in document_ids:
+            position = positions.get(document_id)
+            if position is None:
+                missing.append(document_id)
+            elif isinstance(position, list):
+                found.extend(position)
+            else:
+                found.append(position)
+                
+        return np.asarray(found, dtype=np.int64), missing
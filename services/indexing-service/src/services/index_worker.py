@@ -0,0 +1,317 @@
+import asyncio
+import json
+import logging
+import numpy as np
+import os
+import shutil
+import tempfile
+from typing import Any, AsyncIterator, Dict, List, Optional
+from index_artifacts import download_index
+from index_format import decode_array, encode_array, label_dtype
+from storage_client import StorageClient
+from token_store import write_token_store
+from .colbert_indexer import ColbertIndexer
+from .document_stream import iter_document_batches
+from .index_writer import CODEC_FILES, ResidualCodec
+from .kmeans_clusterer import KMeansClusterer
+
+logger = logging.getLogger(__name__)
+
+# Entry points executed in the indexing process pool. Each worker process keeps
+# its own ColbertIndexer so the model is loaded once per process, not per job.
+_indexer: Optional[ColbertIndexer] = None
+
+def _get_indexer() -> ColbertIndexer:
+    global _indexer
+    if _indexer is None:
+        _indexer = ColbertIndexer()
+    return _indexer
+
+def warm_worker():
+    """Pool initializer: load the model as each worker process starts, not with its first job"""
+    try:
+        asyncio.run(_get_indexer().initialize())
+    except Exception as e:
+        # A failing initializer would break the whole pool; jobs retry the load instead
+        logger.error(f"Could not load the model in indexing worker {os.getpid()}: {str(e)}")
+
+def worker_status() -> Dict[str, Any]:
+    return {"pid": os.getpid(), "model_loaded": _indexer is not None and _indexer.model is not None}
+
+async def _iter_file(path: str, chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+            await asyncio.sleep(0)
+
+def _count_records(ndjson_path: str) -> int:
+    with open(ndjson_path, "rb") as f:
+        return sum(1 for line in f if line.strip())
+
+async def _iter_list(documents: List[Dict[str, Any]], batch_size: int) -> AsyncIterator[List[Dict[str, Any]]]:
+    for start in range(0, len(documents), batch_size):
+        yield documents[start:start + batch_size]
+
+async def _record_documents(
+    batches: AsyncIterator[List[Dict[str, Any]]],
+    documents_path: str,
+    ids_path: str
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Pass batches through while writing the segment's documents (NDJSON) and ids (JSON list)"""
+    ids = []
+    with open(documents_path, "w") as documents_file:
+        async for batch in batches:
+            for doc in batch:
+                documents_file.write(json.dumps(doc) + "\n")
+                ids.append(str(doc["id"]))
+            yield batch
+    with open(ids_path, "w") as ids_file:
+        json.dump(ids, ids_file)
+
+def _segment_paths(work_dir: str) -> Dict[str, str]:
+    return {
+        "work_dir": work_dir,
+        "embeddings_path": os.path.join(work_dir, "embeddings.f32"),
+        "documents_path": os.path.join(work_dir, "documents.ndjson"),
+        "ids_path": os.path.join(work_dir, "ids.json")
+    }
+
+async def _build_index(
+    index_name: str,
+    documents: Optional[List[Dict[str, Any]]],
+    ndjson_path: Optional[str],
+    batch_size: int,
+    start: int,
+    paths: Dict[str, str]
+) -> Dict[str, Any]:
+    indexer = _get_indexer()
+    
+    if ndjson_path is not None:
+        batches = iter_document_batches(_iter_file(ndjson_path), batch_size, start=start)
+        expected_documents = _count_records(ndjson_path)
+    else:
+        batches = _iter_list(documents, batch_size)
+        expected_documents = len(documents)
+    batches = _record_documents(batches, paths["documents_path"], paths["ids_path"])
+    
+    with open(paths["embeddings_path"], "wb") as embeddings_file:
+        return await indexer.index_document_stream(
+            batches, index_name, embeddings_file, paths["work_dir"], expected_documents=expected_documents
+        )
+
+def build_index(
+    index_name: str,
+    documents: Optional[List[Dict[str, Any]]] = None,
+    ndjson_path: Optional[str] = None,
+    batch_size: int = 1024,
+    token_store_nbits: Optional[int] = None,
+    start: int = 0
+) -> Dict[str, Any]:
+    """
+    Index documents given inline or as a spooled NDJSON file.
+    
+    The index with its token store, its pooled embeddings and the segment's
+    documents and ids are written to a fresh work_dir, which is returned for
+    the caller to upload and remove. start is the position of the first
+    document when it begins a shard of a larger index.
+    """
+    paths = _segment_paths(tempfile.mkdtemp(prefix="index-"))
+    
+    try:
+        result = asyncio.run(_build_index(index_name, documents, ndjson_path, batch_size, start, paths))
+        if result["document_count"]:
+            result["token_store"] = write_token_store(result["path"], token_store_nbits)
+    except BaseException:
+        shutil.rmtree(paths["work_dir"], ignore_errors=True)
+        raise
+    result.update(paths)
+    return result
+
+async def _update_index(
+    index_name: str,
+    index_prefix: str,
+    start: int,
+    documents: Optional[List[Dict[str, Any]]],
+    ndjson_path: Optional[str],
+    batch_size: int,
+    paths: Dict[str, str]
+) -> Dict[str, Any]:
+    # Only the stored index's centroids and residual buckets are needed
+    codec_path = os.path.join(paths["work_dir"], "codec")
+    storage_client = StorageClient()
+    try:
+        await download_index(storage_client, index_prefix, codec_path, paths=CODEC_FILES)
+    finally:
+        await storage_client.close()
+    codec = ResidualCodec.load(codec_path)
+    
+    if ndjson_path is not None:
+        batches = iter_document_batches(_iter_file(ndjson_path), batch_size, start=start)
+    else:
+        batches = _iter_list(documents, batch_size)
+    batches = _record_documents(batches, paths["documents_path"], paths["ids_path"])
+    
+    with open(paths["embeddings_path"], "wb") as embeddings_file:
+        return await _get_indexer().index_document_stream(
+            batches, index_name, embeddings_file, paths["work_dir"], codec=codec
+        )
+
+def update_index(
+    index_name: str,
+    index_prefix: str,
+    start: int,
+    documents: Optional[List[Dict[str, Any]]] = None,
+    ndjson_path: Optional[str] = None,
+    batch_size: int = 1024,
+    token_store_nbits: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Index documents appended to a stored index as a segment of their own.
+    
+    The new documents are compressed with the centroids and residual buckets
+    of the stored index at index_prefix, so only those files are downloaded,
+    and written to a new index directory in a fresh work_dir. The stored
+    index is not read or rewritten; segments are merged when the index is
+    compacted. document_count in the result is the number added.
+    """
+    paths = _segment_paths(tempfile.mkdtemp(prefix="index-"))
+    
+    try:
+        result = asyncio.run(_update_index(index_name, index_prefix, start, documents, ndjson_path, batch_size, paths))
+        if result["document_count"]:
+            result["token_store"] = write_token_store(result["path"], token_store_nbits)
+    except BaseException:
+        shutil.rmtree(paths["work_dir"], ignore_errors=True)
+        raise
+    result.update(paths)
+    return result
+
+async def _collect_live_documents(segments: List[Dict[str, Any]], tombstones_key: Optional[str], ndjson_path: str) -> int:
+    storage_client = StorageClient()
+    try:
+        deleted = np.empty(0, dtype=np.int64)
+        if tombstones_key:
+            deleted = decode_array(await storage_client.get_object(tombstones_key)).astype(np.int64)
+            
+        live = 0
+        with open(ndjson_path, "wb") as out:
+            for segment in segments:
+                start, end = segment["start"], segment["start"] + segment["count"]
+                dead = set((deleted[(deleted >= start) & (deleted < end)] - start).tolist())
+                # Segments are streamed, so only the current partial line is held in memory
+                offset, buffer = 0, b""
+                async for chunk in storage_client.iter_object(segment["documents"]):
+                    *lines, buffer = (buffer + chunk).split(b"\n")
+                    for line in lines:
+                        if offset not in dead:
+                            out.write(line + b"\n")
+                            live += 1
+                        offset += 1
+                if buffer and offset not in dead:
+                    out.write(buffer + b"\n")
+                    live += 1
+        return live
+    finally:
+        await storage_client.close()
+
+def collect_live_documents(segments: List[Dict[str, Any]], tombstones_key: Optional[str]) -> str:
+    """Write every document of an index that has not been deleted to a temp NDJSON file"""
+    spool = tempfile.NamedTemporaryFile(suffix=".ndjson", delete=False)
+    spool.close()
+    try:
+        live = asyncio.run(_collect_live_documents(segments, tombstones_key, spool.name))
+    except BaseException:
+        os.remove(spool.name)
+        raise
+    logger.info(f"Collected {live} live documents from {len(segments)} segments")
+    return spool.name
+
+def split_documents(ndjson_path: str, shard_count: int) -> List[Dict[str, Any]]:
+    """
+    Split a spooled NDJSON file into at most shard_count contiguous document ranges.
+    
+    Each range is written to its own temp file; the ranges are returned as
+    start, count and ndjson_path, with sizes differing by at most one.
+    """
+    with open(ndjson_path, "rb") as f:
+        total = sum(1 for line in f if line.strip())
+    bounds = np.linspace(0, total, max(1, min(shard_count, total)) + 1).astype(np.int64)
+    
+    shards = []
+    try:
+        with open(ndjson_path, "rb") as f:
+            lines = (line for line in f if line.strip())
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                spool = tempfile.NamedTemporaryFile(suffix=".ndjson", delete=False)
+                with spool:
+                    for _ in range(end - start):
+                        spool.write(next(lines).rstrip(b"\n") + b"\n")
+                shards.append({"start": int(start), "count": int(end - start), "ndjson_path": spool.name})
+    except BaseException:
+        for shard in shards:
+            os.remove(shard["ndjson_path"])
+        raise
+    return shards
+
+def join_files(paths: List[str], target: str) -> str:
+    """Concatenate files, such as the pooled embeddings of several shards, into target"""
+    with open(target, "wb") as out:
+        for path in paths:
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, out, 8 * 1024 * 1024)
+    return target
+
+def cluster_embeddings(
+    embeddings_path: str,
+    document_count: int,
+    dim: int,
+    n_clusters: int,
+    compress: bool = False
+) -> Dict[str, Any]:
+    """Fit k-means over the spilled embeddings and return labels and centroids as encoded array containers"""
+    embeddings = np.memmap(embeddings_path, dtype=np.float32, mode="r", shape=(document_count, dim))
+    clusterer = KMeansClusterer(n_clusters=n_clusters).fit(embeddings)
+    labels = clusterer.predict_batch(embeddings).astype(label_dtype(len(clusterer.centroids)))
+    return {
+        "n_clusters": len(clusterer.centroids),
+        "labels": encode_array(labels, compress),
+        "centroids": encode_array(clusterer.centroids.astype(np.float32), compress)
+    }
+
+def update_clusters(
+    embeddings_path: str,
+    document_count: int,
+    dim: int,
+    labels_data: bytes,
+    centroids_data: bytes,
+    tombstones_data: Optional[bytes] = None,
+    compress: bool = False
+) -> Dict[str, Any]:
+    """
+    Assign newly added embeddings to the stored centroids and nudge those
+    centroids towards them, without revisiting existing documents.
+    """
+    embeddings = np.memmap(embeddings_path, dtype=np.float32, mode="r", shape=(document_count, dim))
+    labels = decode_array(labels_data)
+    centroids = decode_array(centroids_data).astype(np.float32)
+    
+    # Deleted documents no longer weigh on their cluster
+    alive = np.ones(len(labels), dtype=bool)
+    if tombstones_data is not None:
+        alive[decode_array(tombstones_data).astype(np.int64)] = False
+    counts = np.bincount(labels[alive], minlength=len(centroids))
+    
+    clusterer = KMeansClusterer(n_clusters=len(centroids))
+    clusterer.centroids = centroids
+    clusterer.partial_fit(embeddings, counts)
+    
+    dtype = label_dtype(len(centroids))
+    labels = np.concatenate([labels.astype(dtype), clusterer.predict_batch(embeddings).astype(dtype)])
+    return {
+        "n_clusters": len(centroids),
+        "labels": encode_array(labels, compress),
+        "centroids": encode_array(clusterer.centroids, compress)
+    }
@@ -0,0 +1,324 @@
+import json
+import logging
+import math
+import numpy as np
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from document_table import DocumentTableWriter
+from token_store import pack_residuals, quantization_buckets
+from .kmeans_clusterer import KMeansClusterer
+
+logger = logging.getLogger(__name__)
+
+# Scores held at once when assigning tokens to centroids, (tokens x centroids)
+MAX_BLOCK_SCORES = 1 << 24
+
+# Files of a ColBERT index directory that ResidualCodec.load reads
+CODEC_FILES = ("metadata.json", "centroids.pt", "buckets.pt", "avg_residual.pt")
+
+def default_nbits(document_count: Optional[int]) -> int:
+    """Residual bits per dimension, wider for small collections as RAGatouille chooses them"""
+    if document_count is not None and document_count < 5000:
+        return 8
+    if document_count is not None and document_count < 10000:
+        return 4
+    return 2
+
+def pool_embeddings(token_embeddings: np.ndarray, doclens: Sequence[int]) -> np.ndarray:
+    """Mean-pooled, L2-normalised document embeddings from the flattened token embeddings of each document"""
+    doclens = np.asarray(doclens, dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(doclens)[:-1]))
+    sums = np.add.reduceat(np.asarray(token_embeddings, dtype=np.float32), offsets, axis=0)
+    pooled = sums / np.maximum(doclens, 1).astype(np.float32)[:, None]
+    pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+    return pooled.astype(np.float32)
+
+class ResidualCodec:
+    """
+    Centroids and residual buckets of a ColBERTv2 index: each token embedding
+    is stored as its nearest centroid plus an nbits-per-dimension quantised
+    residual, as ColBERT's own ResidualCodec stores it.
+    """
+    
+    def __init__(self, centroids: np.ndarray, cutoffs: np.ndarray, weights: np.ndarray, avg_residual: np.ndarray, nbits: int):
+        if 8 % nbits != 0:
+            raise ValueError(f"Unsupported residual width: {nbits} bits")
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.cutoffs = np.asarray(cutoffs, dtype=np.float32)
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.avg_residual = np.asarray(avg_residual, dtype=np.float32)
+        self.nbits = nbits
+        
+    @classmethod
+    def train(cls, sample: np.ndarray, n_partitions: int, nbits: int, max_iter: int = 4) -> "ResidualCodec":
+        """Fit centroids to a sample of token embeddings, then buckets to the sample's residuals"""
+        n_partitions = max(1, min(n_partitions, len(sample)))
+        centroids = KMeansClusterer(n_clusters=n_partitions, max_iter=max_iter).fit(sample).centroids
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        # Stored in half precision, so tokens are coded against the centroids readers will see
+        centroids = centroids.astype(np.float16).astype(np.float32)
+        
+        codes = cls.assign(sample, centroids)
+        residuals = np.asarray(sample, dtype=np.float32) - centroids[codes]
+        cutoffs, weights = quantization_buckets(residuals, nbits)
+        return cls(centroids, cutoffs, weights, np.abs(residuals).mean(axis=0), nbits)
+        
+    @classmethod
+    def load(cls, index_path: str) -> "ResidualCodec":
+        """The codec of an existing ColBERT index directory"""
+        import torch
+        
+        def load(name: str):
+            return torch.load(os.path.join(index_path, name), map_location="cpu")
+            
+        with open(os.path.join(index_path, "metadata.json")) as f:
+            nbits = json.load(f).get("config", {}).get("nbits", 2)
+        cutoffs, weights = load("buckets.pt")
+        avg_residual = load("avg_residual.pt") if os.path.exists(os.path.join(index_path, "avg_residual.pt")) else None
+        centroids = load("centroids.pt").float().numpy()
+        return cls(
+            centroids,
+            cutoffs.float().numpy(),
+            weights.float().numpy(),
+            avg_residual.float().numpy() if avg_residual is not None else np.zeros(centroids.shape[1], dtype=np.float32),
+            nbits
+        )
+        
+    @staticmethod
+    def assign(embeddings: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        """Nearest centroid of each L2-normalised embedding, a block of rows at a time"""
+        rows = max(1, MAX_BLOCK_SCORES // max(len(centroids), 1))
+        codes = np.empty(len(embeddings), dtype=np.int32)
+        for start in range(0, len(embeddings), rows):
+            block = np.asarray(embeddings[start:start + rows], dtype=np.float32)
+            codes[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        return codes
+        
+    def compress(self, embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Centroid codes and packed residuals of (tokens, dim) embeddings"""
+        codes = self.assign(embeddings, self.centroids)
+        residuals = np.asarray(embeddings, dtype=np.float32) - self.centroids[codes]
+        return codes, pack_residuals(residuals, self.cutoffs, self.nbits)
+        
+    def save(self, index_path: str):
+        import torch
+        torch.save(torch.from_numpy(self.centroids).half(), os.path.join(index_path, "centroids.pt"))
+        torch.save((torch.from_numpy(self.cutoffs), torch.from_numpy(self.weights)), os.path.join(index_path, "buckets.pt"))
+        torch.save(torch.from_numpy(self.avg_residual), os.path.join(index_path, "avg_residual.pt"))
+
+class ColbertIndexWriter:
+    """
+    Writes a ColBERTv2 index directory from token embeddings that arrive
+    batch by batch, instead of handing the whole collection to ColBERT.
+    
+    The first batches, up to sample_tokens token embeddings, are held back
+    to train the centroids and residual buckets (unless a codec is given);
+    after that each batch is compressed as it arrives and buffered until
+    chunk_documents documents make a chunk, which is written out as ColBERT
+    writes it. Memory is bounded by the sample and one chunk of compressed
+    tokens. The number of centroids follows ColBERT's rule for the
+    collection size, estimated from expected_documents when known, up to
+    max_partitions to bound the CPU time k-means takes. Only the inverted
+    lists, built once in finish(), grow with the collection.
+    
+    As the centroids are trained on the start of the stream, collections
+    whose documents are sorted by topic should be shuffled first.
+    """
+    
+    def __init__(
+        self,
+        index_path: str,
+        config: Dict[str, Any],
+        nbits: int = 2,
+        codec: Optional[ResidualCodec] = None,
+        expected_documents: Optional[int] = None,
+        sample_tokens: int = 1 << 18,
+        max_partitions: int = 1 << 13,
+        chunk_documents: int = 25000
+    ):
+        self.index_path = index_path
+        self.config = dict(config, nbits=codec.nbits if codec is not None else nbits)
+        self.nbits = self.config["nbits"]
+        self.codec = codec
+        self.expected_documents = expected_documents
+        self.sample_tokens = sample_tokens
+        self.max_partitions = max_partitions
+        self.chunk_documents = chunk_documents
+        
+        # Batches held back for training, and compressed batches waiting to fill a chunk
+        self._sample: List[Tuple[np.ndarray, np.ndarray]] = []
+        self._sampled_tokens = 0
+        self._buffer: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self._buffered_documents = 0
+        # Unique (centroid, document) pairs of each written chunk, for the inverted lists
+        self._postings: List[Tuple[np.ndarray, np.ndarray]] = []
+        
+        self.num_chunks = 0
+        self.num_documents = 0
+        self.num_embeddings = 0
+        os.makedirs(index_path, exist_ok=True)
+        
+    def add(self, embeddings: np.ndarray, doclens: Sequence[int]):
+        """Add the flattened token embeddings of a batch of documents, (tokens, dim), and their lengths"""
+        doclens = np.asarray(doclens, dtype=np.int64)
+        if self.codec is None:
+            self._sample.append((np.asarray(embeddings, dtype=np.float16), doclens))
+            self._sampled_tokens += len(embeddings)
+            if self._sampled_tokens >= self.sample_tokens:
+                self._train()
+            return
+        self._compress(embeddings, doclens)
+        
+    def _train(self):
+        sample = np.concatenate([embeddings for embeddings, _ in self._sample]).astype(np.float32)
+        documents = sum(len(doclens) for _, doclens in self._sample)
+        # ColBERT's partition count, 2^floor(log2(16 sqrt(embeddings))), from the estimated collection size
+        estimate = len(sample) * max(self.expected_documents or 0, documents) / max(documents, 1)
+        n_partitions = min(2 ** int(np.floor(np.log2(16 * math.sqrt(max(estimate, 1))))), self.max_partitions, len(sample))
+        
+        logger.info(f"Training {n_partitions} centroids on {len(sample)} token embeddings of {documents} documents")
+        self.codec = ResidualCodec.train(sample, n_partitions, self.nbits)
+        del sample
+        
+        sampled, self._sample = self._sample, []
+        for embeddings, doclens in sampled:
+            self._compress(embeddings, doclens)
+            
+    def _compress(self, embeddings: np.ndarray, doclens: np.ndarray):
+        codes, residuals = self.codec.compress(embeddings)
+        self._buffer.append((codes, residuals, doclens))
+        self._buffered_documents += len(doclens)
+        if self._buffered_documents >= self.chunk_documents:
+            self._write_chunk()
+            
+    def _write_chunk(self):
+        import torch
+        
+        if not self._buffer:
+            return
+        codes = np.concatenate([codes for codes, _, _ in self._buffer])
+        residuals = np.concatenate([residuals for _, residuals, _ in self._buffer])
+        doclens = np.concatenate([doclens for _, _, doclens in self._buffer])
+        self._buffer, self._buffered_documents = [], 0
+        
+        chunk = self.num_chunks
+        torch.save(torch.from_numpy(codes), os.path.join(self.index_path, f"{chunk}.codes.pt"))
+        torch.save(torch.from_numpy(residuals), os.path.join(self.index_path, f"{chunk}.residuals.pt"))
+        self._write_json(f"doclens.{chunk}.json", doclens.tolist())
+        self._write_json(f"{chunk}.metadata.json", {
+            "passage_offset": self.num_documents,
+            "num_passages": len(doclens),
+            "num_embeddings": len(codes),
+            "embedding_offset": self.num_embeddings
+        })
+        
+        # Pairs are unique within a chunk and documents never span chunks
+        pids = np.repeat(np.arange(self.num_documents, self.num_documents + len(doclens), dtype=np.int64), doclens)
+        pairs = np.unique(codes.astype(np.int64) * (1 << 32) + pids)
+        self._postings.append(((pairs >> 32).astype(np.int32), (pairs & 0xFFFFFFFF).astype(np.int32)))
+        
+        self.num_chunks += 1
+        self.num_documents += len(doclens)
+        self.num_embeddings += len(codes)
+        
+    def _write_json(self, name: str, value: Any):
+        with open(os.path.join(self.index_path, name), "w") as f:
+            json.dump(value, f)
+            
+    def finish(self) -> Dict[str, Any]:
+        """Write the last chunk, the inverted lists and the index metadata"""
+        import torch
+        
+        if self.codec is None:
+            if not self._sample:
+                raise ValueError("No documents were added to the index")
+            self._train()
+        self._write_chunk()
+        
+        # Inverted lists: the documents of each centroid, in document order
+        n_centroids = len(self.codec.centroids)
+        codes = np.concatenate([codes for codes, _ in self._postings])
+        pids = np.concatenate([pids for _, pids in self._postings])
+        ivf = pids[np.argsort(codes, kind="stable")]
+        lengths = np.bincount(codes, minlength=n_centroids).astype(np.int64)
+        self._postings = []
+        torch.save((torch.from_numpy(ivf), torch.from_numpy(lengths)), os.path.join(self.index_path, "ivf.pid.pt"))
+        
+        self.codec.save(self.index_path)
+        avg_doclen = self.num_embeddings / max(self.num_documents, 1)
+        self._write_json("plan.json", {
+            "config": self.config,
+            "num_chunks": self.num_chunks,
+            "num_partitions": n_centroids,
+            "num_embeddings_est": self.num_embeddings,
+            "avg_doclen_est": avg_doclen
+        })
+        self._write_json("metadata.json", {
+            "config": self.config,
+            "num_chunks": self.num_chunks,
+            "num_partitions": n_centroids,
+            "num_embeddings": self.num_embeddings,
+            "avg_doclen": avg_doclen
+        })
+        
+        logger.info(
+            f"Wrote index {self.index_path}: {self.num_documents} documents, {self.num_embeddings} tokens "
+            f"in {self.num_chunks} chunks, {n_centroids} centroids"
+        )
+        return {"num_documents": self.num_documents, "num_embeddings": self.num_embeddings, "num_partitions": n_centroids}
+
+class _JsonWriter:
+    """Writes a JSON list or object one item at a time"""
+    
+    def __init__(self, path: str, brackets: str):
+        self._file = open(path, "w")
+        self._close = brackets[1]
+        self._first = True
+        self._file.write(brackets[0])
+        
+    def _separate(self):
+        if not self._first:
+            self._file.write(",")
+        self._first = False
+        
+    def append(self, value: Any):
+        self._separate()
+        self._file.write(json.dumps(value))
+        
+    def set(self, key: str, value: Any):
+        self._separate()
+        self._file.write(f"{json.dumps(key)}:{json.dumps(value)}")
+        
+    def close(self):
+        self._file.write(self._close)
+        self._file.close()
+
+class DocumentWriter:
+    """
+    Writes the RAGatouille files of an index as documents arrive:
+    collection.json (contents by position), pid_docid_map.json and
+    docid_metadata_map.json (documents with metadata only), plus the
+    document table query workers map instead of parsing them.
+    """
+    
+    def __init__(self, index_path: str):
+        os.makedirs(index_path, exist_ok=True)
+        self._collection = _JsonWriter(os.path.join(index_path, "collection.json"), "[]")
+        self._ids = _JsonWriter(os.path.join(index_path, "pid_docid_map.json"), "{}")
+        self._metadata = _JsonWriter(os.path.join(index_path, "docid_metadata_map.json"), "{}")
+        self._table = DocumentTableWriter(index_path)
+        self.count = 0
+        
+    def add(self, documents: List[Dict[str, Any]]):
+        for doc in documents:
+            document_id = str(doc["id"])
+            self._collection.append(doc["content"])
+            self._ids.set(str(self.count), document_id)
+            if doc.get("metadata"):
+                self._metadata.set(document_id, doc["metadata"])
+            self._table.add(doc["content"], document_id, doc.get("metadata"))
+            self.count += 1
+            
+    def close(self):
+        for writer in (self._collection, self._ids, self._metadata, self._table):
+            writer.close()
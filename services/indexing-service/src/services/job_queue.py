@@ -0,0 +1,203 @@
+import asyncio
+import itertools
+import logging
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from instrumentation import current_trace, observe_stage, use_trace
+
+logger = logging.getLogger(__name__)
+
+class JobCancelled(Exception):
+    """Raised inside a job runner when the job has been cancelled"""
+
+class Job:
+    def __init__(self, user_id: str, payload: Dict[str, Any], priority: int, stages: List[str]):
+        self.job_id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.payload = payload
+        self.priority = priority
+        self.status = "queued"
+        self.stages = {name: {"status": "pending", "started_at": None, "duration": None} for name in stages}
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.exception: Optional[Exception] = None
+        self.cancel_requested = False
+        self.done = asyncio.Event()
+        # The submitting request's trace, carried over to the calls the job makes
+        self.trace = current_trace()
+        
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+        
+    def check_cancelled(self):
+        if self.cancel_requested:
+            raise JobCancelled(f"Job {self.job_id} was cancelled")
+            
+    def start_stage(self, name: str):
+        """Mark a stage as running; raises JobCancelled if cancellation was requested"""
+        self.check_cancelled()
+        self.stages[name]["status"] = "running"
+        self.stages[name]["started_at"] = time.time()
+        
+    def finish_stage(self, name: str):
+        stage = self.stages[name]
+        stage["status"] = "completed"
+        stage["duration"] = time.time() - stage["started_at"]
+        observe_stage(name, stage["duration"])
+        
+    def to_dict(self) -> Dict[str, Any]:
+        completed = sum(1 for stage in self.stages.values() if stage["status"] == "completed")
+        return {
+            "job_id": self.job_id,
+            "user_id": self.user_id,
+            "status": self.status,
+            "priority": self.priority,
+            "progress": completed / len(self.stages) if self.stages else 1.0,
+            "stages": self.stages,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queue_time": (self.started_at or time.time()) - self.submitted_at,
+            "result": self.result,
+            "error": self.error
+        }
+
+class JobQueue:
+    """
+    In-process scheduler for long-running indexing jobs.
+    
+    max_workers jobs run at once and each tenant is limited to tenant_limit
+    of them. Among eligible queued jobs the highest priority runs first, then
+    the oldest. The runner does the actual work, typically by handing stages
+    to a process pool so the event loop stays free.
+    """
+    
+    def __init__(
+        self,
+        runner: Callable[[Job], Awaitable[Dict[str, Any]]],
+        max_workers: int = 2,
+        tenant_limit: int = 1,
+        history: int = 1000
+    ):
+        self.runner = runner
+        self.max_workers = max_workers
+        self.tenant_limit = tenant_limit
+        self.history = history
+        
+        self._jobs: Dict[str, Job] = {}
+        self._queued: List[Job] = []
+        self._running: Dict[str, int] = defaultdict(int)
+        self._sequence = itertools.count()
+        self._order: Dict[str, int] = {}
+        self._changed: Optional[asyncio.Condition] = None
+        self._workers: List[asyncio.Task] = []
+        
+    def start(self):
+        self._changed = asyncio.Condition()
+        self._workers = [asyncio.ensure_future(self._worker(i)) for i in range(self.max_workers)]
+        logger.info(f"Started job queue with {self.max_workers} workers")
+        
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        
+    async def submit(self, user_id: str, payload: Dict[str, Any], stages: List[str], priority: int = 0) -> Job:
+        job = Job(user_id, payload, priority, stages)
+        self._jobs[job.job_id] = job
+        self._order[job.job_id] = next(self._sequence)
+        self._queued.append(job)
+        self._trim_history()
+        
+        async with self._changed:
+            self._changed.notify_all()
+            
+        logger.info(f"Queued job {job.job_id} for user {user_id} with priority {priority}")
+        return job
+        
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+        
+    async def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel a queued job immediately, or a running job at its next stage boundary"""
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return job
+            
+        job.cancel_requested = True
+        if job in self._queued:
+            self._queued.remove(job)
+            self._finish(job, "cancelled")
+        return job
+        
+    def _next_job(self) -> Optional[Job]:
+        eligible = [job for job in self._queued if self._running[job.user_id] < self.tenant_limit]
+        if not eligible:
+            return None
+        job = min(eligible, key=lambda j: (-j.priority, self._order[j.job_id]))
+        self._queued.remove(job)
+        return job
+        
+    async def _worker(self, worker_id: int):
+        while True:
+            async with self._changed:
+                job = self._next_job()
+                while job is None:
+                    await self._changed.wait()
+                    job = self._next_job()
+                self._running[job.user_id] += 1
+                
+            job.status = "running"
+            job.started_at = time.time()
+            observe_stage("queue_wait", job.started_at - job.submitted_at)
+            logger.info(f"Worker {worker_id} started job {job.job_id}")
+            
+            try:
+                with use_trace(job.trace):
+                    job.result = await self.runner(job)
+                self._finish(job, "completed")
+            except JobCancelled:
+                self._finish(job, "cancelled")
+            except Exception as e:
+                logger.error(f"Job {job.job_id} failed: {str(e)}")
+                job.error = str(e)
+                job.exception = e
+                self._finish(job, "failed")
+            finally:
+                self._running[job.user_id] -= 1
+                async with self._changed:
+                    self._changed.notify_all()
+                    
+    def _finish(self, job: Job, status: str):
+        job.status = status
+        job.finished_at = time.time()
+        # Finished jobs stay in the history; inline documents are not needed there
+        job.payload.pop("documents", None)
+        for stage in job.stages.values():
+            if stage["status"] == "running":
+                stage["status"] = status
+        job.done.set()
+        logger.info(f"Job {job.job_id} {status}")
+        
+    def _trim_history(self):
+        """Forget the oldest finished jobs once more than history are tracked"""
+        finished = [job for job in self._jobs.values() if job.finished]
+        for job in finished[:max(0, len(self._jobs) - self.history)]:
+            del self._jobs[job.job_id]
+            del self._order[job.job_id]
+            
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.max_workers,
+            "tenant_limit": self.tenant_limit,
+            "queued": len(self._queued),
+            "running": sum(self._running.values()),
+            "tracked_jobs": len(self._jobs)
+        }
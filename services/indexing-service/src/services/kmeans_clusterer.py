@@ -1,26 +1,186 @@
+import io
 import logging
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Optional, Tuple, Union
 import time
 
 logger = logging.getLogger(__name__)
 
+ArrayLike = Union[np.ndarray, List[List[float]]]
+
 class KMeansClusterer:
-    def __init__(self, n_clusters=100):
+    """
+    Mini-batch k-means over float32 embeddings.
+    
+    Fitting runs on a random subset of at most max_points_per_centroid points
+    per cluster, seeded with k-means++ and stopped early once the largest
+    centroid shift drops below tol. Distances are computed in chunks of
+    chunk_size rows so memory stays bounded by chunk_size * n_clusters.
+    """
+    
+    def __init__(
+        self,
+        n_clusters=100,
+        max_iter=25,
+        batch_size=16384,
+        chunk_size=65536,
+        max_points_per_centroid=256,
+        init="k-means++",
+        tol=1e-4,
+        seed=42
+    ):
+        if init not in ("k-means++", "random"):
+            raise ValueError(f"Unknown initialisation method: {init}")
+            
         self.n_clusters = n_clusters
-        # In a real implementation, we would import fastkmeans
-        # For now, we'll simulate it to avoid dependencies
+        self.max_iter = max_iter
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.max_points_per_centroid = max_points_per_centroid
+        self.init = init
+        self.tol = tol
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        
+    @staticmethod
+    def _as_float32(embeddings: ArrayLike) -> np.ndarray:
+        # np.memmap inputs are kept as-is so large corpora are read lazily
+        if isinstance(embeddings, np.ndarray) and embeddings.dtype == np.float32:
+            return embeddings
+        return np.asarray(embeddings, dtype=np.float32)
+        
+    def _assign(self, X: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        """Assign each row of X to its nearest centroid, chunk_size rows at a time"""
+        labels = np.empty(len(X), dtype=np.int32)
+        centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+        
+        for start in range(0, len(X), self.chunk_size):
+            chunk = np.ascontiguousarray(X[start:start + self.chunk_size], dtype=np.float32)
+            # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2; ||x||^2 does not affect the argmin
+            scores = chunk @ centroids.T
+            scores *= -2.0
+            scores += centroid_norms
+            labels[start:start + len(chunk)] = np.argmin(scores, axis=1)
+            
+        return labels
+        
+    @staticmethod
+    def _cluster_sums(X: np.ndarray, labels: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Per-cluster point counts and coordinate sums via a sort and segmented reduce"""
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros((k, X.shape[1]), dtype=np.float32)
+        
+        order = np.argsort(labels, kind="stable")
+        present = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[present]
+        sums[present] = np.add.reduceat(X[order], starts, axis=0)
+        
+        return counts.astype(np.float64), sums
+        
+    def _init_centroids(self, X: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+        if self.init == "random":
+            return X[rng.choice(len(X), size=k, replace=False)].copy()
+            
+        # Greedy k-means++ seeding; candidate distances are updated incrementally
+        centroids = np.empty((k, X.shape[1]), dtype=np.float32)
+        centroids[0] = X[rng.integers(len(X))]
+        closest = np.einsum("ij,ij->i", X - centroids[0], X - centroids[0])
+        
+        for i in range(1, k):
+            total = closest.sum()
+            if total <= 0:
+                # Every remaining point coincides with a centroid
+                centroids[i:] = X[rng.choice(len(X), size=k - i)]
+                break
+            idx = rng.choice(len(X), p=closest / total)
+            centroids[i] = X[idx]
+            diff = X - centroids[i]
+            np.minimum(closest, np.einsum("ij,ij->i", diff, diff), out=closest)
+            
+        return centroids
+        
+    def _update(self, centroids: np.ndarray, counts: np.ndarray, batch: np.ndarray):
+        """One mini-batch step, updating centroids and per-centroid counts in place"""
+        labels = self._assign(batch, centroids)
+        batch_counts, batch_sums = self._cluster_sums(batch, labels, len(centroids))
+        
+        # Per-centroid learning rate 1 / n_c, as in Sculley's mini-batch k-means
+        updated = batch_counts > 0
+        counts[updated] += batch_counts[updated]
+        step = (batch_counts[updated] / counts[updated]).astype(np.float32)[:, None]
+        means = batch_sums[updated] / batch_counts[updated, None].astype(np.float32)
+        centroids[updated] += step * (means - centroids[updated])
         
-    async def fit_predict(self, embeddings: List[List[float]]):
+    def fit(self, embeddings: ArrayLike) -> "KMeansClusterer":
+        """Fit centroids to the embeddings"""
+        X = self._as_float32(embeddings)
+        if X.ndim != 2 or len(X) == 0:
+            raise ValueError("Expected a non-empty 2D array of embeddings")
+            
+        rng = np.random.default_rng(self.seed)
+        k = min(self.n_clusters, len(X))
+        
+        # Fit on a random subset; sorted indices keep reads sequential for memmaps
+        max_points = self.max_points_per_centroid * k
+        if len(X) > max_points:
+            sample = np.sort(rng.choice(len(X), size=max_points, replace=False))
+            X = np.ascontiguousarray(X[sample])
+        else:
+            X = np.ascontiguousarray(X)
+            
+        centroids = self._init_centroids(X, k, rng)
+        counts = np.zeros(k, dtype=np.float64)
+        batch_size = min(self.batch_size, len(X))
+        
+        for iteration in range(self.max_iter):
+            previous = centroids.copy()
+            order = rng.permutation(len(X))
+            
+            for start in range(0, len(X), batch_size):
+                self._update(centroids, counts, X[order[start:start + batch_size]])
+                
+            shift = np.sqrt(np.max(np.einsum("ij,ij->i", centroids - previous, centroids - previous)))
+            if shift < self.tol:
+                logger.info(f"KMeans converged after {iteration + 1} iterations (shift {shift:.2e})")
+                break
+                
+        self.centroids = centroids
+        return self
+        
+    def partial_fit(self, embeddings: ArrayLike, counts: Optional[np.ndarray] = None) -> "KMeansClusterer":
+        """
+        Move fitted centroids towards new embeddings without refitting.
+        
+        counts is the number of points already assigned to each centroid, e.g.
+        a bincount of the stored labels, so established clusters move less
+        than small ones. Cost is proportional to the new embeddings only.
+        """
+        if self.centroids is None:
+            raise ValueError("KMeansClusterer has not been fitted")
+            
+        X = self._as_float32(embeddings)
+        k = len(self.centroids)
+        counts = np.zeros(k, dtype=np.float64) if counts is None else np.asarray(counts, dtype=np.float64).copy()
+        
+        for start in range(0, len(X), self.batch_size):
+            self._update(self.centroids, counts, np.ascontiguousarray(X[start:start + self.batch_size]))
+            
+        return self
+        
+    def predict_batch(self, embeddings: ArrayLike) -> np.ndarray:
+        """Assign a batch of embeddings to their nearest centroids"""
+        if self.centroids is None:
+            raise ValueError("KMeansClusterer has not been fitted")
+        return self._assign(self._as_float32(embeddings), self.centroids)
+        
+    async def fit_predict(self, embeddings: ArrayLike):
         """Cluster embeddings using FastKMeans"""
         logger.info(f"Clustering {len(embeddings)} embeddings into {self.n_clusters} clusters")
         
         start_time = time.time()
         
-        # Simulate clustering
-        # In a real implementation, this would use fastkmeans
-        np.random.seed(42)  # For reproducibility
-        cluster_assignments = np.random.randint(0, self.n_clusters, size=len(embeddings))
+        self.fit(embeddings)
+        cluster_assignments = self.predict_batch(embeddings)
         
         duration = time.time() - start_time
         logger.info(f"Clustering completed in {duration:.2f} seconds")
@@ -31,11 +191,33 @@ class KMeansClusterer:
         """Predict cluster for a single embedding"""
         logger.info("Predicting cluster for embedding")
         
-        # Simulate prediction
-        # In a real implementation, this would use fastkmeans
-        np.random.seed(42)  # For reproducibility
-        cluster = np.random.randint(0, self.n_clusters)
+        cluster = int(self.predict_batch(np.asarray(embedding, dtype=np.float32)[None, :])[0])
         
         logger.info(f"Predicted cluster: {cluster}")
         
         return cluster
+        
+    def to_bytes(self) -> bytes:
+        """Serialize the fitted centroids as a .npy payload"""
+        if self.centroids is None:
+            raise ValueError("KMeansClusterer has not been fitted")
+        buffer = io.BytesIO()
+        np.save(buffer, self.centroids, allow_pickle=False)
+        return buffer.getvalue()
+        
+    @classmethod
+    def from_bytes(cls, data: bytes, **kwargs) -> "KMeansClusterer":
+        """Restore a fitted clusterer from to_bytes output without refitting"""
+        centroids = np.load(io.BytesIO(data), allow_pickle=False).astype(np.float32)
+        clusterer = cls(n_clusters=len(centroids), **kwargs)
+        clusterer.centroids = centroids
+        return clusterer
+        
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+            
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "KMeansClusterer":
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read(), **kwargs)
@@ -1,26 +1,104 @@
 from fastapi import FastAPI, HTTPException, Header
 from pydantic import BaseModel
+import asyncio
+import base64
+import json
 import logging
-from typing import List, Dict, Any, Optional
+import os
+from typing import Callable, List, Dict, Any, Optional, Tuple
 import time
-import json
-from dapr.clients import DaprClient
+import numpy as np
+from index_format import decode_array
+from instrumentation import instrument, observe_stage, stage
+from state_store import state_store_from_env
+from storage_client import StorageClient
+from warmup import Warmup
 from .services.colbert_searcher import ColbertSearcher
+from .services.result_cache import ResultCache
+from .services.index_metadata import IndexMetadata, IndexMetadataStore
+from .services.query_batcher import QueryBatcher, QueueFullError
+from .services.shard_coordinator import ShardCoordinator, shard_id
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Query Service", description="Search queries with ColbertV2")
+# Per-stage search latencies on /metrics: cache_lookup, state_lookup, index_load,
+# queue_wait, encode, score and format
+instrument(app, "query-service")
 
 # Initialize services
-colbert_searcher = ColbertSearcher()
-dapr_client = DaprClient()
+state_store = state_store_from_env()
+storage_client = StorageClient()
+colbert_searcher = ColbertSearcher(storage_client)
+index_metadata = IndexMetadataStore(
+    state_store,
+    storage_client=storage_client,
+    cache_dir=os.environ.get("CLUSTER_CACHE_DIR", "/tmp/quickcolbert/clusters"),
+    pointer_ttl=float(os.environ.get("LATEST_INDEX_TTL", "60")),
+    metadata_ttl=float(os.environ.get("INDEX_METADATA_TTL", "10")),
+    max_indexes=int(os.environ.get("INDEX_METADATA_MAX_INDEXES", "1000"))
+)
+result_cache = ResultCache(
+    state_store=state_store if os.environ.get("RESULT_CACHE_SHARED", "false").lower() == "true" else None,
+    max_entries=int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "10000")),
+    ttl=float(os.environ.get("RESULT_CACHE_TTL", "300")),
+    shared_ttl=int(os.environ.get("RESULT_CACHE_SHARED_TTL", "3600"))
+)
+
+# Concurrent /search queries are encoded and scored in micro-batches; at most
+# SEARCH_QUEUE_MAX may wait before new ones are turned away
+query_batcher = QueryBatcher(
+    colbert_searcher,
+    max_batch_size=int(os.environ.get("SEARCH_BATCH_MAX_SIZE", "32")),
+    max_wait=float(os.environ.get("SEARCH_BATCH_MAX_WAIT_MS", "2")) / 1000,
+    max_queue=int(os.environ.get("SEARCH_QUEUE_MAX", "1024")),
+    concurrency=colbert_searcher.search_workers
+)
+
+# Sharded indexes are searched on the QUERY_PEERS that own each shard (this
+# process when there are none) and merged here; shards that have not answered
+# within SHARD_TIMEOUT_MS are left out of a partial result
+shard_coordinator = ShardCoordinator(
+    colbert_searcher,
+    peers=[peer.strip() for peer in os.environ.get("QUERY_PEERS", "").split(",") if peer.strip()],
+    self_url=os.environ.get("QUERY_SELF_URL") or None,
+    timeout=float(os.environ.get("SHARD_TIMEOUT_MS", "2000")) / 1000,
+    replicas=int(os.environ.get("SHARD_REPLICAS", "2"))
+)
+
+# At startup the query encoder, the WARMUP_INDEXES and pinned indexes are
+# loaded and WARMUP_QUERIES (or the queries in WARMUP_QUERIES_FILE, one per
+# line) are searched against them, in the background; /ready fails until then
+warmup = Warmup(
+    "query-service",
+    retry_delay=float(os.environ.get("WARMUP_RETRY_DELAY", "5")),
+    max_attempts=int(os.environ.get("WARMUP_MAX_ATTEMPTS", "3"))
+)
+WARMUP_INDEXES = list(dict.fromkeys(
+    index_id.strip()
+    for index_id in os.environ.get("WARMUP_INDEXES", "").split(",") + os.environ.get("INDEX_CACHE_PINNED", "").split(",")
+    if index_id.strip()
+))
+WARMUP_QUERIES = [
+    "what is late interaction retrieval",
+    "how do I reset my password",
+    "quarterly revenue growth by region",
+    "side effects of common medications"
+]
+
+# Upper bound on the number of queries accepted by /search/batch
+MAX_BATCH_QUERIES = int(os.environ.get("MAX_BATCH_QUERIES", "1024"))
+# Nearest document clusters searched when a query does not say; 0 searches all of them
+CLUSTER_NPROBE = int(os.environ.get("CLUSTER_NPROBE", "0"))
 
 class SearchQuery(BaseModel):
     query: str
     index_id: Optional[str] = None  # If None, use the latest index
     limit: int = 10
+    nprobe: Optional[int] = None  # Nearest document clusters to search; 0 searches all of them
+    clusters: Optional[List[int]] = None  # Only return documents from these clusters
 
 class SearchResult(BaseModel):
     document_id: str
@@ -33,6 +111,81 @@ class SearchResponse(BaseModel):
     results: List[SearchResult]
     processing_time: float
     query: str
+    cached: bool = False
+    partial: bool = False  # Some shards of a sharded index did not answer in time
+
+class BatchSearchRequest(BaseModel):
+    queries: List[SearchQuery]
+
+class BatchSearchResponse(BaseModel):
+    results: List[SearchResponse]
+    timings: Dict[str, float]
+    processing_time: float
+
+class ShardSearchRequest(BaseModel):
+    index_id: str
+    version: Optional[Any] = None
+    shard: int
+    queries: List[str]
+    embeddings: Optional[str] = None  # Base64 array container of the encoded queries
+    limit: int = 10
+    routes: Optional[List[Optional[Dict[str, Any]]]] = None
+
+async def resolve_index(
+    index_id: Optional[str],
+    user_id: str,
+    extra_key: Optional[Callable[[IndexMetadata], str]] = None
+) -> Tuple[IndexMetadata, Optional[bytes]]:
+    """
+    Resolve the index to search (the user's latest by default) and its cached
+    metadata, reading the state under extra_key(metadata) in the same round trip
+    """
+    metadata, extra = await index_metadata.resolve(index_id, user_id, extra_key)
+    if metadata is None:
+        raise HTTPException(status_code=404, detail="Index not found" if index_id else "No index found for this user")
+    return metadata, extra
+
+def query_route(query: SearchQuery) -> Optional[Dict[str, Any]]:
+    """The cluster routing a query asks for, or None to search every document"""
+    nprobe = CLUSTER_NPROBE if query.nprobe is None else query.nprobe
+    if not nprobe and query.clusters is None:
+        return None
+    return {"nprobe": nprobe or None, "clusters": sorted(set(query.clusters)) if query.clusters is not None else None}
+
+def route_key(route: Optional[Dict[str, Any]]) -> str:
+    """Result cache options for a route"""
+    return json.dumps(route, sort_keys=True) if route else ""
+
+def format_results(
+    raw_results: List[Dict[str, Any]],
+    metadata: IndexMetadata,
+    limit: int,
+    route: Optional[Dict[str, Any]] = None
+) -> List[SearchResult]:
+    # Results carry their document position as passage_id; cluster lookup is O(k)
+    positions = [result.get("passage_id", -1) for result in raw_results]
+    clusters = metadata.clusters_for(positions)
+    deleted = metadata.is_deleted(positions)
+    allowed = set(route["clusters"]) if route and route.get("clusters") is not None else None
+    
+    results = []
+    for i, result in enumerate(raw_results):
+        # Deleted documents stay in the index until it is compacted
+        if deleted[i]:
+            continue
+        # The search is restricted to these clusters already unless routing was unavailable
+        if allowed is not None and int(clusters[i]) not in allowed:
+            continue
+        results.append(SearchResult(
+            document_id=str(result.get("document_id", result.get("rank", i))),
+            score=result.get("score", 0.0),
+            content=result.get("content", ""),
+            metadata=result.get("document_metadata", result.get("metadata", {})),
+            cluster=int(clusters[i])
+        ))
+        if len(results) == limit:
+            break
+    return results
 
 @app.post("/search", response_model=SearchResponse)
 async def search(query: SearchQuery, x_user_id: Optional[str] = Header(None)):
@@ -44,75 +197,392 @@ async def search(query: SearchQuery, x_user_id: Optional[str] = Header(None)):
     logger.info(f"Received search query from user {user_id}: {query.query}")
     
     try:
-        # Get the index ID to use
-        index_id = query.index_id
-        if not index_id:
-            # Get the latest index for this user
-            # In a real implementation, we would query the state store for the latest index
-            # For now, we'll simulate it
-            state = await dapr_client.get_state(
-                store_name="statestore",
-                key=f"latest_index:{user_id}"
-            )
-            if state.data:
-                index_id = state.data.decode("utf-8")
-            else:
-                raise HTTPException(status_code=404, detail="No index found for this user")
+        route = query_route(query)
+        options = route_key(route)
+        with stage("cache_lookup"):
+            # Cached results are looked up for the index version this replica holds, if any
+            known = index_metadata.peek(query.index_id, user_id)
+            results = None
+            if known is not None:
+                results = result_cache.get(known.index_id, known.version, query.query, query.limit, options)
+        cached = results is not None
+        partial = False
         
-        # Get index information
-        index_info = await dapr_client.get_state(
-            store_name="statestore",
-            key=f"index:{index_id}"
-        )
-        if not index_info.data:
-            raise HTTPException(status_code=404, detail="Index not found")
+        if not cached:
+            # The shared result is read in the same state round trip as the index, if at all
+            shared_key = None
+            if result_cache.shared:
+                shared_key = lambda m: result_cache.shared_key(m.index_id, m.version, query.query, query.limit, options)
+            with stage("state_lookup"):
+                metadata, shared = await resolve_index(query.index_id, user_id, shared_key)
+            index_id, version = metadata.index_id, metadata.version
+            results = result_cache.shared_result(shared)
+            cached = results is not None
             
-        index_info = json.loads(index_info.data.decode("utf-8"))
-        index_path = index_info["path"]
-        
-        # Load the index if not already loaded
-        await colbert_searcher.load_index(index_path)
-        
-        # Perform the search
-        raw_results = await colbert_searcher.search(query.query, query.limit)
-        
-        # Get cluster information
-        clusters = await dapr_client.get_state(
-            store_name="statestore",
-            key=f"clusters:{index_id}"
-        )
-        cluster_data = {}
-        if clusters.data:
-            cluster_data = json.loads(clusters.data.decode("utf-8"))
-        
-        # Format the results
-        results = []
-        for i, result in enumerate(raw_results):
-            document_id = str(result.get("rank", i))
-            results.append(SearchResult(
-                document_id=document_id,
-                score=result.get("score", 0.0),
-                content=result.get("content", ""),
-                metadata=result.get("metadata", {}),
-                cluster=int(cluster_data.get(document_id, -1))
-            ))
-        
+            if not cached:
+                result_cache.record_miss()
+                router = metadata.router if route else None
+                
+                if metadata.shards:
+                    # Fan out to the owners of each shard and merge their results
+                    with stage("shard_search"):
+                        shard_results, missing = await shard_coordinator.search(
+                            metadata, [query.query], metadata.search_limit(query.limit), router, [route]
+                        )
+                    raw_results, partial = shard_results[0], bool(missing)
+                else:
+                    # Load the index if it is not already resident
+                    with stage("index_load"):
+                        handle = await colbert_searcher.load_index(metadata.path, index_id, metadata.artifacts.get("index"))
+                        
+                    # Perform the search, batched with other concurrent queries; the
+                    # loaded handle is searched even if the index is evicted meanwhile
+                    raw_results = await query_batcher.submit(
+                        index_id, query.query, metadata.search_limit(query.limit), router, route, handle
+                    )
+                    
+                # Format the results with cluster information
+                with stage("format"):
+                    results = [r.dict() for r in format_results(raw_results, metadata, query.limit, route)]
+                # Partial results are never cached
+                if not partial:
+                    await result_cache.put_shared(index_id, version, query.query, query.limit, results, options)
+                    
+            if not partial:
+                result_cache.put(index_id, version, query.query, query.limit, results, options)
+                
         processing_time = time.time() - start_time
-        logger.info(f"Search completed in {processing_time:.2f} seconds")
+        logger.info(f"Search completed in {processing_time:.2f} seconds (cached={cached})")
         
         return SearchResponse(
             results=results,
             processing_time=processing_time,
-            query=query.query
+            query=query.query,
+            cached=cached,
+            partial=partial
         )
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        logger.warning(f"Rejected search query from user {user_id}: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         logger.error(f"Error searching documents: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error searching documents: {str(e)}")
 
+@app.post("/search/batch", response_model=BatchSearchResponse)
+async def search_batch(request: BatchSearchRequest, x_user_id: Optional[str] = Header(None)):
+    """
+    Run many queries at once, encoding and scoring the queries for each index together
+    """
+    start_time = time.time()
+    user_id = x_user_id or "anonymous"
+    logger.info(f"Received batch of {len(request.queries)} search queries from user {user_id}")
+    
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
+        
+    timings = {"cache_lookup": 0.0, "state_lookup": 0.0, "index_load": 0.0, "search": 0.0, "format": 0.0}
+    responses: List[Optional[SearchResponse]] = [None] * len(request.queries)
+    
+    try:
+        # Serve what we can from the in-process result cache
+        stage_start = time.time()
+        routes = [query_route(query) for query in request.queries]
+        options = [route_key(route) for route in routes]
+        pending: List[int] = []
+        for position, query in enumerate(request.queries):
+            known = index_metadata.peek(query.index_id, user_id)
+            results = None
+            if known is not None:
+                results = result_cache.get(known.index_id, known.version, query.query, query.limit, options[position])
+            if results is None:
+                pending.append(position)
+            else:
+                responses[position] = SearchResponse(
+                    results=results,
+                    processing_time=time.time() - start_time,
+                    query=query.query,
+                    cached=True
+                )
+        timings["cache_lookup"] = time.time() - stage_start
+        
+        # Group the remaining queries by the index they target, resolving the indexes in parallel
+        stage_start = time.time()
+        requested = list(dict.fromkeys(request.queries[position].index_id for position in pending))
+        resolutions = await asyncio.gather(*[resolve_index(index_id, user_id) for index_id in requested])
+        resolved = {index_id: metadata for index_id, (metadata, _) in zip(requested, resolutions)}
+        groups: Dict[str, List[int]] = {}
+        metadatas: Dict[str, IndexMetadata] = {}
+        for position in pending:
+            metadata = resolved[request.queries[position].index_id]
+            metadatas[metadata.index_id] = metadata
+            groups.setdefault(metadata.index_id, []).append(position)
+        timings["state_lookup"] = time.time() - stage_start
+        
+        for index_id, positions in groups.items():
+            metadata = metadatas[index_id]
+            version = metadata.version
+            
+            stage_start = time.time()
+            shared = await result_cache.get_shared_many(
+                index_id, version, [(request.queries[p].query, request.queries[p].limit, options[p]) for p in positions]
+            )
+            misses = []
+            for position, results in zip(positions, shared):
+                query = request.queries[position]
+                if results is None:
+                    result_cache.record_miss()
+                    misses.append(position)
+                    continue
+                result_cache.put(index_id, version, query.query, query.limit, results, options[position])
+                responses[position] = SearchResponse(
+                    results=results,
+                    processing_time=time.time() - start_time,
+                    query=query.query,
+                    cached=True
+                )
+            timings["cache_lookup"] += time.time() - stage_start
+            if not misses:
+                continue
+                
+            queries = [request.queries[p] for p in misses]
+            limit = metadata.search_limit(max(q.limit for q in queries))
+            router = metadata.router if any(routes[p] for p in misses) else None
+            partial = False
+            
+            if metadata.shards:
+                stage_start = time.time()
+                raw_results, missing = await shard_coordinator.search(
+                    metadata, [q.query for q in queries], limit, router, [routes[p] for p in misses]
+                )
+                partial = bool(missing)
+                timings["search"] += time.time() - stage_start
+            else:
+                stage_start = time.time()
+                handle = await colbert_searcher.load_index(metadata.path, index_id, metadata.artifacts.get("index"))
+                timings["index_load"] += time.time() - stage_start
+                
+                stage_start = time.time()
+                raw_results = await colbert_searcher.search_batch(
+                    [q.query for q in queries], limit, index_id, router, [routes[p] for p in misses], handle
+                )
+                timings["search"] += time.time() - stage_start
+                
+            stage_start = time.time()
+            shared_entries = []
+            for position, query, query_results in zip(misses, queries, raw_results):
+                results = [r.dict() for r in format_results(query_results, metadata, query.limit, routes[position])]
+                if not partial:
+                    result_cache.put(index_id, version, query.query, query.limit, results, options[position])
+                    shared_entries.append((query.query, query.limit, options[position], results))
+                responses[position] = SearchResponse(
+                    results=results,
+                    processing_time=time.time() - start_time,
+                    query=query.query,
+                    partial=partial
+                )
+            await result_cache.put_shared_many(index_id, version, shared_entries)
+            timings["format"] += time.time() - stage_start
+            
+        processing_time = time.time() - start_time
+        logger.info(f"Batch of {len(request.queries)} searches completed in {processing_time:.2f} seconds")
+        for name, seconds in timings.items():
+            observe_stage(f"batch_{name}", seconds)
+            
+        return BatchSearchResponse(
+            results=responses,
+            timings=timings,
+            processing_time=processing_time
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error searching documents: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error searching documents: {str(e)}")
+
+@app.post("/shards/search")
+async def search_shard(request: ShardSearchRequest):
+    """
+    Search one shard of a sharded index for a coordinating query service
+    
+    Results carry whole-index positions as passage_id and are not filtered
+    for deleted documents; the coordinator does that after merging.
+    """
+    metadata = await index_metadata.get(request.index_id)
+    if metadata is not None and request.version is not None and metadata.version != request.version:
+        # This process may have missed an update event; look again once
+        index_metadata.on_index_updated(request.index_id)
+        colbert_searcher.invalidate(request.index_id)
+        metadata = await index_metadata.get(request.index_id)
+    if metadata is None or not 0 <= request.shard < len(metadata.shards):
+        raise HTTPException(status_code=404, detail=f"Shard {request.shard} of index {request.index_id} not found")
+    if request.version is not None and metadata.version != request.version:
+        raise HTTPException(status_code=409, detail=f"Index {request.index_id} is at version {metadata.version}")
+        
+    embeddings = None
+    if request.embeddings is not None:
+        embeddings = decode_array(base64.b64decode(request.embeddings)).astype(np.float32)
+        
+    try:
+        results = await colbert_searcher.search_shard(
+            request.index_id,
+            request.shard,
+            metadata.shards[request.shard],
+            request.queries,
+            embeddings,
+            request.limit,
+            metadata.router if request.routes and any(request.routes) else None,
+            request.routes
+        )
+    except Exception as e:
+        logger.error(f"Error searching shard {request.shard} of index {request.index_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error searching shard: {str(e)}")
+    return {"results": results}
+
+@app.get("/dapr/subscribe")
+async def subscribe():
+    """Dapr pub/sub subscriptions for this service"""
+    return [
+        {"pubsubname": "pubsub", "topic": "index-created", "route": "/events/index-created"},
+        {"pubsubname": "pubsub", "topic": "index-updated", "route": "/events/index-updated"}
+    ]
+
+@app.post("/events/index-created")
+async def on_index_created(event: Dict[str, Any]):
+    """Refresh cached metadata and results when a user's latest index is replaced or an index is rebuilt"""
+    data = event.get("data", event)
+    index_name = data.get("index_name")
+    user_id = data.get("user_id")
+    logger.info(f"Received index-created event for {index_name} from user {user_id}")
+    
+    index_metadata.on_index_created(index_name, user_id)
+    if index_name:
+        result_cache.invalidate_index(index_name)
+        
+    return {"status": "SUCCESS"}
+
+@app.post("/events/index-updated")
+async def on_index_updated(event: Dict[str, Any]):
+    """Drop cached state for an index whose documents were appended or deleted"""
+    data = event.get("data", event)
+    index_name = data.get("index_name")
+    logger.info(f"Received index-updated event for {index_name} (version {data.get('version')})")
+    
+    if index_name:
+        index_metadata.on_index_updated(index_name)
+        colbert_searcher.invalidate(index_name)
+        result_cache.invalidate_index(index_name)
+        
+    return {"status": "SUCCESS"}
+
+@app.post("/indexes/{index_id}/pin")
+async def pin_index(index_id: str):
+    """Keep an index resident in the index cache"""
+    colbert_searcher.index_cache.pin(index_id)
+    return {"index_id": index_id, "pinned": True}
+
+@app.delete("/indexes/{index_id}/pin")
+async def unpin_index(index_id: str):
+    """Allow a pinned index to be evicted again"""
+    colbert_searcher.index_cache.unpin(index_id)
+    return {"index_id": index_id, "pinned": False}
+
+def warmup_queries() -> List[str]:
+    path = os.environ.get("WARMUP_QUERIES_FILE")
+    if not path:
+        return WARMUP_QUERIES
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+async def warm_model():
+    if colbert_searcher.engine == "plaid":
+        await colbert_searcher.initialize()
+    # The ragatouille engine loads a model with each index instead
+    return {"engine": colbert_searcher.engine}
+
+async def warm_indexes():
+    """Load the warmup indexes, or the shards of them this process owns"""
+    loaded = []
+    for index_id in WARMUP_INDEXES:
+        metadata = await index_metadata.get(index_id)
+        if metadata is None:
+            logger.warning(f"Warmup index {index_id} not found")
+            continue
+        if metadata.shards:
+            for shard, artifact in enumerate(metadata.shards):
+                key = shard_id(index_id, shard)
+                if None in shard_coordinator.owners(key):
+                    await colbert_searcher.load_index(key, key, artifact)
+                    loaded.append(key)
+        else:
+            await colbert_searcher.load_index(metadata.path, index_id, metadata.artifacts.get("index"))
+            loaded.append(index_id)
+    return {"loaded": loaded}
+
+async def warm_queries():
+    """
+    Encode and search the warmup queries on every warm index, or only encode
+    them without one; searches go straight to the searcher, not the result cache
+    """
+    queries = warmup_queries()
+    if not queries:
+        return {"queries": 0, "indexes": 0}
+    warm = set(colbert_searcher.index_cache.resident())
+    searched = 0
+    for index_id in WARMUP_INDEXES:
+        metadata = await index_metadata.get(index_id)
+        if metadata is None:
+            continue
+        for shard, artifact in enumerate(metadata.shards):
+            key = shard_id(index_id, shard)
+            if key in warm:
+                await colbert_searcher.search_shard(index_id, shard, artifact, queries)
+                searched += 1
+        if not metadata.shards and index_id in warm:
+            await colbert_searcher.search_batch(queries, index_id=index_id)
+            searched += 1
+    if not searched and colbert_searcher.engine == "plaid":
+        await colbert_searcher.encode(queries)
+    return {"queries": len(queries), "indexes": searched}
+
+warmup.step("model", warm_model)
+warmup.step("indexes", warm_indexes)
+warmup.step("queries", warm_queries)
+
+@app.on_event("startup")
+async def startup():
+    warmup.start()
+
+@app.get("/stats")
+async def stats():
+    return {
+        **colbert_searcher.stats(),
+        "warmup": warmup.stats(),
+        "query_batcher": query_batcher.stats(),
+        "shard_coordinator": shard_coordinator.stats(),
+        "result_cache": result_cache.stats(),
+        "index_metadata": index_metadata.stats(),
+        "state_store": state_store.stats()
+    }
+
+@app.on_event("shutdown")
+async def shutdown():
+    await warmup.stop()
+    await query_batcher.close()
+    await shard_coordinator.close()
+    await storage_client.close()
+    await state_store.close()
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness: 200 once the model, warmup indexes and warmup queries are warm, 503 until then"""
+    return warmup.response()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
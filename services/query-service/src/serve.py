@@ -0,0 +1,244 @@
+"""
+Pre-fork server for the query service.
+
+The supervisor loads the ColBERT query encoder once, binds the listening
+socket and forks QUERY_WORKERS worker processes. Workers share the encoder's
+weights copy-on-write and the memory-mapped index token stores through the
+page cache, so memory stays flat as workers are added. Each worker imports the
+app after the fork, so its Dapr and storage clients are its own, and serves
+the inherited socket with uvicorn.
+
+Workers publish a heartbeat from their event loop into shared memory. The
+supervisor restarts workers that exit or whose heartbeat is older than
+QUERY_WORKER_HEARTBEAT_TIMEOUT seconds, and stops them all on SIGTERM/SIGINT.
+
+The query-service image runs it as `python -m src.serve` from /app; HOST and
+PORT choose the listening address (default 0.0.0.0:8001).
+
+Set PROMETHEUS_MULTIPROC_DIR to have /metrics on any worker report the
+metrics of all of them; the supervisor empties it on startup.
+"""
+import asyncio
+import gc
+import logging
+import mmap
+import os
+import signal
+import socket
+import time
+import shutil
+import numpy as np
+from typing import Dict, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 1.0
+
+def _limit_threads(threads: int):
+    """Give each worker its share of the cores for intra-op parallelism"""
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+async def _heartbeat(heartbeats: np.ndarray, slot: int):
+    while True:
+        heartbeats[slot] = time.time()
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+def _reset_metrics():
+    """Drop metric files left by a previous run in the shared Prometheus directory"""
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+def _forget_metrics(pid: int):
+    """Stop reporting the live gauges of a worker that exited"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid)
+
+def _run_worker(slot: int, sock: socket.socket, heartbeats: np.ndarray, threads: int):
+    import uvicorn
+    
+    # The supervisor's handlers must not run in workers; uvicorn installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    _limit_threads(threads)
+    
+    from .app import app
+    
+    @app.on_event("startup")
+    async def start_heartbeat():
+        asyncio.ensure_future(_heartbeat(heartbeats, slot))
+        
+    server = uvicorn.Server(uvicorn.Config(app, log_level="info"))
+    server.run(sockets=[sock])
+
+class Supervisor:
+    def __init__(
+        self,
+        workers: int,
+        host: str = "0.0.0.0",
+        port: int = 8001,
+        threads_per_worker: Optional[int] = None,
+        heartbeat_timeout: float = 30.0,
+        startup_timeout: float = 120.0,
+        restart_delay: float = 1.0,
+        graceful_timeout: float = 30.0
+    ):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        self.heartbeat_timeout = heartbeat_timeout
+        self.startup_timeout = startup_timeout
+        self.restart_delay = restart_delay
+        self.graceful_timeout = graceful_timeout
+        
+        # One heartbeat timestamp per worker slot, in memory shared with the workers
+        self._heartbeat_memory = mmap.mmap(-1, 8 * workers)
+        self.heartbeats = np.frombuffer(self._heartbeat_memory, dtype=np.float64)
+        
+        self._pids: Dict[int, int] = {}
+        self._started_at: Dict[int, float] = {}
+        self._running = True
+        self.restarts = 0
+        
+    def _preload(self):
+        # Tokenizer threads started before a fork would deadlock in the workers
+        os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+        from .services.colbert_searcher import preload_model
+        
+        start_time = time.time()
+        preload_model()
+        logger.info(f"Preloaded query encoder in {time.time() - start_time:.2f} seconds")
+        
+    def _bind(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        return sock
+        
+    def _spawn(self, slot: int, sock: socket.socket):
+        # A fresh worker gets startup_timeout to load before its heartbeat is checked
+        self.heartbeats[slot] = time.time() + self.startup_timeout - self.heartbeat_timeout
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(slot, sock, self.heartbeats, self.threads_per_worker)
+            except BaseException:
+                logger.exception(f"Query worker {slot} failed")
+                code = 1
+            finally:
+                os._exit(code)
+                
+        self._pids[slot] = pid
+        self._started_at[slot] = time.time()
+        logger.info(f"Started query worker {slot} (pid {pid})")
+        
+    def _stop(self, *_):
+        self._running = False
+        
+    def _reap(self, sock: socket.socket):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+                
+            slot = next((s for s, p in self._pids.items() if p == pid), None)
+            if slot is None:
+                continue
+            del self._pids[slot]
+            _forget_metrics(pid)
+            if not self._running:
+                continue
+                
+            logger.warning(f"Query worker {slot} (pid {pid}) exited with status {status}, restarting")
+            # Avoid a tight loop when a worker crashes on startup
+            if time.time() - self._started_at[slot] < self.restart_delay:
+                time.sleep(self.restart_delay)
+            self.restarts += 1
+            self._spawn(slot, sock)
+            
+    def _check_heartbeats(self):
+        now = time.time()
+        for slot, pid in list(self._pids.items()):
+            if now - self.heartbeats[slot] > self.heartbeat_timeout:
+                logger.warning(f"Query worker {slot} (pid {pid}) stopped responding, killing it")
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                    
+    def _shutdown(self):
+        logger.info(f"Stopping {len(self._pids)} query workers")
+        for pid in self._pids.values():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+                
+        deadline = time.time() + self.graceful_timeout
+        while self._pids and time.time() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(0.1)
+                continue
+            self._pids = {slot: p for slot, p in self._pids.items() if p != pid}
+            
+        for pid in self._pids.values():
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+                
+    def run(self):
+        _reset_metrics()
+        self._preload()
+        sock = self._bind()
+        logger.info(f"Serving on {self.host}:{self.port} with {self.workers} workers, {self.threads_per_worker} threads each")
+        
+        # Keep the collector from touching (and so copying) objects loaded before the fork
+        gc.collect()
+        gc.freeze()
+        
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        
+        for slot in range(self.workers):
+            self._spawn(slot, sock)
+            
+        while self._running:
+            self._reap(sock)
+            self._check_heartbeats()
+            time.sleep(HEARTBEAT_INTERVAL)
+            
+        self._shutdown()
+        sock.close()
+
+def main():
+    Supervisor(
+        workers=int(os.environ.get("QUERY_WORKERS", str(os.cpu_count() or 1))),
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", "8001")),
+        threads_per_worker=int(os.environ.get("QUERY_WORKER_THREADS", "0")) or None,
+        heartbeat_timeout=float(os.environ.get("QUERY_WORKER_HEARTBEAT_TIMEOUT", "30")),
+        startup_timeout=float(os.environ.get("QUERY_WORKER_STARTUP_TIMEOUT", "120"))
+    ).run()
+
+if __name__ == "__main__":
+    main()
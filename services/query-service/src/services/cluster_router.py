@@ -0,0 +1,68 @@
+import numpy as np
+from typing import Any, Dict, Optional, Sequence
+
+class ClusterRouter:
+    """
+    Routes queries to the document clusters found by KMeansClusterer.
+    
+    Documents were clustered on their mean-pooled, L2-normalised token
+    embeddings, so a query is pooled the same way and assigned to its nprobe
+    nearest cluster centroids. The documents of each cluster are kept as one
+    position-sorted list, so the documents of any set of clusters are a few
+    slices.
+    """
+    
+    def __init__(self, centroids: np.ndarray, labels: np.ndarray):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.n_clusters = len(self.centroids)
+        
+        # Positions without a known cluster (-1) are never routed to
+        labels = np.asarray(labels)
+        assigned = np.flatnonzero((labels >= 0) & (labels < self.n_clusters))
+        order = np.argsort(labels[assigned], kind="stable")
+        self.members = assigned[order].astype(np.int64)
+        self.offsets = np.zeros(self.n_clusters + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels[assigned], minlength=self.n_clusters), out=self.offsets[1:])
+        
+    @property
+    def document_count(self) -> int:
+        return len(self.members)
+        
+    def nearest(self, query: np.ndarray, nprobe: int, clusters: Optional[Sequence[int]] = None) -> np.ndarray:
+        """The nprobe clusters nearest to a (query length, dim) query, optionally chosen among clusters"""
+        pooled = np.asarray(query, dtype=np.float32).mean(axis=0)
+        pooled /= max(float(np.linalg.norm(pooled)), 1e-12)
+        
+        choices = np.arange(self.n_clusters) if clusters is None else np.unique(np.asarray(clusters, dtype=np.int64))
+        choices = choices[(choices >= 0) & (choices < self.n_clusters)]
+        if len(choices) == 0:
+            return choices
+        scores = self.centroids[choices] @ pooled
+        nprobe = min(nprobe, len(choices))
+        if nprobe < len(choices):
+            return choices[np.argpartition(-scores, nprobe - 1)[:nprobe]]
+        return choices
+        
+    def documents(self, clusters: Sequence[int]) -> np.ndarray:
+        """Sorted positions of every document in the given clusters"""
+        clusters = np.unique(np.asarray(clusters, dtype=np.int64))
+        clusters = clusters[(clusters >= 0) & (clusters < self.n_clusters)]
+        if len(clusters) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate([self.members[self.offsets[c]:self.offsets[c + 1]] for c in clusters]))
+        
+    def allowed(self, query: np.ndarray, route: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """
+        Documents a query may match under route, or None when it is unrestricted
+        
+        route holds nprobe, the number of nearest clusters to search, and/or
+        clusters, the only clusters results may come from.
+        """
+        if not route:
+            return None
+        nprobe, clusters = route.get("nprobe"), route.get("clusters")
+        if nprobe:
+            clusters = self.nearest(query, nprobe, clusters)
+        if clusters is None:
+            return None
+        return self.documents(clusters)
@@ -1,45 +1,320 @@
 from ragatouille import RAGPretrainedModel
+import asyncio
 import logging
+import numpy as np
 import os
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+from instrumentation import stage
+from model_snapshot import load_pretrained
+from token_store import has_token_store
+from .embedding_cache import QueryEmbeddingCache
+from .index_cache import IndexCache, directory_size
+from .index_disk_cache import IndexDiskCache
+from .plaid_engine import PlaidSearcher, resident_size
+from .shard_coordinator import shard_id
 
 logger = logging.getLogger(__name__)
 
+MODEL_NAME = "colbert-ir/colbertv2.0"
+
+# Loaded once per process, or once by the pre-fork supervisor so that every
+# worker shares the weights copy-on-write
+_shared_model = None
+
+def inference_checkpoint(model):
+    """Return the ColBERT inference checkpoint wrapped by a RAGatouille model"""
+    colbert = model.model
+    checkpoint = getattr(colbert, "inference_ckpt", None)
+    if checkpoint is None:
+        from colbert.modeling.checkpoint import Checkpoint
+        checkpoint = Checkpoint(colbert.checkpoint, colbert_config=colbert.config)
+        colbert.inference_ckpt = checkpoint
+    return checkpoint
+
+def preload_model():
+    """Load the query encoder for this process and any processes forked from it"""
+    global _shared_model
+    if _shared_model is None:
+        # With MODEL_SNAPSHOT_DIR set, later starts unpickle the built model instead
+        _shared_model = load_pretrained(
+            MODEL_NAME, os.environ.get("MODEL_SNAPSHOT_DIR") or None, prepare=inference_checkpoint
+        )
+    return _shared_model
+
+def _optional(name: str, cast):
+    """An optional numeric setting from the environment"""
+    value = os.environ.get(name)
+    return cast(value) if value else None
+
 class ColbertSearcher:
-    def __init__(self):
+    def __init__(self, storage_client=None):
         self.model = None
         self.loaded_index = None
+        # Created on first use, inside the event loop that serves requests
+        self._model_lock: Optional[asyncio.Lock] = None
         
+        # "plaid" searches with the built-in NumPy engine; "ragatouille" with RAGPretrainedModel.search
+        self.engine = os.environ.get("SEARCH_ENGINE", "plaid")
+        if self.engine not in ("plaid", "ragatouille"):
+            raise ValueError(f"Unknown search engine: {self.engine}")
+        # PLAID knobs; unset ones follow PLAID's defaults for the requested k
+        self.search_params = {
+            "ncells": _optional("PLAID_NCELLS", int),
+            "centroid_score_threshold": _optional("PLAID_CENTROID_SCORE_THRESHOLD", float),
+            "ndocs": _optional("PLAID_NDOCS", int)
+        }
+        
+        # Encoded queries reused across searches; 0 bytes disables the cache
+        self.embedding_cache = None
+        embedding_cache_bytes = int(os.environ.get("QUERY_EMBEDDING_CACHE_MAX_BYTES", str(64 * 1024 ** 2)))
+        if embedding_cache_bytes > 0:
+            self.embedding_cache = QueryEmbeddingCache(
+                MODEL_NAME,
+                max_bytes=embedding_cache_bytes,
+                cache_dir=os.environ.get("QUERY_EMBEDDING_CACHE_DIR") or None,
+                max_disk_bytes=int(os.environ.get("QUERY_EMBEDDING_CACHE_MAX_DISK_BYTES", str(1024 ** 3)))
+            )
+            
+        # Searches run here, off the event loop; one worker scores one batch at a time
+        self.search_workers = int(os.environ.get("SEARCH_WORKERS", "1"))
+        self.executor = ThreadPoolExecutor(max_workers=self.search_workers, thread_name_prefix="search")
+        
+        self.index_cache = IndexCache(
+            loader=self._load_model_for_index,
+            max_bytes=int(os.environ.get("INDEX_CACHE_MAX_BYTES", str(4 * 1024 ** 3))),
+            policy=os.environ.get("INDEX_CACHE_POLICY", "lru"),
+            sizer=self._index_size
+        )
+        for index_id in filter(None, os.environ.get("INDEX_CACHE_PINNED", "").split(",")):
+            self.index_cache.pin(index_id.strip())
+            
+        # Index directories fetched from object storage, kept on local disk across restarts
+        self.index_store = None
+        if storage_client is not None:
+            self.index_store = IndexDiskCache(
+                storage_client,
+                cache_dir=os.environ.get("INDEX_DISK_CACHE_DIR", "/tmp/quickcolbert/indexes"),
+                max_bytes=int(os.environ.get("INDEX_DISK_CACHE_MAX_BYTES", str(20 * 1024 ** 3))),
+                concurrency=int(os.environ.get("INDEX_DOWNLOAD_CONCURRENCY", "8"))
+            )
+            
     async def initialize(self):
-        """Initialize the ColbertV2 model"""
-        logger.info("Initializing ColbertV2 model")
-        self.model = RAGPretrainedModel.from_pretrained("colbert-ir/colbertv2.0")
-        logger.info("ColbertV2 model initialized")
+        """Initialize the ColbertV2 model off the event loop; concurrent callers wait for the same load"""
+        if self._model_lock is None:
+            self._model_lock = asyncio.Lock()
+        async with self._model_lock:
+            if self.model is not None:
+                return
+            logger.info("Initializing ColbertV2 model")
+            loop = asyncio.get_event_loop()
+            self.model = await loop.run_in_executor(None, preload_model)
+            logger.info("ColbertV2 model initialized")
+            
+    def _checkpoint(self):
+        """Return the ColBERT inference checkpoint wrapped by the RAGatouille model"""
+        return inference_checkpoint(self.model)
+        
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """ColBERT query embeddings, (queries, query length, dim) float32, served from the cache where possible"""
+        with stage("encode"):
+            if self.embedding_cache is not None:
+                return self.embedding_cache.encode(queries, self._encode)
+            return self._encode(queries)
+            
+    async def encode(self, queries: List[str]) -> np.ndarray:
+        """Encode queries off the event loop, e.g. once for every shard they are sent to"""
+        if self.model is None:
+            await self.initialize()
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, self.encode_queries, queries)
+        
+    def _encode(self, queries: List[str]) -> np.ndarray:
+        embeddings = self._checkpoint().queryFromText(queries, bsize=len(queries), to_cpu=True)
+        return embeddings.float().numpy()
+        
+    def _index_size(self, index_path: str) -> int:
+        """Budgeted size of a loaded index; mapped token stores only count what is copied into memory"""
+        if self.engine == "plaid" and has_token_store(index_path):
+            return resident_size(index_path)
+        return directory_size(index_path)
         
-    async def load_index(self, index_path: str):
-        """Load an index for searching"""
+    async def _load_model_for_index(self, index_path: str):
+        """Load a model bound to the index at index_path without blocking the event loop"""
+        loop = asyncio.get_event_loop()
+        if self.engine == "ragatouille":
+            return await loop.run_in_executor(None, RAGPretrainedModel.from_index, index_path)
+            
+        # One query encoder is shared by every loaded index
         if self.model is None:
             await self.initialize()
+        return await loop.run_in_executor(
+            None, PlaidSearcher.open, index_path, self.encode_queries, self.search_params
+        )
+        
+    async def load_index(
+        self,
+        index_path: Optional[str],
+        index_id: Optional[str] = None,
+        artifact: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Load an index for searching, reusing it if it is already resident
+        
+        When the index was uploaded to object storage (artifact), it is
+        downloaded into the local disk cache first and loaded from there.
+        """
+        index_id = index_id or index_path
+        if index_path is None and (artifact is None or self.index_store is None):
+            raise ValueError(f"Index {index_id} has no local path to load it from")
             
-        logger.info(f"Loading index from {index_path}")
+        if artifact is not None and self.index_store is not None:
+            index_path = await self.index_store.fetch(index_id, artifact)
+            try:
+                entry = await self.index_cache.get(index_id, index_path)
+                # Downloads no longer loaded here may be evicted by any worker
+                self.index_store.retain(self._resident_paths())
+            finally:
+                self.index_store.release(index_path)
+        else:
+            entry = await self.index_cache.get(index_id, index_path)
+        if self.engine == "ragatouille":
+            self.model = entry.handle
+        self.loaded_index = index_id
         
-        # In a real implementation, we would download the index from Cloudflare R2
-        # For now, we'll assume the index is available locally
-        self.model.load_index(index_path)
-        self.loaded_index = index_path
+        return entry.handle
         
-        logger.info(f"Index loaded from {index_path}")
+    def invalidate(self, index_id: str):
+        """Drop a loaded index, and every loaded shard of it, e.g. after it has been updated"""
+        self.index_cache.invalidate(index_id)
+        for resident in self.index_cache.resident():
+            if resident.startswith(f"{index_id}/shards/"):
+                self.index_cache.invalidate(resident)
+        if self.index_store is not None:
+            self.index_store.retain(self._resident_paths())
+            
+    def _resident_paths(self) -> List[str]:
+        return [self.index_cache.peek(index_id).index_path for index_id in self.index_cache.resident()]
         
-    async def search(self, query: str, limit: int = 10):
-        """Search using ColbertV2"""
-        if self.model is None or self.loaded_index is None:
+    def _entry(self, index_id: Optional[str]):
+        index_id = index_id or self.loaded_index
+        entry = self.index_cache.peek(index_id) if index_id else None
+        if entry is None:
             raise ValueError("Model or index not initialized")
+        return index_id, entry
+        
+    def _run_search(self, handle, queries, limit: int, router, routes):
+        if self.engine == "plaid":
+            # Encoded and scored separately, as PlaidSearcher.search would, so each is timed
+            batch = [queries] if isinstance(queries, str) else queries
+            embeddings = self.encode_queries(batch)
+            with stage("score"):
+                results = handle.search_embeddings(embeddings, k=limit, router=router, routes=routes)
+            return results[0] if len(results) == 1 else results
+        with stage("search"):
+            return handle.search(queries, k=limit)
             
-        logger.info(f"Searching for: {query}")
+    async def search(
+        self,
+        query: str,
+        limit: int = 10,
+        index_id: Optional[str] = None,
+        router=None,
+        route: Optional[Dict[str, Any]] = None,
+        handle=None
+    ):
+        """
+        Search using ColbertV2
         
-        # Execute search
-        results = self.model.search(query, k=limit)
+        With the PLAID engine, route (nprobe and/or clusters) restricts the
+        search to documents of the query's nearest or selected clusters.
+        handle, as returned by load_index, is searched even if the index has
+        since been evicted or replaced; otherwise the resident index is.
+        """
+        if handle is None:
+            index_id, entry = self._entry(index_id)
+            handle = entry.handle
+            
+        logger.info(f"Searching index {index_id} for: {query}")
+        
+        # Execute search without blocking the event loop
+        loop = asyncio.get_event_loop()
+        results = await loop.run_in_executor(
+            self.executor, self._run_search, handle, query, limit, router, [route]
+        )
         
         logger.info(f"Found {len(results)} results for query: {query}")
         
         return results
+        
+    async def search_batch(
+        self,
+        queries: List[str],
+        limit: int = 10,
+        index_id: Optional[str] = None,
+        router=None,
+        routes: Optional[List[Optional[Dict[str, Any]]]] = None,
+        handle=None
+    ):
+        """Search many queries against one index, or handle as search() does, encoding them in a single batch"""
+        if handle is None:
+            index_id, entry = self._entry(index_id)
+            handle = entry.handle
+            
+        logger.info(f"Searching index {index_id} for a batch of {len(queries)} queries")
+        
+        # A list of queries is encoded and searched as one batch
+        loop = asyncio.get_event_loop()
+        results = await loop.run_in_executor(
+            self.executor, self._run_search, handle, queries, limit, router, routes
+        )
+        if len(queries) == 1:
+            results = [results]
+            
+        return results
+        
+    def _run_shard_search(self, handle, queries, embeddings, limit: int, router, routes, offset: int):
+        if self.engine == "plaid":
+            if embeddings is None:
+                embeddings = self.encode_queries(queries)
+            with stage("score"):
+                return handle.search_embeddings(embeddings, k=limit, router=router, routes=routes, offset=offset)
+                
+        with stage("search"):
+            results = handle.search(queries, k=limit)
+        if len(queries) == 1:
+            results = [results]
+        return [[dict(result, passage_id=result["passage_id"] + offset) for result in query_results] for query_results in results]
+        
+    async def search_shard(
+        self,
+        index_id: str,
+        shard: int,
+        artifact: Dict[str, Any],
+        queries: List[str],
+        embeddings: Optional[np.ndarray] = None,
+        limit: int = 10,
+        router=None,
+        routes: Optional[List[Optional[Dict[str, Any]]]] = None
+    ):
+        """
+        Search one shard of a sharded index, loading it first if needed
+        
+        embeddings, when given, are the already encoded queries. Results carry
+        whole-index positions as passage_id, so shards can be merged.
+        """
+        key = shard_id(index_id, shard)
+        handle = await self.load_index(key, key, artifact)
+        
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.executor, self._run_shard_search, handle, queries, embeddings, limit, router, routes, artifact["start"]
+        )
+        
+    def stats(self) -> Dict[str, Any]:
+        stats = {"engine": self.engine, "index_cache": self.index_cache.stats()}
+        if self.index_store is not None:
+            stats["index_disk_cache"] = self.index_store.stats()
+        if self.embedding_cache is not None:
+            stats["query_embedding_cache"] = self.embedding_cache.stats()
+        return stats
@@ -0,0 +1,213 @@
+import hashlib
+import logging
+import os
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+from index_format import FormatError, decode_array, write_array
+from .result_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+def _writer_alive(name: str) -> bool:
+    """Whether the process that named a <key>.qcar.<pid>.tmp file is still running"""
+    try:
+        os.kill(int(name.split(".")[-2]), 0)
+    except (ValueError, IndexError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class QueryEmbeddingCache:
+    """
+    ColBERT query embeddings keyed by model id and normalized query text.
+    
+    Embeddings are held as float16 in an in-memory LRU bounded by max_bytes.
+    With cache_dir they are also written to disk as array containers, so
+    popular queries stay encoded across restarts; the disk tier drops its
+    least recently used files beyond max_disk_bytes. Lookups and inserts are
+    locked, so several search threads can share one cache.
+    
+    Worker processes may share cache_dir: a miss reads the file another
+    worker wrote, and each process writes through its own temp file. Each
+    process only accounts for the files it has written or read, though, so
+    together they can hold up to max_disk_bytes per process, and a file one
+    of them evicts is simply a miss for the others.
+    """
+    
+    def __init__(
+        self,
+        model_id: str,
+        max_bytes: int = 64 * 1024 ** 2,
+        cache_dir: Optional[str] = None,
+        max_disk_bytes: int = 1024 ** 3
+    ):
+        self.model_id = model_id
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._resident_bytes = 0
+        self._files: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._scan()
+            
+    def _scan(self):
+        """Pick up embeddings written before a restart, oldest first"""
+        found = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".tmp") and not _writer_alive(name):
+                # Left by a process that died while writing
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+            elif name.endswith(".qcar"):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                found.append((stat.st_mtime, name[:-len(".qcar")], stat.st_size))
+        for _, key, size in sorted(found):
+            self._files[key] = size
+            self._disk_bytes += size
+        logger.info(f"Found {len(self._files)} cached query embeddings in {self.cache_dir}")
+        
+    def _key(self, query: str) -> str:
+        return hashlib.sha1(f"{self.model_id}\x00{normalize_query(query)}".encode("utf-8")).hexdigest()
+        
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.qcar")
+        
+    def _remember(self, key: str, embedding: np.ndarray):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._resident_bytes -= previous.nbytes
+        self._entries[key] = embedding
+        self._resident_bytes += embedding.nbytes
+        
+        while self._resident_bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._resident_bytes -= evicted.nbytes
+            self.evictions += 1
+            
+    def _read(self, key: str) -> Optional[np.ndarray]:
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+            embedding = decode_array(data)
+        except FileNotFoundError:
+            # Never written, or evicted by another process
+            self._disk_bytes -= self._files.pop(key, 0)
+            return None
+        except (OSError, FormatError) as e:
+            logger.warning(f"Dropping unreadable cached query embedding {key}: {str(e)}")
+            self._forget_file(key)
+            return None
+        # Files written by other processes sharing cache_dir are adopted here
+        self._disk_bytes += len(data) - self._files.pop(key, 0)
+        self._files[key] = len(data)
+        return embedding
+        
+    def _write(self, key: str, embedding: np.ndarray):
+        path = self._path(key)
+        # Written aside and renamed, so a crash never leaves a partial file; the
+        # temp name is per process, as workers may write the same query at once
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            size = write_array(tmp_path, embedding)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write cached query embedding {key}: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+            
+        self._disk_bytes += size - self._files.pop(key, 0)
+        self._files[key] = size
+        while self._disk_bytes > self.max_disk_bytes and len(self._files) > 1:
+            self._forget_file(next(iter(self._files)))
+            
+    def _forget_file(self, key: str):
+        self._disk_bytes -= self._files.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+            
+    def get(self, query: str) -> Optional[np.ndarray]:
+        """The cached float16 embedding of a query, from memory or disk"""
+        key = self._key(query)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return embedding
+            if self.cache_dir is not None:
+                embedding = self._read(key)
+                if embedding is not None:
+                    self._remember(key, embedding)
+                    self.disk_hits += 1
+                    return embedding
+            self.misses += 1
+            return None
+            
+    def put(self, query: str, embedding: np.ndarray):
+        key = self._key(query)
+        embedding = np.ascontiguousarray(embedding, dtype=np.float16)
+        with self._lock:
+            self._remember(key, embedding)
+            if self.cache_dir is not None:
+                self._write(key, embedding)
+                
+    def encode(self, queries: List[str], encoder: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Embeddings of queries as float32, (queries, query length, dim).
+        
+        Only the distinct queries missing from the cache are passed to
+        encoder, together as one batch.
+        """
+        embeddings: List[Optional[np.ndarray]] = [self.get(query) for query in queries]
+        
+        missing: Dict[str, List[int]] = {}
+        for position, embedding in enumerate(embeddings):
+            if embedding is None:
+                missing.setdefault(normalize_query(queries[position]), []).append(position)
+                
+        if missing:
+            encoded = encoder([queries[positions[0]] for positions in missing.values()])
+            for positions, embedding in zip(missing.values(), encoded):
+                # Rounded like cached ones, so a query scores the same on every search
+                embedding = embedding.astype(np.float16)
+                self.put(queries[positions[0]], embedding)
+                for position in positions:
+                    embeddings[position] = embedding
+                    
+        return np.stack(embeddings).astype(np.float32)
+        
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "model_id": self.model_id,
+            "entries": len(self._entries),
+            "resident_bytes": self._resident_bytes,
+            "max_bytes": self.max_bytes,
+            "disk_entries": len(self._files),
+            "disk_bytes": self._disk_bytes,
+            "max_disk_bytes": self.max_disk_bytes if self.cache_dir is not None else 0,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions
+        }
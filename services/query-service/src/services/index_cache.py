@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+class CachedIndex:
+    def __init__(self, index_id: str, index_path: str, handle: Any, size_bytes: int, load_time: float):
+        self.index_id = index_id
+        self.index_path = index_path
+        self.handle = handle
+        self.size_bytes = size_bytes
+        self.load_time = load_time
+        self.hits = 0
+        self.last_used = time.time()
+
+def directory_size(path: str) -> int:
+    """Estimate the resident size of an index from its on-disk footprint"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+        
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+class IndexCache:
+    """
+    Loaded indexes kept resident across requests, keyed by index_id.
+    
+    Unpinned entries are evicted in LRU or LFU order once the memory budget is
+    exceeded. Concurrent requests for an index that is still loading share a
+    single load.
+    """
+    
+    def __init__(
+        self,
+        loader: Callable[[str], Awaitable[Any]],
+        max_bytes: int = 4 * 1024 ** 3,
+        policy: str = "lru",
+        sizer: Callable[[str], int] = directory_size
+    ):
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f"Unknown eviction policy: {policy}")
+            
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.sizer = sizer
+        
+        self._entries: "OrderedDict[str, CachedIndex]" = OrderedDict()
+        self._loading: Dict[Tuple[str, str], asyncio.Future] = {}
+        # Path of the load started last for each index; an older load finishing later is not cached
+        self._requested: Dict[str, str] = {}
+        self._pinned: Set[str] = set()
+        self._resident_bytes = 0
+        
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.loads = 0
+        self.load_failures = 0
+        self.evictions = 0
+        self.total_load_time = 0.0
+        
+    async def get(self, index_id: str, index_path: str) -> CachedIndex:
+        """Return the loaded index, loading it at most once for concurrent callers"""
+        entry = self._entries.get(index_id)
+        if entry is not None and entry.index_path == index_path:
+            self.hits += 1
+            entry.hits += 1
+            entry.last_used = time.time()
+            self._entries.move_to_end(index_id)
+            return entry
+            
+        # A load of another path (e.g. the previous version of an updated
+        # index) is not joined: its searcher would answer for the wrong one
+        key = (index_id, index_path)
+        pending = self._loading.get(key)
+        if pending is None:
+            self.misses += 1
+            self._requested[index_id] = index_path
+            # Run the load as its own task so a cancelled request does not
+            # abort a load that other requests are waiting on
+            pending = asyncio.ensure_future(self._load(index_id, index_path))
+            self._loading[key] = pending
+            pending.add_done_callback(lambda _: self._loading.pop(key, None))
+        else:
+            self.coalesced += 1
+            
+        return await asyncio.shield(pending)
+        
+    async def _load(self, index_id: str, index_path: str) -> CachedIndex:
+        logger.info(f"Index cache miss for {index_id}, loading from {index_path}")
+        
+        start_time = time.time()
+        try:
+            handle = await self.loader(index_path)
+        except Exception:
+            self.load_failures += 1
+            if self._requested.get(index_id) == index_path:
+                del self._requested[index_id]
+            raise
+        load_time = time.time() - start_time
+        
+        self.loads += 1
+        self.total_load_time += load_time
+        
+        entry = CachedIndex(index_id, index_path, handle, self.sizer(index_path), load_time)
+        if self._requested.get(index_id) != index_path:
+            # Superseded by a load of another path while this one ran
+            return entry
+        del self._requested[index_id]
+        
+        previous = self._entries.pop(index_id, None)
+        if previous is not None:
+            self._resident_bytes -= previous.size_bytes
+            
+        self._entries[index_id] = entry
+        self._resident_bytes += entry.size_bytes
+        self._evict(keep=index_id)
+        
+        logger.info(
+            f"Loaded index {index_id} ({entry.size_bytes} bytes) in {load_time:.2f} seconds, "
+            f"{len(self._entries)} indexes resident"
+        )
+        return entry
+        
+    def _evict(self, keep: str):
+        """Evict unpinned entries until the cache fits in its memory budget"""
+        while self._resident_bytes > self.max_bytes:
+            candidates = [
+                index_id for index_id in self._entries
+                if index_id != keep and index_id not in self._pinned
+            ]
+            if not candidates:
+                logger.warning(
+                    f"Index cache over budget ({self._resident_bytes} > {self.max_bytes} bytes) "
+                    "but every other index is pinned"
+                )
+                return
+                
+            if self.policy == "lfu":
+                victim = min(candidates, key=lambda i: (self._entries[i].hits, self._entries[i].last_used))
+            else:
+                # OrderedDict keeps entries in least-recently-used first order
+                victim = candidates[0]
+                
+            self.invalidate(victim)
+            self.evictions += 1
+            
+    def invalidate(self, index_id: str) -> bool:
+        """Drop an index from the cache, e.g. after it has been rebuilt"""
+        entry = self._entries.pop(index_id, None)
+        if entry is None:
+            return False
+            
+        self._resident_bytes -= entry.size_bytes
+        logger.info(f"Evicted index {index_id} from cache")
+        return True
+        
+    def pin(self, index_id: str):
+        """Keep an index resident regardless of eviction order"""
+        self._pinned.add(index_id)
+        
+    def unpin(self, index_id: str):
+        self._pinned.discard(index_id)
+        self._evict(keep="")
+        
+    def peek(self, index_id: str) -> Optional[CachedIndex]:
+        return self._entries.get(index_id)
+        
+    def resident(self) -> List[str]:
+        return list(self._entries)
+        
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "policy": self.policy,
+            "max_bytes": self.max_bytes,
+            "resident_bytes": self._resident_bytes,
+            "resident_indexes": len(self._entries),
+            "pinned_indexes": sorted(self._pinned),
+            "loading_indexes": len(self._loading),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced_loads": self.coalesced,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "loads": self.loads,
+            "load_failures": self.load_failures,
+            "evictions": self.evictions,
+            "avg_load_time": self.total_load_time / self.loads if self.loads else 0.0
+        }
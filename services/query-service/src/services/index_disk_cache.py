@@ -0,0 +1,337 @@
+import asyncio
+import fcntl
+import logging
+import os
+import shutil
+import time
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import quote, unquote
+from index_artifacts import MANIFEST_NAME, download_index, read_manifest
+
+logger = logging.getLogger(__name__)
+
+LOCK_DIR = ".locks"
+CACHE_LOCK = "cache.lock"
+
+class LocalIndex:
+    def __init__(self, index_id: str, path: str, size_bytes: int, created_at: float, last_used: float = 0.0):
+        self.index_id = index_id
+        self.path = path
+        self.size_bytes = size_bytes
+        self.created_at = created_at
+        self.last_used = last_used
+
+def entry_name(index_id: str) -> str:
+    """Quoted index id; shard ids such as idx/shards/0 stay one level deep"""
+    return quote(index_id, safe="")
+
+def version_name(index_id: str, created_at: Any) -> str:
+    """Directory name of one uploaded version of an index; quote never leaves an @ in entry_name"""
+    return f"{entry_name(index_id)}@{created_at!r}"
+
+def _downloader_alive(name: str) -> bool:
+    """Whether the process that named a <version>.<pid>.partial directory is still running"""
+    try:
+        os.kill(int(name.split(".")[-2]), 0)
+    except (ValueError, IndexError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class IndexDiskCache:
+    """
+    Index directories downloaded from object storage on first use, shared by
+    every worker process on the host.
+    
+    Each uploaded version of an index is its own directory directly under
+    cache_dir (see version_name), downloaded into a per-process .partial
+    directory and renamed into place once every file has been verified, so a
+    directory holding a manifest is always complete and is picked up again
+    after a restart. Files unchanged since a cached version are linked rather
+    than downloaded.
+    
+    Processes coordinate through flock on a lock file per version: a shared
+    lock is held while a version is claimed by a fetch or retained because it
+    is loaded, and an exclusive one while it is downloaded or deleted, so a
+    version is fetched once however many workers ask for it and never removed
+    under one that has it open. Eviction runs under a cache-wide lock over
+    what is on disk, deleting superseded versions and then the least recently
+    used ones that no process holds until the cache fits max_bytes.
+    """
+    
+    def __init__(self, storage_client, cache_dir: str, max_bytes: int = 20 * 1024 ** 3, concurrency: int = 8):
+        self.storage_client = storage_client
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.concurrency = concurrency
+        
+        self._entries: Dict[str, LocalIndex] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        # Shared locks held by this process, by version name
+        self._locks: Dict[str, int] = {}
+        self._claims: Dict[str, int] = {}
+        self._retained: set = set()
+        self._disk_bytes = 0
+        
+        self.hits = 0
+        self.downloads = 0
+        self.download_failures = 0
+        self.downloaded_bytes = 0
+        self.evictions = 0
+        
+        os.makedirs(os.path.join(cache_dir, LOCK_DIR), exist_ok=True)
+        self._scan()
+        
+    def _lock_path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, LOCK_DIR, f"{name}.lock")
+        
+    def _lock(self, name: str, operation: int) -> int:
+        """Open the lock file of name and flock it, retrying if it was deleted meanwhile"""
+        path = self._lock_path(name)
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, operation)
+                if os.path.exists(path) and os.stat(path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except BaseException:
+                os.close(fd)
+                raise
+            os.close(fd)
+            
+    def _try_lock(self, name: str, operation: int) -> Optional[int]:
+        try:
+            return self._lock(name, operation | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+            
+    def _survey(self) -> List[LocalIndex]:
+        """Complete versions on disk, least recently used first"""
+        found = []
+        for name in os.listdir(self.cache_dir):
+            if "@" not in name or name.endswith(".partial"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                manifest = read_manifest(path)
+                last_used = os.path.getmtime(os.path.join(path, MANIFEST_NAME))
+            except (OSError, ValueError):
+                continue
+            index_id = unquote(name.split("@", 1)[0])
+            found.append(LocalIndex(index_id, path, manifest["total_bytes"], manifest["created_at"], last_used))
+        found.sort(key=lambda entry: entry.last_used)
+        
+        self._entries = {os.path.basename(entry.path): entry for entry in found}
+        self._disk_bytes = sum(entry.size_bytes for entry in found)
+        return found
+        
+    def _scan(self):
+        """Adopt complete downloads left by earlier processes and remove what they abandoned"""
+        cache_lock = self._lock(CACHE_LOCK, fcntl.LOCK_EX)
+        try:
+            for name in os.listdir(self.cache_dir):
+                path = os.path.join(self.cache_dir, name)
+                if name == LOCK_DIR:
+                    continue
+                if name.endswith(".partial"):
+                    if not _downloader_alive(name):
+                        shutil.rmtree(path, ignore_errors=True)
+                    continue
+                if "@" not in name:
+                    # Cached before versions had their own directories
+                    shutil.rmtree(path, ignore_errors=True)
+                    continue
+                if not os.path.exists(os.path.join(path, MANIFEST_NAME)):
+                    fd = self._try_lock(name, fcntl.LOCK_EX)
+                    if fd is not None:
+                        shutil.rmtree(path, ignore_errors=True)
+                        os.close(fd)
+            found = self._survey()
+        finally:
+            os.close(cache_lock)
+            
+        if found:
+            logger.info(f"Found {len(found)} cached indexes ({self._disk_bytes} bytes) in {self.cache_dir}")
+            
+    async def fetch(self, index_id: str, artifact: Dict[str, Any]) -> str:
+        """
+        Local path of an index, downloading it first if needed
+        
+        The version stays claimed, and so on disk, until release(path) is called.
+        """
+        name = version_name(index_id, artifact.get("created_at"))
+        path = os.path.join(self.cache_dir, name)
+        while True:
+            if name in self._locks:
+                self.hits += 1
+                # The manifest mtime records recency across processes and restarts
+                os.utime(os.path.join(path, MANIFEST_NAME))
+            else:
+                pending = self._loading.get(name)
+                if pending is None:
+                    pending = asyncio.ensure_future(self._fetch(index_id, name, artifact))
+                    self._loading[name] = pending
+                    pending.add_done_callback(lambda _: self._loading.pop(name, None))
+                await asyncio.shield(pending)
+                
+            # The lock may have been dropped by retain while this fetch waited
+            if name in self._locks:
+                self._claims[name] = self._claims.get(name, 0) + 1
+                return path
+                
+    async def _fetch(self, index_id: str, name: str, artifact: Dict[str, Any]):
+        loop = asyncio.get_event_loop()
+        path = os.path.join(self.cache_dir, name)
+        manifest = os.path.join(path, MANIFEST_NAME)
+        
+        while True:
+            fd = await loop.run_in_executor(None, self._lock, name, fcntl.LOCK_SH)
+            try:
+                if os.path.exists(manifest):
+                    self.hits += 1
+                    os.utime(manifest)
+                else:
+                    # Only one process downloads a version; the others wait here and find it complete
+                    await loop.run_in_executor(None, fcntl.flock, fd, fcntl.LOCK_EX)
+                    if os.path.exists(manifest):
+                        self.hits += 1
+                    else:
+                        await self._download(index_id, path, artifact)
+                    await loop.run_in_executor(None, fcntl.flock, fd, fcntl.LOCK_SH)
+            except BaseException:
+                os.close(fd)
+                raise
+            if os.path.exists(manifest):
+                break
+            # Evicted by another process while the lock was being converted
+            os.close(fd)
+        self._locks[name] = fd
+        
+        await loop.run_in_executor(None, self._evict)
+        
+    def _reusable(self, index_id: str, path: str) -> Optional[tuple]:
+        """The newest other complete version of an index, share-locked so it is not deleted while linked from"""
+        prefix = f"{entry_name(index_id)}@"
+        for entry in sorted(self._entries.values(), key=lambda entry: entry.created_at, reverse=True):
+            name = os.path.basename(entry.path)
+            if entry.path == path or not name.startswith(prefix):
+                continue
+            fd = self._try_lock(name, fcntl.LOCK_SH)
+            if fd is None:
+                continue
+            if os.path.exists(os.path.join(entry.path, MANIFEST_NAME)):
+                return fd, entry.path
+            os.close(fd)
+        return None
+        
+    async def _download(self, index_id: str, path: str, artifact: Dict[str, Any]):
+        partial = f"{path}.{os.getpid()}.partial"
+        shutil.rmtree(partial, ignore_errors=True)
+        reusable = self._reusable(index_id, path)
+        
+        start_time = time.time()
+        try:
+            manifest = await download_index(
+                self.storage_client, artifact["prefix"], partial, self.concurrency,
+                reuse_dir=reusable[1] if reusable is not None else None
+            )
+            # Left without a manifest by an older process, and held exclusively here
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(partial, path)
+        except BaseException:
+            self.download_failures += 1
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        finally:
+            if reusable is not None:
+                os.close(reusable[0])
+                
+        self.downloads += 1
+        self.downloaded_bytes += manifest["total_bytes"]
+        logger.info(
+            f"Downloaded index {index_id} ({manifest['total_bytes']} bytes) in {time.time() - start_time:.2f} seconds"
+        )
+        
+    def _evict(self):
+        """Delete versions no process holds until every process's downloads fit in max_bytes together"""
+        cache_lock = self._lock(CACHE_LOCK, fcntl.LOCK_EX)
+        try:
+            found = self._survey()
+            if self._disk_bytes <= self.max_bytes:
+                return
+                
+            newest: Dict[str, float] = {}
+            for entry in found:
+                newest[entry.index_id] = max(newest.get(entry.index_id, entry.created_at), entry.created_at)
+            # Versions superseded by a newer download go first, then least recently used
+            candidates = sorted(found, key=lambda entry: entry.created_at == newest[entry.index_id])
+            
+            for entry in candidates:
+                if self._disk_bytes <= self.max_bytes:
+                    break
+                name = os.path.basename(entry.path)
+                if name in self._locks:
+                    continue
+                fd = self._try_lock(name, fcntl.LOCK_EX)
+                if fd is None:
+                    continue
+                try:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    os.remove(self._lock_path(name))
+                finally:
+                    os.close(fd)
+                self._entries.pop(name, None)
+                self._disk_bytes -= entry.size_bytes
+                self.evictions += 1
+                logger.info(f"Removed cached index {entry.index_id} ({entry.size_bytes} bytes) from disk")
+                
+            if self._disk_bytes > self.max_bytes:
+                logger.warning(f"Index disk cache over budget ({self._disk_bytes} > {self.max_bytes} bytes)")
+        finally:
+            os.close(cache_lock)
+            
+    def _unlock(self, name: str):
+        if name not in self._retained and not self._claims.get(name):
+            fd = self._locks.pop(name, None)
+            if fd is not None:
+                os.close(fd)
+                
+    def release(self, path: str):
+        """Drop a claim taken by fetch; the version stays locked while it is retained"""
+        name = os.path.basename(path)
+        claims = self._claims.get(name, 0) - 1
+        if claims > 0:
+            self._claims[name] = claims
+        else:
+            self._claims.pop(name, None)
+        self._unlock(name)
+        
+    def retain(self, paths: Iterable[str]):
+        """Keep the versions at paths, e.g. every loaded index, locked and let the rest be evicted"""
+        self._retained = {
+            os.path.basename(path) for path in paths
+            if os.path.dirname(path) == self.cache_dir
+        }
+        for name in list(self._locks):
+            self._unlock(name)
+            
+    def peek(self, index_id: str) -> Optional[LocalIndex]:
+        """The newest version of an index found on disk at the last scan"""
+        versions = [entry for entry in self._entries.values() if entry.index_id == index_id]
+        return max(versions, key=lambda entry: entry.created_at) if versions else None
+        
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cache_dir": self.cache_dir,
+            "max_bytes": self.max_bytes,
+            "disk_bytes": self._disk_bytes,
+            "indexes": len(self._entries),
+            "locked_indexes": len(self._locks),
+            "downloading": len(self._loading),
+            "hits": self.hits,
+            "downloads": self.downloads,
+            "download_failures": self.download_failures,
+            "downloaded_bytes": self.downloaded_bytes,
+            "evictions": self.evictions
+        }
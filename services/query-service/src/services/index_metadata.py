@@ -0,0 +1,331 @@
+import asyncio
+import logging
+import numpy as np
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from index_format import open_array
+from state_store import decode_json
+from .cluster_router import ClusterRouter
+
+logger = logging.getLogger(__name__)
+
+class IndexMetadata:
+    def __init__(
+        self,
+        index_id: str,
+        info: Dict[str, Any],
+        clusters: np.ndarray,
+        tombstones: Optional[np.ndarray] = None,
+        centroids: Optional[np.ndarray] = None
+    ):
+        self.index_id = index_id
+        self.info = info
+        # Cluster id per document position; -1 where no assignment is known
+        self.clusters = clusters
+        # Sorted positions of deleted documents, filtered out of results until compaction
+        self.tombstones = tombstones if tombstones is not None else np.empty(0, dtype=np.uint32)
+        # Centroids of the document clusters, when the index has them
+        self.centroids = centroids
+        self._router: Optional[ClusterRouter] = None
+        
+    @property
+    def path(self) -> Optional[str]:
+        """Local index directory, only recorded for indexes not stored in object storage"""
+        return self.info.get("path")
+        
+    @property
+    def artifacts(self) -> Dict[str, Any]:
+        return self.info.get("artifacts", {})
+        
+    @property
+    def shards(self) -> List[Dict[str, Any]]:
+        """Index directory pointers of a sharded index, each with its start and count; empty when unsharded"""
+        return self.artifacts.get("shards", [])
+        
+    @property
+    def version(self) -> Any:
+        return index_version(self.info)
+        
+    @property
+    def router(self) -> Optional[ClusterRouter]:
+        """Cluster routing for this index, built on first use"""
+        if self._router is None and self.centroids is not None:
+            self._router = ClusterRouter(self.centroids, self.clusters)
+        return self._router
+        
+    def clusters_for(self, positions: Sequence[int]) -> np.ndarray:
+        """Look up cluster ids for result positions in O(len(positions))"""
+        positions = np.asarray(positions, dtype=np.int64)
+        labels = np.full(len(positions), -1, dtype=np.int32)
+        valid = (positions >= 0) & (positions < len(self.clusters))
+        labels[valid] = self.clusters[positions[valid]]
+        return labels
+        
+    def is_deleted(self, positions: Sequence[int]) -> np.ndarray:
+        """Mask of result positions whose documents have been deleted"""
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(self.tombstones) == 0:
+            return np.zeros(len(positions), dtype=bool)
+        found = np.minimum(np.searchsorted(self.tombstones, positions), len(self.tombstones) - 1)
+        return self.tombstones[found] == positions
+        
+    def search_limit(self, limit: int) -> int:
+        """How many results to request so that limit remain after dropping deleted documents"""
+        return limit + min(len(self.tombstones), limit)
+
+def index_version(info: Dict[str, Any]) -> Any:
+    """Version of an index record; records written before versioning use their creation time"""
+    return info.get("version", info.get("created_at"))
+
+def clusters_from_json(cluster_data: Dict[str, Any], document_count: int) -> np.ndarray:
+    """Convert a {position: cluster} JSON map into a dense int32 array"""
+    clusters = np.full(max(document_count, len(cluster_data)), -1, dtype=np.int32)
+    if cluster_data:
+        positions = np.fromiter((int(k) for k in cluster_data.keys()), dtype=np.int64, count=len(cluster_data))
+        labels = np.fromiter((int(v) for v in cluster_data.values()), dtype=np.int32, count=len(cluster_data))
+        clusters[positions] = labels
+    return clusters
+
+class IndexMetadataStore:
+    """
+    In-process cache of per-index information and cluster assignments.
+    
+    Each index is fetched from the state store once and its cluster map is
+    held as a dense NumPy array indexed by document position. Cluster
+    assignments are downloaded from object storage into cache_dir and
+    memory-mapped; indexes written before the binary format fall back to the
+    legacy clusters:<id> JSON record. The per-user latest_index pointer is
+    cached for pointer_ttl seconds. index-created and index-updated events
+    update both immediately, but pubsub delivers each event to one replica
+    only, so a cached index is trusted for metadata_ttl seconds and then
+    revalidated against the version of its index:<id> record, which is
+    read in the same round trip as the pointer when both have expired.
+    At most max_indexes indexes are cached, least recently used first out;
+    the downloaded files of an index are deleted when it is forgotten.
+    """
+    
+    def __init__(
+        self,
+        state_store,
+        storage_client=None,
+        cache_dir: str = "/tmp/quickcolbert/clusters",
+        pointer_ttl: float = 60.0,
+        metadata_ttl: float = 10.0,
+        max_indexes: int = 1000
+    ):
+        self.state_store = state_store
+        self.storage_client = storage_client
+        self.cache_dir = cache_dir
+        self.pointer_ttl = pointer_ttl
+        self.metadata_ttl = metadata_ttl
+        self.max_indexes = max(1, max_indexes)
+        
+        self._indexes: "OrderedDict[str, IndexMetadata]" = OrderedDict()
+        # When each cached index is next revalidated against its record
+        self._expires: Dict[str, float] = {}
+        # Local artifact files of each cached index
+        self._files: Dict[str, List[str]] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._latest: Dict[str, tuple] = {}
+        
+        self.hits = 0
+        self.loads = 0
+        self.revalidations = 0
+        self.evictions = 0
+        
+    def _fresh(self, index_id: str) -> bool:
+        return self._expires.get(index_id, 0.0) > time.time()
+        
+    def _forget(self, index_id: str, keep: Sequence[str] = ()):
+        self._indexes.pop(index_id, None)
+        self._expires.pop(index_id, None)
+        # Arrays already handed out stay readable through their memory maps
+        for path in set(self._files.pop(index_id, [])) - set(keep):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+                
+    def _touch(self, metadata: IndexMetadata) -> IndexMetadata:
+        if metadata.index_id in self._indexes:
+            self._indexes.move_to_end(metadata.index_id)
+        return metadata
+        
+    def _revalidate(self, metadata: IndexMetadata, record: Optional[bytes]) -> bool:
+        """Keep a cached index for another metadata_ttl if its record still has the same version"""
+        self.revalidations += 1
+        info = decode_json(record)
+        if info is None or index_version(info) != metadata.version:
+            self._forget(metadata.index_id)
+            return False
+        self._expires[metadata.index_id] = time.time() + self.metadata_ttl
+        return True
+        
+    def _set_latest(self, user_id: str, pointer: Optional[bytes]) -> Optional[str]:
+        if pointer is None:
+            self._latest.pop(user_id, None)
+            return None
+        index_id = pointer.decode("utf-8")
+        self._latest[user_id] = (index_id, time.time() + self.pointer_ttl)
+        return index_id
+        
+    async def latest_index(self, user_id: str) -> Optional[str]:
+        """The user's most recent index id"""
+        cached = self._latest.get(user_id)
+        if cached is not None and cached[1] > time.time():
+            return cached[0]
+        return self._set_latest(user_id, await self.state_store.get(f"latest_index:{user_id}"))
+        
+    def peek(self, index_id: Optional[str], user_id: str) -> Optional[IndexMetadata]:
+        """The index resolve() would return, when that needs no state round trip, else None"""
+        if not index_id:
+            cached = self._latest.get(user_id)
+            if cached is None or cached[1] <= time.time():
+                return None
+            index_id = cached[0]
+        metadata = self._indexes.get(index_id) if self._fresh(index_id) else None
+        return self._touch(metadata) if metadata is not None else None
+        
+    async def resolve(
+        self,
+        index_id: Optional[str],
+        user_id: str,
+        extra_key: Optional[Callable[[IndexMetadata], str]] = None
+    ) -> Tuple[Optional[IndexMetadata], Optional[bytes]]:
+        """
+        The index to search (the user's latest by default) and, with
+        extra_key, the state stored under extra_key(metadata), e.g. a shared
+        cached result, or (None, None) when there is no such index.
+        
+        Once the index is cached this costs one state round trip at most:
+        extra_key is read on its own or, when the user's latest-index pointer
+        or the cached index has expired, together with the pointer and the
+        index record, on the bet that the pointer still points to the index
+        it pointed to before and that the index has not changed.
+        """
+        keys = []
+        if not index_id:
+            cached = self._latest.get(user_id)
+            if cached is not None and cached[1] > time.time():
+                index_id = cached[0]
+            else:
+                keys.append(f"latest_index:{user_id}")
+            previous = self._indexes.get(cached[0]) if cached is not None else None
+        else:
+            previous = self._indexes.get(index_id)
+            
+        record_key = None
+        if previous is not None:
+            if not self._fresh(previous.index_id):
+                record_key = f"index:{previous.index_id}"
+                keys.append(record_key)
+            if keys and extra_key is not None:
+                keys.append(extra_key(previous))
+                
+        if keys:
+            values = await self.state_store.get_many(keys)
+            if not index_id:
+                index_id = self._set_latest(user_id, values[keys[0]])
+                if index_id is None:
+                    return None, None
+            if previous is not None and index_id == previous.index_id:
+                if record_key is None or self._revalidate(previous, values[record_key]):
+                    self.hits += 1
+                    return self._touch(previous), values[keys[-1]] if extra_key is not None else None
+                    
+        metadata = await self.get(index_id)
+        if metadata is None or extra_key is None:
+            return metadata, None
+        return metadata, await self.state_store.get(extra_key(metadata))
+        
+    async def get(self, index_id: str) -> Optional[IndexMetadata]:
+        """Index information and clusters, loaded from the state store once per version"""
+        metadata = self._indexes.get(index_id)
+        if metadata is not None and self._fresh(index_id):
+            self.hits += 1
+            return self._touch(metadata)
+            
+        pending = self._loading.get(index_id)
+        if pending is None:
+            pending = asyncio.ensure_future(self._load(index_id, metadata))
+            self._loading[index_id] = pending
+            pending.add_done_callback(lambda _: self._loading.pop(index_id, None))
+            
+        return await asyncio.shield(pending)
+        
+    async def _load(self, index_id: str, previous: Optional[IndexMetadata] = None) -> Optional[IndexMetadata]:
+        # The legacy cluster record is read in the same round trip, in case the index has one
+        values = await self.state_store.get_many([f"index:{index_id}", f"clusters:{index_id}"])
+        if previous is not None and self._revalidate(previous, values[f"index:{index_id}"]):
+            return previous
+        info = decode_json(values[f"index:{index_id}"])
+        if info is None:
+            self._forget(index_id)
+            return None
+            
+        # Cluster assignments, tombstones and centroids are downloaded in parallel
+        artifacts = info.get("artifacts", {})
+        names = [
+            name for name in ("clusters", "tombstones", "centroids")
+            if artifacts.get(name) is not None and self.storage_client is not None
+        ]
+        paths = [self._artifact_path(artifacts[name]) for name in names]
+        opened = dict(zip(names, await asyncio.gather(*[
+            self._open_artifact(path, artifacts[name]) for path, name in zip(paths, names)
+        ])))
+        clusters, tombstones, centroids = opened.get("clusters"), opened.get("tombstones"), opened.get("centroids")
+        if clusters is None:
+            cluster_data = decode_json(values[f"clusters:{index_id}"]) or {}
+            clusters = clusters_from_json(cluster_data, info.get("document_count", 0))
+            
+        metadata = IndexMetadata(index_id, info, clusters, tombstones, centroids)
+        # Files of a superseded version are not needed again
+        self._forget(index_id, keep=paths)
+        self._indexes[index_id] = metadata
+        self._expires[index_id] = time.time() + self.metadata_ttl
+        self._files[index_id] = paths
+        while len(self._indexes) > self.max_indexes:
+            self._forget(next(iter(self._indexes)))
+            self.evictions += 1
+        self.loads += 1
+        logger.info(f"Loaded metadata for index {index_id} ({len(clusters)} cluster assignments)")
+        return metadata
+        
+    def _artifact_path(self, artifact: Dict[str, Any]) -> str:
+        # Keys are unique per index version, so a cached file is never stale
+        return os.path.join(self.cache_dir, *artifact["key"].split("/"))
+        
+    async def _open_artifact(self, path: str, artifact: Dict[str, Any]) -> np.ndarray:
+        """Download an array container once and memory-map it from the local cache"""
+        if not os.path.exists(path) or os.path.getsize(path) != artifact.get("bytes"):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            await self.storage_client.download(artifact["key"], path)
+        return open_array(path)
+        
+    def on_index_created(self, index_name: Optional[str], user_id: Optional[str]):
+        """Refresh cached state after an index-created event"""
+        if index_name:
+            # The index may have been rebuilt in place; reload it on next use
+            self._forget(index_name)
+            if user_id:
+                self._latest[user_id] = (index_name, time.time() + self.pointer_ttl)
+        elif user_id:
+            self._latest.pop(user_id, None)
+            
+    def on_index_updated(self, index_name: str):
+        """Drop an index whose documents were appended or deleted; it is reloaded on next use"""
+        self._forget(index_name)
+        
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "indexes": len(self._indexes),
+            "cluster_bytes": sum(m.clusters.nbytes for m in self._indexes.values()),
+            "max_indexes": self.max_indexes,
+            "latest_pointers": len(self._latest),
+            "hits": self.hits,
+            "loads": self.loads,
+            "revalidations": self.revalidations,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,392 @@
+import json
+import logging
+import numpy as np
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from document_table import DocumentTable, has_document_table, open_document_table
+from token_store import (
+    build_ivf, decompression_table, has_token_store, open_token_store, pack_residuals, quantization_buckets
+)
+
+logger = logging.getLogger(__name__)
+
+# Tokens scored per block in the centroid-interaction and exact stages, which
+# bounds the (tokens x query length) score matrices held at once
+MAX_BLOCK_TOKENS = 1 << 18
+
+def default_search_params(k: int) -> Dict[str, Any]:
+    """PLAID's defaults: wider candidate generation for larger k"""
+    if k <= 10:
+        return {"ncells": 1, "centroid_score_threshold": 0.5, "ndocs": 256}
+    if k <= 100:
+        return {"ncells": 2, "centroid_score_threshold": 0.45, "ndocs": 1024}
+    return {"ncells": 4, "centroid_score_threshold": 0.4, "ndocs": max(k * 4, 4096)}
+
+def _ranges(starts: np.ndarray, lengths: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Concatenated arange(start, start + length) for each pair, and the pair each element came from"""
+    lengths = lengths.astype(np.int64)
+    owners = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.cumsum(lengths) - lengths
+    positions = np.arange(int(lengths.sum()), dtype=np.int64) - offsets[owners] + starts[owners]
+    return positions, owners
+
+def _segment_max(values: np.ndarray, segments: np.ndarray, n: int) -> np.ndarray:
+    """Column-wise maximum of the rows of each segment; rows are grouped by segment and empty segments are 0"""
+    out = np.zeros((n, values.shape[1]), dtype=np.float32)
+    if len(values) == 0:
+        return out
+    starts = np.flatnonzero(np.r_[True, segments[1:] != segments[:-1]])
+    out[segments[starts]] = np.maximum.reduceat(values, starts, axis=0)
+    return out
+
+def _top(scores: np.ndarray, n: int) -> np.ndarray:
+    """Indices of the n highest scores, best first"""
+    if n < len(scores):
+        candidates = np.argpartition(-scores, n - 1)[:n]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+def doc_offsets(doclens: Sequence[int]) -> np.ndarray:
+    """First token of each document, plus the total token count"""
+    offsets = np.zeros(len(doclens) + 1, dtype=np.int64)
+    np.cumsum(doclens, out=offsets[1:])
+    return offsets
+
+class PlaidIndex:
+    """
+    A ColBERTv2 index held as NumPy arrays and searched with the PLAID pipeline.
+    
+    Every document token is stored as the id of its nearest centroid (codes)
+    plus an nbits-per-dimension quantised residual. Search runs in four stages:
+    
+    1. candidate generation: documents with a token in one of the ncells
+       centroids closest to each query token;
+    2. centroid interaction with pruning: an approximate MaxSim in which each
+       token is represented by its centroid, ignoring centroids whose best
+       score against the query is below centroid_score_threshold; the top
+       ndocs documents survive;
+    3. centroid interaction without pruning over those, keeping ndocs / 4;
+    4. exact MaxSim over the decompressed token embeddings.
+    
+    Codes, residuals and inverted lists may be memory-mapped (see
+    from_store): only the tokens of the documents being scored are read.
+    """
+    
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        codes: np.ndarray,
+        residuals: np.ndarray,
+        doc_offsets: np.ndarray,
+        bucket_weights: np.ndarray,
+        nbits: int,
+        ivf: Optional[Tuple[np.ndarray, np.ndarray]] = None
+    ):
+        if 8 % nbits != 0:
+            raise ValueError(f"Unsupported residual width: {nbits} bits")
+            
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.codes = codes
+        self.residuals = residuals
+        self.doc_offsets = doc_offsets
+        self.bucket_weights = np.asarray(bucket_weights, dtype=np.float32)
+        self.nbits = nbits
+        self.dim = self.centroids.shape[1]
+        
+        if self.doc_offsets[-1] != len(codes):
+            raise ValueError(f"Document lengths cover {self.doc_offsets[-1]} tokens but {len(codes)} are stored")
+            
+        # Residual values of every possible packed byte, so decompression is a single lookup
+        self._residual_values = self.bucket_weights[decompression_table(nbits)]
+        
+        # Inverted lists: the documents holding at least one token of each centroid
+        pids, lengths = ivf if ivf is not None else build_ivf(codes, doc_offsets, len(self.centroids))
+        self.ivf_pids = pids
+        self.ivf_offsets = np.zeros(len(self.centroids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.ivf_offsets[1:])
+        
+    @property
+    def document_count(self) -> int:
+        return len(self.doc_offsets) - 1
+        
+    @classmethod
+    def from_embeddings(
+        cls,
+        embeddings: np.ndarray,
+        doclens: Sequence[int],
+        centroids: np.ndarray,
+        nbits: int = 2
+    ) -> "PlaidIndex":
+        """Compress L2-normalised token embeddings against the given centroids, as ColBERT indexing does"""
+        centroids = np.asarray(centroids, dtype=np.float32)
+        codes = np.concatenate([
+            np.argmax(embeddings[start:start + MAX_BLOCK_TOKENS] @ centroids.T, axis=1)
+            for start in range(0, len(embeddings), MAX_BLOCK_TOKENS)
+        ]).astype(np.int32)
+        residuals = embeddings - centroids[codes]
+        cutoffs, weights = quantization_buckets(residuals, nbits)
+        packed = pack_residuals(residuals, cutoffs, nbits)
+        return cls(centroids, codes, packed, doc_offsets(doclens), weights, nbits)
+        
+    @classmethod
+    def from_store(cls, index_path: str) -> "PlaidIndex":
+        """Open the token store of an index, memory-mapped rather than read into memory"""
+        store = open_token_store(index_path)
+        return cls(
+            store["centroids"],
+            store["codes"],
+            store["residuals"],
+            store["doc_offsets"],
+            store["buckets"],
+            store["nbits"],
+            (store["ivf_pids"], store["ivf_lengths"])
+        )
+        
+    def _doclens(self, pids: np.ndarray) -> np.ndarray:
+        return self.doc_offsets[pids + 1] - self.doc_offsets[pids]
+        
+    def _tokens(self, pids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Token positions of the given documents and, per token, the index of its document in pids"""
+        return _ranges(self.doc_offsets[pids], self._doclens(pids))
+        
+    def _blocks(self, pids: np.ndarray):
+        """Split pids into runs of roughly MAX_BLOCK_TOKENS tokens"""
+        per_block = max(1, int(MAX_BLOCK_TOKENS * len(pids) / max(int(self._doclens(pids).sum()), 1)))
+        for start in range(0, len(pids), per_block):
+            yield start, pids[start:start + per_block]
+            
+    def decompress(self, positions: np.ndarray) -> np.ndarray:
+        """Reconstruct L2-normalised token embeddings from centroid codes and residuals"""
+        embeddings = self._residual_values[self.residuals[positions]].reshape(len(positions), self.dim)
+        embeddings += self.centroids[self.codes[positions]]
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings
+        
+    def candidates(self, centroid_scores: np.ndarray, ncells: int) -> np.ndarray:
+        """Documents with a token in one of the ncells best centroids of any query token"""
+        ncells = min(ncells, len(self.centroids))
+        cells = np.argpartition(-centroid_scores, ncells - 1, axis=0)[:ncells]
+        cells = np.unique(cells)
+        positions, _ = _ranges(self.ivf_offsets[cells], np.diff(self.ivf_offsets)[cells])
+        return np.unique(self.ivf_pids[positions])
+        
+    def centroid_interaction(
+        self,
+        pids: np.ndarray,
+        centroid_scores: np.ndarray,
+        keep: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Approximate MaxSim with every token replaced by its centroid; tokens of centroids not kept are skipped"""
+        scores = np.empty(len(pids), dtype=np.float32)
+        for start, block in self._blocks(pids):
+            positions, owners = self._tokens(block)
+            codes = self.codes[positions]
+            if keep is not None:
+                kept = keep[codes]
+                codes, owners = codes[kept], owners[kept]
+            maxima = _segment_max(centroid_scores[codes], owners, len(block))
+            scores[start:start + len(block)] = maxima.sum(axis=1)
+        return scores
+        
+    def maxsim(self, pids: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Exact late-interaction scores over decompressed token embeddings"""
+        scores = np.empty(len(pids), dtype=np.float32)
+        for start, block in self._blocks(pids):
+            positions, owners = self._tokens(block)
+            similarities = self.decompress(positions) @ query.T
+            scores[start:start + len(block)] = _segment_max(similarities, owners, len(block)).sum(axis=1)
+        return scores
+        
+    def search(
+        self,
+        query: np.ndarray,
+        k: int = 10,
+        ncells: Optional[int] = None,
+        centroid_score_threshold: Optional[float] = None,
+        ndocs: Optional[int] = None,
+        allowed: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k document positions and scores for one (query length, dim) query embedding matrix
+        
+        allowed, a sorted array of document positions, restricts the search to
+        those documents. When fewer than k of them are found through the
+        centroid cells, all of them are scored.
+        """
+        defaults = default_search_params(k)
+        ncells = ncells or defaults["ncells"]
+        threshold = defaults["centroid_score_threshold"] if centroid_score_threshold is None else centroid_score_threshold
+        ndocs = max(ndocs or defaults["ndocs"], k)
+        
+        query = np.ascontiguousarray(query, dtype=np.float32)
+        centroid_scores = self.centroids @ query.T
+        
+        pids = self.candidates(centroid_scores, ncells)
+        if allowed is not None:
+            pids = np.intersect1d(pids, allowed, assume_unique=True)
+            if len(pids) < k:
+                pids = np.asarray(allowed)
+        if len(pids) > ndocs:
+            keep = centroid_scores.max(axis=1) >= threshold
+            approximate = self.centroid_interaction(pids, centroid_scores, keep)
+            pids = pids[_top(approximate, ndocs)]
+        if len(pids) > max(ndocs // 4, k):
+            approximate = self.centroid_interaction(pids, centroid_scores)
+            pids = pids[_top(approximate, max(ndocs // 4, k))]
+            
+        # Reading the survivors in storage order keeps page faults sequential on mapped stores
+        pids = np.sort(pids)
+        scores = self.maxsim(pids, query)
+        order = _top(scores, k)
+        return pids[order], scores[order]
+
+def load_colbert_index(index_path: str) -> PlaidIndex:
+    """Load the centroids, codes, residuals and inverted lists of a ColBERTv2 index directory"""
+    import torch
+    
+    def load(name: str):
+        return torch.load(os.path.join(index_path, name), map_location="cpu")
+        
+    with open(os.path.join(index_path, "metadata.json")) as f:
+        metadata = json.load(f)
+    nbits = metadata.get("config", {}).get("nbits", 2)
+    
+    codes, residuals, doclens = [], [], []
+    for chunk in range(metadata["num_chunks"]):
+        codes.append(load(f"{chunk}.codes.pt").numpy().astype(np.int32))
+        residuals.append(load(f"{chunk}.residuals.pt").numpy())
+        with open(os.path.join(index_path, f"doclens.{chunk}.json")) as f:
+            doclens.extend(json.load(f))
+            
+    _, bucket_weights = load("buckets.pt")
+    ivf = None
+    if os.path.exists(os.path.join(index_path, "ivf.pid.pt")):
+        pids, lengths = load("ivf.pid.pt")
+        ivf = (pids.numpy(), lengths.numpy())
+        
+    index = PlaidIndex(
+        load("centroids.pt").float().numpy(),
+        np.concatenate(codes),
+        np.concatenate(residuals),
+        doc_offsets(doclens),
+        bucket_weights.float().numpy(),
+        nbits,
+        ivf
+    )
+    logger.info(f"Loaded PLAID index from {index_path}: {index.document_count} documents, {len(index.codes)} tokens")
+    return index
+
+# Files of an index with a token store that are read into memory; the rest
+# of the store is mapped and paged in on demand
+RESIDENT_FILES = (
+    "token_store/centroids.qcar",
+    "token_store/ivf_lengths.qcar"
+)
+# Parsed into memory only when the index has no document table
+DOCUMENT_FILES = (
+    "collection.json",
+    "pid_docid_map.json",
+    "docid_metadata_map.json"
+)
+
+def resident_size(index_path: str) -> int:
+    """Memory an index opened from its token store holds outside the page cache"""
+    names = RESIDENT_FILES if has_document_table(index_path) else DOCUMENT_FILES + RESIDENT_FILES
+    return sum(
+        os.path.getsize(os.path.join(index_path, name)) for name in names
+        if os.path.exists(os.path.join(index_path, name))
+    )
+
+class PlaidSearcher:
+    """
+    A loaded index plus what is needed to answer text queries against it.
+    
+    search() returns results in the same shape as RAGPretrainedModel.search so
+    the two are interchangeable behind ColbertSearcher.
+    """
+    
+    def __init__(
+        self,
+        index: PlaidIndex,
+        encode: Callable[[List[str]], np.ndarray],
+        documents: DocumentTable,
+        params: Optional[Dict[str, Any]] = None
+    ):
+        self.index = index
+        self.encode = encode
+        self.documents = documents
+        self.params = {name: value for name, value in (params or {}).items() if value is not None}
+        
+    @classmethod
+    def open(cls, index_path: str, encode: Callable[[List[str]], np.ndarray], params: Optional[Dict[str, Any]] = None) -> "PlaidSearcher":
+        """
+        Load a RAGatouille index directory: the ColBERT index plus its collection and id maps
+        
+        The index's token store and document table are memory-mapped when it
+        has them; otherwise the ColBERT chunks and JSON files are read into memory.
+        """
+        index = PlaidIndex.from_store(index_path) if has_token_store(index_path) else load_colbert_index(index_path)
+        if has_document_table(index_path):
+            return cls(index, encode, open_document_table(index_path), params)
+            
+        def read(name: str, default):
+            path = os.path.join(index_path, name)
+            if not os.path.exists(path):
+                return default
+            with open(path) as f:
+                return json.load(f)
+                
+        contents = read("collection.json", [])
+        pid_map = read("pid_docid_map.json", {})
+        document_ids = [str(pid_map.get(str(pid), pid)) for pid in range(index.document_count)]
+        documents = DocumentTable.from_lists(contents, document_ids, read("docid_metadata_map.json", {}))
+        return cls(index, encode, documents, params)
+        
+    def _result(self, pid: int, score: float, rank: int, offset: int = 0) -> Dict[str, Any]:
+        pid = int(pid)
+        return {
+            "content": self.documents.content(pid),
+            "score": float(score),
+            "rank": rank,
+            "document_id": self.documents.document_id(pid),
+            "passage_id": pid + offset,
+            "document_metadata": self.documents.metadata(pid)
+        }
+        
+    def search_embeddings(
+        self,
+        embeddings: np.ndarray,
+        k: int = 10,
+        router=None,
+        routes: Optional[List[Optional[Dict[str, Any]]]] = None,
+        offset: int = 0,
+        **params
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Search a batch of (queries, query length, dim) embeddings
+        
+        With a ClusterRouter, routes[i] restricts query i to the documents of
+        its nearest or selected clusters (see ClusterRouter.allowed). offset is
+        the position of this index's first document when it is one shard of a
+        larger index; routing and result passage_ids use whole-index positions.
+        """
+        params = {**self.params, **{name: value for name, value in params.items() if value is not None}}
+        results = []
+        for i, query in enumerate(embeddings):
+            allowed = router.allowed(query, routes[i]) if router is not None and routes else None
+            if allowed is not None:
+                allowed = allowed[(allowed >= offset) & (allowed < offset + self.index.document_count)] - offset
+                if len(allowed) == 0:
+                    results.append([])
+                    continue
+            pids, scores = self.index.search(query, k, allowed=allowed, **params)
+            results.append([self._result(pid, score, rank + 1, offset) for rank, (pid, score) in enumerate(zip(pids, scores))])
+        return results
+        
+    def search(self, query, k: int = 10, **params):
+        """Search one query or a list of queries, like RAGPretrainedModel.search"""
+        queries = [query] if isinstance(query, str) else list(query)
+        results = self.search_embeddings(self.encode(queries), k, **params)
+        # RAGPretrainedModel returns a flat result list for a single query
+        return results[0] if len(results) == 1 else results
\ No newline at end of file
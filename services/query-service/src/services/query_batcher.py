@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from instrumentation import observe_stage
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the batch size histogram buckets
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+class QueueFullError(RuntimeError):
+    """Raised when a query arrives while the scheduler queue is at capacity"""
+
+class PendingQuery:
+    def __init__(self, index_id: str, query: str, limit: int, router, route: Optional[Dict[str, Any]], handle=None):
+        self.index_id = index_id
+        self.query = query
+        self.limit = limit
+        self.router = router
+        self.route = route
+        # The loaded index to search; it stays searchable if evicted from the cache meanwhile
+        self.handle = handle
+        self.future = asyncio.get_event_loop().create_future()
+        self.enqueued_at = time.time()
+
+class QueryBatcher:
+    """
+    Dynamic micro-batching of single search queries.
+    
+    Queries wait up to max_wait seconds, or until max_batch_size have arrived,
+    and the queries for each index are then encoded and scored together by
+    ColbertSearcher.search_batch. At most concurrency batches run at once;
+    while they do, new queries keep accumulating, so batches grow with load.
+    At most max_queue queries may wait; beyond that submit raises
+    QueueFullError so callers shed load instead of queueing without bound.
+    """
+    
+    def __init__(
+        self,
+        searcher,
+        max_batch_size: int = 32,
+        max_wait: float = 0.002,
+        max_queue: int = 1024,
+        concurrency: int = 1
+    ):
+        self.searcher = searcher
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.concurrency = concurrency
+        
+        self._pending: Deque[PendingQuery] = deque()
+        self._ready: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._in_flight = 0
+        
+        self.submitted = 0
+        self.rejected = 0
+        self.batches = 0
+        self.batched_queries = 0
+        self.largest_batch = 0
+        self.failed_batches = 0
+        self.total_queue_wait = 0.0
+        self.total_batch_time = 0.0
+        self.batch_sizes = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+        
+    def _start(self):
+        # Created on first use so they bind to the running event loop
+        self._ready = asyncio.Event()
+        self._full = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._task = asyncio.ensure_future(self._run())
+        
+    async def submit(
+        self,
+        index_id: str,
+        query: str,
+        limit: int,
+        router=None,
+        route: Optional[Dict[str, Any]] = None,
+        handle=None
+    ) -> List[Dict[str, Any]]:
+        """
+        Queue a query for the next batch against index_id and wait for its results
+        
+        handle is the index as ColbertSearcher.load_index returned it; without
+        one, the index resident under index_id when the batch runs is searched.
+        """
+        if len(self._pending) >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(f"Search queue is full ({self.max_queue} queries waiting)")
+        if self._task is None:
+            self._start()
+            
+        pending = PendingQuery(index_id, query, limit, router, route, handle)
+        self._pending.append(pending)
+        self.submitted += 1
+        self._ready.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._full.set()
+            
+        return await pending.future
+        
+    def _take_batch(self) -> List[PendingQuery]:
+        batch = []
+        while self._pending and len(batch) < self.max_batch_size:
+            pending = self._pending.popleft()
+            # Requests that were cancelled while queued are dropped
+            if not pending.future.done():
+                batch.append(pending)
+                
+        if not self._pending:
+            self._ready.clear()
+        if len(self._pending) < self.max_batch_size:
+            self._full.clear()
+        return batch
+        
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.max_wait)
+            except asyncio.TimeoutError:
+                pass
+                
+            # Backpressure: wait for a free slot, letting the queue fill meanwhile
+            await self._slots.acquire()
+            batch = self._take_batch()
+            if not batch:
+                self._slots.release()
+                continue
+            asyncio.ensure_future(self._dispatch(batch))
+            
+    async def _dispatch(self, batch: List[PendingQuery]):
+        self._in_flight += 1
+        start_time = time.time()
+        self._record(batch, start_time)
+        
+        try:
+            # Queries submitted across a reload of their index search the version they loaded
+            groups: Dict[Tuple[str, int], List[PendingQuery]] = {}
+            for pending in batch:
+                groups.setdefault((pending.index_id, id(pending.handle)), []).append(pending)
+                
+            for (index_id, _), group in groups.items():
+                router = next((pending.router for pending in group if pending.router is not None), None)
+                try:
+                    results = await self.searcher.search_batch(
+                        [pending.query for pending in group],
+                        max(pending.limit for pending in group),
+                        index_id,
+                        router,
+                        [pending.route for pending in group],
+                        group[0].handle
+                    )
+                except Exception as e:
+                    self.failed_batches += 1
+                    logger.error(f"Search batch of {len(group)} queries on {index_id} failed: {str(e)}")
+                    for pending in group:
+                        if not pending.future.done():
+                            pending.future.set_exception(e)
+                    continue
+                    
+                for pending, query_results in zip(group, results):
+                    if not pending.future.done():
+                        pending.future.set_result(query_results[:pending.limit])
+        finally:
+            self.total_batch_time += time.time() - start_time
+            self._in_flight -= 1
+            self._slots.release()
+            
+    def _record(self, batch: List[PendingQuery], start_time: float):
+        self.batches += 1
+        self.batched_queries += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        for pending in batch:
+            self.total_queue_wait += start_time - pending.enqueued_at
+            observe_stage("queue_wait", start_time - pending.enqueued_at)
+        bucket = next((i for i, bound in enumerate(BATCH_SIZE_BUCKETS) if len(batch) <= bound), len(BATCH_SIZE_BUCKETS))
+        self.batch_sizes[bucket] += 1
+        
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        while self._pending:
+            pending = self._pending.popleft()
+            if not pending.future.done():
+                pending.future.cancel()
+                
+    def stats(self) -> Dict[str, Any]:
+        labels = [str(bound) for bound in BATCH_SIZE_BUCKETS] + [f">{BATCH_SIZE_BUCKETS[-1]}"]
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait": self.max_wait,
+            "max_queue": self.max_queue,
+            "concurrency": self.concurrency,
+            "queue_depth": len(self._pending),
+            "in_flight_batches": self._in_flight,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "avg_batch_size": self.batched_queries / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "batch_size_histogram": dict(zip(labels, self.batch_sizes)),
+            "avg_queue_wait": self.total_queue_wait / self.batched_queries if self.batched_queries else 0.0,
+            "avg_batch_time": self.total_batch_time / self.batches if self.batches else 0.0
+        }
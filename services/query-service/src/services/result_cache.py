@@ -0,0 +1,197 @@
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+from state_store import decode_json
+
+logger = logging.getLogger(__name__)
+
+def normalize_query(query: str) -> str:
+    """Case-fold and collapse whitespace; the ColBERTv2 tokenizer is uncased"""
+    return " ".join(query.casefold().split())
+
+class ResultCache:
+    """
+    Two-tier cache of formatted search results.
+    
+    Both tiers are keyed by the resolved index id and version, so an entry
+    can never outlive the index version it was computed from; callers look
+    the in-process tier up with the metadata IndexMetadataStore.peek() holds,
+    which costs no state round trip. Entries of older versions are dropped
+    by invalidate_index() when an index changes, or age out. The optional
+    shared tier lives in the state store and only expires through its TTL.
+    options distinguishes results of the same query searched differently,
+    e.g. routed to a subset of clusters.
+    """
+    
+    def __init__(
+        self,
+        state_store=None,
+        max_entries: int = 10000,
+        ttl: float = 300.0,
+        shared_ttl: int = 3600
+    ):
+        self.state_store = state_store
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared_ttl = shared_ttl
+        
+        self._entries: "OrderedDict[Tuple[str, Any, str, int, str], Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        self._indexes: Dict[str, Set[Tuple[str, Any, str, int, str]]] = {}
+        
+        self.memory_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        
+    def get(self, index_id: str, version: Any, query: str, limit: int, options: str = "") -> Optional[List[Dict[str, Any]]]:
+        """Look up the in-process tier for a resolved index version"""
+        key = (index_id, version, normalize_query(query), limit, options)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+            
+        expires_at, results = entry
+        if expires_at < time.time():
+            self._remove(key)
+            return None
+            
+        self._entries.move_to_end(key)
+        self.memory_hits += 1
+        return results
+        
+    def put(
+        self,
+        index_id: str,
+        version: Any,
+        query: str,
+        limit: int,
+        results: List[Dict[str, Any]],
+        options: str = ""
+    ):
+        key = (index_id, version, normalize_query(query), limit, options)
+        if key in self._entries:
+            self._remove(key)
+            
+        self._entries[key] = (time.time() + self.ttl, results)
+        self._indexes.setdefault(index_id, set()).add(key)
+        
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+            
+    def _remove(self, key: Tuple[str, Any, str, int, str]):
+        self._entries.pop(key, None)
+        keys = self._indexes.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._indexes[key[0]]
+                
+    @property
+    def shared(self) -> bool:
+        return self.state_store is not None
+        
+    def shared_key(self, index_id: str, version: Any, query: str, limit: int, options: str = "") -> str:
+        """State store key of a shared entry, e.g. to read it together with other state"""
+        # Unrouted searches keep the keys they had before options existed
+        scoped = f"{options}\x00{normalize_query(query)}" if options else normalize_query(query)
+        digest = hashlib.sha1(f"{version}\x00{limit}\x00{scoped}".encode("utf-8")).hexdigest()
+        return f"results:{index_id}:{digest}"
+        
+    def shared_result(self, data: Optional[bytes]) -> Optional[List[Dict[str, Any]]]:
+        """Decode a shared entry read from the state store, counting it as a hit"""
+        if not data:
+            return None
+        self.shared_hits += 1
+        return decode_json(data)
+        
+    async def get_shared(
+        self,
+        index_id: str,
+        version: Any,
+        query: str,
+        limit: int,
+        options: str = ""
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Look up the shared state-store tier for a resolved index version"""
+        return (await self.get_shared_many(index_id, version, [(query, limit, options)]))[0]
+        
+    async def get_shared_many(
+        self,
+        index_id: str,
+        version: Any,
+        lookups: Sequence[Tuple[str, int, str]]
+    ) -> List[Optional[List[Dict[str, Any]]]]:
+        """Look up (query, limit, options) searches of one index version in the shared tier, in one round trip"""
+        if self.state_store is None or not lookups:
+            return [None] * len(lookups)
+            
+        keys = [self.shared_key(index_id, version, *lookup) for lookup in lookups]
+        try:
+            values = await self.state_store.get_many(keys)
+        except Exception as e:
+            logger.warning(f"Shared result cache lookup failed: {str(e)}")
+            return [None] * len(lookups)
+        return [self.shared_result(values[key]) for key in keys]
+        
+    async def put_shared(
+        self,
+        index_id: str,
+        version: Any,
+        query: str,
+        limit: int,
+        results: List[Dict[str, Any]],
+        options: str = ""
+    ):
+        await self.put_shared_many(index_id, version, [(query, limit, options, results)])
+        
+    async def put_shared_many(
+        self,
+        index_id: str,
+        version: Any,
+        entries: Sequence[Tuple[str, int, str, List[Dict[str, Any]]]]
+    ):
+        """Store (query, limit, options, results) entries of one index version, in one round trip"""
+        if self.state_store is None or not entries:
+            return
+            
+        try:
+            await self.state_store.save_many(
+                {self.shared_key(index_id, version, query, limit, options): results for query, limit, options, results in entries},
+                ttl=self.shared_ttl
+            )
+        except Exception as e:
+            logger.warning(f"Shared result cache write failed: {str(e)}")
+            
+    def record_miss(self):
+        self.misses += 1
+        
+    def invalidate_index(self, index_id: str) -> int:
+        """Drop every in-process entry cached for any version of an index"""
+        keys = self._indexes.pop(index_id, set())
+        for key in keys:
+            self._entries.pop(key, None)
+            
+        if keys:
+            self.invalidations += 1
+            logger.info(f"Invalidated {len(keys)} cached results for {index_id}")
+        return len(keys)
+        
+    def stats(self) -> Dict[str, Any]:
+        hits = self.memory_hits + self.shared_hits
+        lookups = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "shared_tier": self.shared,
+            "memory_hits": self.memory_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
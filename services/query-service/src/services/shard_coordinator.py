@@ -0,0 +1,180 @@
+import asyncio
+import base64
+import hashlib
+import heapq
+import httpx
+import itertools
+import logging
+import numpy as np
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from index_format import encode_array
+from instrumentation import propagate_trace
+
+logger = logging.getLogger(__name__)
+
+def shard_id(index_id: str, shard: int) -> str:
+    """Cache key of one shard of a sharded index"""
+    return f"{index_id}/shards/{shard}"
+
+class ShardCoordinator:
+    """
+    Scatter-gather search over the shards of a sharded index.
+    
+    Every shard is owned by replicas of the query service peers, chosen by
+    rendezvous hashing of the shard id, so all coordinators agree on the
+    owners and each shard is only loaded by them. Without peers this process
+    owns every shard. Queries are encoded once here and sent to the first
+    owner of each shard in parallel; an owner that fails is retried on the
+    next one. Shards that have not answered within timeout seconds are left
+    out and reported, and the per-shard top-k lists are merged with a heap.
+    """
+    
+    def __init__(
+        self,
+        searcher,
+        peers: Sequence[str] = (),
+        self_url: Optional[str] = None,
+        timeout: float = 2.0,
+        replicas: int = 2
+    ):
+        self.searcher = searcher
+        self.peers = [peer.rstrip("/") for peer in peers]
+        self.self_url = self_url.rstrip("/") if self_url else None
+        self.timeout = timeout
+        self.replicas = max(1, replicas)
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        
+        self.searches = 0
+        self.partial_searches = 0
+        self.local_requests = 0
+        self.remote_requests = 0
+        self.shard_failures = 0
+        self.shard_timeouts = 0
+        
+    def owners(self, shard: str) -> List[Optional[str]]:
+        """Peers that serve a shard, preferred first; None stands for this process"""
+        if not self.peers:
+            return [None]
+        ranked = sorted(
+            self.peers,
+            key=lambda peer: hashlib.sha1(f"{shard}@{peer}".encode("utf-8")).digest(),
+            reverse=True
+        )
+        return [None if peer == self.self_url else peer for peer in ranked[:self.replicas]]
+        
+    def _client(self, peer: str) -> httpx.AsyncClient:
+        client = self._clients.get(peer)
+        if client is None:
+            client = httpx.AsyncClient(base_url=peer, timeout=self.timeout, event_hooks={"request": [propagate_trace]})
+            self._clients[peer] = client
+        return client
+        
+    async def search(
+        self,
+        metadata,
+        queries: List[str],
+        limit: int,
+        router=None,
+        routes: Optional[List[Optional[Dict[str, Any]]]] = None
+    ) -> Tuple[List[List[Dict[str, Any]]], List[int]]:
+        """Top-limit results of each query over every shard of an index, and the shards left out"""
+        self.searches += 1
+        # Only the PLAID engine can search pre-encoded queries
+        embeddings = await self.searcher.encode(queries) if self.searcher.engine == "plaid" else None
+        
+        deadline = asyncio.get_event_loop().time() + self.timeout
+        answers = await asyncio.gather(*[
+            self._search_shard(metadata, number, shard, queries, embeddings, limit, router, routes, deadline)
+            for number, shard in enumerate(metadata.shards)
+        ])
+        missing = [number for number, answer in enumerate(answers) if answer is None]
+        if missing:
+            self.partial_searches += 1
+            logger.warning(f"Search on {metadata.index_id} is missing shards {missing}")
+            
+        merged = []
+        for position in range(len(queries)):
+            # Each shard's results are sorted by score already
+            ranked = heapq.merge(*[answer[position] for answer in answers if answer is not None], key=lambda result: -result["score"])
+            merged.append([dict(result, rank=rank + 1) for rank, result in enumerate(itertools.islice(ranked, limit))])
+        return merged, missing
+        
+    async def _search_shard(
+        self,
+        metadata,
+        number: int,
+        shard: Dict[str, Any],
+        queries: List[str],
+        embeddings: Optional[np.ndarray],
+        limit: int,
+        router,
+        routes: Optional[List[Optional[Dict[str, Any]]]],
+        deadline: float
+    ) -> Optional[List[List[Dict[str, Any]]]]:
+        loop = asyncio.get_event_loop()
+        key = shard_id(metadata.index_id, number)
+        
+        for owner in self.owners(key):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                if owner is None:
+                    self.local_requests += 1
+                    search = self.searcher.search_shard(metadata.index_id, number, shard, queries, embeddings, limit, router, routes)
+                else:
+                    self.remote_requests += 1
+                    search = self._ask(owner, metadata, number, queries, embeddings, limit, routes)
+                return await asyncio.wait_for(search, remaining)
+            except asyncio.TimeoutError:
+                self.shard_timeouts += 1
+                logger.warning(f"Shard {key} timed out on {owner or 'this process'}")
+                break
+            except Exception as e:
+                self.shard_failures += 1
+                logger.warning(f"Shard {key} failed on {owner or 'this process'}: {str(e)}")
+        return None
+        
+    async def _ask(
+        self,
+        owner: str,
+        metadata,
+        number: int,
+        queries: List[str],
+        embeddings: Optional[np.ndarray],
+        limit: int,
+        routes: Optional[List[Optional[Dict[str, Any]]]]
+    ) -> List[List[Dict[str, Any]]]:
+        """Search one shard on a peer, which routes with its own copy of the index metadata"""
+        payload = {
+            "index_id": metadata.index_id,
+            "version": metadata.version,
+            "shard": number,
+            "queries": queries,
+            "limit": limit,
+            "routes": routes
+        }
+        if embeddings is not None:
+            payload["embeddings"] = base64.b64encode(encode_array(embeddings.astype(np.float16))).decode("ascii")
+            
+        response = await self._client(owner).post("/shards/search", json=payload)
+        response.raise_for_status()
+        return response.json()["results"]
+        
+    async def close(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+        
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "peers": len(self.peers),
+            "replicas": self.replicas,
+            "timeout": self.timeout,
+            "searches": self.searches,
+            "partial_searches": self.partial_searches,
+            "local_requests": self.local_requests,
+            "remote_requests": self.remote_requests,
+            "shard_failures": self.shard_failures,
+            "shard_timeouts": self.shard_timeouts
+        }
@@ -1,15 +1,21 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Header, Query, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+import asyncio
+import base64
 import logging
-from typing import List, Dict, Any, Optional
+import re
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
 import json
-from .services.r2_storage import R2Storage
+from instrumentation import instrument
+from .services.r2_storage import ObjectNotFound, R2Storage
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Storage Service", description="Document and index storage with Cloudflare R2")
+instrument(app, "storage-service")
 
 # Initialize R2 storage service
 r2_storage = R2Storage()
@@ -18,9 +24,45 @@ class ObjectMetadata(BaseModel):
     key: str
     size: int
     last_modified: str
+    etag: Optional[str] = None
     metadata: Dict[str, str] = {}
 
-@app.post("/objects/{key}")
+class ObjectListing(BaseModel):
+    objects: List[ObjectMetadata]
+    prefixes: List[str] = []
+    next_continuation_token: Optional[str] = None
+
+class BatchGetRequest(BaseModel):
+    keys: List[str]
+
+class BatchDeleteRequest(BaseModel):
+    keys: List[str] = []
+    prefix: Optional[str] = None
+
+class CopyPrefixRequest(BaseModel):
+    source_prefix: str
+    target_prefix: str
+
+# Limits for batch requests
+MAX_LIST_KEYS = 1000
+MAX_BATCH_GET_KEYS = 1000
+
+def parse_metadata(metadata: Optional[str]) -> Dict[str, str]:
+    if not metadata:
+        return {}
+    try:
+        return json.loads(metadata)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid metadata format")
+
+async def iter_upload(file: UploadFile) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await file.read(r2_storage.part_size)
+        if not chunk:
+            return
+        yield chunk
+
+@app.post("/objects/{key:path}")
 async def store_object(
     key: str,
     file: UploadFile = File(...),
@@ -29,41 +71,163 @@ async def store_object(
     """Store an object in Cloudflare R2"""
     logger.info(f"Received request to store object with key: {key}")
     
-    content = await file.read()
-    meta = {}
+    meta = parse_metadata(metadata)
+    size = await r2_storage.store_stream(key, iter_upload(file), meta)
     
-    if metadata:
-        try:
-            meta = json.loads(metadata)
-        except json.JSONDecodeError:
-            raise HTTPException(status_code=400, detail="Invalid metadata format")
+    return {"key": key, "size": size, "metadata": meta}
+
+@app.put("/objects/{key:path}")
+async def put_object(
+    key: str,
+    request: Request,
+    x_object_metadata: Optional[str] = Header(None)
+):
+    """Store the raw request body as an object, streaming it to R2 as it arrives"""
+    logger.info(f"Received streaming upload for object with key: {key}")
     
-    await r2_storage.store_object(key, content, meta)
+    meta = parse_metadata(x_object_metadata)
+    size = await r2_storage.store_stream(key, request.stream(), meta)
     
-    return {"key": key, "size": len(content), "metadata": meta}
+    return {"key": key, "size": size, "metadata": meta}
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single 'bytes=start-end' range into inclusive offsets"""
+    if not range_header:
+        return None
+        
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+    if match is None or match.group(1) == match.group(2) == "":
+        raise HTTPException(status_code=416, detail="Unsupported range")
+        
+    if match.group(1) == "":
+        # Suffix range: the last N bytes
+        start, end = max(size - int(match.group(2)), 0), size - 1
+    else:
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else size - 1
+        
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable")
+    return start, min(end, size - 1)
 
-@app.get("/objects/{key}")
-async def get_object(key: str):
-    """Retrieve an object from Cloudflare R2"""
+@app.get("/objects/{key:path}")
+async def get_object(key: str, range: Optional[str] = Header(None)):
+    """Stream an object from Cloudflare R2, honouring a single byte range"""
     logger.info(f"Received request to retrieve object with key: {key}")
     
     try:
-        data = await r2_storage.get_object(key)
-        return data
-    except Exception as e:
-        raise HTTPException(status_code=404, detail=f"Object not found: {str(e)}")
+        info = await r2_storage.head_object(key)
+    except ObjectNotFound:
+        raise HTTPException(status_code=404, detail=f"Object not found: {key}")
+        
+    size = info["size"]
+    byte_range = parse_range(range, size)
+    start, end = byte_range or (0, size - 1)
+    
+    headers = {
+        "Content-Length": str(end - start + 1),
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{info["etag"]}"'
+    }
+    if byte_range is not None:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        
+    return StreamingResponse(
+        r2_storage.iter_object(key, start, end, size),
+        status_code=206 if byte_range is not None else 200,
+        media_type="application/octet-stream",
+        headers=headers
+    )
 
 @app.get("/objects")
-async def list_objects(prefix: str = ""):
-    """List objects in Cloudflare R2 with a given prefix"""
+async def list_objects(
+    prefix: str = "",
+    continuation_token: Optional[str] = None,
+    max_keys: int = Query(MAX_LIST_KEYS, gt=0, le=MAX_LIST_KEYS),
+    delimiter: Optional[str] = None,
+    stream: bool = False
+):
+    """
+    List objects in Cloudflare R2 with a given prefix
+    
+    Returns one page and the token for the next one. With stream=true, every
+    matching object is streamed as NDJSON instead, listed concurrently per
+    sub-prefix.
+    """
     logger.info(f"Received request to list objects with prefix: {prefix}")
     
+    if stream:
+        async def lines():
+            async for obj in r2_storage.iter_objects(prefix):
+                yield json.dumps(obj) + "\n"
+                
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+        
     try:
-        objects = await r2_storage.list_objects(prefix)
-        return {"objects": objects}
+        page = await r2_storage.list_page(prefix, continuation_token, max_keys, delimiter)
+        return ObjectListing(**page)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error listing objects: {str(e)}")
 
+@app.post("/batch/get")
+async def batch_get(request: BatchGetRequest):
+    """
+    Fetch many small objects in one request
+    
+    Objects are streamed back as NDJSON lines with base64 data, in completion
+    order; missing keys are reported with an error.
+    """
+    if len(request.keys) > MAX_BATCH_GET_KEYS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_GET_KEYS} keys per batch")
+        
+    slots = asyncio.Semaphore(r2_storage.max_concurrency)
+    
+    async def fetch(key: str) -> Dict[str, Any]:
+        async with slots:
+            try:
+                data = await r2_storage.get_object(key)
+            except ObjectNotFound:
+                return {"key": key, "error": "not found"}
+        return {"key": key, "size": len(data), "data": base64.b64encode(data).decode("ascii")}
+        
+    async def lines():
+        for result in asyncio.as_completed([fetch(key) for key in request.keys]):
+            yield json.dumps(await result) + "\n"
+            
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.post("/batch/delete")
+async def batch_delete(request: BatchDeleteRequest):
+    """Delete the given keys, and every object under prefix if one is given"""
+    if not request.keys and not request.prefix:
+        raise HTTPException(status_code=400, detail="Either keys or prefix is required")
+        
+    keys = list(request.keys)
+    if request.prefix:
+        keys.extend([obj["key"] async for obj in r2_storage.iter_objects(request.prefix)])
+        
+    try:
+        return await r2_storage.delete_objects(keys)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting objects: {str(e)}")
+
+@app.post("/batch/copy-prefix")
+async def copy_prefix(request: CopyPrefixRequest):
+    """Copy every object under source_prefix to target_prefix inside the bucket"""
+    # Overlapping prefixes would copy objects onto themselves, or copy the copies again
+    source, target = request.source_prefix, request.target_prefix
+    if source.startswith(target) or target.startswith(source):
+        raise HTTPException(status_code=400, detail="Source and target prefixes must not overlap")
+        
+    try:
+        return await r2_storage.copy_prefix(request.source_prefix, request.target_prefix)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error copying objects: {str(e)}")
+
+@app.on_event("shutdown")
+async def shutdown():
+    r2_storage.close()
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
@@ -1,17 +1,39 @@
+import asyncio
 import boto3
 import logging
 import os
-from typing import Optional, List, Dict, Any
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, AsyncIterator, Callable
 import json
+from instrumentation import stage
 
 logger = logging.getLogger(__name__)
 
+class ObjectNotFound(KeyError):
+    """Raised when a key does not exist in the bucket"""
+
+def _is_missing(error: ClientError) -> bool:
+    return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
 class R2Storage:
     def __init__(self):
         self.bucket_name = os.environ.get("CLOUDFLARE_R2_BUCKET")
         self.account_id = os.environ.get("CLOUDFLARE_R2_ACCOUNT_ID")
         self.access_key = os.environ.get("CLOUDFLARE_R2_ACCESS_KEY")
         self.secret_key = os.environ.get("CLOUDFLARE_R2_SECRET_KEY")
+        # Overrides the R2 endpoint, e.g. to point at a local S3-compatible server
+        self.endpoint_url = os.environ.get("CLOUDFLARE_R2_ENDPOINT")
+        
+        # Multipart uploads and ranged downloads move part_size bytes per request,
+        # with at most max_concurrency requests in flight per transfer
+        self.part_size = int(os.environ.get("R2_PART_SIZE", str(16 * 1024 * 1024)))
+        self.max_concurrency = int(os.environ.get("R2_TRANSFER_CONCURRENCY", "8"))
+        
+        # boto3 is blocking, so every call runs on this pool instead of the event loop
+        self.max_workers = int(os.environ.get("R2_MAX_WORKERS", "32"))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="r2")
         
         self.client = self._initialize_client()
         
@@ -19,21 +41,30 @@ class R2Storage:
         """Initialize the S3 client for Cloudflare R2"""
         logger.info("Initializing Cloudflare R2 client")
         
-        endpoint_url = f"https://{self.account_id}.r2.cloudflarestorage.com"
+        endpoint_url = self.endpoint_url or f"https://{self.account_id}.r2.cloudflarestorage.com"
         
         return boto3.client(
             's3',
             endpoint_url=endpoint_url,
             aws_access_key_id=self.access_key,
-            aws_secret_access_key=self.secret_key
+            aws_secret_access_key=self.secret_key,
+            # One pooled connection per worker thread
+            config=Config(max_pool_connections=self.max_workers)
         )
         
+    async def _run(self, fn: Callable, **kwargs) -> Any:
+        loop = asyncio.get_event_loop()
+        # Timed as one stage per S3 operation, including the wait for a free worker
+        with stage(f"r2_{fn.__name__}"):
+            return await loop.run_in_executor(self.executor, lambda: fn(**kwargs))
+            
     async def store_object(self, key: str, data: bytes, metadata: Optional[Dict[str, str]] = None):
         """Store an object in R2"""
         logger.info(f"Storing object with key: {key}")
         
         try:
-            self.client.put_object(
+            await self._run(
+                self.client.put_object,
                 Bucket=self.bucket_name,
                 Key=key,
                 Body=data,
@@ -45,38 +76,322 @@ class R2Storage:
             logger.error(f"Error storing object with key {key}: {str(e)}")
             raise
             
+    async def store_stream(
+        self,
+        key: str,
+        chunks: AsyncIterator[bytes],
+        metadata: Optional[Dict[str, str]] = None
+    ) -> int:
+        """
+        Store an object from an async stream of chunks and return its size.
+        
+        Objects smaller than one part are written with a single put. Larger ones
+        use a multipart upload with up to max_concurrency parts in flight, so
+        memory use is bounded by max_concurrency * part_size.
+        """
+        buffer = bytearray()
+        size = 0
+        upload_id = None
+        parts: Dict[int, str] = {}
+        tasks: List[asyncio.Future] = []
+        slots = asyncio.Semaphore(self.max_concurrency)
+        
+        async def upload_part(part_number: int, body: bytes):
+            try:
+                response = await self._run(
+                    self.client.upload_part,
+                    Bucket=self.bucket_name,
+                    Key=key,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=body
+                )
+                parts[part_number] = response["ETag"]
+            finally:
+                slots.release()
+                
+        async def flush(body: bytes):
+            nonlocal upload_id
+            if upload_id is None:
+                response = await self._run(
+                    self.client.create_multipart_upload,
+                    Bucket=self.bucket_name,
+                    Key=key,
+                    Metadata=metadata or {}
+                )
+                upload_id = response["UploadId"]
+                
+            await slots.acquire()
+            tasks.append(asyncio.ensure_future(upload_part(len(tasks) + 1, body)))
+            
+        try:
+            async for chunk in chunks:
+                buffer.extend(chunk)
+                size += len(chunk)
+                while len(buffer) >= self.part_size:
+                    await flush(bytes(buffer[:self.part_size]))
+                    del buffer[:self.part_size]
+                # Surface a failed part as soon as possible
+                for task in tasks:
+                    if task.done() and task.exception() is not None:
+                        raise task.exception()
+                        
+            if upload_id is None:
+                await self.store_object(key, bytes(buffer), metadata)
+                return size
+                
+            if buffer:
+                await flush(bytes(buffer))
+            await asyncio.gather(*tasks)
+            
+            await self._run(
+                self.client.complete_multipart_upload,
+                Bucket=self.bucket_name,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": [
+                    {"PartNumber": number, "ETag": parts[number]} for number in sorted(parts)
+                ]}
+            )
+            logger.info(f"Successfully stored object with key: {key} ({size} bytes in {len(parts)} parts)")
+            return size
+        except BaseException as e:
+            for task in tasks:
+                task.cancel()
+            if upload_id is not None:
+                logger.error(f"Aborting multipart upload for key {key}: {str(e)}")
+                await self._run(
+                    self.client.abort_multipart_upload,
+                    Bucket=self.bucket_name,
+                    Key=key,
+                    UploadId=upload_id
+                )
+            raise
+            
+    async def head_object(self, key: str) -> Dict[str, Any]:
+        """Size, etag, last-modified time and user metadata of an object"""
+        try:
+            response = await self._run(self.client.head_object, Bucket=self.bucket_name, Key=key)
+        except ClientError as e:
+            if _is_missing(e):
+                raise ObjectNotFound(key)
+            raise
+            
+        return {
+            "key": key,
+            "size": response["ContentLength"],
+            "etag": response.get("ETag", "").strip('"'),
+            "last_modified": response["LastModified"].isoformat(),
+            "metadata": response.get("Metadata", {})
+        }
+        
     async def get_object(self, key: str):
         """Retrieve an object from R2"""
         logger.info(f"Retrieving object with key: {key}")
         
         try:
-            response = self.client.get_object(
-                Bucket=self.bucket_name,
-                Key=key
-            )
-            data = response['Body'].read()
+            chunks = [chunk async for chunk in self.iter_object(key)]
+            data = b"".join(chunks)
             logger.info(f"Successfully retrieved object with key: {key}")
             return data
         except Exception as e:
             logger.error(f"Error retrieving object with key {key}: {str(e)}")
             raise
             
-    async def list_objects(self, prefix: str = ""):
-        """List objects in R2 with a given prefix"""
-        logger.info(f"Listing objects with prefix: {prefix}")
+    async def _get_range(self, key: str, start: int, end: int) -> bytes:
+        def get_object_range():
+            response = self.client.get_object(Bucket=self.bucket_name, Key=key, Range=f"bytes={start}-{end}")
+            return response["Body"].read()
+            
+        try:
+            return await self._run(get_object_range)
+        except ClientError as e:
+            if _is_missing(e):
+                raise ObjectNotFound(key)
+            raise
+            
+    async def iter_object(
+        self,
+        key: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        size: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """
+        Stream bytes start..end (inclusive) of an object in order.
+        
+        The range is fetched as part_size ranged GETs with up to max_concurrency
+        of them in flight, so at most that many parts are buffered.
+        """
+        if size is None:
+            size = (await self.head_object(key))["size"]
+        end = size - 1 if end is None else min(end, size - 1)
         
+        ranges = [(offset, min(offset + self.part_size, end + 1) - 1) for offset in range(start, end + 1, self.part_size)]
+        window: List[asyncio.Future] = []
         try:
-            response = self.client.list_objects_v2(
-                Bucket=self.bucket_name,
-                Prefix=prefix
-            )
+            for part_start, part_end in ranges:
+                window.append(asyncio.ensure_future(self._get_range(key, part_start, part_end)))
+                if len(window) >= self.max_concurrency:
+                    yield await window.pop(0)
+            while window:
+                yield await window.pop(0)
+        finally:
+            for pending in window:
+                pending.cancel()
+                
+    @staticmethod
+    def _object_info(obj: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "key": obj["Key"],
+            "size": obj["Size"],
+            "etag": obj.get("ETag", "").strip('"'),
+            "last_modified": obj["LastModified"].isoformat()
+        }
+        
+    async def list_page(
+        self,
+        prefix: str = "",
+        continuation_token: Optional[str] = None,
+        max_keys: int = 1000,
+        delimiter: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """One page of a listing: objects, common prefixes and the token for the next page"""
+        kwargs = {"Bucket": self.bucket_name, "Prefix": prefix, "MaxKeys": max_keys}
+        if continuation_token:
+            kwargs["ContinuationToken"] = continuation_token
+        if delimiter:
+            kwargs["Delimiter"] = delimiter
+            
+        response = await self._run(self.client.list_objects_v2, **kwargs)
+        return {
+            "objects": [self._object_info(obj) for obj in response.get("Contents", [])],
+            "prefixes": [p["Prefix"] for p in response.get("CommonPrefixes", [])],
+            "next_continuation_token": response.get("NextContinuationToken") if response.get("IsTruncated") else None
+        }
+        
+    async def _iter_pages(self, prefix: str, delimiter: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Pages of a listing, requesting the next page while the current one is consumed"""
+        pending = asyncio.ensure_future(self.list_page(prefix, delimiter=delimiter))
+        try:
+            while pending is not None:
+                page = await pending
+                token = page["next_continuation_token"]
+                pending = asyncio.ensure_future(self.list_page(prefix, token, delimiter=delimiter)) if token else None
+                yield page
+        finally:
+            if pending is not None:
+                pending.cancel()
+                
+    async def iter_objects(self, prefix: str = "", delimiter: str = "/") -> AsyncIterator[Dict[str, Any]]:
+        """
+        Every object under prefix, as it is listed.
+        
+        The first level below prefix is listed with a delimiter, and each
+        sub-prefix found is then listed by its own worker, with up to
+        max_concurrency listings running at once. Objects are therefore not
+        yielded in key order.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_concurrency * 1000)
+        prefixes: List[str] = []
+        
+        async for page in self._iter_pages(prefix, delimiter):
+            for obj in page["objects"]:
+                yield obj
+            prefixes.extend(page["prefixes"])
+            
+        if not prefixes:
+            return
             
-            objects = []
-            if 'Contents' in response:
-                objects = [obj['Key'] for obj in response['Contents']]
+        slots = asyncio.Semaphore(self.max_concurrency)
+        
+        async def list_prefix(sub_prefix: str):
+            async with slots:
+                async for page in self._iter_pages(sub_prefix):
+                    for obj in page["objects"]:
+                        await queue.put(obj)
+                        
+        async def run():
+            try:
+                await asyncio.gather(*[list_prefix(sub_prefix) for sub_prefix in prefixes])
+                await queue.put(None)
+            except Exception as e:
+                await queue.put(e)
                 
+        worker = asyncio.ensure_future(run())
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            worker.cancel()
+            
+    async def list_objects(self, prefix: str = ""):
+        """List every object in R2 with a given prefix"""
+        logger.info(f"Listing objects with prefix: {prefix}")
+        
+        try:
+            objects = [obj async for obj in self.iter_objects(prefix)]
             logger.info(f"Found {len(objects)} objects with prefix: {prefix}")
             return objects
         except Exception as e:
             logger.error(f"Error listing objects with prefix {prefix}: {str(e)}")
             raise
+            
+    async def delete_objects(self, keys: List[str]) -> Dict[str, Any]:
+        """Delete keys in batches of 1000 (the S3 limit), with batches running concurrently"""
+        slots = asyncio.Semaphore(self.max_concurrency)
+        
+        async def delete_batch(batch: List[str]) -> Dict[str, Any]:
+            async with slots:
+                return await self._run(
+                    self.client.delete_objects,
+                    Bucket=self.bucket_name,
+                    Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True}
+                )
+                
+        responses = await asyncio.gather(*[
+            delete_batch(keys[start:start + 1000]) for start in range(0, len(keys), 1000)
+        ])
+        errors = [
+            {"key": error["Key"], "error": error.get("Message", error.get("Code", ""))}
+            for response in responses for error in response.get("Errors", [])
+        ]
+        logger.info(f"Deleted {len(keys) - len(errors)} of {len(keys)} objects")
+        return {"deleted": len(keys) - len(errors), "errors": errors}
+        
+    async def copy_prefix(self, source_prefix: str, target_prefix: str) -> Dict[str, Any]:
+        """Server-side copy of every object under source_prefix to the same relative key under target_prefix"""
+        slots = asyncio.Semaphore(self.max_concurrency)
+        copies = []
+        errors = []
+        
+        async def copy(key: str):
+            target = target_prefix + key[len(source_prefix):]
+            try:
+                # The managed copy switches to multipart copies for large objects
+                await self._run(
+                    self.client.copy,
+                    CopySource={"Bucket": self.bucket_name, "Key": key},
+                    Bucket=self.bucket_name,
+                    Key=target
+                )
+            except Exception as e:
+                errors.append({"key": key, "error": str(e)})
+            finally:
+                slots.release()
+                
+        async for obj in self.iter_objects(source_prefix):
+            await slots.acquire()
+            copies.append(asyncio.ensure_future(copy(obj["key"])))
+        await asyncio.gather(*copies)
+        
+        logger.info(f"Copied {len(copies) - len(errors)} objects from {source_prefix} to {target_prefix}")
+        return {"copied": len(copies) - len(errors), "errors": errors}
+        
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,74 @@
+"""
+Shared fixtures. The services import the common libraries as top-level
+modules and their own code as the services package, as they do in their
+containers, so those source trees go on sys.path here; the services
+packages of the different services merge as one namespace package.
+"""
+import asyncio
+import httpx
+import importlib
+import os
+import pytest
+import sys
+import types
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path[:0] = [
+    os.path.join(REPO, "libs", "common"),
+    os.path.join(REPO, "benchmarks"),
+    os.path.join(REPO, "services", "query-service", "src"),
+    os.path.join(REPO, "services", "indexing-service", "src"),
+    os.path.join(REPO, "services", "api-gateway", "src")
+]
+
+from local_s3 import LocalS3
+from storage_client import StorageClient
+
+BUCKET = "quickcolbert"
+
+@pytest.fixture
+def local_s3():
+    s3 = LocalS3().start()
+    s3.bucket(BUCKET)
+    yield s3
+    s3.stop()
+
+def load_service_app(package: str, service: str):
+    """Import a service's app; it imports its own modules relatively, so it is loaded as a package"""
+    for name in [name for name in sys.modules if name.split(".")[0] == package]:
+        del sys.modules[name]
+    module = types.ModuleType(package)
+    module.__path__ = [os.path.join(REPO, "services", service, "src")]
+    sys.modules[package] = module
+    return importlib.import_module(f"{package}.app")
+
+@pytest.fixture
+def storage_app(local_s3, monkeypatch):
+    """The storage service's app, backed by the in-memory S3"""
+    monkeypatch.setenv("CLOUDFLARE_R2_BUCKET", BUCKET)
+    monkeypatch.setenv("CLOUDFLARE_R2_ACCESS_KEY", "local")
+    monkeypatch.setenv("CLOUDFLARE_R2_SECRET_KEY", "local")
+    monkeypatch.setenv("CLOUDFLARE_R2_ENDPOINT", local_s3.endpoint)
+    return load_service_app("storage_service", "storage-service")
+
+@pytest.fixture
+def indexing_app(storage_client, monkeypatch):
+    """The indexing service's app, storing indexes through the in-process storage service"""
+    monkeypatch.setenv("STATE_STORE_BACKEND", "memory")
+    module = load_service_app("indexing_service", "indexing-service")
+    monkeypatch.setattr(module, "storage_client", storage_client)
+    return module
+
+@pytest.fixture
+def gateway_app(monkeypatch):
+    """The api-gateway's app, routing searches over two query service replicas"""
+    monkeypatch.setenv("QUERY_SERVICE_REPLICAS", "http://query-a:8001,http://query-b:8001")
+    return load_service_app("api_gateway", "api-gateway")
+
+@pytest.fixture
+def storage_client(storage_app):
+    """A StorageClient talking to the storage service in process"""
+    client = StorageClient(base_url="http://storage-service")
+    client.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=storage_app.app), base_url=client.base_url)
+    yield client
+    asyncio.run(client.close())
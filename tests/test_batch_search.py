@@ -0,0 +1,59 @@
+import asyncio
+import httpx
+import numpy as np
+from document_table import DocumentTable
+from services.plaid_engine import PlaidIndex, PlaidSearcher
+
+def make_searcher(n_documents=30, tokens=5, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((n_documents * tokens, dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    index = PlaidIndex.from_embeddings(embeddings, [tokens] * n_documents, embeddings[::7])
+    ids = [f"doc-{pid}" for pid in range(n_documents)]
+    documents = DocumentTable.from_lists([f"passage {pid}" for pid in range(n_documents)], ids, {})
+    queries = embeddings.reshape(n_documents, tokens, dim)
+    return PlaidSearcher(index, lambda texts: queries[[int(text) for text in texts]], documents)
+
+def test_a_batch_scores_like_its_queries_one_at_a_time():
+    searcher = make_searcher()
+    batch = searcher.search(["3", "17", "29"], k=4)
+    assert batch == [searcher.search(query, k=4) for query in ["3", "17", "29"]]
+    assert [results[0]["document_id"] for results in batch] == ["doc-3", "doc-17", "doc-29"]
+
+def gateway_client(gateway_app):
+    """Route the gateway's replicas to a handler answering each query with its own text"""
+    replicas = []
+    
+    def handler(request):
+        queries = httpx.Response(200, content=request.content).json()["queries"]
+        replicas.append((request.url.host, [query["query"] for query in queries]))
+        return httpx.Response(200, json={
+            "results": [{"query": query["query"], "results": []} for query in queries],
+            "timings": {"search": 0.5},
+            "processing_time": 1.0 if request.url.host == "query-a" else 2.0
+        })
+        
+    router = gateway_app.query_router
+    asyncio.run(router.start())
+    for url, client in router.replicas.items():
+        client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url=url)
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=gateway_app.app), base_url="http://gateway")
+    return client, replicas
+
+def test_gateway_splits_a_batch_by_replica_and_merges_it_in_order(gateway_app):
+    client, replicas = gateway_client(gateway_app)
+    # Two indexes placed on different replicas
+    placement = {n: gateway_app.query_router.ranked(f"index:index-{n}")[0] for n in range(20)}
+    first = "index-0"
+    other = next(f"index-{n}" for n, url in placement.items() if url != placement[0])
+    
+    queries = [{"query": "q0", "index_id": first}, {"query": "q1", "index_id": other}, {"query": "q2", "index_id": first}]
+    response = asyncio.run(client.post("/search/batch", json={"queries": queries}, headers={"X-API-Key": "test-api-key"}))
+    
+    assert response.status_code == 200
+    body = response.json()
+    assert [result["query"] for result in body["results"]] == ["q0", "q1", "q2"]
+    assert sorted(queries for _, queries in replicas) == [["q0", "q2"], ["q1"]]
+    # Sub-batches run in parallel: timings add up, the processing time is the slowest
+    assert body["timings"] == {"search": 1.0}
+    assert body["processing_time"] == 2.0
@@ -0,0 +1,30 @@
+import numpy as np
+from services.cluster_router import ClusterRouter
+
+CENTROIDS = np.eye(3, dtype=np.float32)
+LABELS = np.array([2, 0, -1, 1, 0, 2, 7])
+
+def test_documents_of_clusters_are_sorted_positions():
+    router = ClusterRouter(CENTROIDS, LABELS)
+    # Unknown (-1) and out of range labels are never routed to
+    assert router.document_count == 5
+    assert router.documents([0, 2]).tolist() == [0, 1, 4, 5]
+    assert router.documents([2, 2, 9]).tolist() == [0, 5]
+    assert router.documents([]).tolist() == []
+
+def test_queries_are_pooled_and_routed_to_their_nearest_clusters():
+    router = ClusterRouter(CENTROIDS, LABELS)
+    query = np.array([[0.9, 0.1, 0.0], [0.7, 0.0, 0.3]], dtype=np.float32)
+    assert router.nearest(query, 1).tolist() == [0]
+    assert sorted(router.nearest(query, 2).tolist()) == [0, 2]
+    assert router.nearest(query, 1, clusters=[1, 2]).tolist() == [2]
+    assert router.nearest(query, 5, clusters=[1, 9]).tolist() == [1]
+
+def test_routes_restrict_the_allowed_documents():
+    router = ClusterRouter(CENTROIDS, LABELS)
+    query = np.array([[0.0, 1.0, 0.2]], dtype=np.float32)
+    assert router.allowed(query, None) is None
+    assert router.allowed(query, {"nprobe": None, "clusters": None}) is None
+    assert router.allowed(query, {"nprobe": 1}).tolist() == [3]
+    assert router.allowed(query, {"clusters": [0]}).tolist() == [1, 4]
+    assert router.allowed(query, {"nprobe": 1, "clusters": [0, 2]}).tolist() == [0, 5]
@@ -0,0 +1,34 @@
+import asyncio
+import pytest
+from services.document_stream import DocumentStreamError, iter_document_batches
+
+async def chunked(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+def collect(data: bytes, batch_size=2, size=7, **kwargs):
+    async def main():
+        return [batch async for batch in iter_document_batches(chunked(data, size), batch_size, **kwargs)]
+    return asyncio.run(main())
+
+def test_records_split_across_chunks_are_batched():
+    data = b'{"id": 1, "content": "a"}\n\n{"content": "b", "metadata": {"k": "v"}}\n{"id": "x", "content": "c"}'
+    batches = collect(data, start=10)
+    assert [len(batch) for batch in batches] == [2, 1]
+    assert batches[0][0] == {"id": "1", "content": "a", "metadata": {}}
+    # Records without an id are numbered by their position, offset by start
+    assert batches[0][1] == {"id": "11", "content": "b", "metadata": {"k": "v"}}
+    assert batches[1][0]["id"] == "x"
+
+@pytest.mark.parametrize("line, message", [
+    (b"{not json", "Invalid JSON on record 1"),
+    (b"[1, 2]", "Record 1 is not a JSON object"),
+    (b'{"content": 3}', "Invalid document on record 1"),
+])
+def test_malformed_records_are_reported_by_position(line, message):
+    with pytest.raises(DocumentStreamError, match=message):
+        collect(b'{"content": "ok"}\n' + line + b"\n")
+
+def test_records_are_passed_through_without_a_parser():
+    batches = collect(b'{"content": 3, "extra": true}\n', parse=None)
+    assert batches == [[{"content": 3, "extra": True, "id": "0"}]]
@@ -0,0 +1,31 @@
+import os
+from document_table import DocumentTable, DocumentTableWriter, has_document_table, open_document_table, table_path
+
+def test_written_table_maps_documents_by_position(tmp_path):
+    index_path = str(tmp_path / "index")
+    os.makedirs(index_path)
+    writer = DocumentTableWriter(index_path)
+    writer.add("first passage", "a", {"source": "wiki"})
+    writer.add("zweite Passage ü", "b")
+    writer.add("", "c", {})
+    writer.close()
+    
+    assert has_document_table(index_path)
+    assert not os.path.exists(table_path(index_path) + ".partial")
+    
+    table = open_document_table(index_path)
+    assert len(table) == 3
+    assert [table.content(pid) for pid in range(3)] == ["first passage", "zweite Passage ü", ""]
+    assert [table.document_id(pid) for pid in range(3)] == ["a", "b", "c"]
+    assert [table.metadata(pid) for pid in range(3)] == [{"source": "wiki"}, {}, {}]
+
+def test_empty_table(tmp_path):
+    writer = DocumentTableWriter(str(tmp_path))
+    writer.close()
+    assert len(open_document_table(str(tmp_path))) == 0
+
+def test_table_over_json_maps_matches_missing_entries_like_the_files():
+    table = DocumentTable.from_lists(["only content"], ["a", "b"], {"b": {"lang": "en"}})
+    assert len(table) == 2
+    assert table.content(1) == ""
+    assert table.metadata(0) == {} and table.metadata(1) == {"lang": "en"}
@@ -0,0 +1,56 @@
+import numpy as np
+import os
+from services.embedding_cache import QueryEmbeddingCache
+
+class Encoder:
+    """Encodes a query as a (4, 8) array filled with its length, counting the queries encoded"""
+    
+    def __init__(self):
+        self.batches = []
+        
+    def __call__(self, queries):
+        self.batches.append(list(queries))
+        return np.stack([np.full((4, 8), len(query), dtype=np.float32) for query in queries])
+
+def test_only_distinct_missing_queries_are_encoded_in_one_batch():
+    cache = QueryEmbeddingCache("colbert")
+    encoder = Encoder()
+    cache.encode(["hello"], encoder)
+    
+    embeddings = cache.encode(["Hello", "a query", "A  Query", "hello"], encoder)
+    assert encoder.batches == [["hello"], ["a query"]]
+    assert embeddings.shape == (4, 4, 8) and embeddings.dtype == np.float32
+    assert embeddings[:, 0, 0].tolist() == [5, 7, 7, 5]
+    assert (cache.hits, cache.misses) == (2, 3)
+
+def test_memory_is_bounded_least_recently_used_first():
+    # Each float16 (4, 8) embedding takes 64 bytes
+    cache = QueryEmbeddingCache("colbert", max_bytes=128)
+    for query in ("a", "b"):
+        cache.put(query, np.zeros((4, 8)))
+    cache.get("a")
+    cache.put("c", np.zeros((4, 8)))
+    
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+
+def test_the_disk_tier_survives_restarts_and_is_bounded(tmp_path):
+    cache = QueryEmbeddingCache("colbert", cache_dir=str(tmp_path))
+    cache.put("kept", np.ones((4, 8)))
+    # A temp file of a writer that died is cleaned up on start
+    (tmp_path / "abc.qcar.999999999.tmp").write_bytes(b"partial")
+    
+    restarted = QueryEmbeddingCache("colbert", cache_dir=str(tmp_path))
+    assert np.array_equal(restarted.get("kept"), np.ones((4, 8), dtype=np.float16))
+    assert restarted.disk_hits == 1
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".tmp")] == []
+    # Another model's embeddings are not shared
+    assert QueryEmbeddingCache("other-model", cache_dir=str(tmp_path)).get("kept") is None
+    
+    size = restarted.stats()["disk_bytes"]
+    bounded = QueryEmbeddingCache("colbert", cache_dir=str(tmp_path), max_disk_bytes=2 * size)
+    bounded.put("second", np.zeros((4, 8)))
+    bounded.put("third", np.zeros((4, 8)))
+    assert len(os.listdir(tmp_path)) == 2
+    assert QueryEmbeddingCache("colbert", cache_dir=str(tmp_path)).get("kept") is None
@@ -0,0 +1,95 @@
+import asyncio
+import pytest
+from services.index_cache import IndexCache
+
+class Loader:
+    """Loads an index as its path, failing for paths starting with "missing", and counts the loads"""
+    
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.loads = []
+        
+    async def __call__(self, index_path):
+        self.loads.append(index_path)
+        await asyncio.sleep(self.delay)
+        if index_path.startswith("missing"):
+            raise FileNotFoundError(index_path)
+        return f"handle:{index_path}"
+
+def make_cache(loader, **kwargs):
+    return IndexCache(loader, sizer=lambda path: 100, **kwargs)
+
+def test_concurrent_requests_share_one_load():
+    loader = Loader(delay=0.01)
+    cache = make_cache(loader)
+    
+    async def main():
+        return await asyncio.gather(*[cache.get("docs", "/indexes/docs") for _ in range(3)])
+        
+    entries = asyncio.run(main())
+    assert all(entry is entries[0] for entry in entries)
+    assert entries[0].handle == "handle:/indexes/docs"
+    assert loader.loads == ["/indexes/docs"]
+    assert (cache.misses, cache.coalesced) == (1, 2)
+    
+    asyncio.run(cache.get("docs", "/indexes/docs"))
+    assert cache.hits == 1
+
+def test_a_new_path_replaces_the_cached_index():
+    cache = make_cache(Loader())
+    asyncio.run(cache.get("docs", "/indexes/docs@1"))
+    entry = asyncio.run(cache.get("docs", "/indexes/docs@2"))
+    assert cache.peek("docs") is entry
+    assert cache.stats()["resident_bytes"] == 100
+
+def test_a_superseded_load_is_not_cached():
+    cache = make_cache(Loader(delay=0.01))
+    
+    async def main():
+        old = asyncio.ensure_future(cache.get("docs", "/indexes/docs@1"))
+        await asyncio.sleep(0)
+        new = await cache.get("docs", "/indexes/docs@2")
+        return await old, new
+        
+    old, new = asyncio.run(main())
+    assert old.handle == "handle:/indexes/docs@1"
+    assert cache.peek("docs") is new
+
+def test_failed_loads_leave_nothing_behind():
+    loader = Loader()
+    cache = make_cache(loader)
+    for n in range(3):
+        with pytest.raises(FileNotFoundError):
+            asyncio.run(cache.get(f"bogus-{n}", f"missing/{n}"))
+            
+    assert cache.load_failures == 3
+    assert cache.resident() == []
+    assert cache._requested == {} and cache._loading == {}
+    
+    # A later load of the same id is attempted again
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(cache.get("bogus-0", "missing/0"))
+    assert len(loader.loads) == 4
+
+@pytest.mark.parametrize("policy, evicted", [("lru", "b"), ("lfu", "a")])
+def test_eviction_policies(policy, evicted):
+    cache = make_cache(Loader(), max_bytes=250, policy=policy)
+    for index_id in ("a", "b", "b", "a"):
+        asyncio.run(cache.get(index_id, f"/indexes/{index_id}"))
+    if policy == "lfu":
+        # b has been used more often than a
+        asyncio.run(cache.get("b", "/indexes/b"))
+    asyncio.run(cache.get("c", "/indexes/c"))
+    
+    assert cache.peek(evicted) is None
+    assert sorted(cache.resident()) == sorted({"a", "b", "c"} - {evicted})
+
+def test_pinned_indexes_are_not_evicted():
+    cache = make_cache(Loader(), max_bytes=150)
+    cache.pin("a")
+    asyncio.run(cache.get("a", "/indexes/a"))
+    asyncio.run(cache.get("b", "/indexes/b"))
+    assert cache.resident() == ["a", "b"]
+    
+    cache.unpin("a")
+    assert cache.resident() == ["b"]
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import pytest
+import time
+from index_artifacts import MANIFEST_NAME, upload_index
+from services.index_disk_cache import LOCK_DIR, IndexDiskCache, entry_name, version_name
+
+def write_index(path, files):
+    os.makedirs(path, exist_ok=True)
+    for name, data in files.items():
+        with open(os.path.join(path, name), "wb") as f:
+            f.write(data)
+
+def publish(storage_client, tmp_path, index_id, version, files):
+    """Upload an index directory and return the artifact pointer the index record holds"""
+    source = tmp_path / "source" / entry_name(index_id) / str(version)
+    write_index(str(source), files)
+    prefix = f"indexes/{index_id}/v{version}"
+    manifest = asyncio.run(upload_index(storage_client, str(source), prefix, index_id))
+    return {"prefix": prefix, "version": version, "created_at": manifest["created_at"]}
+
+def read(path, name):
+    with open(os.path.join(path, name), "rb") as f:
+        return f.read()
+
+def fetch(cache, index_id, artifact):
+    """Fetch an index and drop the claim, leaving it free to evict"""
+    path = asyncio.run(cache.fetch(index_id, artifact))
+    cache.release(path)
+    return path
+
+def test_fetch_downloads_once_into_a_flat_directory(storage_client, tmp_path):
+    artifact = publish(storage_client, tmp_path, "docs/shards/0", 1, {"a.bin": b"a" * 100, "b.bin": b"b" * 50})
+    cache = IndexDiskCache(storage_client, str(tmp_path / "cache"))
+    
+    path = fetch(cache, "docs/shards/0", artifact)
+    assert path == str(tmp_path / "cache" / version_name("docs/shards/0", artifact["created_at"]))
+    assert read(path, "a.bin") == b"a" * 100
+    assert os.path.exists(os.path.join(path, MANIFEST_NAME))
+    
+    assert fetch(cache, "docs/shards/0", artifact) == path
+    assert (cache.downloads, cache.hits) == (1, 1)
+    assert cache.stats()["disk_bytes"] == 150
+
+def test_scan_adopts_versions_and_removes_abandoned_downloads(storage_client, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    artifact = publish(storage_client, tmp_path, "docs/shards/1", 1, {"a.bin": b"a" * 10})
+    path = fetch(IndexDiskCache(storage_client, cache_dir), "docs/shards/1", artifact)
+    abandoned = f"{entry_name('other')}@1.0.999999999.partial"
+    running = f"{entry_name('other')}@1.0.{os.getpid()}.partial"
+    for name in (abandoned, running, os.path.join("nested", "shards", "0")):
+        write_index(os.path.join(cache_dir, name), {"a.bin": b"x"})
+        
+    cache = IndexDiskCache(storage_client, cache_dir)
+    assert cache.peek("docs/shards/1").path == path
+    assert sorted(os.listdir(cache_dir)) == sorted([LOCK_DIR, os.path.basename(path), running])
+    
+    fetch(cache, "docs/shards/1", artifact)
+    assert cache.downloads == 0
+
+def test_updated_index_is_downloaded_again(storage_client, tmp_path):
+    first = publish(storage_client, tmp_path, "docs", 1, {"a.bin": b"a" * 10, "b.bin": b"b" * 10})
+    second = publish(storage_client, tmp_path, "docs", 2, {"a.bin": b"a" * 10, "b.bin": b"c" * 10})
+    cache = IndexDiskCache(storage_client, str(tmp_path / "cache"))
+    
+    old_path = fetch(cache, "docs", first)
+    path = fetch(cache, "docs", second)
+    assert path != old_path
+    assert read(path, "b.bin") == b"c" * 10
+    assert cache.downloads == 2
+    # The unchanged file is linked from the cached version
+    assert os.stat(os.path.join(path, "a.bin")).st_ino == os.stat(os.path.join(old_path, "a.bin")).st_ino
+    assert not any(name.endswith(".partial") for name in os.listdir(tmp_path / "cache"))
+
+def test_failed_download_leaves_no_partial_directory(storage_client, tmp_path):
+    artifact = {"prefix": "indexes/missing/v1", "created_at": 1.0}
+    cache = IndexDiskCache(storage_client, str(tmp_path / "cache"))
+    
+    with pytest.raises(Exception):
+        asyncio.run(cache.fetch("missing", artifact))
+    assert os.listdir(tmp_path / "cache") == [LOCK_DIR]
+    assert cache.download_failures == 1
+
+def test_least_recently_used_indexes_are_evicted(storage_client, tmp_path):
+    artifacts = {
+        index_id: publish(storage_client, tmp_path, index_id, 1, {"a.bin": bytes(100)})
+        for index_id in ("one", "two", "three")
+    }
+    cache = IndexDiskCache(storage_client, str(tmp_path / "cache"), max_bytes=250)
+    
+    for index_id in ("one", "two", "one", "three"):
+        fetch(cache, index_id, artifacts[index_id])
+        time.sleep(0.02)
+    assert cache.peek("two") is None
+    assert cache.peek("one") is not None and cache.peek("three") is not None
+    assert cache.evictions == 1
+    
+    # Claimed and retained indexes are kept even over budget
+    claimed = asyncio.run(cache.fetch("one", artifacts["one"]))
+    time.sleep(0.02)
+    loaded = asyncio.run(cache.fetch("three", artifacts["three"]))
+    cache.retain([loaded])
+    cache.release(loaded)
+    fetch(cache, "two", artifacts["two"])
+    assert all(cache.peek(index_id) is not None for index_id in artifacts)
+    assert cache.stats()["disk_bytes"] == 300
+    
+    # and go once they are neither
+    cache.release(claimed)
+    cache.retain([])
+    fetch(cache, "two", artifacts["two"])
+    assert cache.peek("one") is None
+    assert cache.stats()["disk_bytes"] == 200
+
+def test_workers_sharing_a_directory_download_once_and_share_the_budget(storage_client, tmp_path):
+    artifacts = {
+        index_id: publish(storage_client, tmp_path, index_id, 1, {"a.bin": bytes(100)})
+        for index_id in ("docs", "other", "third")
+    }
+    cache_dir = str(tmp_path / "cache")
+    first = IndexDiskCache(storage_client, cache_dir, max_bytes=150)
+    second = IndexDiskCache(storage_client, cache_dir, max_bytes=150)
+    
+    path = asyncio.run(first.fetch("docs", artifacts["docs"]))
+    assert fetch(second, "docs", artifacts["docs"]) == path
+    assert (first.downloads, second.downloads, second.hits) == (1, 0, 1)
+    
+    # An index another worker has claimed is not evicted
+    other = asyncio.run(second.fetch("other", artifacts["other"]))
+    assert os.path.exists(path) and second.evictions == 0
+    
+    first.release(path)
+    asyncio.run(second.fetch("third", artifacts["third"]))
+    assert not os.path.exists(path)
+    assert os.path.exists(other)
+    assert second.evictions == 1
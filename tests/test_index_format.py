@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from index_format import (
+    HEADER_SIZE, FormatError, create_array, decode_array, encode_array, label_dtype, open_array, seal_array, write_array
+)
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_arrays_round_trip(compress):
+    array = np.arange(24, dtype=np.float32).reshape(2, 3, 4)
+    decoded = decode_array(encode_array(array, compress))
+    assert decoded.dtype == array.dtype
+    assert np.array_equal(decoded, array)
+
+def test_big_endian_arrays_are_stored_little_endian():
+    array = np.arange(5, dtype=">i4")
+    decoded = decode_array(encode_array(array))
+    assert decoded.dtype == np.dtype("<i4")
+    assert decoded.tolist() == [0, 1, 2, 3, 4]
+
+def test_corrupt_and_foreign_buffers_are_rejected():
+    data = bytearray(encode_array(np.arange(10, dtype=np.int64)))
+    data[-1] ^= 0xFF
+    with pytest.raises(FormatError):
+        decode_array(bytes(data))
+    with pytest.raises(FormatError):
+        decode_array(bytes(data[:-8]))
+    with pytest.raises(FormatError):
+        decode_array(b"NOPE" + bytes(HEADER_SIZE))
+    with pytest.raises(FormatError):
+        encode_array(np.zeros((1, 1, 1, 1, 1)))
+
+def test_uncompressed_files_are_memory_mapped(tmp_path):
+    path = str(tmp_path / "a.qcar")
+    array = np.arange(12, dtype=np.uint16).reshape(3, 4)
+    assert write_array(path, array) == HEADER_SIZE + array.nbytes
+    opened = open_array(path)
+    assert isinstance(opened, np.memmap)
+    assert np.array_equal(opened, array)
+    
+    write_array(path, array, compress=True)
+    assert np.array_equal(open_array(path), array)
+
+def test_created_arrays_are_checksummed_when_sealed(tmp_path):
+    path = str(tmp_path / "b.qcar")
+    out = create_array(path, np.int32, (4, 2))
+    out[...] = np.arange(8).reshape(4, 2)
+    out.flush()
+    del out
+    seal_array(path)
+    
+    with open(path, "rb") as f:
+        assert decode_array(f.read()).tolist() == [[0, 1], [2, 3], [4, 5], [6, 7]]
+    assert open_array(path).shape == (4, 2)
+
+def test_empty_arrays(tmp_path):
+    path = str(tmp_path / "c.qcar")
+    write_array(path, np.empty((0, 3), dtype=np.float32))
+    assert open_array(path).shape == (0, 3)
+
+def test_label_dtype():
+    assert label_dtype(100) == np.dtype("<u2")
+    assert label_dtype(70000) == np.dtype("<i4")
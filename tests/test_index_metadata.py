@@ -0,0 +1,109 @@
+import asyncio
+import numpy as np
+from index_format import encode_array
+from state_store import MemoryStateStore
+from services.index_metadata import IndexMetadataStore, clusters_from_json
+
+def make_store(**kwargs):
+    state = MemoryStateStore()
+    asyncio.run(state.save_many({
+        "latest_index:user": "docs",
+        "index:docs": {"path": "/indexes/docs", "version": 1, "document_count": 4},
+        "clusters:docs": {"0": 2, "3": 1},
+        "result:docs": "cached"
+    }))
+    return state, IndexMetadataStore(state, **kwargs)
+
+def extra_key(metadata):
+    return f"result:{metadata.index_id}"
+
+def test_resolve_loads_the_latest_index_with_its_legacy_clusters():
+    _, store = make_store()
+    metadata, extra = asyncio.run(store.resolve(None, "user", extra_key))
+    assert metadata.index_id == "docs" and metadata.version == 1
+    assert metadata.clusters.tolist() == [2, -1, -1, 1]
+    assert extra == b"cached"
+    assert store.peek(None, "user") is metadata
+
+def test_resolve_of_an_expired_index_costs_one_round_trip():
+    state, store = make_store(pointer_ttl=0, metadata_ttl=0)
+    metadata, _ = asyncio.run(store.resolve(None, "user"))
+    assert store.peek(None, "user") is None
+    
+    round_trips = state.round_trips
+    again, extra = asyncio.run(store.resolve(None, "user", extra_key))
+    assert state.round_trips == round_trips + 1
+    assert again is metadata and extra == b"cached"
+    assert store.revalidations == 1
+
+def test_a_new_record_version_is_loaded_again():
+    state, store = make_store(metadata_ttl=0)
+    metadata, _ = asyncio.run(store.resolve("docs", "user"))
+    asyncio.run(state.save("index:docs", {"path": "/indexes/docs", "version": 2, "document_count": 5}))
+    
+    updated, _ = asyncio.run(store.resolve("docs", "user"))
+    assert updated is not metadata
+    assert updated.version == 2 and len(updated.clusters) == 5
+    assert store.loads == 2
+
+def test_missing_indexes_resolve_to_none():
+    state, store = make_store()
+    assert asyncio.run(store.resolve(None, "nobody", extra_key)) == (None, None)
+    assert asyncio.run(store.resolve("gone", "user", extra_key)) == (None, None)
+
+def test_cluster_lookups_cost_the_number_of_results():
+    _, store = make_store()
+    metadata = asyncio.run(store.get("docs"))
+    assert metadata.clusters_for([0, 3, 9, -1]).tolist() == [2, 1, -1, -1]
+    assert clusters_from_json({}, 2).tolist() == [-1, -1]
+
+def publish(state, storage_client, index_id, version, labels):
+    """Store an index record whose cluster assignments live in object storage"""
+    key = f"indexes/{index_id}/{version}/clusters.qcar"
+    data = encode_array(np.array(labels, dtype=np.uint16))
+    asyncio.run(storage_client.put_object(key, data))
+    asyncio.run(state.save(f"index:{index_id}", {
+        "path": f"/indexes/{index_id}",
+        "version": version,
+        "document_count": len(labels),
+        "artifacts": {"clusters": {"key": key, "bytes": len(data)}}
+    }))
+
+def test_downloaded_clusters_of_a_superseded_version_are_deleted(storage_client, tmp_path):
+    state = MemoryStateStore()
+    store = IndexMetadataStore(state, storage_client, cache_dir=str(tmp_path), metadata_ttl=0)
+    publish(state, storage_client, "docs", 1, [0, 1, 1])
+    assert asyncio.run(store.get("docs")).clusters.tolist() == [0, 1, 1]
+    old = tmp_path / "indexes" / "docs" / "1" / "clusters.qcar"
+    assert old.exists()
+    
+    publish(state, storage_client, "docs", 2, [2, 2, 0, 1])
+    assert asyncio.run(store.get("docs")).clusters.tolist() == [2, 2, 0, 1]
+    assert not old.exists()
+    assert (tmp_path / "indexes" / "docs" / "2" / "clusters.qcar").exists()
+
+def test_least_recently_used_indexes_are_evicted_with_their_files(storage_client, tmp_path):
+    state = MemoryStateStore()
+    store = IndexMetadataStore(state, storage_client, cache_dir=str(tmp_path), max_indexes=2)
+    for index_id in ("a", "b", "c"):
+        publish(state, storage_client, index_id, 1, [0])
+    asyncio.run(store.get("a"))
+    asyncio.run(store.get("b"))
+    asyncio.run(store.get("a"))
+    asyncio.run(store.get("c"))
+    
+    assert list(store._indexes) == ["a", "c"]
+    assert store.stats()["evictions"] == 1
+    assert not (tmp_path / "indexes" / "b" / "1" / "clusters.qcar").exists()
+    assert (tmp_path / "indexes" / "a" / "1" / "clusters.qcar").exists()
+
+def test_deleted_documents_are_filtered_until_compaction():
+    _, store = make_store()
+    metadata = asyncio.run(store.get("docs"))
+    assert metadata.is_deleted([0, 1]).tolist() == [False, False]
+    assert metadata.search_limit(10) == 10
+    
+    metadata.tombstones = np.array([1, 3], dtype=np.uint32)
+    assert metadata.is_deleted([0, 1, 3, 7]).tolist() == [False, True, True, False]
+    assert metadata.search_limit(10) == 12
+    assert metadata.search_limit(1) == 2
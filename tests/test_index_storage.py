@@ -0,0 +1,45 @@
+import asyncio
+import json
+import numpy as np
+from index_format import encode_array
+from services.index_disk_cache import IndexDiskCache
+
+def build_result(tmp_path, document_count=2):
+    """The output of one indexing run: an index directory plus its documents, under a scratch directory"""
+    work_dir = tmp_path / "build"
+    (work_dir / "index").mkdir(parents=True)
+    (work_dir / "index" / "metadata.json").write_text(json.dumps({"num_chunks": 1}))
+    (work_dir / "documents.ndjson").write_text("".join(f'{{"content": "d{n}"}}\n' for n in range(document_count)))
+    (work_dir / "ids.json").write_text(json.dumps([f"d{n}" for n in range(document_count)]))
+    return {
+        "path": str(work_dir / "index"),
+        "work_dir": str(work_dir),
+        "document_count": document_count,
+        "documents_path": str(work_dir / "documents.ndjson"),
+        "ids_path": str(work_dir / "ids.json")
+    }
+
+def test_stored_records_point_to_object_storage_only(indexing_app, storage_client, tmp_path):
+    clusters = {
+        "labels": encode_array(np.array([0, 1], dtype=np.uint16)),
+        "centroids": encode_array(np.zeros((2, 4), dtype=np.float32)),
+        "n_clusters": 2
+    }
+    asyncio.run(indexing_app.store_index("docs", [build_result(tmp_path)], clusters, "alice"))
+    state = indexing_app.state_store
+    record = asyncio.run(state.get_json("index:docs"))
+    
+    # The scratch build directory is removed after storing, so it is not recorded
+    assert "path" not in record
+    assert asyncio.run(state.get("latest_index:alice")) == b"docs"
+    assert record["artifacts"]["index"]["prefix"] == "indexes/docs/v1/index"
+    assert record["artifacts"]["segments"] == [
+        {"start": 0, "count": 2, "documents": "indexes/docs/v1/documents.ndjson", "ids": "indexes/docs/v1/ids.json"}
+    ]
+    
+    # The pointer is all a query replica needs to load the index
+    cache = IndexDiskCache(storage_client, str(tmp_path / "cache"))
+    path = asyncio.run(cache.fetch("docs", record["artifacts"]["index"]))
+    cache.release(path)
+    with open(f"{path}/metadata.json") as f:
+        assert json.load(f) == {"num_chunks": 1}
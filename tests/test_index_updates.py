@@ -0,0 +1,109 @@
+import asyncio
+import httpx
+import json
+import numpy as np
+from index_format import encode_array
+from storage_client import StorageClient
+from services import index_worker
+from services.index_updates import DocumentPositions, artifact_keys, needs_compaction
+
+class Objects:
+    """An object store holding JSON id lists, counting the objects read"""
+    
+    def __init__(self, objects):
+        self.objects = objects
+        self.reads = []
+        
+    async def get_object(self, key):
+        self.reads.append(key)
+        return json.dumps(self.objects[key]).encode("utf-8")
+
+def segment(start, ids):
+    return {"start": start, "count": len(ids), "documents": f"seg{start}/documents.ndjson", "ids": f"seg{start}/ids.json"}
+
+def record(*segments, **fields):
+    return dict(fields, artifacts={"segments": list(segments)})
+
+def test_positions_are_extended_by_appended_segments():
+    first, appended = segment(0, ["a", "b", "a"]), segment(3, ["c"])
+    storage = Objects({first["ids"]: ["a", "b", "a"], appended["ids"]: ["c"]})
+    positions = DocumentPositions(storage)
+    
+    found, missing = asyncio.run(positions.resolve("docs", record(first), ["a", "x"]))
+    assert found.tolist() == [0, 2] and missing == ["x"]
+    
+    found, _ = asyncio.run(positions.resolve("docs", record(first, appended), ["c", "b"]))
+    assert found.tolist() == [3, 1]
+    assert storage.reads == [first["ids"], appended["ids"]]
+    
+    # A compaction replaces every segment, so the map is rebuilt
+    compacted = segment(0, ["b", "c"])
+    compacted["ids"] = "compacted/ids.json"
+    storage.objects[compacted["ids"]] = ["b", "c"]
+    found, missing = asyncio.run(positions.resolve("docs", record(compacted), ["a", "c"]))
+    assert found.tolist() == [1] and missing == ["a"]
+
+def test_compaction_thresholds():
+    index = {"document_count": 10, "deleted_count": 2, "artifacts": {"index": {"prefix": "p"}}}
+    assert needs_compaction(index, 0.2)
+    assert not needs_compaction(index, 0.3)
+    assert not needs_compaction({"document_count": 0}, 0.2)
+    shards = {"document_count": 10, "artifacts": {"shards": [{"prefix": f"s{n}"} for n in range(3)]}}
+    assert needs_compaction(shards, 0.5, max_shards=2)
+    assert not needs_compaction(shards, 0.5, max_shards=3)
+
+def test_artifact_keys_cover_every_object_of_a_version():
+    version = {"artifacts": {
+        "index": {"prefix": "v1/index"},
+        "clusters": {"key": "v1/clusters.qcar"},
+        "tombstones": {"key": "v1/tombstones.qcar"},
+        "segments": [segment(0, ["a"])]
+    }}
+    manifests = {"v1/index": {"files": [{"path": "a.bin"}, {"path": "b.bin", "key": "v0/index/b.bin"}]}}
+    assert artifact_keys(version, manifests) == {
+        "v1/index/manifest.json", "v1/index/a.bin", "v0/index/b.bin",
+        "v1/clusters.qcar", "v1/tombstones.qcar", "seg0/documents.ndjson", "seg0/ids.json"
+    }
+
+def test_live_documents_are_streamed_without_the_deleted_ones(storage_app, storage_client, tmp_path, monkeypatch):
+    class SmallChunks(StorageClient):
+        """Streams objects in 7-byte chunks, so that lines are split across chunks"""
+        
+        async def iter_object(self, key):
+            async for chunk in super().iter_object(key):
+                for start in range(0, len(chunk), 7):
+                    yield chunk[start:start + 7]
+                    
+    def in_process_client():
+        client = SmallChunks(base_url="http://storage-service")
+        client.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=storage_app.app), base_url=client.base_url)
+        return client
+        
+    monkeypatch.setattr(index_worker, "StorageClient", in_process_client)
+    first = segment(0, [str(n) for n in range(2000)])
+    second = segment(2000, ["d", "e"])
+    
+    async def publish():
+        lines = "".join(f'{{"id": "{n}", "content": "document {n}"}}\n' for n in range(2000))
+        await storage_client.put_object(first["documents"], lines.encode("utf-8"))
+        # The last line of a segment may lack its newline
+        await storage_client.put_object(second["documents"], b'{"id": "d"}\n{"id": "e"}')
+        deleted = np.array(list(range(0, 2000, 3)) + [2001], dtype=np.uint32)
+        await storage_client.put_object("tombstones.qcar", encode_array(deleted))
+        
+    asyncio.run(publish())
+    path = str(tmp_path / "live.ndjson")
+    live = asyncio.run(index_worker._collect_live_documents([first, second], "tombstones.qcar", path))
+    
+    expected = [str(n) for n in range(2000) if n % 3] + ["d"]
+    assert live == len(expected)
+    with open(path) as f:
+        assert [json.loads(line)["id"] for line in f] == expected
+
+def test_the_gateway_requires_document_ids(gateway_app):
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=gateway_app.app), base_url="http://gateway")
+    response = asyncio.run(client.post(
+        "/documents/index", json=[{"content": "no id"}], headers={"X-API-Key": "test-api-key"}
+    ))
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"][-1] == "id"
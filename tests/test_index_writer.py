@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from services.index_writer import ColbertIndexWriter, DocumentWriter, ResidualCodec, default_nbits, pool_embeddings
+from services.plaid_engine import PlaidSearcher
+
+torch = pytest.importorskip("torch")
+
+def token_embeddings(n_documents=40, tokens=6, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((n_documents, tokens, dim)).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=-1, keepdims=True)
+
+def write_index(index_path, embeddings, batch_documents=8, first_id=0, **kwargs):
+    writer = ColbertIndexWriter(index_path, {"dim": embeddings.shape[-1]}, nbits=4, **kwargs)
+    documents = DocumentWriter(index_path)
+    for start in range(0, len(embeddings), batch_documents):
+        batch = embeddings[start:start + batch_documents]
+        writer.add(batch.reshape(-1, batch.shape[-1]), [batch.shape[1]] * len(batch))
+        documents.add([
+            {"id": f"doc-{n}", "content": f"passage {n}", "metadata": {"n": n}}
+            for n in range(first_id + start, first_id + start + len(batch))
+        ])
+    documents.close()
+    return writer.finish()
+
+@pytest.mark.parametrize("token_store", [False, True])
+def test_written_index_is_searchable_with_plaid(tmp_path, token_store):
+    embeddings = token_embeddings()
+    index_path = str(tmp_path / "index")
+    # Small samples and chunks exercise training mid-stream and several chunks
+    info = write_index(index_path, embeddings, sample_tokens=64, chunk_documents=16)
+    assert info["num_documents"] == 40 and info["num_embeddings"] == 240
+    if token_store:
+        from token_store import write_token_store
+        write_token_store(index_path)
+        
+    searcher = PlaidSearcher.open(index_path, lambda queries: embeddings[[7, 31]])
+    assert searcher.index.document_count == 40
+    results = searcher.search(["first", "second"], k=3)
+    assert [query_results[0]["document_id"] for query_results in results] == ["doc-7", "doc-31"]
+    assert results[0][0]["content"] == "passage 7"
+    assert results[0][0]["document_metadata"] == {"n": 7}
+
+def test_appended_segment_reuses_the_codec(tmp_path):
+    embeddings = token_embeddings()
+    base = str(tmp_path / "base")
+    write_index(base, embeddings[:20])
+    codec = ResidualCodec.load(base)
+    
+    segment = str(tmp_path / "segment")
+    write_index(segment, embeddings[20:], first_id=20, codec=codec)
+    assert np.array_equal(ResidualCodec.load(segment).centroids, codec.centroids)
+    results = PlaidSearcher.open(segment, lambda queries: embeddings[[25]]).search("query", k=1)
+    assert results[0]["document_id"] == "doc-25"
+
+def test_pooled_embeddings_are_normalised_means():
+    pooled = pool_embeddings(np.array([[1, 0], [0, 1], [3, 4]], dtype=np.float32), [2, 1])
+    assert np.allclose(pooled, [[0.70710677, 0.70710677], [0.6, 0.8]])
+
+def test_default_nbits():
+    assert [default_nbits(n) for n in (100, 7000, 50000, None)] == [8, 4, 2, 2]
@@ -0,0 +1,65 @@
+import asyncio
+import httpx
+from fastapi import FastAPI
+from instrumentation import STAGE_SECONDS, TraceContext, current_trace, instrument, propagate_trace, stage, use_trace
+
+TRACEPARENT = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+def test_traceparent_round_trip():
+    trace = TraceContext.parse(TRACEPARENT)
+    assert (trace.trace_id, trace.span_id, trace.flags) == ("4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7", "01")
+    assert trace.header() == TRACEPARENT
+    
+    child = trace.child()
+    assert child.trace_id == trace.trace_id and child.span_id != trace.span_id
+    assert len(TraceContext.start().header()) == len(TRACEPARENT)
+
+def test_malformed_traceparents_are_ignored():
+    for header in (None, "", "garbage", "00-abc-00f067aa0ba902b7-01", f"00-{'0' * 32}-00f067aa0ba902b7-01"):
+        assert TraceContext.parse(header) is None
+
+def test_requests_forward_a_child_of_the_current_trace():
+    trace = TraceContext.parse(TRACEPARENT)
+    
+    async def send():
+        request = httpx.Request("GET", "http://query-a:8001/search")
+        await propagate_trace(request)
+        return request
+        
+    assert "traceparent" not in asyncio.run(send()).headers
+    with use_trace(trace):
+        assert current_trace() is trace
+        forwarded = TraceContext.parse(asyncio.run(send()).headers["traceparent"])
+    assert current_trace() is None
+    assert forwarded.trace_id == trace.trace_id and forwarded.span_id != trace.span_id
+
+def test_stages_are_observed():
+    def count():
+        return sum(sample.value for metric in STAGE_SECONDS.collect() for sample in metric.samples
+                   if sample.name.endswith("_count") and sample.labels["stage"] == "test-stage")
+                   
+    before = count()
+    with stage("test-stage") as timed:
+        pass
+    assert timed.seconds >= 0
+    assert count() == before + 1
+
+def test_instrumented_app_continues_the_callers_trace():
+    app = FastAPI()
+    instrument(app, "test-service")
+    
+    @app.get("/trace")
+    async def trace():
+        return {"trace_id": current_trace().trace_id}
+        
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            traced = await client.get("/trace", headers={"traceparent": TRACEPARENT})
+            untraced = await client.get("/trace")
+            metrics = await client.get("/metrics")
+        return traced, untraced, metrics
+        
+    traced, untraced, metrics = asyncio.run(main())
+    assert traced.json()["trace_id"] == traced.headers["x-trace-id"] == "4bf92f3577b34da6a3ce929d0e0e4736"
+    assert untraced.json()["trace_id"] == untraced.headers["x-trace-id"] != traced.headers["x-trace-id"]
+    assert 'quickcolbert_request_seconds_count{handler="trace",method="GET",service="test-service",status="200"}' in metrics.text
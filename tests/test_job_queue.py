@@ -0,0 +1,99 @@
+import asyncio
+import pytest
+from services.job_queue import JobQueue
+
+class Runner:
+    """Runs each job's stages, waiting on a per-job gate when the payload asks for it"""
+    
+    def __init__(self):
+        self.started = []
+        self.gates = {}
+        
+    async def __call__(self, job):
+        self.started.append(job.payload["name"])
+        for stage in job.stages:
+            job.start_stage(stage)
+            if job.payload.get("gated"):
+                await self.gates.setdefault(job.payload["name"], asyncio.Event()).wait()
+            if job.payload.get("fail"):
+                raise RuntimeError("boom")
+            job.finish_stage(stage)
+        return {"documents": len(job.payload.get("documents", []))}
+        
+    def open(self, name):
+        self.gates.setdefault(name, asyncio.Event()).set()
+
+def run(main, runner, **kwargs):
+    async def wrapper():
+        queue = JobQueue(runner, **kwargs)
+        queue.start()
+        try:
+            return await main(queue)
+        finally:
+            await queue.stop()
+    return asyncio.run(wrapper())
+
+def test_finished_jobs_drop_their_documents():
+    runner = Runner()
+    
+    async def main(queue):
+        job = await queue.submit("alice", {"name": "a", "documents": [{"content": "x"}] * 3}, ["parse", "index"])
+        await job.done.wait()
+        return job
+        
+    job = run(main, runner)
+    assert job.status == "completed" and job.result == {"documents": 3}
+    assert job.payload == {"name": "a"}
+    assert job.to_dict()["progress"] == 1.0
+
+def test_higher_priority_runs_first_within_tenant_limits():
+    runner = Runner()
+    
+    async def main(queue):
+        blocker = await queue.submit("alice", {"name": "blocker", "gated": True}, ["index"])
+        await asyncio.sleep(0)
+        low = await queue.submit("bob", {"name": "low"}, ["index"], priority=0)
+        high = await queue.submit("bob", {"name": "high"}, ["index"], priority=5)
+        # alice is at her limit, so her second job waits even with a free worker
+        waiting = await queue.submit("alice", {"name": "waiting"}, ["index"], priority=9)
+        await asyncio.gather(low.done.wait(), high.done.wait())
+        assert waiting.status == "queued"
+        runner.open("blocker")
+        await asyncio.gather(blocker.done.wait(), waiting.done.wait())
+        
+    run(main, runner, max_workers=2, tenant_limit=1)
+    assert runner.started == ["blocker", "high", "low", "waiting"]
+
+def test_cancel_and_failure():
+    runner = Runner()
+    
+    async def main(queue):
+        running = await queue.submit("alice", {"name": "running", "gated": True}, ["parse", "index"])
+        queued = await queue.submit("alice", {"name": "queued"}, ["index"])
+        await asyncio.sleep(0)
+        await queue.cancel(queued.job_id)
+        await queue.cancel(running.job_id)
+        runner.open("running")
+        await running.done.wait()
+        
+        failed = await queue.submit("bob", {"name": "failed", "fail": True}, ["index"])
+        await failed.done.wait()
+        return running, queued, failed
+        
+    running, queued, failed = run(main, runner)
+    assert queued.status == "cancelled" and queued.started_at is None
+    # The running job stops at its next stage boundary
+    assert running.status == "cancelled"
+    assert running.stages["parse"]["status"] == "completed" and running.stages["index"]["status"] == "pending"
+    assert failed.status == "failed" and failed.error == "boom"
+    assert failed.stages["index"]["status"] == "failed"
+
+def test_history_forgets_the_oldest_finished_jobs():
+    async def main(queue):
+        jobs = []
+        for n in range(4):
+            jobs.append(await queue.submit("alice", {"name": str(n)}, ["index"]))
+            await jobs[-1].done.wait()
+        return [queue.get(job.job_id) is not None for job in jobs]
+        
+    assert run(main, Runner(), history=2) == [False, False, True, True]
@@ -0,0 +1,67 @@
+import asyncio
+import numpy as np
+import pytest
+from services.kmeans_clusterer import KMeansClusterer
+
+def blobs(n_per_blob=200, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = np.array([[0, 0], [10, 0], [0, 10]], dtype=np.float32)
+    points = np.concatenate([center + rng.standard_normal((n_per_blob, 2)) for center in centers])
+    return points.astype(np.float32), np.repeat(np.arange(len(centers)), n_per_blob)
+
+def same_partition(labels, expected):
+    """Labels split the points exactly as expected does, up to renumbering"""
+    pairs = set(zip(labels.tolist(), expected.tolist()))
+    return len(pairs) == len(set(labels.tolist())) == len(set(expected.tolist()))
+
+@pytest.mark.parametrize("init", ["k-means++", "random"])
+def test_separated_clusters_are_found(init):
+    points, expected = blobs()
+    clusterer = KMeansClusterer(n_clusters=3, batch_size=64, init=init).fit(points)
+    assert clusterer.centroids.shape == (3, 2)
+    assert same_partition(clusterer.predict_batch(points), expected)
+
+def test_fitting_is_deterministic_and_samples_large_inputs():
+    points, _ = blobs()
+    first = KMeansClusterer(n_clusters=3, max_points_per_centroid=20).fit(points)
+    second = KMeansClusterer(n_clusters=3, max_points_per_centroid=20).fit(points)
+    assert np.array_equal(first.centroids, second.centroids)
+
+def test_fewer_points_than_clusters():
+    clusterer = KMeansClusterer(n_clusters=10).fit(np.eye(3, dtype=np.float32))
+    assert len(clusterer.centroids) == 3
+
+def test_partial_fit_moves_centroids_towards_new_points():
+    points, _ = blobs()
+    clusterer = KMeansClusterer(n_clusters=3).fit(points)
+    label = clusterer.predict_batch([[10, 0]])[0]
+    before = clusterer.centroids[label].copy()
+    
+    clusterer.partial_fit(np.full((50, 2), [12, 0], dtype=np.float32), counts=np.full(3, 200))
+    after = clusterer.centroids[label]
+    assert after[0] > before[0]
+    assert abs(after[0] - 12) > 1
+
+def test_centroids_round_trip(tmp_path):
+    points, _ = blobs()
+    clusterer = KMeansClusterer(n_clusters=3).fit(points)
+    path = str(tmp_path / "centroids.npy")
+    clusterer.save(path)
+    restored = KMeansClusterer.load(path)
+    assert restored.n_clusters == 3
+    assert np.array_equal(restored.predict_batch(points), clusterer.predict_batch(points))
+
+def test_async_helpers():
+    points, expected = blobs()
+    clusterer = KMeansClusterer(n_clusters=3)
+    labels = asyncio.run(clusterer.fit_predict(points))
+    assert same_partition(np.asarray(labels), expected)
+    assert asyncio.run(clusterer.predict([10.0, 0.0])) == labels[len(points) // 3]
+
+def test_errors():
+    with pytest.raises(ValueError):
+        KMeansClusterer(init="forgy")
+    with pytest.raises(ValueError):
+        KMeansClusterer().predict_batch([[0.0, 0.0]])
+    with pytest.raises(ValueError):
+        KMeansClusterer().fit(np.empty((0, 2), dtype=np.float32))
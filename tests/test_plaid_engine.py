@@ -0,0 +1,59 @@
+import numpy as np
+from document_table import DocumentTable
+from services.plaid_engine import PlaidIndex, PlaidSearcher, doc_offsets
+
+def normalized(array):
+    return (array / np.linalg.norm(array, axis=-1, keepdims=True)).astype(np.float32)
+
+def make_index(n_documents=50, tokens=8, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    embeddings = normalized(rng.standard_normal((n_documents * tokens, dim)))
+    centroids = normalized(embeddings[rng.choice(len(embeddings), min(32, len(embeddings)), replace=False)])
+    index = PlaidIndex.from_embeddings(embeddings, [tokens] * n_documents, centroids, nbits=4)
+    return index, embeddings.reshape(n_documents, tokens, dim)
+
+def test_document_offsets():
+    assert doc_offsets([2, 0, 3]).tolist() == [0, 2, 2, 5]
+
+def test_a_document_used_as_the_query_ranks_first():
+    index, documents = make_index()
+    assert index.document_count == 50
+    for pid in (0, 17, 49):
+        pids, scores = index.search(documents[pid], k=5)
+        assert pids[0] == pid
+        assert len(pids) == 5 and np.all(np.diff(scores) <= 0)
+
+def test_decompressed_tokens_approximate_the_embeddings():
+    index, documents = make_index()
+    decompressed = index.decompress(np.arange(8))
+    cosine = np.sum(decompressed * documents[0], axis=1) / np.linalg.norm(decompressed, axis=1)
+    assert cosine.min() > 0.9
+
+def test_search_is_restricted_to_allowed_documents():
+    index, documents = make_index()
+    allowed = np.array([3, 5, 8])
+    pids, _ = index.search(documents[17], k=2, allowed=allowed)
+    assert set(pids.tolist()) <= set(allowed.tolist())
+    
+    pids, _ = index.search(documents[5], k=1, allowed=allowed)
+    assert pids.tolist() == [5]
+
+def test_searcher_results_carry_document_fields():
+    index, documents = make_index(n_documents=3)
+    table = DocumentTable.from_lists(["a", "b", "c"], ["doc-a", "doc-b", "doc-c"], {"doc-b": {"lang": "en"}})
+    searcher = PlaidSearcher(index, lambda queries: documents[[1]], table)
+    
+    results = searcher.search("query", k=2, ncells=24)
+    assert [result["rank"] for result in results] == [1, 2]
+    assert results[0] == dict(
+        results[0], content="b", document_id="doc-b", passage_id=1, document_metadata={"lang": "en"}
+    )
+
+def test_shard_results_carry_whole_index_positions():
+    index, documents = make_index(n_documents=3)
+    table = DocumentTable.from_lists(["a", "b", "c"], ["doc-a", "doc-b", "doc-c"], {})
+    searcher = PlaidSearcher(index, lambda queries: documents[[1]], table)
+    
+    shard = searcher.search_embeddings(documents[[1]], k=1, offset=100, ncells=24)
+    assert shard[0][0]["passage_id"] == 101
+    assert shard[0][0]["document_id"] == "doc-b"
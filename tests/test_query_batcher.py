@@ -0,0 +1,100 @@
+import asyncio
+from services.index_cache import IndexCache
+from services.query_batcher import QueryBatcher, QueueFullError
+
+class RecordingSearcher:
+    """Answers each query with results naming it, and records the batches it was given"""
+    
+    def __init__(self, fail_on=None):
+        self.calls = []
+        self.fail_on = fail_on
+        
+    async def search_batch(self, queries, limit, index_id, router, routes, handle=None):
+        self.calls.append((index_id, list(queries), limit))
+        if index_id == self.fail_on:
+            raise RuntimeError("index unavailable")
+        return [[{"query": query, "rank": rank} for rank in range(limit)] for query in queries]
+
+class CachedSearcher:
+    """Searches the given handle or, like ColbertSearcher, the index resident under index_id"""
+    
+    def __init__(self, index_cache):
+        self.index_cache = index_cache
+        
+    async def search_batch(self, queries, limit, index_id, router, routes, handle=None):
+        if handle is None:
+            entry = self.index_cache.peek(index_id)
+            if entry is None:
+                raise ValueError("Model or index not initialized")
+            handle = entry.handle
+        return [[{"query": query, "index": handle}] for query in queries]
+
+def run(batcher, submissions):
+    async def main():
+        try:
+            return await asyncio.gather(*[batcher.submit(*args) for args in submissions], return_exceptions=True)
+        finally:
+            await batcher.close()
+    return asyncio.run(main())
+
+def test_concurrent_queries_are_searched_together_per_index():
+    searcher = RecordingSearcher()
+    batcher = QueryBatcher(searcher, max_batch_size=8, max_wait=0.05)
+    results = run(batcher, [("docs", "a", 2), ("other", "b", 1), ("docs", "c", 3)])
+    
+    assert sorted(searcher.calls) == [("docs", ["a", "c"], 3), ("other", ["b"], 1)]
+    # Each query gets its own results, cut to its own limit
+    assert [len(result) for result in results] == [2, 1, 3]
+    assert results[0][0]["query"] == "a"
+    assert batcher.stats()["batches"] == 1
+    assert batcher.stats()["largest_batch"] == 3
+
+def test_full_batches_are_dispatched_without_waiting():
+    searcher = RecordingSearcher()
+    batcher = QueryBatcher(searcher, max_batch_size=2, max_wait=10.0)
+    results = run(batcher, [("docs", f"q{i}", 1) for i in range(4)])
+    assert all(isinstance(result, list) for result in results)
+    assert [len(queries) for _, queries, _ in searcher.calls] == [2, 2]
+
+def test_a_failed_batch_fails_only_its_own_queries():
+    searcher = RecordingSearcher(fail_on="broken")
+    batcher = QueryBatcher(searcher, max_wait=0.05)
+    results = run(batcher, [("broken", "a", 1), ("docs", "b", 1)])
+    
+    assert isinstance(results[0], RuntimeError)
+    assert results[1][0]["query"] == "b"
+    assert batcher.failed_batches == 1
+
+def test_queries_beyond_the_queue_limit_are_rejected():
+    batcher = QueryBatcher(RecordingSearcher(), max_queue=2, max_wait=0.05)
+    results = run(batcher, [("docs", f"q{i}", 1) for i in range(3)])
+    
+    assert isinstance(results[2], QueueFullError)
+    assert all(isinstance(result, list) for result in results[:2])
+    assert batcher.rejected == 1
+
+def test_queued_queries_search_the_index_they_loaded():
+    async def load(index_path):
+        return f"handle:{index_path}"
+        
+    cache = IndexCache(load, sizer=lambda path: 100, max_bytes=150)
+    batcher = QueryBatcher(CachedSearcher(cache), max_wait=0.05)
+    
+    async def main():
+        old = (await cache.get("docs", "/indexes/docs@1")).handle
+        queued = [asyncio.ensure_future(batcher.submit("docs", "a", 1, None, None, old))]
+        await asyncio.sleep(0)
+        # docs is replaced by a new version, which is then evicted, before the batch runs
+        new = (await cache.get("docs", "/indexes/docs@2")).handle
+        queued.append(asyncio.ensure_future(batcher.submit("docs", "b", 1, None, None, new)))
+        await cache.get("other", "/indexes/other")
+        assert cache.peek("docs") is None
+        try:
+            return await asyncio.gather(*queued)
+        finally:
+            await batcher.close()
+            
+    old, new = asyncio.run(main())
+    assert old == [{"query": "a", "index": "handle:/indexes/docs@1"}]
+    assert new == [{"query": "b", "index": "handle:/indexes/docs@2"}]
+    assert batcher.batches == 1 and batcher.failed_batches == 0
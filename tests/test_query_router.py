@@ -0,0 +1,79 @@
+import asyncio
+import httpx
+import pytest
+from services.query_router import QueryRouter, routing_key
+from services.upstream_clients import UpstreamClient
+
+URLS = ["http://replica-a:8001", "http://replica-b:8001", "http://replica-c:8001"]
+
+def make_router(statuses=None, unreachable=(), **kwargs):
+    """A router over URLS whose replicas answer in process; statuses maps a host to the status it answers with"""
+    statuses = statuses or {}
+    hits = []
+    
+    def handler(request):
+        hits.append(request.url.host)
+        if request.url.host in unreachable:
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(statuses.get(request.url.host, 200), json={"replica": request.url.host})
+        
+    router = QueryRouter(lambda url: UpstreamClient("query_service", url, 5.0), urls=URLS, **kwargs)
+    asyncio.run(router.start())
+    for url, client in router.replicas.items():
+        client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url=url)
+    return router, hits
+
+def host(url):
+    return httpx.URL(url).host
+
+def test_routing_keys():
+    assert routing_key("docs", "user") == "index:docs"
+    assert routing_key(None, "user") == "user:user"
+
+def test_rankings_are_stable_and_only_lose_removed_replicas():
+    router, _ = make_router()
+    ranking = router.ranked("index:docs")
+    assert sorted(ranking) == sorted(URLS)
+    assert router.ranked("index:docs") == ranking
+    
+    asyncio.run(router._set_replicas([url for url in URLS if url != ranking[0]]))
+    assert router.ranked("index:docs") == ranking[1:]
+
+def test_requests_go_to_the_first_ranked_replica():
+    router, hits = make_router()
+    response = asyncio.run(router.post("index:docs", "/search", json={}))
+    assert response.json()["replica"] == host(router.ranked("index:docs")[0])
+    assert hits == [host(router.ranked("index:docs")[0])]
+
+def test_retryable_statuses_fail_over_to_the_next_replica():
+    router, _ = make_router()
+    first, second = router.ranked("index:docs")[:2]
+    router, hits = make_router(statuses={host(first): 503})
+    
+    response = asyncio.run(router.post("index:docs", "/search"))
+    assert response.status_code == 200
+    assert hits == [host(first), host(second)]
+    assert router.failovers == 1
+
+def test_unreachable_replicas_are_tried_last_while_ejected():
+    router, _ = make_router()
+    first, second = router.ranked("index:docs")[:2]
+    router, hits = make_router(unreachable={host(first)})
+    
+    asyncio.run(router.post("index:docs", "/search"))
+    asyncio.run(router.post("index:docs", "/search"))
+    assert hits == [host(first), host(second), host(second)]
+
+def test_the_last_attempt_raises():
+    router, _ = make_router(unreachable={host(url) for url in URLS}, attempts=2)
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(router.post("index:docs", "/search"))
+
+def test_a_loaded_replica_spills_to_the_next_one():
+    router, hits = make_router(min_load=1)
+    first, second = router.ranked("index:docs")[:2]
+    router.replicas[first].in_flight = 10
+    
+    asyncio.run(router.post("index:docs", "/search"))
+    assert hits == [host(second)]
+    assert router.spilled == 1
@@ -0,0 +1,59 @@
+import asyncio
+import time
+from services.result_cache import ResultCache
+from state_store import MemoryStateStore
+
+RESULTS = [{"document_id": "a", "score": 1.0}]
+
+def test_entries_are_keyed_by_version_and_normalised_query():
+    cache = ResultCache()
+    cache.put("docs", 1, "What is  ColBERT?", 10, RESULTS)
+    assert cache.get("docs", 1, "what is colbert?", 10) == RESULTS
+    assert cache.get("docs", 2, "what is colbert?", 10) is None
+    assert cache.get("docs", 1, "what is colbert?", 5) is None
+    assert cache.get("docs", 1, "what is colbert?", 10, options='{"nprobe": 2}') is None
+
+def test_invalidation_drops_every_version_of_an_index():
+    cache = ResultCache()
+    cache.put("docs", 1, "a", 10, RESULTS)
+    cache.put("docs", 2, "b", 10, RESULTS)
+    cache.put("other", 1, "a", 10, RESULTS)
+    
+    assert cache.invalidate_index("docs") == 2
+    assert cache.get("docs", 2, "b", 10) is None
+    assert cache.get("other", 1, "a", 10) == RESULTS
+    assert cache.invalidate_index("docs") == 0
+    assert cache.stats()["invalidations"] == 1
+
+def test_entries_expire_and_the_least_recently_used_is_evicted(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    cache = ResultCache(max_entries=2, ttl=10)
+    cache.put("docs", 1, "a", 10, RESULTS)
+    cache.put("docs", 1, "b", 10, RESULTS)
+    cache.get("docs", 1, "a", 10)
+    cache.put("docs", 1, "c", 10, RESULTS)
+    assert cache.get("docs", 1, "b", 10) is None
+    assert cache.stats()["evictions"] == 1
+    
+    now[0] += 11
+    assert cache.get("docs", 1, "a", 10) is None
+    # Expired entries are forgotten, including in the per-index key sets
+    assert cache.invalidate_index("docs") == 1
+
+def test_shared_tier_round_trips_through_the_state_store():
+    store = MemoryStateStore()
+    cache = ResultCache(state_store=store)
+    asyncio.run(cache.put_shared_many("docs", 3, [("a", 10, "", RESULTS), ("b", 10, "", [])]))
+    round_trips = store.round_trips
+    
+    found = asyncio.run(cache.get_shared_many("docs", 3, [("A", 10, ""), ("b", 10, ""), ("a", 5, "")]))
+    # An empty result list is a hit too
+    assert found == [RESULTS, [], None]
+    assert store.round_trips == round_trips + 1
+    assert asyncio.run(cache.get_shared("docs", 4, "a", 10)) is None
+    
+    cache.record_miss()
+    cache.record_miss()
+    stats = cache.stats()
+    assert (stats["shared_hits"], stats["misses"], stats["hit_rate"]) == (2, 2, 0.5)
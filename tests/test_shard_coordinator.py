@@ -0,0 +1,84 @@
+import asyncio
+import httpx
+import numpy as np
+from services.shard_coordinator import ShardCoordinator, shard_id
+
+PEERS = ["http://query-a:8001", "http://query-b:8001", "http://query-c:8001"]
+
+class Metadata:
+    index_id = "docs"
+    version = 3
+    shards = [{"prefix": "p0", "start": 0}, {"prefix": "p1", "start": 10}, {"prefix": "p2", "start": 20}]
+
+class ShardSearcher:
+    """Answers shard searches locally with two results per query, failing or stalling the given shards"""
+    
+    engine = "plaid"
+    
+    def __init__(self, failing=(), stalled=()):
+        self.failing = failing
+        self.stalled = stalled
+        self.encoded = []
+        
+    async def encode(self, queries):
+        self.encoded.append(list(queries))
+        return np.zeros((len(queries), 4, 8), dtype=np.float32)
+        
+    async def search_shard(self, index_id, number, shard, queries, embeddings, limit, router, routes):
+        if number in self.failing:
+            raise RuntimeError("shard unavailable")
+        if number in self.stalled:
+            await asyncio.sleep(10)
+        return [
+            [{"passage_id": shard["start"] + n, "score": float(number - n * 5), "rank": n + 1} for n in range(2)]
+            for _ in queries
+        ]
+
+def test_shard_results_are_merged_by_score():
+    searcher = ShardSearcher()
+    coordinator = ShardCoordinator(searcher)
+    results, missing = asyncio.run(coordinator.search(Metadata(), ["a", "b"], 4))
+    
+    assert missing == []
+    assert searcher.encoded == [["a", "b"]]
+    assert [result["passage_id"] for result in results[0]] == [20, 10, 0, 21]
+    assert [result["rank"] for result in results[1]] == [1, 2, 3, 4]
+
+def test_failed_and_slow_shards_are_left_out_and_reported():
+    coordinator = ShardCoordinator(ShardSearcher(failing=[0], stalled=[2]), timeout=0.1)
+    results, missing = asyncio.run(coordinator.search(Metadata(), ["a"], 10))
+    assert missing == [0, 2]
+    assert [result["passage_id"] for result in results[0]] == [10, 11]
+    stats = coordinator.stats()
+    assert (stats["partial_searches"], stats["shard_failures"], stats["shard_timeouts"]) == (1, 1, 1)
+
+def test_owners_agree_and_failed_peers_are_retried_on_the_next_owner():
+    key = shard_id("docs", 0)
+    owners = ShardCoordinator(ShardSearcher(), PEERS).owners(key)
+    assert len(owners) == 2 and None not in owners
+    # Every peer agrees on the owners, standing for itself as None
+    for peer in PEERS:
+        expected = [None if owner == peer else owner for owner in owners]
+        assert ShardCoordinator(ShardSearcher(), PEERS, self_url=peer).owners(key) == expected
+    
+    asked = []
+    
+    def handler(request):
+        asked.append(request.url.host)
+        if request.url.host == httpx.URL(owners[0]).host:
+            return httpx.Response(503)
+        body = httpx.Response(200, content=request.content).json()
+        assert body["version"] == 3 and "embeddings" in body
+        return httpx.Response(200, json={"results": [[{"passage_id": body["shard"], "score": 1.0}]]})
+        
+    coordinator = ShardCoordinator(ShardSearcher(), PEERS)
+    for peer in PEERS:
+        coordinator._clients[peer] = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url=peer)
+        
+    class OneShard(Metadata):
+        shards = Metadata.shards[:1]
+        
+    results, missing = asyncio.run(coordinator.search(OneShard(), ["a"], 5))
+    assert missing == [] and results[0][0]["passage_id"] == 0
+    assert asked == [httpx.URL(owner).host for owner in owners]
+    assert coordinator.stats()["shard_failures"] == 1
@@ -0,0 +1,60 @@
+import asyncio
+import time
+from state_store import MemoryStateStore, decode_json
+
+def test_values_expire_after_their_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    store = MemoryStateStore()
+    
+    asyncio.run(store.save("short", b"a", ttl=5))
+    asyncio.run(store.save("kept", b"b"))
+    now[0] += 4
+    assert asyncio.run(store.get("short")) == b"a"
+    now[0] += 2
+    assert asyncio.run(store.get("short")) is None
+    assert asyncio.run(store.get("kept")) == b"b"
+
+def test_transaction_writes_and_deletes_in_one_round_trip():
+    store = MemoryStateStore()
+    asyncio.run(store.save_many({"old": "x", "other": {"n": 1}}))
+    round_trips = store.round_trips
+    
+    asyncio.run(store.transaction({"new": {"n": 2}}, deletes=["old", "never-written"]))
+    assert store.round_trips == round_trips + 1
+    assert asyncio.run(store.get("old")) is None
+    assert asyncio.run(store.get_json("new")) == {"n": 2}
+    assert asyncio.run(store.get_json("other")) == {"n": 1}
+
+def test_get_many_reads_each_key_once_and_returns_none_for_missing_keys():
+    store = MemoryStateStore()
+    asyncio.run(store.save("a", "1"))
+    round_trips, keys_read = store.round_trips, store.keys_read
+    
+    values = asyncio.run(store.get_many(["a", "missing", "a"]))
+    assert values == {"a": b"1", "missing": None}
+    assert store.round_trips == round_trips + 1
+    assert store.keys_read == keys_read + 2
+    
+    assert asyncio.run(store.get_many([])) == {}
+    assert store.round_trips == round_trips + 1
+
+def test_published_events_reach_subscribers():
+    store = MemoryStateStore()
+    received = []
+    
+    async def on_event(event):
+        received.append(("async", event))
+        
+    store.subscribe("index-updated", lambda event: received.append(("sync", event)))
+    store.subscribe("index-updated", on_event)
+    asyncio.run(store.publish("pubsub", "index-updated", {"index_name": "docs"}))
+    asyncio.run(store.publish("pubsub", "index-created", {"index_name": "other"}))
+    
+    assert received == [("sync", {"index_name": "docs"}), ("async", {"index_name": "docs"})]
+    assert [topic for _, topic, _ in store.events] == ["index-updated", "index-created"]
+    assert store.published == 2
+
+def test_decode_json():
+    assert decode_json(b'{"a": [1]}') == {"a": [1]}
+    assert decode_json(None) is None
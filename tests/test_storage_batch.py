@@ -0,0 +1,47 @@
+import asyncio
+import base64
+import httpx
+import json
+import pytest
+
+def put(storage_client, objects):
+    async def main():
+        await asyncio.gather(*[storage_client.put_object(key, data) for key, data in objects.items()])
+    asyncio.run(main())
+
+def keys(storage_client, prefix="", page_size=1000):
+    async def main():
+        return [obj["key"] async for obj in storage_client.list_objects(prefix, page_size)]
+    return asyncio.run(main())
+
+def test_listing_pages_through_every_object(storage_client):
+    put(storage_client, {f"list/{n:02d}": b"x" for n in range(5)})
+    put(storage_client, {"other/a": b"y"})
+    assert keys(storage_client, "list/", page_size=2) == [f"list/{n:02d}" for n in range(5)]
+    
+    response = asyncio.run(storage_client.client.get("/objects", params={"prefix": "list/", "stream": "true"}))
+    assert sorted(json.loads(line)["key"] for line in response.text.splitlines()) == keys(storage_client, "list/")
+
+def test_batch_get_reports_missing_keys(storage_client):
+    put(storage_client, {"get/a": b"alpha"})
+    response = asyncio.run(storage_client.client.post("/batch/get", json={"keys": ["get/a", "get/missing"]}))
+    results = {line["key"]: line for line in map(json.loads, response.text.splitlines())}
+    assert base64.b64decode(results["get/a"]["data"]) == b"alpha"
+    assert results["get/missing"]["error"] == "not found"
+
+def test_copy_and_delete_by_prefix(storage_client):
+    put(storage_client, {"v1/a": b"a", "v1/sub/b": b"b"})
+    result = asyncio.run(storage_client.copy_prefix("v1/", "v2/"))
+    assert result == {"copied": 2, "errors": []}
+    assert asyncio.run(storage_client.get_object("v2/sub/b")) == b"b"
+    
+    asyncio.run(storage_client.delete_objects(keys=["v2/a"], prefix="v1/"))
+    assert keys(storage_client, "v") == ["v2/sub/b"]
+
+@pytest.mark.parametrize("source, target", [("v1/", "v1/"), ("v1/", "v1/copy/"), ("v1/copy/", "v1/"), ("v1", "v10/"), ("", "v2/")])
+def test_overlapping_copies_are_rejected(storage_client, source, target):
+    put(storage_client, {"v1/a": b"a"})
+    with pytest.raises(httpx.HTTPStatusError) as error:
+        asyncio.run(storage_client.copy_prefix(source, target))
+    assert error.value.response.status_code == 400
+    assert keys(storage_client) == ["v1/a"]
@@ -0,0 +1,50 @@
+import asyncio
+import httpx
+import pytest
+from fastapi import HTTPException
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=10-", (10, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=990-5000", (990, 999)),
+    (" bytes=5-5 ", (5, 5))
+])
+def test_parse_range(storage_app, header, expected):
+    assert storage_app.parse_range(header, 1000) == expected
+
+@pytest.mark.parametrize("header", ["bytes=-", "items=0-1", "bytes=0-1,5-9", "bytes=1000-", "bytes=20-10"])
+def test_unsatisfiable_ranges_are_rejected(storage_app, header):
+    with pytest.raises(HTTPException) as error:
+        storage_app.parse_range(header, 1000)
+    assert error.value.status_code == 416
+
+def test_ranged_reads_return_partial_content(storage_client):
+    data = bytes(range(256)) * 4
+    asyncio.run(storage_client.put_object("ranges/object", data))
+    
+    async def get(range_header):
+        response = await storage_client.client.get("/objects/ranges/object", headers={"Range": range_header})
+        return response.status_code, response.content, response.headers.get("content-range")
+        
+    assert asyncio.run(get("bytes=100-199")) == (206, data[100:200], "bytes 100-199/1024")
+    assert asyncio.run(get("bytes=-24")) == (206, data[-24:], "bytes 1000-1023/1024")
+    assert asyncio.run(get("bytes=2000-"))[0] == 416
+
+def test_download_replaces_the_file_atomically(storage_client, tmp_path):
+    data = bytes(range(256)) * 4096
+    asyncio.run(storage_client.put_object("downloads/object", data))
+    path = tmp_path / "object"
+    path.write_bytes(b"old")
+    
+    assert asyncio.run(storage_client.download("downloads/object", str(path))) == len(data)
+    assert path.read_bytes() == data
+    
+    # A failed download leaves neither the old file changed nor a partial file behind
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(storage_client.download("downloads/missing", str(path)))
+    assert path.read_bytes() == data
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["object"]
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from token_store import build_ivf, decompression_table, pack_residuals, quantization_buckets, unpack_residuals
+
+@pytest.mark.parametrize("nbits", [1, 2, 4, 8])
+def test_residuals_unpack_to_their_bucket_values(nbits):
+    rng = np.random.default_rng(0)
+    weights = np.sort(rng.standard_normal(1 << nbits)).astype(np.float32)
+    cutoffs = (weights[:-1] + weights[1:]) / 2
+    buckets = rng.integers(0, 1 << nbits, size=(5, 16))
+    
+    packed = pack_residuals(weights[buckets], cutoffs, nbits)
+    assert packed.shape == (5, 16 * nbits // 8) and packed.dtype == np.uint8
+    assert np.array_equal(unpack_residuals(packed, weights, nbits), weights[buckets])
+
+def test_decompression_table_reads_each_bucket_least_significant_bit_first():
+    table = decompression_table(2)
+    assert table.shape == (256, 4)
+    # Buckets follow the byte from its high bits down, each with its bits reversed
+    assert table[0b11100100].tolist() == [3, 1, 2, 0]
+
+def test_quantization_buckets_split_values_into_equal_shares():
+    values = np.linspace(-1, 1, 4001, dtype=np.float32)
+    cutoffs, weights = quantization_buckets(values, 2)
+    assert np.allclose(cutoffs, [-0.5, 0, 0.5], atol=1e-3)
+    assert np.allclose(weights, [-0.75, -0.25, 0.25, 0.75], atol=1e-3)
+    assert np.bincount(np.searchsorted(cutoffs, values, side="right")).min() >= 1000
+
+def test_inverted_lists_hold_each_document_once_per_centroid():
+    codes = np.array([0, 2, 0, 1, 1, 2])
+    doc_offsets = np.array([0, 3, 5, 6])
+    pids, lengths = build_ivf(codes, doc_offsets, 4)
+    assert lengths.tolist() == [1, 1, 2, 0]
+    assert pids.tolist() == [0, 1, 0, 2]
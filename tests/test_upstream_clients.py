@@ -0,0 +1,49 @@
+import asyncio
+import httpx
+import pytest
+from services.upstream_clients import UpstreamClient, upstream_from_env
+
+def make_client(handler):
+    upstream = UpstreamClient("query_service", "http://query:8001", 5.0)
+    upstream.client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url=upstream.base_url)
+    return upstream
+
+def test_requests_are_counted_while_in_flight():
+    seen = []
+    
+    async def main():
+        async def handler(request):
+            seen.append(upstream.in_flight)
+            if request.url.path == "/down":
+                raise httpx.ConnectError("connection refused", request=request)
+            return httpx.Response(200, json={"path": request.url.path})
+            
+        upstream = make_client(handler)
+        response = await upstream.post("/search", json={"query": "q"})
+        with pytest.raises(httpx.ConnectError):
+            await upstream.get("/down")
+        return upstream, response
+        
+    upstream, response = asyncio.run(main())
+    assert response.json() == {"path": "/search"}
+    assert seen == [1, 1]
+    stats = upstream.stats()
+    assert (stats["requests"], stats["errors"], stats["in_flight"]) == (2, 1, 0)
+    assert stats["avg_latency"] >= 0.0
+
+def test_pooled_clients_are_configured_from_the_environment(monkeypatch):
+    monkeypatch.setenv("STORAGE_SERVICE_URL", "http://storage:8002")
+    monkeypatch.setenv("STORAGE_SERVICE_TIMEOUT", "12")
+    monkeypatch.setenv("UPSTREAM_MAX_CONNECTIONS", "7")
+    monkeypatch.setenv("UPSTREAM_HTTP2", "false")
+    upstream = upstream_from_env("storage_service", "STORAGE_SERVICE", "http://localhost:8002", 60.0)
+    
+    asyncio.run(upstream.start())
+    try:
+        stats = upstream.stats()
+        assert stats["base_url"] == "http://storage:8002"
+        assert (stats["timeout"], stats["max_connections"], stats["http2"]) == (12.0, 7, False)
+        assert upstream.client.timeout.connect == 5.0
+    finally:
+        asyncio.run(upstream.close())
+    assert upstream.client is None
@@ -0,0 +1,60 @@
+import asyncio
+import json
+from model_snapshot import snapshot_path
+from warmup import Warmup
+
+def flaky(failures, result):
+    """A step failing its first `failures` runs, then returning result"""
+    runs = []
+    
+    async def run():
+        runs.append(len(runs))
+        if len(runs) <= failures:
+            raise ConnectionError("storage is not up yet")
+        return result
+        
+    run.runs = runs
+    return run
+
+def warm(warmup):
+    async def main():
+        warmup.start()
+        await warmup._task
+        
+    asyncio.run(main())
+    return warmup
+
+def test_ready_once_every_step_has_run():
+    warmup = Warmup("test-service", retry_delay=0)
+    assert not warmup.ready and warmup.response().status_code == 503
+    
+    model, index = flaky(0, "model loaded"), flaky(1, {"indexes": 2})
+    warmup.step("model", model)
+    warmup.step("indexes", index)
+    warm(warmup)
+    
+    assert warmup.ready and not warmup.failed
+    assert (len(model.runs), len(index.runs)) == (1, 2)
+    response = warmup.response()
+    assert response.status_code == 200
+    stats = json.loads(response.body)
+    assert stats["steps"]["indexes"]["result"] == {"indexes": 2}
+    assert "error" not in stats["steps"]["indexes"]
+    assert stats["cold_start_seconds"] >= 0
+
+def test_a_step_failing_every_attempt_keeps_the_service_unready():
+    warmup = Warmup("test-service", retry_delay=0, max_attempts=2)
+    later = flaky(0, None)
+    warmup.step("storage", flaky(5, None))
+    warmup.step("later", later)
+    warm(warmup)
+    
+    assert warmup.failed and not warmup.ready
+    assert warmup.response().status_code == 503
+    assert warmup.status["storage"] == {"status": "failed", "duration": None, "error": "storage is not up yet"}
+    assert warmup.status["later"]["status"] == "pending" and later.runs == []
+
+def test_snapshot_names_are_per_model_and_library_versions(tmp_path):
+    path = snapshot_path(str(tmp_path), "colbert-ir/colbertv2.0")
+    assert path.startswith(str(tmp_path / "colbert-ir--colbertv2.0-")) and path.endswith(".pt")
+    assert snapshot_path(str(tmp_path), "colbert-ir/colbertv2.0") == path